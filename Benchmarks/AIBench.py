@@ -0,0 +1,113 @@
+# AIBench.py
+# --------------------------------------------------------------------------
+
+# Measures the computer players in Plugin/Uno/AI.py: how many rollouts a
+# second one search thread manages for a mid-game position at different
+# table sizes, and how often a searching player beats players using the
+# quick rollout policy, against the 1/players share it would get by chance.
+#
+# ------ Usage
+#	python2 Benchmarks/AIBench.py [--seconds 1] [--games 100]
+#		[--rollouts 50,200]
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import Plugin.Uno.AI as AI
+import Plugin.Uno.Engine as Engine
+
+# ------------------------------------------------------------------------------
+
+TABLE_SIZES = (2, 4, 8)
+
+def dealGame(rng, players, opening_turns=0):
+	"""Returns a dealt game, played opening_turns turns in by quickMove()."""
+	game = Engine.Game(rng)
+	for i in range(players):
+		game.addPlayer()
+	game.start()
+	game.nextTurn()
+
+	for turn in range(opening_turns):
+		move = AI.quickMove(game, game.turn_index, rng)
+		if move is None:
+			game.draw(game.turn_index)
+		else:
+			game.play(game.turn_index, move[0], move[1])
+			if game.hasWon(game.turn_index):
+				return dealGame(rng, players, opening_turns)
+		game.nextTurn()
+
+	return game
+
+def playMatch(rng, players, rollouts):
+	"""Plays one game, seat 0 searching with rollouts a move and everyone
+	else on quickMove(). Returns the winner, None if abandoned."""
+	game = dealGame(rng, players)
+
+	for turn in range(1000):
+		current = game.turn_index
+
+		for attempt in range(2):
+			if current == 0:
+				move = AI.search(game, current, rng, 60, rollouts)[0]
+			else:
+				move = AI.quickMove(game, current, rng)
+
+			# Nothing to play, draw once and try again.
+			if move is None and attempt == 0:
+				game.draw(current)
+				continue
+			break
+
+		if move is not None:
+			game.play(current, move[0], move[1])
+			if game.hasWon(current):
+				return current
+
+		game.nextTurn()
+
+	return None
+
+# ------------------------------------------------------------------------------
+
+def main():
+	parser = argparse.ArgumentParser(description="Rollouts/second and strength of the computer players.")
+	parser.add_argument("--seconds", type=float, default=1.0, help="search time per measurement")
+	parser.add_argument("--games", type=int, default=100, help="games per strength match")
+	parser.add_argument("--rollouts", default="50,200", help="comma separated rollouts per move to match")
+	parser.add_argument("--seed", type=int, default=1)
+	options = parser.parse_args()
+
+	rng = random.Random(options.seed)
+
+	print "%-8s %12s" % ("players", "rollouts/s")
+	for players in TABLE_SIZES:
+		game = dealGame(rng, players, opening_turns=players * 2)
+		start = time.time()
+		move, run = AI.search(game, game.turn_index, rng, options.seconds, 1000000)
+
+		# A single legal move isn't searched, deal again until there's a choice.
+		while not run:
+			game = dealGame(rng, players, opening_turns=players * 2)
+			start = time.time()
+			move, run = AI.search(game, game.turn_index, rng, options.seconds, 1000000)
+
+		print "%-8d %12.0f" % (players, run / (time.time() - start))
+
+	print
+	print "%-8s %-10s %8s %10s %10s" % ("players", "rollouts", "games", "wins", "by chance")
+	for players in (2, 4):
+		for rollouts in [int(rollouts) for rollouts in options.rollouts.split(",")]:
+			winners = [playMatch(rng, players, rollouts) for i in range(options.games)]
+			finished = len([winner for winner in winners if winner is not None])
+			wins = winners.count(0)
+			print "%-8d %-10d %8d %9.1f%% %9.1f%%" % (players, rollouts, finished, 100.0 * wins / max(finished, 1), 100.0 / players)
+
+if __name__ == "__main__":
+	main()
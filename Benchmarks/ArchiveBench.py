@@ -0,0 +1,178 @@
+# ArchiveBench.py
+# --------------------------------------------------------------------------
+
+# Measures the game archive in Plugin/Uno/Archive.py: what recording a
+# finished game costs the table that finished it, how many games a second
+# the writer keeps up with, how many bytes each game takes on disk, and, once
+# it's full, how long opening it takes and the memory that holds, what
+# reading one game back costs and how quickly one player's games stream.
+#
+# Games are synthetic, with moves shaped like real ones, so the archive can
+# be filled with millions without playing them.
+#
+# ------ Usage
+#	python2 Benchmarks/ArchiveBench.py [--games 200000] [--players 10000]
+#		[--dir /tmp]
+
+import argparse
+import itertools
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import Plugin.Uno.Archive as Archive
+import Plugin.Uno.Journal as Journal
+
+# ------------------------------------------------------------------------------
+
+LOOKUPS = 20000
+
+# Distinct games made, the rest repeat them with other players.
+TEMPLATES = 1000
+
+def randomMoves(rng, players):
+	"""Returns a game's worth of moves for a number of players."""
+	moves = [Archive.encodeMove(Journal.JOIN, "")] * players
+	moves.append(Archive.encodeMove(Journal.START, ""))
+
+	for turn in xrange(rng.randrange(30, 150)):
+		moves.append(Archive.encodeMove(Journal.TURN, ""))
+		player = turn % players
+		if rng.random() < 0.7:
+			moves.append(Archive.encodeMove(Journal.PLAY, Journal.PLAY_FIELDS.pack(player, rng.randrange(54), -1)))
+		else:
+			moves.append(Archive.encodeMove(Journal.DRAW, Journal.PLAYER_FIELDS.pack(player, 1)))
+			moves.append(Archive.encodeMove(Journal.CANPASS, Journal.FLAG_FIELDS.pack(1)))
+
+	return "".join(moves)
+
+def randomGames(rng, count, nicks):
+	"""Yields count (channel, seed, players, winner, moves) games of 2 to 6
+	players."""
+	templates = []
+	for i in xrange(TEMPLATES):
+		seats = rng.randrange(2, 7)
+		hands = [[rng.randrange(54) for card in xrange(rng.randrange(0, 12))] for seat in xrange(seats)]
+		templates.append((hands, randomMoves(rng, seats)))
+
+	for i in xrange(count):
+		hands, moves = templates[i % TEMPLATES]
+		players = [(nick, None, rng.randrange(5, 40), hand) for nick, hand in itertools.izip(rng.sample(nicks, len(hands)), hands)]
+		yield "#uno" + str(i % 20), rng.getrandbits(64), players, rng.randrange(len(players)), moves
+
+def residentKB():
+	"""Returns this process's resident memory in KB, 0 if unknown."""
+	try:
+		with open("/proc/self/status") as status:
+			for line in status:
+				if line.startswith("VmRSS:"):
+					return int(line.split()[1])
+	except IOError:
+		pass
+	return 0
+
+def directoryBytes(path):
+	"""Returns the size of every file in a directory."""
+	return sum([os.path.getsize(os.path.join(path, name)) for name in os.listdir(path)])
+
+def benchWrite(path, games):
+	"""Returns microseconds per recordGame() and games written a second."""
+	archive = Archive.GameArchive(path)
+
+	count = 0
+	recorded = 0.0
+	start = time.time()
+	for game in games:
+		before = time.time()
+		archive.recordGame(*game)
+		recorded += time.time() - before
+		count += 1
+
+		# Keep the queue from holding everything at once.
+		if count % 10000 == 0:
+			archive.flush()
+
+	archive.flush()
+	written = time.time() - start
+
+	archive.close()
+	return recorded / count * 1e6, count / written
+
+def benchOpen(path):
+	"""Returns the archive, milliseconds to open it and the KB that took."""
+	before = residentKB()
+	start = time.time()
+	archive = Archive.GameArchive(path)
+	return archive, (time.time() - start) * 1000, residentKB() - before
+
+def benchRead(archive, rng, nicks):
+	"""Returns microseconds per getGame(), per game id streamed from
+	playerGames() and per game read back through it, and games per nick."""
+	ids = [rng.randrange(len(archive)) for i in xrange(LOOKUPS)]
+
+	start = time.time()
+	for game_id in ids:
+		archive.getGame(game_id)
+	get = (time.time() - start) / LOOKUPS * 1e6
+
+	streamed = 0
+	start = time.time()
+	for nick in nicks[:100]:
+		for game_id in archive.playerGames(nick):
+			streamed += 1
+	stream = (time.time() - start) / max(streamed, 1) * 1e6
+
+	read = 0
+	start = time.time()
+	for nick in nicks[:10]:
+		for game_id in archive.playerGames(nick):
+			archive.getGame(game_id)
+			read += 1
+	player = (time.time() - start) / max(read, 1) * 1e6
+
+	return get, stream, player, streamed / 100.0
+
+# ------------------------------------------------------------------------------
+
+def main():
+	parser = argparse.ArgumentParser(description="Cost of writing and reading the finished game archive.")
+	parser.add_argument("--games", type=int, default=200000, help="games to archive")
+	parser.add_argument("--players", type=int, default=10000, help="distinct nicks")
+	parser.add_argument("--seed", type=int, default=1)
+	parser.add_argument("--dir", default=None, help="where to write the archive")
+	options = parser.parse_args()
+
+	rng = random.Random(options.seed)
+	nicks = ["player" + str(i) for i in xrange(options.players)]
+
+	directory = tempfile.mkdtemp(prefix="unobot-archive-", dir=options.dir)
+
+	try:
+		path = os.path.join(directory, "archive")
+
+		record, written = benchWrite(path, randomGames(rng, options.games, nicks))
+		print "%-28s %10.1fus" % ("recordGame()", record)
+		print "%-28s %10.0f games/s" % ("written", written)
+		print "%-28s %10.0f bytes" % ("per game on disk", directoryBytes(path) / float(options.games))
+
+		print
+		archive, elapsed, memory = benchOpen(path)
+		print "%-28s %10.1fms, %d games" % ("open", elapsed, len(archive))
+		print "%-28s %10d KB" % ("memory held open", memory)
+
+		print
+		get, stream, player, per_nick = benchRead(archive, rng, nicks)
+		print "%-28s %10.1fus" % ("getGame()", get)
+		print "%-28s %10.2fus a game, %.0f games a nick" % ("playerGames()", stream, per_nick)
+		print "%-28s %10.1fus a game" % ("a player's games, read", player)
+		archive.close()
+	finally:
+		shutil.rmtree(directory)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,218 @@
+# CaptureReplay.py
+# --------------------------------------------------------------------------
+
+# Feeds a capture (see DeeIRC/Capture.py, recorded with IRC_CAPTURE) back
+# into a fresh DeeBot in this process, with no network, and compares what
+# the bot sends now with what it sent when the capture was made.
+#
+# Server lines go in through DeeIRC.receiveLine(), so the reactor's dispatch
+# thread, the command executor and the table actors all run as they would
+# live. Outgoing lines are taken straight off the send queue, with flood
+# control off.
+#
+# The replay never connects, so registration (NICK/USER) and our own lag
+# PINGs are left out of the comparison.
+#
+# If the capture noted a random seed, the game is seeded the same way so the
+# same cards come out. Channels run in parallel, so lines are compared per
+# target: in order for a channel, and as a set for a nick, since notices to
+# one nick can come from several channels.
+#
+# ------ Usage
+#	python2 Benchmarks/CaptureReplay.py capture.bin [--speed 1] [--fast]
+#
+# The bot is configured from the usual IRC_* environment variables, set them
+# as they were in production (IRC_CHANNEL, IRC_ADMINS, ...) for a clean diff.
+
+import argparse
+import collections
+import difflib
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import DeeIRC.Capture as Capture
+import DeeIRC.IRC as IRC
+import DeeIRC.Parser as Parser
+import DeeIRC.Utils as Utils
+
+# ------------------------------------------------------------------------------
+
+# Commands whose first parameter is where the line is going.
+TARGETED = ("PRIVMSG", "NOTICE", "MODE", "JOIN", "PART", "KICK", "TOPIC")
+
+def isConnectionLine(line):
+	"""Returns true for lines that come from connecting rather than from
+	anything the server said."""
+	return line.startswith(("NICK ", "USER ", "PING :" + IRC.PING_TOKEN))
+
+def targetOf(line):
+	"""Returns what a line is addressed to, for grouping the diff."""
+	message = Parser.parse(line)
+	if message.command in TARGETED:
+		return message.param(0)
+	return "*"
+
+def groupByTarget(lines):
+	"""Returns {target:[line, ...]}, keeping order within each target."""
+	groups = collections.OrderedDict()
+	for line in lines:
+		groups.setdefault(targetOf(line), []).append(line)
+	return groups
+
+# ------------------------------------------------------------------------------
+
+class Collector(object):
+	"""Drains the bot's send queue on a thread of it's own."""
+
+	def __init__(self, bot):
+		"""Constructor."""
+		self.bot = bot
+		self.lines = []
+		self.last = time.time()
+		self.running = True
+		self.thread = threading.Thread(target=self.drainLoop, name="CaptureReplay-collector")
+		self.thread.daemon = True
+		self.thread.start()
+
+	def drainLoop(self):
+		"""Moves lines off the send queue as they appear."""
+		while self.running:
+			line = self.bot.send_queue.pop()
+
+			if line is None:
+				time.sleep(0.001)
+				continue
+
+			self.lines.append(line[:-2])
+			self.last = time.time()
+
+	def waitQuiet(self, quiet=1.0, timeout=60.0):
+		"""Waits until nothing has been sent for quiet seconds."""
+		deadline = time.time() + timeout
+		while time.time() < deadline:
+			if not len(self.bot.send_queue) and not self.bot.command_executor.pending() and time.time() - self.last >= quiet:
+				break
+			time.sleep(0.05)
+
+		self.running = False
+		self.thread.join()
+
+# ------------------------------------------------------------------------------
+
+def loadCapture(path):
+	"""Returns (inbound, outbound, seed) from a capture. Inbound is a list
+	of (seconds, line), outbound a list of lines."""
+	inbound = []
+	outbound = []
+	seed = None
+
+	for seconds, direction, line in Capture.readCapture(path):
+		if direction == Capture.INBOUND:
+			inbound.append((seconds, line))
+		elif direction == Capture.OUTBOUND:
+			outbound.append(line)
+		elif direction == Capture.NOTE and line.startswith("seed ") and seed is None:
+			seed = long(line[5:])
+
+	return inbound, outbound, seed
+
+def createBot(seed):
+	"""Builds a DeeBot that's never connected, with flood control off. The
+	seed is applied before plugins load, as it was when capturing."""
+	for name, value in (("IRC_SERVER", "127.0.0.1"), ("IRC_CHANNEL", "#uno"), ("IRC_ADMINS", ""), ("IRC_NS_PW", "")):
+		os.environ.setdefault(name, value)
+
+	# Never record the replay over the capture.
+	os.environ.pop("IRC_CAPTURE", None)
+	os.environ.pop("IRC_METRICS_PORT", None)
+
+	# The bot writes it's pid file to the working directory.
+	os.chdir(tempfile.mkdtemp(prefix="unobot-replay-"))
+
+	import DeeBot
+
+	if seed is not None:
+		random.seed(seed)
+
+	bot = DeeBot.DeeBot()
+	bot.debug = False
+	bot.setFloodControl(None, 0)
+
+	return bot
+
+def replay(bot, inbound, speed):
+	"""Feeds server lines to the bot, at speed times the recorded pace, or
+	as fast as possible if speed is None. Returns the seconds taken."""
+	start = time.time()
+
+	for seconds, line in inbound:
+		if speed:
+			wait = start + seconds / speed - time.time()
+			if wait > 0:
+				time.sleep(wait)
+
+		bot.receiveLine(line)
+
+	return time.time() - start
+
+def report(recorded, replayed):
+	"""Prints a per target diff. Returns the number of targets that differ."""
+	recorded = [line for line in recorded if not isConnectionLine(line)]
+	replayed = [line for line in replayed if not isConnectionLine(line)]
+	recorded_groups = groupByTarget(recorded)
+	replayed_groups = groupByTarget(replayed)
+	differing = 0
+
+	for target in list(recorded_groups) + [target for target in replayed_groups if not target in recorded_groups]:
+		before = recorded_groups.get(target, [])
+		after = replayed_groups.get(target, [])
+
+		if not Utils.isChannel(target):
+			before = sorted(before)
+			after = sorted(after)
+
+		if before != after:
+			differing += 1
+			for line in difflib.unified_diff(before, after, "recorded " + target, "replayed " + target, lineterm=""):
+				print line
+
+	print
+	print str(len(recorded)) + " lines recorded, " + str(len(replayed)) + " replayed, " + str(differing) + " of " + str(len(set(recorded_groups) | set(replayed_groups))) + " targets differ."
+
+	return differing
+
+# ------------------------------------------------------------------------------
+
+def main():
+	parser = argparse.ArgumentParser(description="Replays a capture into the bot and diffs the output.")
+	parser.add_argument("capture", help="file recorded with IRC_CAPTURE")
+	parser.add_argument("--speed", type=float, default=1.0, help="multiple of the recorded pace")
+	parser.add_argument("--fast", action="store_true", help="feed lines as fast as possible")
+	options = parser.parse_args()
+
+	inbound, outbound, seed = loadCapture(os.path.abspath(options.capture))
+
+	bot = createBot(seed)
+
+	collector = Collector(bot)
+	bot.reactor.start()
+
+	try:
+		elapsed = replay(bot, inbound, None if options.fast else options.speed)
+		collector.waitQuiet()
+	finally:
+		bot.reactor.stop()
+
+	print "Fed " + str(len(inbound)) + " lines in " + "%.2f" % elapsed + "s, " + "%.0f" % (len(inbound) / max(elapsed, 0.000001)) + " lines/second."
+
+	if report(outbound, collector.lines):
+		sys.exit(1)
+
+if __name__ == "__main__":
+	main()
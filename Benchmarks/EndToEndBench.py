@@ -0,0 +1,241 @@
+# EndToEndBench.py
+# --------------------------------------------------------------------------
+
+# Runs the real bot in a child process against Benchmarks/StandIn.py and
+# measures it from the outside, over TCP, the way players see it.
+#
+# A game is dealt in each of a number of channels, then virtual players ask
+# "top" and "turn" (one reply each) round robin across the channels at a
+# fixed rate. The rate steps up until the bot falls behind, i.e. replies go
+# missing or the 99th percentile latency passes the limit. Each step reports
+# command -> reply latency percentiles and the reply rate achieved; the last
+# step that kept up is the sustained rate.
+#
+# Use this for any change to DeeIRC/IRC.py or the Uno plugin.
+#
+# ------ Usage
+#	python2 Benchmarks/EndToEndBench.py [--channels 20] [--duration 5]
+#		[--rates 50,100,200,...] [--max-latency 0.5]
+#	python2 Benchmarks/EndToEndBench.py --script lines.txt [--rate 500]
+#
+# A script is one raw line per line as the bot would receive it, prefix
+# included (":nick!user@host PRIVMSG #uno :play r5"). It's replayed at the
+# given rate, or as fast as possible, and the time until the bot goes quiet
+# is reported instead.
+
+import argparse
+import collections
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import StandIn
+
+# ------------------------------------------------------------------------------
+
+DEFAULT_RATES = "50,100,200,400,800,1600,3200"
+
+# Lines the bot sends back for the commands we time.
+REPLY_STARTS = ("Top card: ", "It's currently ")
+
+def percentile(values, fraction):
+	"""Returns the value below which fraction of the sorted values fall."""
+	if not values:
+		return None
+	return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def formatMs(seconds):
+	"""Formats seconds as milliseconds for the report."""
+	if seconds is None:
+		return "-"
+	return "%.1fms" % (seconds * 1000)
+
+# ------------------------------------------------------------------------------
+
+class ReplyTracker(object):
+	"""Matches the bot's replies to the commands that caused them. The bot
+	answers each channel in order, so a FIFO per channel is enough."""
+
+	def __init__(self, nick):
+		"""Constructor."""
+		self.nick = nick
+		self.lock = threading.Lock()
+		self.waiting = collections.defaultdict(collections.deque)
+		self.latencies = []
+		self.started = set()
+		self.last_line = time.time()
+		self.lines = 0
+
+	def sent(self, channel, when):
+		"""Notes a timed command was injected."""
+		with self.lock:
+			self.waiting[channel].append(when)
+
+	def outstanding(self):
+		"""Returns how many timed commands haven't been answered."""
+		with self.lock:
+			return sum([len(queue) for queue in self.waiting.values()])
+
+	def reset(self):
+		"""Forgets what's outstanding and the latencies so far."""
+		with self.lock:
+			self.waiting.clear()
+			self.latencies = []
+
+	def onLine(self, nick, line, when):
+		"""StandIn callback, sees every line the bot sends."""
+		if nick != self.nick:
+			return
+
+		self.last_line = when
+		self.lines += 1
+
+		parts = line.split(" ", 2)
+		if len(parts) < 3 or parts[0] != "PRIVMSG":
+			return
+
+		channel = parts[1]
+		text = parts[2][1:]
+
+		if text.startswith("Game Started"):
+			self.started.add(channel)
+			return
+
+		for message in text.split(" | "):
+			if message.startswith(REPLY_STARTS):
+				with self.lock:
+					queue = self.waiting.get(channel)
+					if queue:
+						self.latencies.append(when - queue.popleft())
+
+# ------------------------------------------------------------------------------
+
+def setupGames(server, tracker, channels, nick):
+	"""Deals a two player game in every channel."""
+	for channel in channels:
+		server.forceJoin(nick, channel)
+
+	# Give the bot a moment to see it's joins before the games start.
+	time.sleep(0.5)
+
+	for index, channel in enumerate(channels):
+		first = "p" + str(index) + "a"
+		second = "p" + str(index) + "b"
+		server.inject(first, "PRIVMSG", channel, "uno")
+		server.inject(second, "PRIVMSG", channel, "join")
+		server.inject(first, "PRIVMSG", channel, "deal")
+
+	deadline = time.time() + 10
+	while len(tracker.started) < len(channels):
+		if time.time() > deadline:
+			raise RuntimeError("Only " + str(len(tracker.started)) + " of " + str(len(channels)) + " games started.")
+		time.sleep(0.05)
+
+def runStep(server, tracker, channels, rate, duration):
+	"""Sends timed commands at rate/second for duration seconds, then waits
+	a little for stragglers. Returns (sent, latencies, missing, elapsed)."""
+	tracker.reset()
+	commands = ("top", "turn")
+	total = int(rate * duration)
+	start = time.time()
+
+	for index in range(total):
+		wait = start + index / float(rate) - time.time()
+		if wait > 0:
+			time.sleep(wait)
+
+		channel = channels[index % len(channels)]
+		tracker.sent(channel, time.time())
+		server.inject("p" + str(index % len(channels)) + "a", "PRIVMSG", channel, commands[index % 2])
+
+	elapsed = time.time() - start
+
+	# Let the bot catch up, but not forever.
+	deadline = time.time() + 2
+	while tracker.outstanding() and time.time() < deadline:
+		time.sleep(0.01)
+
+	with tracker.lock:
+		latencies = sorted(tracker.latencies)
+
+	return total, latencies, tracker.outstanding(), elapsed
+
+def runRamp(options, server, tracker):
+	"""Steps the rate up until the bot falls behind."""
+	channels = ["#bench" + str(i) for i in range(options.channels)]
+	setupGames(server, tracker, channels, options.nick)
+
+	print "%-8s %8s %8s %8s %8s %8s %8s %8s" % ("rate/s", "sent", "missing", "replies/s", "p50", "p90", "p99", "max")
+
+	sustained = None
+	for rate in [int(rate) for rate in options.rates.split(",")]:
+		sent, latencies, missing, elapsed = runStep(server, tracker, channels, rate, options.duration)
+
+		p99 = percentile(latencies, 0.99)
+		print "%-8d %8d %8d %8.0f %8s %8s %8s %8s" % (rate, sent, missing, len(latencies) / elapsed, formatMs(percentile(latencies, 0.5)), formatMs(percentile(latencies, 0.9)), formatMs(p99), formatMs(latencies and latencies[-1] or None))
+
+		if missing or p99 is None or p99 > options.max_latency:
+			break
+		sustained = rate
+
+	print
+	if sustained is None:
+		print "The bot didn't keep up at any rate tried."
+	else:
+		print "Sustained " + str(sustained) + " commands/second with p99 under " + formatMs(options.max_latency) + "."
+
+def runScript(options, server, tracker):
+	"""Replays a script and times how long the bot takes to go quiet."""
+	lines = [line.rstrip("\r\n") for line in open(options.script) if line.strip()]
+
+	for channel in set([line.split(" ")[2] for line in lines if len(line.split(" ")) > 2 and line.split(" ")[2][0:1] == "#"]):
+		server.forceJoin(options.nick, channel)
+	time.sleep(0.5)
+
+	before = tracker.lines
+	start = time.time()
+	server.replay(lines, options.rate)
+
+	# Quiet for a second means done.
+	while time.time() - tracker.last_line < 1.0:
+		time.sleep(0.05)
+	elapsed = max(tracker.last_line - start, 0.000001)
+
+	print "Replayed " + str(len(lines)) + " lines in " + "%.2f" % elapsed + "s, " + "%.0f" % (len(lines) / elapsed) + " lines/second."
+	print "The bot sent " + str(tracker.lines - before) + " lines back."
+
+# ------------------------------------------------------------------------------
+
+def main():
+	parser = argparse.ArgumentParser(description="End to end benchmark of the bot against a local stand-in server.")
+	parser.add_argument("--channels", type=int, default=20, help="channels with a game running")
+	parser.add_argument("--duration", type=float, default=5.0, help="seconds per rate step")
+	parser.add_argument("--rates", default=DEFAULT_RATES, help="comma separated commands/second to try")
+	parser.add_argument("--max-latency", type=float, default=0.5, help="p99 seconds above which the bot has fallen behind")
+	parser.add_argument("--script", help="replay this file of raw lines instead")
+	parser.add_argument("--rate", type=float, default=None, help="lines/second for --script, as fast as possible if not given")
+	parser.add_argument("--nick", default="UnoBot", help="the bot's nick")
+	options = parser.parse_args()
+
+	server = StandIn.StandIn()
+	server.start()
+
+	tracker = ReplyTracker(options.nick)
+	server.on_line = tracker.onLine
+
+	bot = StandIn.launchBot(server.port, server=server, nick=options.nick)
+
+	try:
+		if options.script:
+			runScript(options, server, tracker)
+		else:
+			runRamp(options, server, tracker)
+	finally:
+		bot.kill()
+		server.stop()
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,230 @@
+# JournalBench.py
+# --------------------------------------------------------------------------
+
+# Measures the game journal in Plugin/Uno/Journal.py: what journaling adds to
+# each move a table makes, how many records a second group commit keeps up
+# with against an fsync per record, and how long rebuilding every table
+# takes on startup, from a long journal and from a compacted one.
+#
+# Journals are written to a temporary directory, on the same disk as it.
+#
+# ------ Usage
+#	python2 Benchmarks/JournalBench.py [--moves 20000] [--tables 1000]
+#		[--dir /tmp]
+
+import argparse
+import contextlib
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import DeeIRC.Metrics as Metrics
+import DeeIRC.TimerWheel as TimerWheel
+import Plugin.Uno as Uno
+import Plugin.Uno.Cards as Cards
+import Plugin.Uno.Journal as Journal
+import Plugin.Uno.Table as Table
+
+# ------------------------------------------------------------------------------
+
+class NullBot(object):
+	"""Takes everything a table sends and does nothing with it."""
+
+	def __init__(self, journal_path=""):
+		"""Constructor."""
+		self.config = {"journal":journal_path}
+
+	def sendMessage(self, target, message, priority=None):
+		pass
+
+	sendNotice = sendMessage
+
+	def sendRaw(self, line):
+		pass
+
+	def sendAddMode(self, channel, nick, mode):
+		pass
+
+	sendRemMode = sendAddMode
+
+	def isAdmin(self, nick):
+		return False
+
+	def addEvent(self, event_type, event):
+		pass
+
+	removeEvent = addEvent
+
+	def log(self, message):
+		pass
+
+	def callLater(self, delay, function, *args):
+		return TimerWheel.Timer(time.time() + delay, function, args)
+
+	@contextlib.contextmanager
+	def batch(self):
+		yield
+
+def playMoves(bot, table, rng, moves, stop_short=False):
+	"""Plays moves commands at a table, dealing a new game whenever one
+	ends. With stop_short the last game is left unfinished."""
+	channel = table.channel
+
+	for move in range(moves):
+		if table.state != Table.UNO_STATE_STARTED:
+			table.commandUno(bot, "alice", channel, "")
+			table.commandJoin(bot, "bob", channel, "")
+			table.commandJoin(bot, "carol", channel, "")
+			table.commandDeal(bot, "alice", channel, "")
+
+		player_index = table.game.turn_index
+		nick = table.players[player_index]["nick"]
+		playable = table.playableCards(player_index)
+
+		if playable:
+			card = rng.choice(Cards.maskCards(playable))
+
+			# Don't win, so the game is still going.
+			if stop_short and len(table.players[player_index]["hand"]) == 1:
+				table.commandDraw(bot, nick, channel, "")
+				continue
+
+			table.commandPlay(bot, nick, channel, Cards.toString(card) + (Cards.isWild(card) and " r" or ""))
+		elif table.game.canpass:
+			table.commandPass(bot, nick, channel, "")
+		else:
+			table.commandDraw(bot, nick, channel, "")
+
+# ------------------------------------------------------------------------------
+
+def benchMoves(directory, moves):
+	"""Microseconds per command with and without a journal, and per record."""
+	results = {}
+
+	for name in ("off", "on"):
+		journal = None
+		if name == "on":
+			journal = Journal.Journal(os.path.join(directory, "moves"))
+
+		table = Table.UnoTable("#bench", "1", journal)
+		bot = NullBot()
+
+		start = time.time()
+		playMoves(bot, table, random.Random(1), moves)
+		results[name] = (time.time() - start) / moves * 1e6
+
+		if journal:
+			journal.close()
+
+	records = moves * 4
+	journal = Journal.Journal(os.path.join(directory, "records"))
+	payload = Journal.PLAY_FIELDS.pack(1, 20, -1)
+
+	start = time.time()
+	for i in xrange(records):
+		journal.record("#bench", Journal.PLAY, payload)
+	results["record"] = (time.time() - start) / records * 1e6
+
+	journal.close()
+	return results
+
+def benchCommits(directory, seconds):
+	"""Records committed a second by group commit and by an fsync each."""
+	record = Journal.encode("#bench", Journal.PLAY, Journal.PLAY_FIELDS.pack(1, 20, -1))
+
+	# One fsync per record, the way a naive journal would.
+	path = os.path.join(directory, "each")
+	with open(path, "ab") as journal_file:
+		count = 0
+		start = time.time()
+		while time.time() - start < seconds:
+			journal_file.write(record)
+			journal_file.flush()
+			os.fsync(journal_file.fileno())
+			count += 1
+		each = count / (time.time() - start)
+
+	# As fast as record() can be called, committed in groups.
+	commit_seconds = Metrics.getRegistry().histogram("uno_journal_commit_seconds")
+	commits, spent = commit_seconds.count, commit_seconds.sum
+
+	journal = Journal.Journal(os.path.join(directory, "group"))
+	count = 0
+	start = time.time()
+	while time.time() - start < seconds:
+		for i in xrange(1000):
+			journal.record("#bench", Journal.PLAY, record)
+		count += 1000
+	journal.close()
+	group = count / (time.time() - start)
+
+	return each, group, commit_seconds.count - commits, commit_seconds.sum - spent
+
+def benchRecovery(directory, tables, moves):
+	"""Milliseconds to rebuild every table, from the whole journal and after
+	the rewrite that recovery leaves behind."""
+	path = os.path.join(directory, "recovery")
+	rng = random.Random(2)
+
+	plugin = Uno.UnoPlugin()
+	plugin.load(NullBot(path))
+
+	# Left to grow, to see what compaction saves.
+	plugin.journal.compactor = None
+
+	bot = NullBot()
+	for i in range(tables):
+		playMoves(bot, plugin.getTable("#table" + str(i)), rng, moves, stop_short=True)
+	plugin.unload(bot)
+
+	size = os.path.getsize(path)
+	results = []
+
+	for attempt in ("journal", "compacted"):
+		start = time.time()
+		plugin = Uno.UnoPlugin()
+		plugin.load(NullBot(path))
+		results.append((attempt, (time.time() - start) * 1000, size, plugin.countActiveTables()))
+		plugin.unload(bot)
+		size = os.path.getsize(path)
+
+	return results
+
+# ------------------------------------------------------------------------------
+
+def main():
+	parser = argparse.ArgumentParser(description="Cost of journaling Uno games, and of recovering from the journal.")
+	parser.add_argument("--moves", type=int, default=20000, help="commands to time per run")
+	parser.add_argument("--tables", type=int, default=1000, help="tables to recover")
+	parser.add_argument("--table-moves", type=int, default=40, help="commands played at each table before recovery")
+	parser.add_argument("--seconds", type=float, default=2.0, help="time per commit measurement")
+	parser.add_argument("--dir", default=None, help="where to write journals")
+	options = parser.parse_args()
+
+	directory = tempfile.mkdtemp(prefix="unobot-journal-", dir=options.dir)
+
+	try:
+		moves = benchMoves(directory, options.moves)
+		print "%-28s %10.1fus" % ("command, no journal", moves["off"])
+		print "%-28s %10.1fus" % ("command, journal", moves["on"])
+		print "%-28s %10.2fus" % ("record()", moves["record"])
+
+		print
+		each, group, commits, commit_seconds = benchCommits(directory, options.seconds)
+		print "%-28s %10.0f records/s" % ("fsync per record", each)
+		print "%-28s %10.0f records/s, %d commits, %.2fms each" % ("group commit", group, commits, commit_seconds / max(commits, 1) * 1000)
+
+		print
+		print "%-12s %10s %12s %8s" % ("recovery", "ms", "bytes", "games")
+		for attempt, milliseconds, size, games in benchRecovery(directory, options.tables, options.table_moves):
+			print "%-12s %10.1f %12d %8d" % (attempt, milliseconds, size, games)
+	finally:
+		shutil.rmtree(directory)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,125 @@
+# ParserBench.py
+# --------------------------------------------------------------------------
+
+# Measures how many server lines per second DeeIRC.Parser gets through.
+#
+# ------ Usage
+#	python2 Benchmarks/ParserBench.py [corpus_file]
+#
+# The corpus is one raw IRC line per line. Without one, a corpus of busy
+# channel traffic is generated: mostly chatter, plus joins, parts, quits,
+# NAMES bursts, IRCv3 tagged lines and pings.
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import DeeIRC.Parser as Parser
+
+# ------------------------------------------------------------------------------
+
+CORPUS_SIZE = 200000
+
+WORDS = ["uno", "play", "r5", "draw", "hello", "anyone", "around", "lol", "gg", "nice", "wd4", "pass", "the", "a", "is"]
+
+def generateCorpus(size, seed=1):
+	"""Returns a list of lines that look like a busy network."""
+	rng = random.Random(seed)
+	nicks = ["user" + str(i) for i in range(500)]
+	channels = ["#uno", "#uno2", "#chat", "#help"]
+	corpus = []
+
+	for i in range(size):
+		nick = rng.choice(nicks)
+		source = ":" + nick + "!~" + nick + "@host-" + str(rng.randint(1, 9999)) + ".example.net"
+		channel = rng.choice(channels)
+		roll = rng.random()
+
+		if roll < 0.70:
+			text = " ".join([rng.choice(WORDS) for j in range(rng.randint(1, 12))])
+			line = source + " PRIVMSG " + channel + " :" + text
+		elif roll < 0.78:
+			line = "@time=2016-01-01T00:00:00.000Z;account=" + nick + ";msgid=a\\sb\\:c " + source + " PRIVMSG " + channel + " :tagged " + rng.choice(WORDS)
+		elif roll < 0.83:
+			line = source + " JOIN :" + channel
+		elif roll < 0.87:
+			line = source + " PART " + channel + " :bye"
+		elif roll < 0.91:
+			line = source + " QUIT :Quit: leaving"
+		elif roll < 0.96:
+			names = " ".join([rng.choice("@+ ") .strip() + rng.choice(nicks) for j in range(40)])
+			line = ":irc.example.net 353 UnoBot = " + channel + " :" + names
+		else:
+			line = "PING :irc.example.net:" + str(i)
+
+		corpus.append(line)
+
+	return corpus
+
+def loadCorpus(path):
+	"""Reads a corpus file, one line per line."""
+	with open(path, "rb") as corpus_file:
+		return [line.rstrip("\r\n") for line in corpus_file if line.strip()]
+
+# ------------------------------------------------------------------------------
+
+def legacyParse(data):
+	"""The split based parsing DeeIRC.mainLoop used to do, for comparison."""
+	split_data = data.split(" ")
+
+	user_full = split_data[0][1:]
+	nick = user_full[0:user_full.find("!")]
+	command = split_data[1].upper()
+	message = " ".join(split_data[3:])[1:]
+
+	return nick, command, message
+
+def dispatchFields(data):
+	"""What handleLine reads from most lines: command, nick and params."""
+	message = Parser.parse(data)
+	if message.command == "PRIVMSG":
+		return message.nick, message.param(0), message.param(1)
+	return message.command
+
+def commandOnly(data):
+	"""The least a dispatcher can do: find the command."""
+	return Parser.parse(data).command
+
+def everything(data):
+	"""Every field, tags included."""
+	message = Parser.parse(data)
+	return message.tags, message.nick, message.user, message.host, message.command, message.params
+
+def run(name, function, corpus, repeat=3):
+	"""Runs a parser over the corpus and prints the best lines/second."""
+	best = None
+
+	for i in range(repeat):
+		start = time.time()
+		for line in corpus:
+			function(line)
+		elapsed = time.time() - start
+
+		if best is None or elapsed < best:
+			best = elapsed
+
+	print "%-18s %12.0f lines/s" % (name, len(corpus) / best)
+
+# ------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+	if len(sys.argv) > 1:
+		corpus = loadCorpus(sys.argv[1])
+	else:
+		corpus = generateCorpus(CORPUS_SIZE)
+
+	print "Corpus:", len(corpus), "lines"
+	print
+
+	run("legacy split", legacyParse, corpus)
+	run("command only", commandOnly, corpus)
+	run("dispatch fields", dispatchFields, corpus)
+	run("all fields", everything, corpus)
@@ -0,0 +1,110 @@
+# RenderBench.py
+# --------------------------------------------------------------------------
+
+# Measures what it costs to render a player's hand for the "Hand: ..."
+# notice: the old way (string cards, a colour dict built per card and the
+# string grown one card at a time), from the precomputed card strings in
+# Plugin/Uno/Table.py, and when the hand hasn't changed since it was last
+# sent, so the cached string is used.
+#
+# ------ Usage
+#	python2 Benchmarks/RenderBench.py
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import DeeIRC.Utils as Utils
+import Plugin.Uno.Cards as Cards
+import Plugin.Uno.Table as Table
+
+# ------------------------------------------------------------------------------
+
+RENDERS = 20000
+
+HAND_SIZES = (7, 60)
+
+def legacyCardColorCode(card):
+	"""UnoTable.cardColorCode as it was."""
+	colors = {
+		"r":{"fg":0, "bg":4},
+		"g":{"fg":0, "bg":3},
+		"b":{"fg":0, "bg":12},
+		"y":{"fg":1, "bg":8},
+		"w":{"fg":0, "bg":1}
+	}
+
+	if len(card) == 2:
+		if card[0] == "w":
+			color = colors[card[1]]
+		else:
+			color = colors[card[0]]
+	else:
+		color = colors[card[0]]
+
+	return Utils.colorCode(**color)
+
+def legacyCardString(card):
+	"""UnoTable.cardString as it was."""
+	return legacyCardColorCode(card) + card + Utils.normalCode()
+
+def legacyDeckString(deck):
+	"""UnoTable.deckString as it was."""
+	deck_string = ""
+	for i in range(len(deck)):
+		deck_string = deck_string + legacyCardString(deck[i]) + " "
+	return deck_string
+
+# ------------------------------------------------------------------------------
+
+def dealHand(size, seed=1):
+	"""Returns size cards from shuffled decks, as a Hand."""
+	rng = random.Random(seed)
+	deck = []
+	while len(deck) < size:
+		deck.extend(Cards.standardDeck())
+	rng.shuffle(deck)
+
+	return Cards.Hand(deck[:size])
+
+def cachedRender(table, hand):
+	"""UnoTable.sendPlayerHand's path to the string, cache included."""
+	if hand.cache is None:
+		hand.cache = table.deckString(hand)
+	return hand.cache
+
+def run(name, function, argument, size):
+	"""Renders a hand RENDERS times and prints the best per render cost."""
+	best = None
+
+	for i in range(3):
+		start = time.time()
+		for j in range(RENDERS):
+			function(argument)
+		elapsed = time.time() - start
+
+		if best is None or elapsed < best:
+			best = elapsed
+
+	print "%-34s %3d cards %9.2f us/render" % (name, size, best / RENDERS * 1e6)
+
+# ------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+	table = Table.UnoTable("#bench")
+
+	for size in HAND_SIZES:
+		hand = dealHand(size)
+
+		# Both ways list the cards in the same order, so should agree.
+		legacy_hand = [Cards.toString(card) for card in hand]
+		if legacyDeckString(legacy_hand) != table.deckString(hand):
+			raise RuntimeError("The two renderings differ for " + str(size) + " cards.")
+
+		run("legacy deckString", legacyDeckString, legacy_hand, size)
+		run("precomputed deckString", table.deckString, hand, size)
+		run("precomputed, cached hand", lambda hand: cachedRender(table, hand), hand, size)
+		print
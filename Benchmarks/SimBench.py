@@ -0,0 +1,85 @@
+# SimBench.py
+# --------------------------------------------------------------------------
+
+# Measures how many simulated games an hour the rules can play, one game at
+# a time through Plugin/Uno/Engine.py and in lockstep batches through
+# Plugin/Uno/Batch.py. Both play the same simple strategy (the lowest legal
+# card, the most held colour for a wild, play a drawn card if possible), so
+# the share of wins per seat and the mean turns should agree as well. The
+# same deals are then played both ways, see Batch.crossCheck(), and any game
+# that finished differently is reported.
+#
+# Needs NumPy for the batch runs.
+#
+# ------ Usage
+#	python2 Benchmarks/SimBench.py [--players 4] [--games 2000]
+#		[--batches 1000,10000]
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import Plugin.Uno.Batch as Batch
+import Plugin.Uno.Engine as Engine
+
+# ------------------------------------------------------------------------------
+
+def playEngineGame(rng, players, max_turns):
+	"""Plays one game through the engine. Returns (winner, turns), winner
+	None if it was abandoned."""
+	game = Engine.Game(rng)
+	for i in range(players):
+		game.addPlayer()
+	game.start()
+	game.nextTurn()
+
+	return Batch.playFirstLegal(game, max_turns)
+
+def report(name, games, finished, wins, turns, elapsed):
+	"""Prints one line of results."""
+	shares = " ".join(["%5.1f%%" % (100.0 * win / max(finished, 1)) for win in wins])
+	print "%-18s %8d %8.0f %12.0f %8.1f   %s" % (name, games, games / elapsed, games / elapsed * 3600, turns, shares)
+
+# ------------------------------------------------------------------------------
+
+def main():
+	parser = argparse.ArgumentParser(description="Simulated Uno games per hour, one at a time and in batches.")
+	parser.add_argument("--players", type=int, default=4, help="players per game")
+	parser.add_argument("--games", type=int, default=2000, help="games to play through the engine")
+	parser.add_argument("--batches", default="1000,10000", help="comma separated batch sizes")
+	parser.add_argument("--max-turns", type=int, default=1000, help="turns before a game is abandoned")
+	parser.add_argument("--seed", type=int, default=1)
+	parser.add_argument("--check", type=int, default=1000, help="deals to play both ways and compare")
+	options = parser.parse_args()
+
+	print "%-18s %8s %8s %12s %8s   %s" % ("", "games", "games/s", "games/hour", "turns", "wins per seat")
+
+	rng = random.Random(options.seed)
+	wins = [0] * options.players
+	turns = 0
+	start = time.time()
+
+	for i in range(options.games):
+		winner, played = playEngineGame(rng, options.players, options.max_turns)
+		if winner is not None:
+			wins[winner] += 1
+			turns += played
+
+	finished = sum(wins)
+	report("engine", options.games, finished, wins, turns / float(max(finished, 1)), time.time() - start)
+
+	for size in [int(size) for size in options.batches.split(",")]:
+		start = time.time()
+		results = Batch.BatchGame(size, options.players, options.seed, max_turns=options.max_turns).run([Batch.firstLegal] * options.players).results()
+		report("batch of " + str(size), size, results["finished"], results["wins"], results["mean_turns"] or 0, time.time() - start)
+
+	compared, mismatches = Batch.crossCheck(options.check, options.players, options.seed, options.max_turns)
+	print
+	print "cross-check: %d of %d deals compared, %d finished differently" % (compared, options.check, len(mismatches))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,419 @@
+# StandIn.py
+# --------------------------------------------------------------------------
+
+# A minimal IRC server for benchmarks and load tests, listening on localhost.
+# It speaks just enough of the protocol for DeeIRC.connect() and ordinary
+# clients: registration, PING/PONG, JOIN/PART/QUIT, NAMES on join, and
+# PRIVMSG/NOTICE/MODE relayed to channels or nicks. There is no flood
+# control, no modes are enforced and nothing is persisted.
+#
+# Besides real clients, lines can be injected from virtual users that have
+# no socket, either one at a time with inject() or as a stream with replay().
+# Every line a client sends is passed to on_line(nick, line, when), which is
+# how benchmarks see the bot's replies.
+#
+# ------ Usage
+#	server = StandIn.StandIn()
+#	server.start()
+#	... connect a bot to 127.0.0.1:server.port ...
+#	server.forceJoin("UnoBot", "#uno")
+#	server.inject("alice", "PRIVMSG", "#uno", "uno")
+#	server.stop()
+#
+# Run on it's own it just serves until interrupted:
+#	python2 Benchmarks/StandIn.py [port]
+
+import os
+import select
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import DeeIRC.Parser as Parser
+import DeeIRC.Utils as Utils
+
+# ------------------------------------------------------------------------------
+
+class Client(object):
+	"""One connected socket."""
+
+	def __init__(self, sock):
+		"""Constructor."""
+		self.sock = sock
+		self.nick = None
+		self.user = None
+		self.buffer = ""
+		self.channels = set()
+		self.registered = False
+		self.lock = threading.Lock()
+
+	def prefix(self):
+		"""Returns the nick!user@host this client's lines are relayed with."""
+		return self.nick + "!" + (self.user or self.nick) + "@standin"
+
+# ------------------------------------------------------------------------------
+
+class StandIn(object):
+	"""Single threaded select() IRC server."""
+
+	def __init__(self, host="127.0.0.1", port=0, name="standin.local"):
+		"""Constructor. Port 0 picks a free one, see self.port once started."""
+		self.host = host
+		self.port = port
+		self.name = name
+
+		# Called as on_line(nick, line, when) for every line a client sends.
+		self.on_line = None
+
+		self.__clients = {}
+		self.__nicks = {}
+		self.__channels = {}
+		self.__lock = threading.RLock()
+
+		self.__listener = None
+		self.__thread = None
+		self.running = False
+
+		self.lines_in = 0
+		self.lines_out = 0
+
+	# ------ Thread management.
+
+	def start(self):
+		"""Starts listening and serving on a background thread."""
+		self.__listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		self.__listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		self.__listener.bind((self.host, self.port))
+		self.__listener.listen(128)
+		self.port = self.__listener.getsockname()[1]
+
+		self.running = True
+		self.__thread = threading.Thread(target=self.serveLoop, name="StandIn")
+		self.__thread.daemon = True
+		self.__thread.start()
+
+	def stop(self):
+		"""Disconnects everyone and stops serving."""
+		self.running = False
+		self.__thread.join()
+
+		with self.__lock:
+			for client in self.__clients.values():
+				self.dropClient(client)
+
+		self.__listener.close()
+
+	def serveLoop(self):
+		"""Accepts clients and reads their lines. Runs in it's own thread."""
+		while self.running:
+			with self.__lock:
+				sockets = [self.__listener] + self.__clients.keys()
+
+			readable, writable, failed = select.select(sockets, [], [], 0.1)
+
+			for sock in readable:
+				if sock is self.__listener:
+					client_sock, address = self.__listener.accept()
+					client_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+					with self.__lock:
+						self.__clients[client_sock] = Client(client_sock)
+				else:
+					self.readClient(sock)
+
+	def readClient(self, sock):
+		"""Reads what a client has sent and handles each whole line."""
+		with self.__lock:
+			client = self.__clients.get(sock)
+		if client is None:
+			return
+
+		try:
+			data = sock.recv(65536)
+		except socket.error:
+			data = ""
+
+		if not data:
+			with self.__lock:
+				self.quitClient(client, "Connection closed")
+			return
+
+		lines = (client.buffer + data).split("\n")
+		client.buffer = lines.pop()
+		now = time.time()
+
+		for line in lines:
+			line = line.rstrip("\r")
+			if line:
+				self.lines_in += 1
+
+				if self.on_line is not None and client.nick is not None:
+					self.on_line(client.nick, line, now)
+
+				with self.__lock:
+					self.handleLine(client, line)
+
+	# ------ Sending.
+
+	def send(self, client, line):
+		"""Sends one line to a client, dropping it if the socket is gone."""
+		try:
+			with client.lock:
+				client.sock.sendall(line + "\r\n")
+			self.lines_out += 1
+		except socket.error:
+			pass
+
+	def sendNumeric(self, client, numeric, text):
+		"""Sends a numeric reply to a client."""
+		self.send(client, ":" + self.name + " " + numeric + " " + (client.nick or "*") + " " + text)
+
+	def deliver(self, target, line, exclude=None):
+		"""Sends a line to everyone in a channel, or to a nick."""
+		with self.__lock:
+			if Utils.isChannel(target):
+				clients = [client for client in self.__channels.get(Utils.lowerNick(target), ()) if client is not exclude]
+			else:
+				client = self.__nicks.get(Utils.lowerNick(target))
+				clients = [client] if client is not None else []
+
+		for client in clients:
+			self.send(client, line)
+
+	# ------ Virtual users.
+
+	def inject(self, nick, command, target, text):
+		"""Sends a line from a user with no socket, e.g.
+		inject("alice", "PRIVMSG", "#uno", "play r5")."""
+		self.deliver(target, ":" + nick + "!" + nick + "@virtual " + command + " " + target + " :" + text)
+
+	def injectLine(self, line):
+		"""Delivers a raw line with a prefix, e.g. from a recording, to
+		wherever it's first parameter points."""
+		message = Parser.parse(line)
+		target = message.param(0)
+
+		if target:
+			self.deliver(target, line)
+
+	def replay(self, lines, rate=None):
+		"""Delivers raw lines at rate lines/second, or as fast as possible if
+		rate is None. Returns the seconds it took."""
+		start = time.time()
+
+		for index, line in enumerate(lines):
+			if rate:
+				wait = start + index / float(rate) - time.time()
+				if wait > 0:
+					time.sleep(wait)
+
+			self.injectLine(line)
+
+		return time.time() - start
+
+	def forceJoin(self, nick, channel):
+		"""Puts a connected client into a channel as if it had asked."""
+		with self.__lock:
+			client = self.__nicks.get(Utils.lowerNick(nick))
+			if client is not None:
+				self.joinChannel(client, channel)
+
+	def hasClient(self, nick):
+		"""Returns true if a nick is connected and registered."""
+		with self.__lock:
+			client = self.__nicks.get(Utils.lowerNick(nick))
+			return client is not None and client.registered
+
+	# ------ Protocol.
+
+	def handleLine(self, client, line):
+		"""Handles one line from a client."""
+		message = Parser.parse(line)
+		command = message.command
+
+		if command == "PRIVMSG" or command == "NOTICE":
+			if client.registered:
+				target = message.param(0)
+				self.deliver(target, ":" + client.prefix() + " " + command + " " + target + " :" + message.param(1), client)
+		elif command == "PING":
+			self.send(client, ":" + self.name + " PONG " + self.name + " :" + message.param(-1))
+		elif command == "PONG":
+			pass
+		elif command == "MODE":
+			target = message.param(0)
+			if client.registered and Utils.isChannel(target):
+				self.deliver(target, ":" + client.prefix() + " " + line.split(" ", 1)[1])
+		elif command == "JOIN":
+			if client.registered:
+				for channel in message.param(0).split(","):
+					if Utils.isChannel(channel):
+						self.joinChannel(client, channel)
+		elif command == "PART":
+			if client.registered:
+				for channel in message.param(0).split(","):
+					self.partChannel(client, channel, "PART " + channel)
+		elif command == "NICK":
+			self.changeNick(client, message.param(0))
+		elif command == "USER":
+			client.user = message.param(0)
+			self.checkRegistered(client)
+		elif command == "QUIT":
+			self.quitClient(client, message.param(0, "Quit"))
+
+	def changeNick(self, client, nick):
+		"""Handles NICK, during registration or after."""
+		key = Utils.lowerNick(nick)
+		if not nick:
+			return
+
+		if key in self.__nicks and self.__nicks[key] is not client:
+			self.sendNumeric(client, "433", nick + " :Nickname is already in use")
+			return
+
+		if client.nick is not None:
+			del self.__nicks[Utils.lowerNick(client.nick)]
+
+			if client.registered:
+				line = ":" + client.prefix() + " NICK :" + nick
+				seen = set([client])
+				self.send(client, line)
+				for channel in client.channels:
+					for member in self.__channels[channel]:
+						if not member in seen:
+							seen.add(member)
+							self.send(member, line)
+
+		client.nick = nick
+		self.__nicks[key] = client
+		self.checkRegistered(client)
+
+	def checkRegistered(self, client):
+		"""Welcomes a client once it has sent both NICK and USER."""
+		if client.registered or client.nick is None or client.user is None:
+			return
+
+		client.registered = True
+		self.sendNumeric(client, "001", ":Welcome to the stand-in network " + client.prefix())
+		self.sendNumeric(client, "005", "CASEMAPPING=rfc1459 CHANTYPES=# :are supported by this server")
+
+	def joinChannel(self, client, channel):
+		"""Adds a client to a channel and sends it the member list."""
+		key = Utils.lowerNick(channel)
+		members = self.__channels.setdefault(key, set())
+
+		if client in members:
+			return
+
+		members.add(client)
+		client.channels.add(key)
+
+		line = ":" + client.prefix() + " JOIN :" + channel
+		for member in members:
+			self.send(member, line)
+
+		self.sendNumeric(client, "353", "= " + channel + " :" + " ".join([member.nick for member in members]))
+		self.sendNumeric(client, "366", channel + " :End of /NAMES list.")
+
+	def partChannel(self, client, channel, command):
+		"""Removes a client from a channel, telling everyone in it."""
+		key = Utils.lowerNick(channel)
+		members = self.__channels.get(key)
+
+		if members is None or not client in members:
+			return
+
+		line = ":" + client.prefix() + " " + command
+		for member in members:
+			self.send(member, line)
+
+		members.discard(client)
+		client.channels.discard(key)
+		if not members:
+			del self.__channels[key]
+
+	def quitClient(self, client, reason):
+		"""Tells a client's channels it has gone and drops it."""
+		seen = set([client])
+		line = ":" + (client.prefix() if client.nick else "*") + " QUIT :" + reason
+
+		for key in list(client.channels):
+			members = self.__channels[key]
+			members.discard(client)
+			for member in members:
+				if not member in seen:
+					seen.add(member)
+					self.send(member, line)
+			if not members:
+				del self.__channels[key]
+
+		client.channels.clear()
+		self.dropClient(client)
+
+	def dropClient(self, client):
+		"""Closes a client's socket and forgets it."""
+		self.__clients.pop(client.sock, None)
+		if client.nick is not None and self.__nicks.get(Utils.lowerNick(client.nick)) is client:
+			del self.__nicks[Utils.lowerNick(client.nick)]
+
+		try:
+			client.sock.close()
+		except socket.error:
+			pass
+
+# ------------------------------------------------------------------------------
+
+def launchBot(port, channel="#uno", nick="UnoBot", timeout=10.0, server=None, **env):
+	"""Starts DeeBot.py in a child process pointed at a local port, with
+	flood control off. Extra IRC_* settings can be passed as keywords, e.g.
+	IRC_COMMAND_PREFIX="!". If a StandIn is given, waits for the bot to
+	register. Returns the Popen, kill() it when done."""
+	root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+	workdir = tempfile.mkdtemp(prefix="unobot-bench-")
+
+	bot_env = dict(os.environ)
+	bot_env.update({
+		"IRC_SERVER":"127.0.0.1",
+		"IRC_PORT":str(port),
+		"IRC_CHANNEL":channel,
+		"IRC_ADMINS":"",
+		"IRC_NS_PW":"",
+		"IRC_SEND_RATE":"1000000",
+		"IRC_SEND_BURST":"1000000",
+		"IRC_RECONNECT":"0",
+	})
+	bot_env.update(env)
+
+	# The bot writes it's pid file to the working directory.
+	devnull = open(os.devnull, "w")
+	process = subprocess.Popen([sys.executable, os.path.join(root, "DeeBot.py")], cwd=workdir, env=bot_env, stdout=devnull, stderr=subprocess.STDOUT)
+
+	if server is not None:
+		deadline = time.time() + timeout
+		while not server.hasClient(nick):
+			if time.time() > deadline or process.poll() is not None:
+				process.kill()
+				raise RuntimeError("The bot didn't connect to the stand-in.")
+			time.sleep(0.05)
+
+	return process
+
+# ------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+	port = 6667
+	if len(sys.argv) > 1:
+		port = int(sys.argv[1])
+
+	server = StandIn(port=port)
+	server.start()
+	print "Stand-in IRC server on " + server.host + ":" + str(server.port)
+
+	try:
+		while True:
+			time.sleep(1)
+	except KeyboardInterrupt:
+		server.stop()
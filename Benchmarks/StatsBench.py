@@ -0,0 +1,143 @@
+# StatsBench.py
+# --------------------------------------------------------------------------
+
+# Measures the player statistics in Plugin/Uno/Stats.py: what recording a
+# finished game costs the table that finished it, how many games a second
+# the batched writer stores against a transaction per game, how long the
+# "stats" and "leaders" lookups take, and how long loading every player's
+# totals takes when the store opens.
+#
+# ------ Usage
+#	python2 Benchmarks/StatsBench.py [--games 20000] [--players 100000]
+#		[--dir /tmp]
+
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import Plugin.Uno.Stats as Stats
+
+# ------------------------------------------------------------------------------
+
+LOOKUPS = 100000
+
+def randomGames(rng, count, nicks):
+	"""Returns count (channel, winner, players) games of 2 to 6 players."""
+	games = []
+	for i in xrange(count):
+		players = [(nick, rng.randrange(5, 40)) for nick in rng.sample(nicks, rng.randrange(2, 7))]
+		games.append(("#uno" + str(i % 20), rng.choice(players)[0], players))
+	return games
+
+def benchBatched(path, games):
+	"""Returns microseconds per recordGame() and games written a second."""
+	store = Stats.StatsStore(path)
+
+	start = time.time()
+	for channel, winner, players in games:
+		store.recordGame(channel, winner, players)
+	recorded = time.time() - start
+
+	store.flush()
+	written = time.time() - start
+
+	store.close()
+	return recorded / len(games) * 1e6, len(games) / written
+
+def benchEach(path, games):
+	"""Returns games written a second with a transaction per game, the way
+	a table writing it's own results would."""
+	store = Stats.StatsStore(path, interval=0)
+
+	start = time.time()
+	for channel, winner, players in games:
+		store.recordGame(channel, winner, players)
+		store.flush()
+	written = time.time() - start
+
+	store.close()
+	return len(games) / written
+
+def benchLookups(path, nicks):
+	"""Returns microseconds per getPlayer(), getLeaders() while unchanged,
+	and getLeaders() after every game."""
+	store = Stats.StatsStore(path)
+	results = []
+
+	start = time.time()
+	for i in xrange(LOOKUPS):
+		store.getPlayer(nicks[i % len(nicks)])
+	results.append((time.time() - start) / LOOKUPS * 1e6)
+
+	start = time.time()
+	for i in xrange(LOOKUPS):
+		store.getLeaders()
+	results.append((time.time() - start) / LOOKUPS * 1e6)
+
+	rounds = 100
+	start = time.time()
+	for i in xrange(rounds):
+		store.recordGame("#uno", nicks[0], [(nicks[0], 10), (nicks[1], 10)])
+		store.getLeaders()
+	results.append((time.time() - start) / rounds * 1e6)
+
+	store.close()
+	return results
+
+def benchWarmUp(path):
+	"""Returns milliseconds to open the store, and the players loaded."""
+	start = time.time()
+	store = Stats.StatsStore(path)
+	elapsed = (time.time() - start) * 1000
+	store.close()
+
+	players = sqlite3.connect(path).execute("SELECT COUNT(*) FROM players").fetchone()[0]
+	return elapsed, players
+
+# ------------------------------------------------------------------------------
+
+def main():
+	parser = argparse.ArgumentParser(description="Cost of recording and looking up player statistics.")
+	parser.add_argument("--games", type=int, default=20000, help="games to record")
+	parser.add_argument("--each", type=int, default=500, help="games to record a transaction at a time")
+	parser.add_argument("--players", type=int, default=100000, help="distinct nicks")
+	parser.add_argument("--seed", type=int, default=1)
+	parser.add_argument("--dir", default=None, help="where to write databases")
+	options = parser.parse_args()
+
+	rng = random.Random(options.seed)
+	nicks = ["player" + str(i) for i in xrange(options.players)]
+	games = randomGames(rng, options.games, nicks)
+
+	directory = tempfile.mkdtemp(prefix="unobot-stats-", dir=options.dir)
+
+	try:
+		path = os.path.join(directory, "stats.db")
+
+		record, batched = benchBatched(path, games)
+		each = benchEach(os.path.join(directory, "each.db"), games[:options.each])
+		print "%-28s %10.1fus" % ("recordGame()", record)
+		print "%-28s %10.0f games/s" % ("written in batches", batched)
+		print "%-28s %10.0f games/s" % ("written one at a time", each)
+
+		print
+		player, leaders, changed = benchLookups(path, nicks)
+		print "%-28s %10.2fus" % ("stats", player)
+		print "%-28s %10.2fus" % ("leaders", leaders)
+		print "%-28s %10.1fus" % ("leaders, after a game", changed)
+
+		print
+		elapsed, players = benchWarmUp(path)
+		print "%-28s %10.1fms, %d players" % ("open and load totals", elapsed, players)
+	finally:
+		shutil.rmtree(directory)
+
+if __name__ == "__main__":
+	main()
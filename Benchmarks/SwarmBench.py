@@ -0,0 +1,427 @@
+# SwarmBench.py
+# --------------------------------------------------------------------------
+
+# Load test with simulated players. Runs the bot in a child process against
+# Benchmarks/StandIn.py and connects a swarm of real client sockets to it,
+# a few players per channel. Each table opens a lobby ("uno"), the others
+# "join", the owner deals, and then everyone plays legal moves from the hands
+# the bot sends them: a matching card if they have one, a wild if not,
+# otherwise "draw" and then "play" or "pass". Finished games start again
+# straight away, so the whole commandPlay path stays under load.
+#
+# Players either act as soon as it's their turn or after a human-like pause
+# (--think). Each step runs a number of concurrent games for a while and
+# reports commands/second, games finished, stalls (a game where the bot
+# went quiet, which is stopped and restarted) and the latency from each
+# command to the bot's first reply, per command.
+#
+# ------ Usage
+#	python2 Benchmarks/SwarmBench.py [--games 5,20,50] [--players 3]
+#		[--duration 10] [--think 0]
+#
+# The swarm and the stand-in server share this process; the bot has it's
+# own.
+
+import argparse
+import collections
+import heapq
+import os
+import random
+import re
+import select
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import StandIn
+
+# ------------------------------------------------------------------------------
+
+COLORS = "rgby"
+
+# Seconds without a word from the bot before a game counts as stalled.
+STALL_TIMEOUT = 10.0
+
+# mIRC colour and formatting codes, as the bot sends cards.
+FORMATTING = re.compile("\x03[0-9]{0,2}(,[0-9]{1,2})?|[\x02\x0f\x16\x1f]")
+
+def stripCodes(text):
+	"""Removes colour and formatting codes."""
+	return FORMATTING.sub("", text)
+
+def percentile(values, fraction):
+	"""Returns the value below which fraction of the sorted values fall."""
+	if not values:
+		return None
+	return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def formatMs(seconds):
+	"""Formats seconds as milliseconds for the report."""
+	if seconds is None:
+		return "-"
+	return "%.1fms" % (seconds * 1000)
+
+# ------------------------------------------------------------------------------
+
+class Game(object):
+	"""What the players at one table know about their game."""
+
+	def __init__(self, channel):
+		"""Constructor."""
+		self.channel = channel
+		self.players = []
+		self.state = "idle"
+		self.top = None
+		self.joined = 0
+		self.last_heard = time.time()
+
+	def owner(self):
+		"""The player who opens the lobby and deals."""
+		return self.players[0]
+
+class Player(object):
+	"""One simulated client."""
+
+	def __init__(self, swarm, nick, game):
+		"""Constructor."""
+		self.swarm = swarm
+		self.nick = nick
+		self.game = game
+		self.hand = []
+		self.drawn = False
+		self.buffer = ""
+		self.registered = False
+
+		# (command, time sent) of the last command awaiting a reply.
+		self.pending = None
+
+		self.sock = socket.create_connection(("127.0.0.1", swarm.port))
+		self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		self.sendLine("NICK " + nick)
+		self.sendLine("USER " + nick + " * * :Swarm player")
+
+	def fileno(self):
+		"""For select()."""
+		return self.sock.fileno()
+
+	def sendLine(self, line):
+		"""Writes one line to the server."""
+		self.sock.sendall(line + "\r\n")
+
+	def say(self, text):
+		"""Sends a command to the game channel, timing the reply."""
+		command = text.split(" ", 1)[0]
+		self.pending = (command, time.time())
+		self.swarm.commands += 1
+		self.sendLine("PRIVMSG " + self.game.channel + " :" + text)
+
+	# ------ Reading.
+
+	def handleRead(self):
+		"""Reads whatever the server has sent."""
+		try:
+			data = self.sock.recv(65536)
+		except socket.error:
+			data = ""
+
+		if not data:
+			raise RuntimeError(self.nick + " was disconnected.")
+
+		lines = (self.buffer + data).split("\n")
+		self.buffer = lines.pop()
+
+		for line in lines:
+			self.handleLine(line.rstrip("\r"))
+
+	def handleLine(self, line):
+		"""Works out what the bot told us."""
+		parts = line.split(" ", 3)
+
+		if len(parts) >= 2 and parts[1] == "001":
+			self.registered = True
+			self.sendLine("JOIN " + self.game.channel)
+			return
+
+		if len(parts) < 4 or not parts[0].startswith(":" + self.swarm.bot_nick + "!"):
+			return
+
+		command, target, text = parts[1], parts[2], stripCodes(parts[3][1:])
+
+		if command == "NOTICE" and target == self.nick:
+			self.replied()
+			for message in text.split(" | "):
+				self.handleNotice(message)
+
+		elif command == "PRIVMSG" and target == self.game.channel:
+			self.game.last_heard = time.time()
+
+			# Only the first player to hear a channel line acts on it.
+			first = self is self.swarm.listener(self.game)
+
+			for message in text.split(" | "):
+				if self.nick in message:
+					self.replied()
+				if first:
+					self.swarm.handleChannel(self.game, message)
+
+	def replied(self):
+		"""Records the latency of the command we're waiting on."""
+		if self.pending is not None:
+			command, sent = self.pending
+			self.swarm.latencies[command].append(time.time() - sent)
+			self.pending = None
+
+	def handleNotice(self, message):
+		"""Hands, and complaints about our moves."""
+		if message.startswith("Hand: "):
+			self.hand = message[6:].split()
+		elif message.startswith("Top card is now: "):
+			self.game.top = message[17:].strip()
+		elif message.startswith(("You can't play", "You don't have", "Please specify")):
+			self.swarm.illegal += 1
+			self.swarm.schedule(0, self.drawOrPass)
+		elif message.startswith("You cannot draw another card"):
+			self.swarm.schedule(0, self.say, "pass")
+		elif message.startswith("You need to \"draw\""):
+			self.swarm.schedule(0, self.say, "draw")
+
+	# ------ Playing.
+
+	def playable(self, card):
+		"""Returns true if the bot will accept a card on the current top."""
+		top = self.game.top
+		if card[0] == "w" or not top:
+			return card[0] == "w"
+
+		# After a wild the top is just a colour.
+		if len(top) == 1:
+			return card[0] == top
+		return card[0] == top[0] or card[1] == top[1] or top[0] == "w"
+
+	def favouriteColor(self):
+		"""The colour we hold most of."""
+		counts = [(len([card for card in self.hand if card[0] == color]), color) for color in COLORS]
+		return max(counts)[1]
+
+	def takeTurn(self):
+		"""Plays a card, or draws."""
+		self.drawn = False
+		self.playOrElse(lambda: self.say("draw"))
+
+	def drawOrPass(self):
+		"""After a refused play."""
+		if self.drawn:
+			self.say("pass")
+		else:
+			self.drawn = True
+			self.say("draw")
+
+	def afterDraw(self):
+		"""Plays the drawn card if we can, otherwise passes."""
+		self.drawn = True
+		self.playOrElse(lambda: self.say("pass"))
+
+	def playOrElse(self, fallback):
+		"""Plays the best legal card, or runs fallback."""
+		cards = [card for card in self.hand if card[0] != "w" and self.playable(card)]
+		if cards:
+			self.say("play " + cards[0])
+		elif "w" in self.hand:
+			self.say("play w " + self.favouriteColor())
+		elif "wd4" in self.hand:
+			self.say("play wd4 " + self.favouriteColor())
+		else:
+			fallback()
+
+# ------------------------------------------------------------------------------
+
+class Swarm(object):
+	"""Runs every player from one select() loop."""
+
+	def __init__(self, port, bot_nick, games, players, think):
+		"""Constructor."""
+		self.port = port
+		self.bot_nick = bot_nick
+		self.think = think
+		self.rng = random.Random(1)
+
+		self.timers = []
+		self.timer_ids = 0
+
+		self.commands = 0
+		self.finished = 0
+		self.stalls = 0
+		self.illegal = 0
+		self.latencies = collections.defaultdict(list)
+
+		self.games = [Game("#swarm" + str(index)) for index in range(games)]
+		self.players = []
+
+		for index, game in enumerate(self.games):
+			for seat in range(players):
+				player = Player(self, "g" + str(index) + "p" + str(seat), game)
+				game.players.append(player)
+				self.players.append(player)
+
+	def listener(self, game):
+		"""The player whose copy of channel lines drives the game."""
+		return game.players[0]
+
+	def schedule(self, delay, function, *args):
+		"""Runs function(*args) after delay seconds."""
+		self.timer_ids += 1
+		heapq.heappush(self.timers, (time.time() + delay, self.timer_ids, function, args))
+
+	def pause(self):
+		"""How long a player thinks before acting."""
+		if not self.think:
+			return 0
+		return self.rng.uniform(self.think * 0.5, self.think * 1.5)
+
+	# ------ Game flow, from the channel.
+
+	def handleChannel(self, game, message):
+		"""Moves a game along based on what the bot announced."""
+		players = dict([(player.nick, player) for player in game.players])
+
+		if " has started a game of Uno" in message:
+			game.state = "lobby"
+			game.joined = 1
+			for player in game.players[1:]:
+				self.schedule(self.pause(), player.say, "join")
+
+		elif message.endswith(" has joined the game!"):
+			game.joined += 1
+			if game.joined == len(game.players):
+				self.schedule(self.pause(), game.owner().say, "deal")
+
+		elif message.startswith("Game Started, Top Card is "):
+			game.state = "playing"
+			game.top = message[26:].strip()
+
+		elif message.startswith("Top card is now: "):
+			game.top = message[17:].strip()
+
+		elif message.endswith("'s turn!"):
+			nick = message[:-8].split(" ")[-1]
+			if nick in players:
+				self.schedule(self.pause(), players[nick].takeTurn)
+
+		elif " played " in message:
+			game.top = message.rsplit(" ", 1)[1].rstrip(".")
+
+		elif " drew a card." in message:
+			nick = message.split(" ", 1)[0]
+			if nick in players:
+				# Our new hand arrives as a notice just before this.
+				self.schedule(self.pause(), players[nick].afterDraw)
+
+		elif message.endswith(" has won the game!"):
+			self.finished += 1
+			self.restart(game)
+
+	def restart(self, game):
+		"""Opens a new lobby at a table."""
+		game.state = "idle"
+		game.top = None
+		for player in game.players:
+			player.hand = []
+		self.schedule(self.pause(), game.owner().say, "uno")
+
+	# ------ Loop.
+
+	def run(self, duration):
+		"""Plays for duration seconds."""
+		start = time.time()
+		deadline = start + duration
+		opened = False
+
+		while time.time() < deadline:
+			now = time.time()
+
+			# Open the lobbies once everyone is in their channel.
+			if not opened and all([player.registered for player in self.players]):
+				opened = True
+				for game in self.games:
+					game.last_heard = now
+					self.schedule(0.2, game.owner().say, "uno")
+
+			while self.timers and self.timers[0][0] <= now:
+				when, timer_id, function, args = heapq.heappop(self.timers)
+				function(*args)
+
+			# Stop and restart any game the bot has gone quiet on.
+			for game in self.games:
+				if game.state != "idle" and now - game.last_heard > STALL_TIMEOUT:
+					self.stalls += 1
+					game.last_heard = now
+					game.owner().say("stop")
+					self.restart(game)
+
+			timeout = 0.05
+			if self.timers:
+				timeout = max(0, min(timeout, self.timers[0][0] - now))
+
+			readable, writable, failed = select.select(self.players, [], [], timeout)
+			for player in readable:
+				player.handleRead()
+
+		return time.time() - start
+
+	def close(self):
+		"""Disconnects every player."""
+		for player in self.players:
+			try:
+				player.sock.close()
+			except socket.error:
+				pass
+
+# ------------------------------------------------------------------------------
+
+def runStep(options, games):
+	"""Runs one step with a fresh server and bot. Returns the swarm."""
+	server = StandIn.StandIn()
+	server.start()
+
+	bot = StandIn.launchBot(server.port, server=server, nick=options.nick, IRC_CHANNEL="#swarm0")
+
+	try:
+		for index in range(games):
+			server.forceJoin(options.nick, "#swarm" + str(index))
+
+		swarm = Swarm(server.port, options.nick, games, options.players, options.think)
+		try:
+			swarm.elapsed = swarm.run(options.duration)
+		finally:
+			swarm.close()
+	finally:
+		bot.kill()
+		server.stop()
+
+	return swarm
+
+def main():
+	parser = argparse.ArgumentParser(description="Load test the bot with simulated Uno players.")
+	parser.add_argument("--games", default="5,20,50", help="comma separated numbers of concurrent games to try")
+	parser.add_argument("--players", type=int, default=3, help="players per game")
+	parser.add_argument("--duration", type=float, default=10.0, help="seconds per step")
+	parser.add_argument("--think", type=float, default=0.0, help="average seconds a player thinks before acting, 0 for none")
+	parser.add_argument("--nick", default="UnoBot", help="the bot's nick")
+	options = parser.parse_args()
+
+	print "%-6s %8s %10s %9s %7s %8s %9s %9s %9s" % ("games", "players", "commands/s", "finished", "stalls", "illegal", "p50", "p90", "p99")
+
+	for games in [int(games) for games in options.games.split(",")]:
+		swarm = runStep(options, games)
+		latencies = sorted(sum(swarm.latencies.values(), []))
+
+		print "%-6d %8d %10.0f %9d %7d %8d %9s %9s %9s" % (games, len(swarm.players), swarm.commands / swarm.elapsed, swarm.finished, swarm.stalls, swarm.illegal, formatMs(percentile(latencies, 0.5)), formatMs(percentile(latencies, 0.9)), formatMs(percentile(latencies, 0.99)))
+
+		for command in sorted(swarm.latencies):
+			values = sorted(swarm.latencies[command])
+			print "       %-8s %7d replies  p50 %9s  p99 %9s" % (command, len(values), formatMs(percentile(values, 0.5)), formatMs(percentile(values, 0.99)))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,118 @@
+# TimerBench.py
+# --------------------------------------------------------------------------
+
+# Measures the reactor's timers, DeeIRC/TimerWheel.py, against the heap the
+# reactor used before: scheduling with many timers waiting, cancelling (a
+# restart, what every table does every turn, is a cancel and a schedule),
+# and firing them all. Cancelled timers stay in the heap until they come
+# up, so it's size after the restarts is shown too.
+#
+# Time is simulated, nothing sleeps.
+#
+# ------ Usage
+#	python2 Benchmarks/TimerBench.py [--timers 10000,100000]
+#		[--restarts 100000]
+
+import argparse
+import heapq
+import itertools
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import DeeIRC.TimerWheel as TimerWheel
+
+# ------------------------------------------------------------------------------
+
+START = 1000000.0
+
+class HeapTimers(object):
+	"""The reactor's timers as they were: a heap, cancelled lazily."""
+
+	def __init__(self, now):
+		"""Constructor."""
+		self.timers = []
+		self.ids = itertools.count()
+
+	def __len__(self):
+		"""Returns the heap's size, cancelled timers included."""
+		return len(self.timers)
+
+	def schedule(self, when, function, args=()):
+		"""Adds a timer."""
+		timer = TimerWheel.Timer(when, function, args)
+		heapq.heappush(self.timers, (when, next(self.ids), timer))
+		return timer
+
+	def advance(self, now):
+		"""Pops the timers that are due."""
+		due = []
+		while self.timers and self.timers[0][0] <= now:
+			due.append(heapq.heappop(self.timers)[2])
+		return due
+
+def delays(rng, count):
+	"""Returns count delays, spread like turn, lobby and idle timeouts."""
+	return [rng.choice((90, 300, 1800)) * rng.random() for i in xrange(count)]
+
+def bench(kind, count, restarts, seed):
+	"""Returns microseconds per schedule, per cancel and per timer fired,
+	and the size after the restarts."""
+	rng = random.Random(seed)
+	timers = kind(START)
+	waits = delays(rng, count)
+
+	start = time.time()
+	handles = [timers.schedule(START + wait, None) for wait in waits]
+	schedule = (time.time() - start) / count * 1e6
+
+	# Each restart cancels a random timer and schedules it again, the
+	# cancels and the schedules timed apart.
+	picks = [rng.randrange(count) for i in xrange(restarts)]
+	waits = delays(rng, restarts)
+
+	cancel = 0.0
+	for pick, wait in itertools.izip(picks, waits):
+		handle = handles[pick]
+		start = time.time()
+		handle.cancel()
+		cancel += time.time() - start
+		handles[pick] = timers.schedule(START + wait, None)
+	cancel = cancel / restarts * 1e6
+	size = len(timers)
+
+	# Run through to the end a tenth of a second at a time, like the
+	# reactor waking up, skipping the cancelled ones as it would.
+	fired = 0
+	now = START
+	start = time.time()
+	while now < START + 1800:
+		now += 0.1
+		for timer in timers.advance(now):
+			if not timer.cancelled:
+				fired += 1
+	advance = (time.time() - start) / max(fired, 1) * 1e6
+
+	return schedule, cancel, advance, size
+
+# ------------------------------------------------------------------------------
+
+def main():
+	parser = argparse.ArgumentParser(description="Cost of the reactor's timers, the timer wheel against a heap.")
+	parser.add_argument("--timers", default="10000,100000", help="comma separated numbers of timers waiting")
+	parser.add_argument("--restarts", type=int, default=100000, help="timers cancelled and scheduled again")
+	parser.add_argument("--seed", type=int, default=1)
+	options = parser.parse_args()
+
+	print "%-8s %8s %12s %12s %12s %10s" % ("timers", "kind", "schedule", "cancel", "fire", "size")
+
+	for count in [int(count) for count in options.timers.split(",")]:
+		for name, kind in (("heap", HeapTimers), ("wheel", TimerWheel.TimerWheel)):
+			schedule, cancel, advance, size = bench(kind, count, options.restarts, options.seed)
+			print "%-8d %8s %10.2fus %10.2fus %10.2fus %10d" % (count, name, schedule, cancel, advance, size)
+
+if __name__ == "__main__":
+	main()
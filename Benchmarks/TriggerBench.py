@@ -0,0 +1,122 @@
+# TriggerBench.py
+# --------------------------------------------------------------------------
+
+# Measures what it costs to decide whether a channel line is a command, the
+# old way (asking every plugin) and through Plugin.CommandIndex. Prints the
+# cost per line and the share of one core that 1,000 lines/second would use.
+#
+# ------ Usage
+#	python2 Benchmarks/TriggerBench.py
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import Plugin
+import Plugin.Uno as Uno
+
+# ------------------------------------------------------------------------------
+
+LINES = 200000
+LINE_RATE = 1000
+
+WORDS = ["hello", "anyone", "around", "lol", "gg", "nice", "the", "a", "is", "what", "Play", "unobot", "deal?", "pass"]
+
+def generateLines(count, command_share, seed=1):
+	"""Returns channel lines, command_share of them Uno commands."""
+	rng = random.Random(seed)
+	commands = ["play r5", "p wd4 g", "draw", "d", "pass", "hand", "top", "turn", "join", "uno"]
+	lines = []
+
+	for i in range(count):
+		if rng.random() < command_share:
+			lines.append(rng.choice(commands))
+		else:
+			lines.append(" ".join([rng.choice(WORDS) for j in range(rng.randint(1, 10))]))
+
+	return lines
+
+# ------------------------------------------------------------------------------
+
+def legacyFind(plugins, message):
+	"""MessageEvent.fire and DeeBot.findPluginFromTrigger as they were."""
+	trigger_end = message.find(" ")
+	if not trigger_end >= 0:
+		trigger_end = len(message)
+	trigger = message[0:trigger_end].lower()
+
+	trigger = trigger.lower()
+	for plugin_name in plugins:
+		plugin = plugins[plugin_name]["module"].getPluginInstance()
+		if plugin.hasCommand(trigger):
+			plugin = plugins[plugin_name]["module"].getPluginInstance()
+			return plugin, trigger, message[trigger_end+1:]
+
+	return None
+
+class FakeModule(object):
+	"""Stands in for a plugin module, to see how the old loop scales."""
+
+	def __init__(self, number):
+		"""Constructor. Gives the plugin a few triggers of it's own."""
+		self.plugin = Plugin.Plugin()
+		for trigger in ("seen", "tell", "quote", "weather"):
+			self.plugin.addCommand(trigger + str(number), None)
+
+	def getPluginInstance(self):
+		"""Returns the plugin, like a real plugin module."""
+		return self.plugin
+
+class NullBot(object):
+	"""Just enough of a bot for plugins to load against."""
+	config = {}
+
+	def addEvent(self, event_type, event):
+		"""Plugins register events on load, there are none to fire here."""
+		pass
+
+def run(name, function, argument, lines, repeat=3):
+	"""Runs a lookup over every line and prints the best per line cost."""
+	best = None
+
+	for i in range(repeat):
+		start = time.time()
+		for line in lines:
+			function(argument, line)
+		elapsed = time.time() - start
+
+		if best is None or elapsed < best:
+			best = elapsed
+
+	per_line = best / len(lines)
+	print "%-30s %8.3f us/line %8.4f%% of a core at %d lines/s" % (name, per_line * 1e6, per_line * LINE_RATE * 100, LINE_RATE)
+
+# ------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+	index = Plugin.CommandIndex()
+
+	uno = Uno.getPluginInstance()
+	uno.attachIndex(index, "Uno")
+	uno.load(NullBot())
+
+	plugins = {"Uno":{"module":Uno, "instance":uno}}
+
+	# The same again with nine more plugins loaded.
+	many_plugins = dict(plugins)
+	for number in range(9):
+		module = FakeModule(number)
+		module.plugin.attachIndex(index, "Fake" + str(number))
+		many_plugins["Fake" + str(number)] = {"module":module, "instance":module.plugin}
+
+	for share in (0.0, 0.05, 0.5):
+		lines = generateLines(LINES, share)
+		print "Lines:", len(lines), "(" + str(int(share * 100)) + "% commands)"
+
+		run("legacy plugin loop", legacyFind, plugins, lines)
+		run("legacy loop, 10 plugins", legacyFind, many_plugins, lines)
+		run("CommandIndex.find, 10 plugins", Plugin.CommandIndex.find, index, lines)
+		print
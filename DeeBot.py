@@ -10,6 +10,8 @@
 #		}
 #	}
 import os
+import random
+import struct
 import threading
 import os
 import sys
@@ -26,24 +28,83 @@ class DeeBot(DeeIRC.IRC.DeeIRC):
 	
 	def __init__(self):
 		"""Constructor"""
-		self.debug = True
+		
+		# Debug logging builds a line for every command and unhandled line,
+		# so it's off unless asked for.
+		self.debug = bool(os.environ.get('IRC_DEBUG'))
 		super(DeeBot, self).__init__("UnoBot")
 		
 		# Config
 		self.config = {}
 		self.config["server"] = os.environ['IRC_SERVER']
+		self.config["port"] = int(os.environ.get('IRC_PORT', 6667))
 		self.config["channel"] = os.environ['IRC_CHANNEL']
 		self.config["admins"] = [x.strip() for x in os.environ['IRC_ADMINS'].split(',')]
 		self.config["plugins"] = ["Uno"]
 		
+		# Flood control: burst lines at once, then rate lines per second.
+		self.config["send_rate"] = float(os.environ.get('IRC_SEND_RATE', DeeIRC.SendQueue.DEFAULT_RATE))
+		self.config["send_burst"] = int(os.environ.get('IRC_SEND_BURST', DeeIRC.SendQueue.DEFAULT_BURST))
+		self.setFloodControl(self.config["send_rate"], self.config["send_burst"])
+		
+		# Reconnect with backoff if the connection drops, keeping games.
+		self.config["reconnect"] = os.environ.get('IRC_RECONNECT', "1") != "0"
+		self.auto_reconnect = self.config["reconnect"]
+		
+		# PING the server to measure lag, and reconnect if it goes quiet.
+		self.config["ping_interval"] = float(os.environ.get('IRC_PING_INTERVAL', DeeIRC.IRC.PING_INTERVAL))
+		self.config["stall_timeout"] = float(os.environ.get('IRC_STALL_TIMEOUT', DeeIRC.IRC.STALL_TIMEOUT))
+		self.ping_interval = self.config["ping_interval"]
+		self.stall_timeout = self.config["stall_timeout"]
+		
+		# Serve Prometheus metrics on this port, on localhost only.
+		self.config["metrics_port"] = int(os.environ.get('IRC_METRICS_PORT', 0))
+		if self.config["metrics_port"]:
+			DeeIRC.Metrics.serve(self.config["metrics_port"])
+		
+		# Record all traffic to this file. The game's random seed is noted,
+		# so a replay deals the same cards.
+		self.config["capture"] = os.environ.get('IRC_CAPTURE', "")
+		if self.config["capture"]:
+			seed = struct.unpack("<Q", os.urandom(8))[0]
+			random.seed(seed)
+			self.startCapture(self.config["capture"]).note("seed " + str(seed))
+		
+		# Journal every game to this file, and pick games back up from it
+		# when we start. Blank keeps games in memory only.
+		self.config["journal"] = os.environ.get('IRC_JOURNAL', "")
+		
+		# Keep player statistics in this SQLite database. Blank keeps them
+		# in memory only, until the bot restarts.
+		self.config["stats"] = os.environ.get('IRC_STATS', "")
+		
+		# Keep every finished game, to replay or export, in this directory.
+		# Blank keeps none.
+		self.config["archive"] = os.environ.get('IRC_ARCHIVE', "")
+		
+		# Commands must start with this, e.g. "!". Blank allows bare words.
+		self.config["command_prefix"] = os.environ.get('IRC_COMMAND_PREFIX', "")
+		
 		# Add events.
 		self.addEvent("connected", Events.ConnectedEvent())
 		self.addEvent("message", Events.MessageEvent())
 		
+		# Log every handled event, only when asked since it's costly.
+		if os.environ.get('IRC_TRACE_EVENTS'):
+			self.addEventListener(self.traceEvents)
+		
 		# Plugin modules are loaded into the plugin dictionary, with the key
 		# being the name of the module.
 		self.plugins = {}
 		
+		# Every plugin's triggers, in one place.
+		self.command_index = Plugin.CommandIndex(self.config["command_prefix"])
+		
+		# Commands run here rather than on the dispatch thread, in order per
+		# channel, dropping any past the limit when we're swamped.
+		self.config["command_queue"] = int(os.environ.get('IRC_COMMAND_QUEUE', DeeIRC.Executor.DEFAULT_MAX_PENDING))
+		self.command_executor = DeeIRC.Executor.KeyedExecutor("commands", max_pending=self.config["command_queue"])
+		
 		# Load plugins.
 		for plugin in self.config["plugins"]:
 			self.loadPlugin(plugin)
@@ -61,9 +122,10 @@ class DeeBot(DeeIRC.IRC.DeeIRC):
 	# ------ Loop --------------------------------------------------------------
 	
 	def run(self):
-		"""Runs continously in it's own thread, calling plugin, think functions and other things. Neccessary for timers, etc."""
+		"""Connects to the configured server. The socket is then serviced by
+		the shared reactor, which keeps the process running."""
 		
-		self.connect(self.config["server"])
+		self.connect(self.config["server"], self.config["port"])
 			
 	# ------ Plugin helpers ----------------------------------------------------
 	
@@ -77,6 +139,7 @@ class DeeBot(DeeIRC.IRC.DeeIRC):
 			
 			# Get the instance of the plugin and load it.
 			plugin = plugin_module.getPluginInstance()
+			plugin.attachIndex(self.command_index, plugin_name)
 			plugin.load(self)
 			
 			# Add it into the dictionary.
@@ -106,8 +169,10 @@ class DeeBot(DeeIRC.IRC.DeeIRC):
 	def unloadPlugin(self, plugin_name):
 	
 		if self.hasPlugin(plugin_name):
-			# Run the unload method.
-			self.getPlugin(plugin_name).unload(self)
+			# Run the unload method, and forget it's commands.
+			plugin = self.getPlugin(plugin_name)
+			plugin.unload(self)
+			self.command_index.removePlugin(plugin)
 			
 			# Delete the plugin and log a message.
 			del self.plugins[plugin_name]
@@ -131,15 +196,10 @@ class DeeBot(DeeIRC.IRC.DeeIRC):
 	
 	def findPluginFromTrigger(self, trigger):
 		"""Returns the plugin name if a command exists, otherwise none"""
-		trigger = trigger.lower() # lowercase!
+		plugin = self.command_index.get(trigger)
 		
-		# Loop through all plugins.
-		for plugin_name in self.plugins:
-			plugin = self.getPlugin(plugin_name)
-			
-			# Check if the plugin has that trigger.
-			if plugin.hasCommand(trigger):
-				return plugin_name
+		if plugin:
+			return plugin.name
 		
 		# Not found :(
 		return None
@@ -0,0 +1,110 @@
+# Actor.py
+# --------------------------------------------------------------------------
+
+# An actor owns some state and a mailbox. Messages sent to it are run one at
+# a time, in the order they arrived, so the state never needs a lock. Actors
+# don't get a thread each; any actor with mail waiting is queued on a shared
+# ActorPool and a free worker runs a few of it's messages before moving on.
+
+import Queue
+import collections
+import threading
+import traceback
+
+# ------------------------------------------------------------------------------
+
+class Actor(object):
+	"""Runs messages serially on a shared pool of worker threads."""
+
+	# How many messages to run before giving other actors a turn.
+	batch_size = 16
+
+	def __init__(self, pool=None):
+		"""Constructor."""
+		if pool is None:
+			pool = getActorPool()
+		self.pool = pool
+
+		self.__mailbox = collections.deque()
+		self.__lock = threading.Lock()
+		self.__scheduled = False
+
+	def send(self, function, *args):
+		"""Queues a call to run on this actor."""
+		with self.__lock:
+			self.__mailbox.append((function, args))
+
+			# Only queue ourselves once, the worker picks up the rest.
+			if self.__scheduled:
+				return
+			self.__scheduled = True
+
+		self.pool.schedule(self)
+
+	def pending(self):
+		"""Returns the number of messages waiting to run."""
+		return len(self.__mailbox)
+
+	def runMailbox(self):
+		"""Runs up to batch_size messages. Called by pool workers."""
+		for i in range(self.batch_size):
+			with self.__lock:
+				if not self.__mailbox:
+					self.__scheduled = False
+					return
+				function, args = self.__mailbox.popleft()
+
+			try:
+				function(*args)
+			except Exception:
+				traceback.print_exc()
+
+		# Still busy, go to the back of the line.
+		with self.__lock:
+			if not self.__mailbox:
+				self.__scheduled = False
+				return
+
+		self.pool.schedule(self)
+
+# ------------------------------------------------------------------------------
+
+class ActorPool(object):
+	"""Worker threads that run actors with waiting messages."""
+
+	def __init__(self, workers=4):
+		"""Constructor."""
+		self.__queue = Queue.Queue()
+		self.__threads = []
+
+		for i in range(workers):
+			thread = threading.Thread(target=self.workLoop, name="DeeIRC-actor-" + str(i))
+			thread.daemon = True
+			thread.start()
+			self.__threads.append(thread)
+
+	def schedule(self, actor):
+		"""Queues an actor to have it's mailbox run."""
+		self.__queue.put(actor)
+
+	def workLoop(self):
+		"""Runs actors as they become ready. Runs in it's own thread."""
+		while True:
+			actor = self.__queue.get()
+			actor.runMailbox()
+
+# ------------------------------------------------------------------------------
+
+# Shared pool, used by every actor that doesn't bring it's own.
+__pool_instance = None
+__pool_lock = threading.Lock()
+
+def getActorPool():
+	"""Returns the process-wide actor pool, creating it if needed."""
+	global __pool_instance
+
+	with __pool_lock:
+		if not __pool_instance:
+			__pool_instance = ActorPool()
+
+	return __pool_instance
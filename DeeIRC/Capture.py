@@ -0,0 +1,135 @@
+# Capture.py
+# --------------------------------------------------------------------------
+
+# Records a connection's traffic to an append-only file, so an incident can
+# be replayed and profiled later (see Benchmarks/CaptureReplay.py).
+#
+# ------ File format
+#	"DEECAP01" magic, then a little endian double: wall clock start time.
+#	Records follow, each:
+#		direction - 1 byte, "<" from the server, ">" to it, "#" a note.
+#		offset - uint64, microseconds since the start time.
+#		length - uint16, then that many bytes of line, without CR LF.
+#
+# Offsets never go backwards, even if the clock does, and appending to an
+# existing capture carries on from it's start time. Each record goes to the
+# file in a single unbuffered write, so a crash or kill loses at most the
+# record being written. That torn record is ignored when reading, and cut
+# off when the capture is carried on, so new records follow the last whole
+# one.
+
+import struct
+import threading
+import time
+
+# ------- Constants ------------------------------------------------------------
+
+MAGIC = "DEECAP01"
+HEADER = struct.Struct("<d")
+RECORD = struct.Struct("<cQH")
+
+INBOUND = "<"
+OUTBOUND = ">"
+NOTE = "#"
+
+# ------------------------------------------------------------------------------
+
+class CaptureWriter(object):
+	"""Appends records to a capture file. Safe to use from any thread."""
+
+	def __init__(self, path):
+		"""Constructor. Creates the file, or carries on an existing one
+		from it's last whole record."""
+		self.path = path
+		self.__lock = threading.Lock()
+		self.__file = open(path, "ab", 0)
+
+		# Not even a whole header, so start again.
+		if self.__file.tell() < len(MAGIC) + HEADER.size:
+			self.__file.truncate(0)
+			self.__file.seek(0)
+
+		if self.__file.tell() == 0:
+			self.start = time.time()
+			self.__file.write(MAGIC + HEADER.pack(self.start))
+			self.__last = 0
+		else:
+			self.start = readHeader(path)
+			self.__file.truncate(wholeLength(path))
+			self.__last = int((time.time() - self.start) * 1000000)
+
+	def write(self, direction, line):
+		"""Records one line."""
+		now = time.time()
+		offset = int((now - self.start) * 1000000)
+		line = line[:0xFFFF]
+
+		with self.__lock:
+			if self.__file is None:
+				return
+
+			if offset < self.__last:
+				offset = self.__last
+			self.__last = offset
+
+			self.__file.write(RECORD.pack(direction, offset, len(line)) + line)
+
+	def note(self, text):
+		"""Records a note, e.g. "seed 1234"."""
+		self.write(NOTE, text)
+
+	def close(self):
+		"""Closes the file."""
+		with self.__lock:
+			if self.__file is not None:
+				self.__file.close()
+				self.__file = None
+
+# ------------------------------------------------------------------------------
+
+def readHeader(path):
+	"""Returns the start time of a capture file."""
+	with open(path, "rb") as capture:
+		header = capture.read(len(MAGIC) + HEADER.size)
+
+	if header[:len(MAGIC)] != MAGIC:
+		raise ValueError(path + " is not a capture file.")
+
+	return HEADER.unpack(header[len(MAGIC):])[0]
+
+def wholeLength(path):
+	"""Returns how many bytes of a capture are the header and whole
+	records, skipping from record to record."""
+	with open(path, "rb") as capture:
+		capture.seek(0, 2)
+		size = capture.tell()
+		end = len(MAGIC) + HEADER.size
+
+		while end + RECORD.size <= size:
+			capture.seek(end)
+			direction, offset, length = RECORD.unpack(capture.read(RECORD.size))
+			if end + RECORD.size + length > size:
+				break
+			end += RECORD.size + length
+
+	return end
+
+def readCapture(path):
+	"""Yields (seconds, direction, line) for every whole record in a
+	capture, seconds being from the start of the capture."""
+	readHeader(path)
+
+	with open(path, "rb") as capture:
+		capture.seek(len(MAGIC) + HEADER.size)
+
+		while True:
+			header = capture.read(RECORD.size)
+			if len(header) < RECORD.size:
+				return
+
+			direction, offset, length = RECORD.unpack(header)
+			line = capture.read(length)
+			if len(line) < length:
+				return
+
+			yield offset / 1000000.0, direction, line
@@ -0,0 +1,80 @@
+# Coalesce.py
+# --------------------------------------------------------------------------
+
+# Collects the messages and notices produced while one command runs, then
+# merges them per target into as few lines as the IRC line limit allows.
+# A play that used to cost four PRIVMSGs to the channel now costs one.
+#
+# Lines that mustn't be merged, low priority text and raw lines like MODE,
+# are held too and sent as they are after the merged ones, so nothing sent
+# during the command overtakes what it announced.
+
+import Metrics
+
+import collections
+
+# ------- Constants ------------------------------------------------------------
+
+# RFC 1459 line limit, including the trailing CR LF.
+MAX_LINE_LENGTH = 512
+
+# Room left for the ":nick!user@host " prefix the server adds when relaying.
+# Hostnames can be up to 63 characters.
+HOST_RESERVE = 63
+
+# Placed between merged messages.
+SEPARATOR = " | "
+
+# ------------------------------------------------------------------------------
+
+class Coalescer(object):
+	"""Buffers messages, keyed by command, target and priority."""
+
+	def __init__(self):
+		"""Constructor."""
+		self.__entries = collections.OrderedDict()
+		self.__held = []
+		self.__merged = Metrics.getRegistry().counter("irc_coalesced_lines_total", "Lines saved by merging announcements.")
+
+	def add(self, command, target, message, priority):
+		"""Holds a message back until flush time."""
+		key = (command, target, priority)
+
+		if key in self.__entries:
+			self.__entries[key].append(message)
+		else:
+			self.__entries[key] = [message]
+
+	def hold(self, data, priority):
+		"""Holds a raw line back until flush time, unmerged."""
+		self.__held.append((data, priority))
+
+	def held(self):
+		"""Returns the raw lines held, as (data, priority), in order."""
+		return self.__held
+
+	def lines(self, prefix_length):
+		"""Returns (command, target, message, priority) tuples with messages
+		merged, in the order each target was first used."""
+		lines = []
+		total = 0
+
+		for (command, target, priority), messages in self.__entries.iteritems():
+			budget = MAX_LINE_LENGTH - 2 - prefix_length - len(command + " " + target + " :")
+			current = None
+
+			for message in messages:
+				if current is None:
+					current = message
+				elif len(current) + len(SEPARATOR) + len(message) <= budget:
+					current = current + SEPARATOR + message
+				else:
+					lines.append((command, target, current, priority))
+					current = message
+
+			lines.append((command, target, current, priority))
+			total += len(messages)
+
+		self.__merged.inc(total - len(lines))
+
+		return lines
@@ -9,81 +9,82 @@ import Utils
 
 class DefaultConnectedEvent(Events.ConnectedEvent):
 	def fire(self, irc):
-		"""Updates bot connection status."""
+		"""Updates bot connection status, and rejoins the channels we were
+		in before the connection dropped."""
 		irc.connected = True
 		
 		irc.log("Connected to server.")
 		
+		for channel in irc.rejoin_channels:
+			irc.sendJoin(channel)
+		irc.rejoin_channels = []
+		
 class DefaultDisconnectedEvent(Events.DisconnectedEvent):
 	def fire(self, irc):
-		"""Updates bot connection status."""
+		"""Updates bot connection status. Remembers our channels for when we
+		reconnect, but not who was in them, that will be out of date."""
 		irc.connected = False
 		
+		irc.rejoin_channels = irc.members.channelNames()
+		irc.members.clear()
+		
 		irc.log("Disconnected from server.")
 		
 class DefaultNamesEvent(Events.NamesEvent):
 	def fire(self, irc, channel, nicks):
-		"""Adds names to channel's nicklist."""
-		if channel in irc.channels:
-			for nick in nicks:
-				if not nick == "" and not nick == irc.nick:
-					if not nick in irc.channels[channel]["nicks"]:
-						irc.channels[channel]["nicks"].append(Utils.stripNickStatus(nick))
+		"""Collects names for the channel's nicklist, until the 366."""
+		irc.members.addNames(channel, [nick for nick in nicks if not irc.isSelf(Utils.stripNickStatus(nick))])
+		
+class DefaultNamesEndEvent(Events.NamesEndEvent):
+	def fire(self, irc, channel):
+		"""Swaps the collected names in as the channel's nicklist."""
+		irc.members.endNames(channel)
 		
 # ------------------------------------------------------------------------------
 
 class DefaultJoinEvent(Events.JoinEvent):
 	def fire(self, irc, nick, channel):
 		"""Updates nick list of channel."""
-		if channel in irc.channels:
-			irc.channels[channel]["nicks"].append(nick)
+		irc.members.join(nick, channel)
 			
 class DefaultPartEvent(Events.PartEvent):
 	def fire(self, irc, nick, channel):
 		"""Updates nick list of channel."""
-		if channel in irc.channels:
-			if nick in irc.channels[channel]["nicks"]:
-				irc.channels[channel]["nicks"].remove(nick)
+		irc.members.part(nick, channel)
 			
 class DefaultQuitEvent(Events.QuitEvent):
 	def fire(self, irc, nick, message):
-		"""Goes through each channel and updates the list of users to match."""
-		for channel in irc.channels:
-			if nick in irc.channels[channel]["nicks"]:
-				irc.channels[channel]["nicks"].remove(nick)
+		"""Removes the user from the channels they were in."""
+		irc.members.quit(nick)
 
 class DefaultKickEvent(Events.KickEvent):
 	def fire(self, irc, nick, kick_nick, channel, message):
 		"""Updates nick list of channel."""
-		if channel in irc.channels:
-			if kick_nick in irc.channels[channel]["nicks"]:
-				irc.channels[channel]["nicks"].remove(kick_nick)
+		irc.members.part(kick_nick, channel)
 
 # ------------------------------------------------------------------------------
 
 class DefaultNickEvent(Events.NickEvent):
 	def fire(self, irc, nick, new_nick):
-		"""Goes through each channel and updates the list of users to match."""
-		for channel in irc.channels:
-			if nick in irc.channels[channel]["nicks"]:
-				irc.channels[channel]["nicks"][irc.channels[channel]["nicks"].index(nick)] = new_nick
+		"""Moves the user's channels over to their new nick."""
+		irc.members.rename(nick, new_nick)
 
 
 # ------------------------------------------------------------------------------
 
 class DefaultSelfJoinEvent(Events.SelfJoinEvent):
 	def fire(self, irc, channel):
-		"""Adds channel to channel list and initalizes it's dictionary."""
-		if not channel in irc.channels:
-			irc.channels[channel] = {"nicks":[]}
+		"""Adds channel to channel list."""
+		if not irc.members.hasChannel(channel):
+			irc.members.addChannel(channel)
 			
 			irc.log("Joined " + channel)
 			
 class DefaultSelfPartEvent(Events.SelfPartEvent):
 	def fire(self, irc, channel):
 		"""	Removes channel from list."""
-		if channel in irc.channels:
-			del irc.channels[channel]
+		if irc.members.hasChannel(channel):
+			irc.members.removeChannel(channel)
 			
 			irc.log("Parted " + channel)
 
@@ -92,8 +93,7 @@ class DefaultSelfPartEvent(Events.SelfPartEvent):
 class DefaultSelfKickEvent(Events.SelfKickEvent):
 	def fire(self, irc, nick, channel, message):
 		"""Removes channel from list."""
-		if channel in irc.channels:
-			del irc.channels[channel]
+		irc.members.removeChannel(channel)
 
 # ------------------------------------------------------------------------------
 
@@ -0,0 +1,229 @@
+# EventBus.py
+# --------------------------------------------------------------------------
+
+# Holds the event handlers for a connection. Each event type has a dispatch
+# chain that is rebuilt whenever a handler is added or removed, so firing an
+# event never has to look at handlers that don't apply.
+#
+# Handlers can be filtered by channel, nick or command. Filtered handlers are
+# indexed by the value they care about, so a handler for one channel costs
+# nothing when other channels are busy. Unfiltered handlers run first, in the
+# order they were added, followed by any filtered handlers that match.
+#
+# ------ Filters
+#	channel - the channel, or the target for message/notice.
+#	nick - the nick that caused the event.
+#	command - the first word of a message/notice, lower case.
+#
+# Filter values can be a single string or a list of them, and are matched
+# case insensitively. Channels and nicks fold with the server's casemapping,
+# see setCasemapping(), the same as Membership.py.
+
+import Utils
+
+# Parameter names for each event type, in the order they're passed.
+EVENT_PARAMETERS = {
+	"connected":(),
+	"disconnected":(),
+	"names":("channel", "nicks"),
+	"names_end":("channel",),
+	"message":("nick", "target", "message"),
+	"notice":("nick", "target", "message"),
+	"nick":("nick", "new_nick"),
+	"join":("nick", "channel"),
+	"part":("nick", "channel"),
+	"kick":("nick", "kick_nick", "channel", "message"),
+	"quit":("nick", "message"),
+	"self_nick":("new_nick",),
+	"self_join":("channel",),
+	"self_part":("channel",),
+	"self_kick":("nick", "channel", "message"),
+	"unhandled":("data",),
+}
+
+# Filters, most selective first. The first one a handler uses is indexed.
+FILTER_ORDER = ("command", "nick", "channel")
+
+# ------------------------------------------------------------------------------
+
+def commandFromMessage(message):
+	"""Returns the first word of a message, lower case."""
+	return message.split(" ", 1)[0].lower()
+
+def foldFilter(filter_name, value, casemapping):
+	"""Returns a filter value folded the way it's extractor folds."""
+	if filter_name == "command":
+		return value.lower()
+	return Utils.lowerNick(value, casemapping)
+
+def getExtractor(event_type, filter_name, casemapping="rfc1459"):
+	"""Returns a function that pulls a filter's value out of an event's
+	parameters, folded, or None if the event doesn't have it."""
+	names = EVENT_PARAMETERS[event_type]
+
+	if filter_name == "command":
+		if "message" in names and "target" in names:
+			index = names.index("message")
+			return lambda parameters: commandFromMessage(parameters[index])
+		return None
+
+	if filter_name == "channel":
+		if "channel" in names:
+			index = names.index("channel")
+		elif "target" in names:
+			index = names.index("target")
+		else:
+			return None
+	elif filter_name in names:
+		index = names.index(filter_name)
+	else:
+		return None
+
+	table = Utils.CASEMAPPINGS[casemapping]
+	return lambda parameters: parameters[index].translate(table)
+
+# ------------------------------------------------------------------------------
+
+class EventBus(object):
+	"""Keeps handlers and compiled dispatch chains for each event type."""
+
+	def __init__(self, casemapping="rfc1459"):
+		"""Constructor."""
+		self.casemapping = casemapping
+		self.__subscriptions = {}
+		self.__chains = {}
+		self.__listeners = ()
+
+		for event_type in EVENT_PARAMETERS:
+			self.__subscriptions[event_type] = []
+			self.compile(event_type)
+
+	# ------ Subscriptions.
+
+	def subscribe(self, event_type, event, **filters):
+		"""Adds a handler, optionally filtered. Returns false if it was
+		already subscribed."""
+		subscriptions = self.__subscriptions[event_type]
+
+		for subscribed_event, subscribed_filters in subscriptions:
+			if subscribed_event is event:
+				return False
+
+		# Normalise filter values into tuples, folded when compiled.
+		normalised = {}
+		for filter_name, values in filters.items():
+			if getExtractor(event_type, filter_name) is None:
+				raise ValueError("Event(" + event_type + ") can't be filtered by " + filter_name)
+
+			if isinstance(values, basestring):
+				values = [values]
+
+			normalised[filter_name] = tuple(values)
+
+		subscriptions.append((event, normalised))
+		self.compile(event_type)
+
+		return True
+
+	def unsubscribe(self, event_type, event):
+		"""Removes a handler. Returns false if it wasn't subscribed."""
+		subscriptions = self.__subscriptions[event_type]
+
+		for index, (subscribed_event, subscribed_filters) in enumerate(subscriptions):
+			if subscribed_event is event:
+				del subscriptions[index]
+				self.compile(event_type)
+				return True
+
+		return False
+
+	def setCasemapping(self, casemapping):
+		"""Folds channel and nick filters with another casemapping, as
+		advertised by the server's 005, recompiling every chain."""
+		if casemapping == self.casemapping or not casemapping in Utils.CASEMAPPINGS:
+			return
+
+		self.casemapping = casemapping
+
+		for event_type in self.__subscriptions:
+			self.compile(event_type)
+
+	def compile(self, event_type):
+		"""Rebuilds the dispatch chain for an event type. The chain is
+		(plain, indexes): a tuple of unfiltered handlers, and a tuple of
+		(extractor, {value:((event, checks), ...)}) for filtered ones."""
+		casemapping = self.casemapping
+		plain = []
+		indexes = {}
+
+		for event, filters in self.__subscriptions[event_type]:
+			if not filters:
+				plain.append(event)
+				continue
+
+			filters = dict([(filter_name, frozenset([foldFilter(filter_name, value, casemapping) for value in values])) for filter_name, values in filters.items()])
+
+			# Index on the most selective filter, check the rest.
+			for filter_name in FILTER_ORDER:
+				if filter_name in filters:
+					break
+
+			checks = tuple([(getExtractor(event_type, other, casemapping), values) for other, values in filters.items() if other != filter_name])
+
+			index = indexes.setdefault(filter_name, {})
+			for value in filters[filter_name]:
+				index[value] = index.get(value, ()) + ((event, checks),)
+
+		compiled = tuple([(getExtractor(event_type, filter_name, casemapping), indexes[filter_name]) for filter_name in FILTER_ORDER if filter_name in indexes])
+
+		# Swapped in one go, so firing threads always see a whole chain.
+		self.__chains[event_type] = (tuple(plain), compiled)
+
+	def handlers(self, event_type):
+		"""Returns every handler for an event type."""
+		return [event for event, filters in self.__subscriptions[event_type]]
+
+	# ------ Listeners.
+
+	def addListener(self, listener):
+		"""Adds a function called as listener(event_type, event, parameters)
+		after each handler runs. Used for tracing, costs nothing when no
+		listeners are attached."""
+		if not listener in self.__listeners:
+			self.__listeners = self.__listeners + (listener,)
+
+	def removeListener(self, listener):
+		"""Removes a listener."""
+		self.__listeners = tuple([existing for existing in self.__listeners if existing != listener])
+
+	# ------ Firing.
+
+	def fire(self, irc, event_type, *parameters):
+		"""Calls every handler that applies to the event."""
+		plain, indexes = self.__chains[event_type]
+		listeners = self.__listeners
+
+		for event in plain:
+			event.fire(irc, *parameters)
+
+			if listeners:
+				self.notify(event_type, event, parameters)
+
+		for extractor, index in indexes:
+			matches = index.get(extractor(parameters))
+
+			if matches:
+				for event, checks in matches:
+					for check, values in checks:
+						if not check(parameters) in values:
+							break
+					else:
+						event.fire(irc, *parameters)
+
+						if listeners:
+							self.notify(event_type, event, parameters)
+
+	def notify(self, event_type, event, parameters):
+		"""Tells the listeners a handler ran."""
+		for listener in self.__listeners:
+			listener(event_type, event, parameters)
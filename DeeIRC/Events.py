@@ -29,6 +29,11 @@ class NamesEvent(Event):
 	def fire(self, irc, nicks, channel):
 		pass
 
+class NamesEndEvent(Event):
+	"""Fired at the end of a channel's list of nicknames (366)."""
+	def fire(self, irc, channel):
+		pass
+
 # ------------------------------------------------------------------------------
 
 class MessageEvent(Event):
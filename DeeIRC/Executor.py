@@ -0,0 +1,93 @@
+# Executor.py
+# --------------------------------------------------------------------------
+
+# Runs work off the dispatch thread while keeping it in order per key, e.g.
+# per channel. Each key with work waiting has a lane of it's own, an Actor,
+# so everything for one channel runs in the order it arrived while other
+# channels run in parallel on the actor pool, and never wait behind each
+# other. A lane is dropped once it's empty, so only busy keys cost memory.
+#
+# Submitting never blocks. Once too much work is waiting, in total or for
+# one key, submit() refuses new work and counts it, so a flood in one
+# channel can't back up the dispatch thread or starve everyone else. The
+# caller should say so, see Events.MessageEvent.
+
+import Actor
+import Metrics
+
+import threading
+import time
+
+# ------- Constants ------------------------------------------------------------
+
+DEFAULT_MAX_PENDING = 1000
+DEFAULT_MAX_LANE_PENDING = 32
+
+# ------------------------------------------------------------------------------
+
+class KeyedExecutor(object):
+	"""Bounded executor that runs work serially per key."""
+
+	def __init__(self, name, max_pending=DEFAULT_MAX_PENDING, max_lane_pending=DEFAULT_MAX_LANE_PENDING, pool=None):
+		"""Constructor. The name labels this executor's metrics."""
+		self.pool = pool
+		self.max_pending = max_pending
+		self.max_lane_pending = max_lane_pending
+
+		# key:[actor, work waiting or running], for keys with work.
+		self.__lanes = {}
+		self.__pending = 0
+		self.__lock = threading.Lock()
+
+		registry = Metrics.getRegistry()
+		self.__depth = registry.gauge("irc_executor_pending", "Work waiting in an executor.", executor=name)
+		self.__dropped = registry.counter("irc_executor_dropped_total", "Work dropped because an executor was full.", executor=name)
+		self.__wait = registry.histogram("irc_executor_wait_seconds", "Time work waited in an executor before running.", executor=name)
+
+	def submit(self, key, function, *args):
+		"""Queues function(*args) behind earlier work for the same key.
+		Returns false, running nothing, if the executor or the key's lane
+		is full."""
+		with self.__lock:
+			lane = self.__lanes.get(key)
+
+			if self.__pending >= self.max_pending or (lane is not None and lane[1] >= self.max_lane_pending):
+				self.__dropped.inc()
+				return False
+
+			if lane is None:
+				lane = self.__lanes[key] = [Actor.Actor(self.pool), 0]
+
+			lane[1] += 1
+			self.__pending += 1
+			self.__depth.set(self.__pending)
+
+			# Sent under the lock, so work for a key can't overtake.
+			lane[0].send(self.run, key, time.time(), function, args)
+
+		return True
+
+	def pending(self):
+		"""Returns how much work is waiting or running."""
+		return self.__pending
+
+	def lanes(self):
+		"""Returns how many keys have work waiting or running."""
+		return len(self.__lanes)
+
+	def run(self, key, queued, function, args):
+		"""Runs one piece of work on it's lane, dropping the lane once
+		nothing else is waiting on it."""
+		self.__wait.observe(time.time() - queued)
+
+		try:
+			function(*args)
+		finally:
+			with self.__lock:
+				self.__pending -= 1
+				self.__depth.set(self.__pending)
+
+				lane = self.__lanes[key]
+				lane[1] -= 1
+				if not lane[1]:
+					del self.__lanes[key]
@@ -11,6 +11,8 @@
 # 	names
 #		users
 #		channel
+#	names_end
+#		channel
 #	message
 #		nick
 #		target
@@ -47,58 +49,126 @@
 #		data
 #
 # ------ Data Structures
-# 	DeeIRC.channels = {
-#		"[channel_name]": {
-#			"nicks":[list of users]
-#		}
-#	}
+# 	DeeIRC.members = Membership, see Membership.py. Tracks the channels
+#	we're in and who is in them, by case folded name.
 
+import Capture
+import Coalesce
+import EventBus
 import Events
 import DefaultEvents
+import Membership
+import Metrics
+import Parser
+import Reactor
+import SendQueue
 import Utils
 
+import contextlib
+import errno
+import itertools
+import random
 import socket
 import threading
 import datetime
+import time
+
+# ------- Constants ------------------------------------------------------------
+
+# Reconnect backoff, in seconds. Each failed attempt doubles the wait, up to
+# the maximum, then it's scaled by a random factor so a netsplit doesn't
+# bring every bot back at the same instant.
+RECONNECT_DELAY = 1.0
+RECONNECT_MAX_DELAY = 300.0
+RECONNECT_JITTER = 0.5
+
+# Lag probes. We PING the server every interval, and give up on the
+# connection if nothing at all has been read for the stall timeout.
+PING_INTERVAL = 30.0
+STALL_TIMEOUT = 120.0
+
+# Starts the token of our own PINGs, so their PONGs can be told apart.
+PING_TOKEN = "DeeIRC-lag-"
 
 # ------------------------------------------------------------------------------
 
 class DeeIRC(object):
 	"""Manages connecting to IRC and handles events."""
 	
-	def __init__(self, nick="UnoBot", user="UnoBot", name="Uno Game Robot"):
+	def __init__(self, nick="UnoBot", user="UnoBot", name="Uno Game Robot", reactor=None):
 		"""Constructor."""
 				
 		self.__sock = None
-		self.__sock_file = None
+		self.__fileno = None
+		
+		# Partial line left over from the last read, and data waiting to be
+		# written once the socket is ready. Lines wait in the send queue until
+		# flood control lets them into the write buffer.
+		self.__read_buffer = ""
+		self.__write_buffer = ""
+		self.send_queue = SendQueue.SendQueue()
+		self.__write_lock = threading.Lock()
+		self.__close_when_flushed = False
+		
+		# Per thread, so each command running in parallel gets it's own batch.
+		self.__local = threading.local()
+		
+		# Traffic recorder, see startCapture().
+		self.capture = None
+		
+		# Where we last connected, and how reconnecting is going.
+		self.server = None
+		self.port = None
+		self.auto_reconnect = True
+		self.__quitting = False
+		self.__reconnect_attempts = 0
+		self.__disconnected_at = None
+		
+		# Our own, so jitter doesn't disturb a seeded game in a replay.
+		self.__random = random.Random()
+		
+		# Lag probes and the stall watchdog.
+		self.ping_interval = PING_INTERVAL
+		self.stall_timeout = STALL_TIMEOUT
+		self.lag = None
+		self.__last_read = None
+		self.__probe_timer = None
+		self.__probe_token = None
+		self.__probe_sent = None
+		self.__probe_ids = itertools.count()
+		
+		registry = Metrics.getRegistry()
+		self.__reconnects = registry.counter("irc_reconnects_total", "Successful reconnections.")
+		self.__reconnect_attempt_count = registry.counter("irc_reconnect_attempts_total", "Connection attempts made while reconnecting.")
+		self.__recovery_time = registry.histogram("irc_reconnect_recovery_seconds", "Time from losing the connection to being registered again.", (1, 2, 5, 10, 30, 60, 120, 300, 600, 1800))
+		self.__lag_time = registry.histogram("irc_lag_seconds", "Round trip time of our PINGs to the server.", (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+		self.__stalls = registry.counter("irc_stalls_total", "Connections dropped because the server went quiet.")
+		
+		# Traffic by command, and handler timings by event type. Looked up
+		# once here, or on first sight for commands.
+		self.__registry = registry
+		self.__inbound = {}
+		self.__outbound = {}
+		self.__event_time = dict([(event_type, registry.histogram("irc_event_seconds", "Time spent in event handlers.", event=event_type)) for event_type in EventBus.EVENT_PARAMETERS])
+		
+		# Every connection shares one reactor unless told otherwise.
+		if reactor is None:
+			reactor = Reactor.getReactor()
+		self.reactor = reactor
 		
 		self.nick = nick
 		self.user = user
 		self.name = name
 		
-		self.channels = {}
+		self.members = Membership.Membership()
+		self.rejoin_channels = []
 		self.connected = False
 		
 		if not "debug" in dir(self):
 			self.debug = False
 		
-		self.__events = {
-			"connected":[],
-			"disconnected":[],
-			"names":[],
-			"message":[],
-			"notice":[],
-			"nick":[],
-			"join":[],
-			"part":[],
-			"kick":[],
-			"quit":[],
-			"self_nick":[],
-			"self_join":[],
-			"self_part":[],
-			"self_kick":[],
-			"unhandled":[]
-		}
+		# Handlers for each event type, see EventBus.py.
+		self.__events = EventBus.EventBus()
 		
 		# Add our default events.
 		self.addEvent("connected", DefaultEvents.DefaultConnectedEvent())
@@ -113,148 +183,368 @@ class DeeIRC(object):
 		self.addEvent("self_part", DefaultEvents.DefaultSelfPartEvent())
 		self.addEvent("self_kick", DefaultEvents.DefaultSelfKickEvent())
 		self.addEvent("names", DefaultEvents.DefaultNamesEvent())
+		self.addEvent("names_end", DefaultEvents.DefaultNamesEndEvent())
 		self.addEvent("unhandled", DefaultEvents.DefaultUnhandledEvent())
-		
-		# Run the main loop in a thread, because that is cool.
-		self.__main_thread = threading.Thread(target=self.mainLoop)
 	
 	def connect(self, server, port=6667):
-		"""Connects to the IRC server and sets up a socket."""
+		"""Connects to the IRC server and hands the socket to the reactor."""
 		self.log("Attempting to connect to server.")
 		
-		self.__sock = socket.create_connection((server, port))
-		self.__sock_file = self.__sock.makefile("rb")
+		self.server = server
+		self.port = port
+		self.__quitting = False
+		
+		self.__sock = socket.create_connection((server, port), 30)
+		# Lines are already gathered into one write where possible, so don't
+		# let Nagle hold replies back waiting for an ACK.
+		self.__sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		self.__sock.setblocking(0)
+		self.__fileno = self.__sock.fileno()
+		
+		self.__read_buffer = ""
+		self.__write_buffer = ""
+		self.__close_when_flushed = False
+		self.send_queue.clear()
 		
-		self.sendRaw("NICK " + self.nick)
-		self.sendRaw("USER " + self.user + " * * :" + self.name)
+		self.lag = None
+		self.__last_read = time.time()
+		self.__probe_token = None
 		
-		# Start the thread.
-		self.__main_thread.start()
+		self.sendRaw("NICK " + self.nick, SendQueue.PRIORITY_HIGH)
+		self.sendRaw("USER " + self.user + " * * :" + self.name, SendQueue.PRIORITY_HIGH)
+		
+		# Start watching the socket.
+		self.reactor.register(self)
+		self.reactor.start()
+		
+		self.__probe_timer = self.reactor.callLater(self.ping_interval, self.probeLag)
 	
 	def disconnect(self, message="UnoBot Framework"):
-		"""Disconnects from the server."""
+		"""Disconnects from the server once the QUIT has been written. We
+		don't reconnect after this."""
 		if self.connected:		
-			self.sendRaw("QUIT :" + message)
-			self.__sock.close()
+			self.__quitting = True
+			self.sendRaw("QUIT :" + message, SendQueue.PRIORITY_HIGH)
+			self.__close_when_flushed = True
 	
-	def mainLoop(self):
-		"""Main loop - reads in data and forwards it to events. Runs in it's
-		own thread."""
-
-		while True:
-			data = self.__sock_file.readline()
+	# ------ Reconnecting.
+	
+	def reconnectDelay(self):
+		"""Returns how long to wait before the next attempt."""
+		delay = min(RECONNECT_MAX_DELAY, RECONNECT_DELAY * (2 ** self.__reconnect_attempts))
+		return delay * self.__random.uniform(1 - RECONNECT_JITTER, 1 + RECONNECT_JITTER)
+	
+	def scheduleReconnect(self):
+		"""Queues the next reconnect attempt."""
+		delay = self.reconnectDelay()
+		self.log("Reconnecting in " + str(round(delay, 1)) + " seconds.")
+		
+		self.reactor.callLater(delay, self.startReconnect)
+	
+	def startReconnect(self):
+		"""Runs a reconnect attempt on it's own thread, so a slow DNS lookup
+		or connect doesn't hold up the reactor."""
+		thread = threading.Thread(target=self.reconnect, name="DeeIRC-reconnect")
+		thread.daemon = True
+		thread.start()
+	
+	def reconnect(self):
+		"""Tries to connect again, scheduling another go if it fails."""
+		if self.__quitting:
+			return
+		
+		self.__reconnect_attempts += 1
+		self.__reconnect_attempt_count.inc()
+		
+		try:
+			self.connect(self.server, self.port)
+		except (socket.error, socket.timeout), e:
+			self.error("Reconnect failed: " + str(e))
+			self.scheduleReconnect()
+	
+	# ------ Reactor callbacks, these run on the I/O thread.
+	
+	def fileno(self):
+		"""Returns the socket's file descriptor, for select()."""
+		return self.__fileno
+	
+	def wantsWrite(self):
+		"""Returns true if there is data that may be written now."""
+		return len(self.__write_buffer) > 0 or self.send_queue.ready()
+	
+	def writeDelay(self):
+		"""Returns seconds until flood control lets the next line out, or
+		None if nothing is queued."""
+		return self.send_queue.delay()
+	
+	def handleRead(self):
+		"""Reads from the socket and queues up complete lines. Server PINGs
+		are answered here so they never wait behind event handlers."""
+		try:
+			data = self.__sock.recv(4096)
+		except socket.error, e:
+			if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+				return
+			data = ""
+		
+		if not data:
+			# Socket has been closed.
+			self.handleClose()
+			return
+		
+		self.__last_read = time.time()
+		
+		lines = (self.__read_buffer + data).split("\n")
+		self.__read_buffer = lines.pop()
+		
+		for line in lines:
+			line = line.rstrip("\r")
 			
-			if data:
-				data = data[:-2]
+			if line:
+				self.receiveLine(line)
+	
+	def receiveLine(self, line):
+		"""Takes one line from the server. Answers PINGs, passes the rest
+		to the dispatch thread."""
+		if self.capture is not None:
+			self.capture.write(Capture.INBOUND, line)
+		
+		# Check for server ping.
+		if line[0:5] == "PING ":
+			self.countLine(self.__inbound, "irc_inbound_lines_total", "PING")
+			self.sendRaw("PONG " + line[5:], SendQueue.PRIORITY_HIGH)
+		else:
+			self.reactor.dispatch(self.handleLine, line)
+	
+	def handleWrite(self):
+		"""Writes as much of the outgoing buffer as the socket will take."""
+		with self.__write_lock:
+			
+			# Move across whatever flood control allows.
+			line = self.send_queue.pop()
+			while line is not None:
+				self.__write_buffer += line
 				
-				# Check for server ping.
-				if data[0:4] == "PING":
-					return_data = data.split(":")[1]
-					self.sendRaw("PONG :" + return_data)
-				else:
-					# Assume it is some sort of message or something.
-					split_data = data.split(" ")
-					
-					user_full = split_data[0][1:]
-					nick = user_full[0:user_full.find("!")]
-					command = split_data[1].upper()
-					
-					if command == "001":
-						# First line of MOTD or something?
-						# Generally means we're connected.
-						self.connected = True
-						self.handleEvents("connected")
-					elif command == "353":
-						# Gives list of users in IRC channel.
-						users = " ".join(split_data[5:])[1:].split(" ")[:-1]
-						channel = split_data[4]
-						
-						self.handleEvents("names", channel, users)
-					elif command == "PRIVMSG":
-						# Message sent.
-						target = split_data[2]
-						message = " ".join(split_data[3:])[1:]
-						
-						self.handleEvents("message", nick, target, message)
-					elif command == "NOTICE":
-						# Message sent.
-						target = split_data[2]
-						message = " ".join(split_data[3:])[1:]
-						
-						self.handleEvents("notice", nick, target, message)
-					elif command == "JOIN":
-						# Someone has joined a channel, or we have.
-						channel = split_data[2][1:]
-						
-						if nick == self.nick:
-							self.handleEvents("self_join", channel)
-						else:
-							self.handleEvents("join", nick, channel)
-					elif command == "PART":
-						# Someone has parted a channel, or we have.
-						channel = split_data[2]
-						
-						if nick == self.nick:
-							self.handleEvents("self_part", channel)
-						else:
-							self.handleEvents("part", nick, channel)
-					elif command == "KICK":
-						# Someone has joined a channel, or we have.
-						channel = split_data[2]
-						kick_nick = split_data[3]
-						message = " ".join(split_data[4:])[1:]
-						
-						if kick_nick == self.nick:
-							self.handleEvents("self_kick", nick, channel, message)
-						else:
-							self.handleEvents("kick", nick, kick_nick, channel, message)
-					elif command == "NICK":
-						# Nickname has changed. Also includes ourselves.
-						new_nick = split_data[2][1:]
-						
-						if nick == self.nick:
-							self.handleEvents("self_nick", new_nick)
-						else:
-							self.handleEvents("nick", nick, new_nick)
-					elif command == "QUIT":
-						# User has quit the server.
-						message = " ".join(split_data[2:])[1:]
-						
-						self.handleEvents("quit", nick, message)
-					else:
-						self.handleEvents("unhandled", data)
+				if self.capture is not None:
+					self.capture.write(Capture.OUTBOUND, line[:-2])
+				line = self.send_queue.pop()
+			
+			try:
+				sent = self.__sock.send(self.__write_buffer)
+			except socket.error, e:
+				if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+					return
+				sent = None
+			
+			if sent is not None:
+				self.__write_buffer = self.__write_buffer[sent:]
+			
+		if sent is None:
+			self.handleClose()
+		elif self.__close_when_flushed and not self.__write_buffer and not len(self.send_queue):
+			self.handleClose()
+	
+	def handleClose(self):
+		"""Closes the socket and lets the event handlers know. Unless we
+		quit on purpose, a reconnect is scheduled."""
+		if self.__fileno is None:
+			return
+		
+		try:
+			self.__sock.close()
+		except socket.error:
+			pass
+		
+		if self.__probe_timer is not None:
+			self.__probe_timer.cancel()
+			self.__probe_timer = None
+		
+		reconnecting = self.auto_reconnect and not self.__quitting
+		if reconnecting and self.__disconnected_at is None:
+			self.__disconnected_at = time.time()
+		
+		# Queue the event before unregistering, the reactor stops with it's
+		# last connection unless we're coming back.
+		self.reactor.dispatch(self.handleEvents, "disconnected")
+		self.reactor.unregister(self, self.__fileno, reconnecting)
+		self.__fileno = None
+		
+		if reconnecting:
+			self.scheduleReconnect()
+	
+	def probeLag(self):
+		"""Timer on the I/O thread. Drops the connection if the server has
+		gone quiet, otherwise sends a PING to time."""
+		if self.__fileno is None:
+			return
+		
+		now = time.time()
+		
+		# A half open connection never errors, it just goes silent.
+		if now - self.__last_read >= self.stall_timeout:
+			self.error("Nothing from the server for " + str(int(now - self.__last_read)) + " seconds, reconnecting.")
+			self.__stalls.inc()
+			self.handleClose()
+			return
+		
+		# Only one probe in flight, a missed PONG shows up as growing lag.
+		if self.__probe_token is None:
+			self.__probe_token = PING_TOKEN + str(next(self.__probe_ids))
+			self.__probe_sent = now
+			self.sendRaw("PING :" + self.__probe_token, SendQueue.PRIORITY_HIGH)
+		
+		self.__probe_timer = self.reactor.callLater(self.ping_interval, self.probeLag)
+	
+	def getLag(self):
+		"""Returns the last measured round trip in seconds, or how long an
+		unanswered PING has been waiting if that's longer. None if we've
+		never sent one."""
+		lag = self.lag
+		
+		if self.__probe_token is not None:
+			waiting = time.time() - self.__probe_sent
+			if lag is None or waiting > lag:
+				lag = waiting
+		
+		return lag
+	
+	# ------ Line handling, runs on the dispatch thread.
+	
+	def handleLine(self, data):
+		"""Works out what a line from the server is and forwards it to
+		events."""
+		message = Parser.parse(data)
+		command = message.command
+		
+		self.countLine(self.__inbound, "irc_inbound_lines_total", command)
+		
+		if command == "PRIVMSG":
+			# Message sent. Checked first, it's most of the traffic.
+			self.handleEvents("message", message.nick, message.param(0), message.param(1))
+		elif command == "NOTICE":
+			# Message sent.
+			self.handleEvents("notice", message.nick, message.param(0), message.param(1))
+		elif command == "PING":
+			# Server ping the reactor didn't catch, e.g. one with tags.
+			self.sendRaw("PONG :" + message.param(-1), SendQueue.PRIORITY_HIGH)
+		elif command == "PONG":
+			# Reply to one of our lag probes.
+			if self.__probe_token is not None and message.param(-1) == self.__probe_token:
+				self.lag = time.time() - self.__probe_sent
+				self.__lag_time.observe(self.lag)
+				self.__probe_token = None
+		elif command == "001":
+			# First line of MOTD or something?
+			# Generally means we're connected.
+			self.connected = True
+			
+			# The server may have changed our nick to fit.
+			self.nick = message.param(0, self.nick)
+			
+			# Back after losing the connection.
+			if self.__disconnected_at is not None:
+				self.__recovery_time.observe(time.time() - self.__disconnected_at)
+				self.__reconnects.inc()
+				self.__disconnected_at = None
+			self.__reconnect_attempts = 0
+			
+			self.handleEvents("connected")
+		elif command == "433" and not self.connected:
+			# Nick in use while registering, e.g. our old connection hasn't
+			# timed out yet. Try another.
+			self.nick = self.nick + "_"
+			self.sendRaw("NICK " + self.nick, SendQueue.PRIORITY_HIGH)
+		elif command == "353":
+			# Gives list of users in IRC channel.
+			channel = message.param(2)
+			users = [user for user in message.param(3).split(" ") if user]
+			
+			self.handleEvents("names", channel, users)
+		elif command == "366":
+			# End of the list of users.
+			self.handleEvents("names_end", message.param(1))
+		elif command == "005":
+			# Server features. We only care how it compares nicks.
+			for feature in message.params[1:-1]:
+				if feature.startswith("CASEMAPPING="):
+					self.members.setCasemapping(feature[12:])
+					self.__events.setCasemapping(self.members.casemapping)
+		elif command == "JOIN":
+			# Someone has joined a channel, or we have.
+			nick = message.nick
+			channel = message.param(0)
+			
+			if self.isSelf(nick):
+				self.handleEvents("self_join", channel)
+			else:
+				self.handleEvents("join", nick, channel)
+		elif command == "PART":
+			# Someone has parted a channel, or we have.
+			nick = message.nick
+			channel = message.param(0)
+			
+			if self.isSelf(nick):
+				self.handleEvents("self_part", channel)
 			else:
-				# Socket has been closed.
-				self.handleEvents("disconnected")
-				quit()
+				self.handleEvents("part", nick, channel)
+		elif command == "KICK":
+			# Someone has been kicked from a channel, or we have.
+			channel = message.param(0)
+			kick_nick = message.param(1)
+			
+			if self.isSelf(kick_nick):
+				self.handleEvents("self_kick", message.nick, channel, message.param(2))
+			else:
+				self.handleEvents("kick", message.nick, kick_nick, channel, message.param(2))
+		elif command == "NICK":
+			# Nickname has changed. Also includes ourselves.
+			nick = message.nick
+			new_nick = message.param(0)
+			
+			if self.isSelf(nick):
+				self.handleEvents("self_nick", new_nick)
+			else:
+				self.handleEvents("nick", nick, new_nick)
+		elif command == "QUIT":
+			# User has quit the server.
+			self.handleEvents("quit", message.nick, message.param(0))
+		else:
+			self.handleEvents("unhandled", data)
 		
 	def handleEvents(self, event_type, *event_parameters):
-		"""Calls the appropriate functions for each event"""
-		for event in self.__events[event_type]:
-			event.fire(self, *event_parameters)
-			
-			if self.debug:
-				self.log("Handled event(" + event_type + "): " + str(event))
+		"""Calls the appropriate functions for each event. Timed only while
+		metrics are being served."""
+		if self.__registry.timing:
+			start = time.time()
+			self.__events.fire(self, event_type, *event_parameters)
+			self.__event_time[event_type].observe(time.time() - start)
+		else:
+			self.__events.fire(self, event_type, *event_parameters)
+	
+	def countLine(self, counters, name, command):
+		"""Counts a line in or out by command."""
+		counter = counters.get(command)
+		
+		if counter is None:
+			counter = counters[command] = self.__registry.counter(name, "Lines exchanged with the server, by command.", command=command)
 		
-		# Debug silliness.
-		if self.debug:
-			self.log("Event(" + event_type + "): " + str(event_parameters))
+		counter.inc()
 	
 	# ------ IRC operation functions.
 	
 	def sendJoin(self, channel):
 		"""Sends commands to join a channel."""
-		if not channel in self.channels:
+		if not self.members.hasChannel(channel):
 			self.sendRaw("JOIN " + channel)
 	
 	def sendPart(self, channel):
 		"""Sends commands to part a channel."""
-		if channel in self.channels:
+		if self.members.hasChannel(channel):
 			self.sendRaw("PART " + channel)
 	
-	def sendAction(self, target, message):
+	def sendAction(self, target, message, priority=SendQueue.PRIORITY_NORMAL):
 		"""Sends a notice to a target."""
-		self.sendRaw("DESCRIBE " + target + " :" + message)
+		self.sendRaw("DESCRIBE " + target + " :" + message, priority)
 		
 	def sendAddMode(self, channel, target, mode):
 		self.sendRaw("MODE " + channel + " +" + mode + " :" + target)
@@ -262,40 +552,140 @@ class DeeIRC(object):
 	def sendRemMode(self, channel, target, mode):
 		self.sendRaw("MODE " + channel + " -" + mode + " :" + target)
 	
-	def sendMessage(self, target, message):
+	def sendMessage(self, target, message, priority=SendQueue.PRIORITY_NORMAL):
 		"""Sends a message to the specificed target."""
-		self.sendRaw("PRIVMSG " + target + " :" + message)
+		self.sendText("PRIVMSG", target, message, priority)
 	
-	def sendNotice(self, target, message):
+	def sendNotice(self, target, message, priority=SendQueue.PRIORITY_NORMAL):
 		"""Sends a notice to a target."""
-		self.sendRaw("NOTICE " + target + " :" + message)
+		self.sendText("NOTICE", target, message, priority)
+	
+	def sendText(self, command, target, message, priority):
+		"""Sends a PRIVMSG or NOTICE, holding it back if a batch is open.
+		Low priority text keeps it's layout and is never merged, but is
+		still held back so it follows the merged lines."""
+		coalescer = getattr(self.__local, "coalescer", None)
+		
+		if coalescer is not None and priority != SendQueue.PRIORITY_LOW:
+			coalescer.add(command, target, message, priority)
+		else:
+			self.sendRaw(command + " " + target + " :" + message, priority)
 	
 	def sendNick(self, new_nick):
 		"""Changes the nickname."""
 		self.sendRaw("NICK " + new_nick)
 	
-	def sendRaw(self, data):
-		"""Sends raw data to the socket. Automatically adds a new
-		line feed and such at the end."""		
-		self.__sock.send(data + "\r\n")
+	def sendRaw(self, data, priority=SendQueue.PRIORITY_NORMAL):
+		"""Queues raw data for the socket. Automatically adds a new
+		line feed and such at the end. Higher priority lines jump ahead
+		when flood control is holding things back. In a batch the line
+		waits, unmerged, until the batch is sent."""
+		coalescer = getattr(self.__local, "coalescer", None)
+		
+		if coalescer is not None:
+			coalescer.hold(data, priority)
+		else:
+			self.queueLine(data, priority)
+	
+	def queueLine(self, data, priority):
+		"""Puts a raw line on the send queue straight away."""
+		self.countLine(self.__outbound, "irc_outbound_lines_total", data.split(" ", 1)[0])
+		self.send_queue.put(data + "\r\n", priority)
+		
+		# Let the reactor know there's something to write.
+		self.reactor.wakeup()
+	
+	@contextlib.contextmanager
+	def batch(self):
+		"""Holds back messages and notices sent by this thread until the
+		block exits, then sends them merged per target, followed by any
+		other lines in the order they were sent. Nested batches join the
+		outer one."""
+		if getattr(self.__local, "coalescer", None) is not None:
+			yield
+			return
+		
+		coalescer = Coalesce.Coalescer()
+		self.__local.coalescer = coalescer
+		
+		try:
+			yield
+		finally:
+			self.__local.coalescer = None
+			
+			prefix_length = len(":" + self.nick + "!" + self.user + "@ ") + Coalesce.HOST_RESERVE
+			for command, target, message, priority in coalescer.lines(prefix_length):
+				self.queueLine(command + " " + target + " :" + message, priority)
+			
+			for data, priority in coalescer.held():
+				self.queueLine(data, priority)
+	
+	def setFloodControl(self, rate, burst):
+		"""Limits sending to burst lines at once, then rate lines per
+		second. A rate of None turns flood control off."""
+		self.send_queue.setRate(rate, burst)
+	
+	# ------ Helpers.
+	
+	def isSelf(self, nick):
+		"""Returns true if a nick is ours, ignoring case."""
+		return self.members.key(nick) == self.members.key(self.nick)
+	
+	# ------ Capture.
+	
+	def startCapture(self, path):
+		"""Records every line to and from the server in a capture file,
+		see Capture.py."""
+		self.stopCapture()
+		self.capture = Capture.CaptureWriter(path)
+		
+		return self.capture
+	
+	def stopCapture(self):
+		"""Stops recording and closes the capture file."""
+		capture = self.capture
+		self.capture = None
+		
+		if capture is not None:
+			capture.close()
+	
+	# ------ Timers.
+	
+	def callLater(self, delay, function, *args):
+		"""Runs a function on the dispatch thread after delay seconds,
+		instead of sleeping in a handler."""
+		return self.reactor.callLaterDispatch(delay, function, *args)
 	
 	# ------ Event management helpers.
 	
-	def addEvent(self, event_type, event):
-		"""Adds an event to the handler."""
-		if not event in self.__events[event_type]:
-			self.__events[event_type].append(event)
+	def addEvent(self, event_type, event, **filters):
+		"""Adds an event to the handler. Filters limit it to certain
+		channels, nicks or commands, e.g. channel="#uno"."""
+		if self.__events.subscribe(event_type, event, **filters):
 			
 			if self.debug:
 				self.log("Added event(" + event_type + "): " + str(event))
 	
 	def removeEvent(self, event_type, event):
 		"""Removes an event from the handler."""
-		if event in self.__events[event_type]:
-			self.__events[event_type].remove(event)
+		if self.__events.unsubscribe(event_type, event):
 			
 			if self.debug:
 				self.log("Removed event(" + event_type + "): " + str(event))
+	
+	def addEventListener(self, listener):
+		"""Adds a function called as listener(event_type, event, parameters)
+		each time a handler runs."""
+		self.__events.addListener(listener)
+	
+	def removeEventListener(self, listener):
+		"""Removes an event listener."""
+		self.__events.removeListener(listener)
+	
+	def traceEvents(self, event_type, event, event_parameters):
+		"""Event listener that logs every handled event. Attach it with
+		addEventListener() when debugging, it's too chatty to leave on."""
+		self.log("Handled event(" + event_type + "): " + str(event) + " " + str(event_parameters))
 		
 	# ------ Error Handling
 	
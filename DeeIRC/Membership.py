@@ -0,0 +1,223 @@
+# Membership.py
+# --------------------------------------------------------------------------
+
+# Tracks who is in which channel. Nicks and channels are stored under their
+# case folded names, interned so the same key is shared by every set it's in.
+# Two indexes are kept in step, so every update touches only the channels the
+# nick is actually in, however big those channels are:
+#
+#	channels = {"[channel_key]":set([nick_key, ...])}
+#	nicks = {"[nick_key]":set([channel_key, ...])}
+#
+# Display names (as the server last sent them) are kept alongside, keyed the
+# same way.
+#
+# NAMES replies can run to hundreds of 353 lines for a big channel. They are
+# collected into a pending set as they arrive and swapped in on 366, so a
+# refresh never leaves the channel half empty.
+
+import Utils
+
+# ------------------------------------------------------------------------------
+
+class Membership(object):
+	"""Nick and channel membership, with O(1) updates."""
+
+	def __init__(self, casemapping="rfc1459"):
+		"""Constructor."""
+		self.casemapping = casemapping
+		self.clear()
+
+	def clear(self):
+		"""Forgets everything, e.g. after a disconnect."""
+		self.channels = {}
+		self.nicks = {}
+		self.names = {}
+		self.pending = {}
+
+	def key(self, name):
+		"""Returns the folded, interned key for a nick or channel."""
+		return intern(Utils.lowerNick(name, self.casemapping))
+
+	def setCasemapping(self, casemapping):
+		"""Switches casemapping, as advertised by the server's 005, and
+		re-keys anything already stored."""
+		if casemapping == self.casemapping or not casemapping in Utils.CASEMAPPINGS:
+			return
+
+		channels = [(self.names[channel], [self.names[nick] for nick in nicks]) for channel, nicks in self.channels.items()]
+
+		self.casemapping = casemapping
+		self.clear()
+
+		for channel, nicks in channels:
+			self.addChannel(channel)
+			for nick in nicks:
+				self.join(nick, channel)
+
+	# ------ Our own channels.
+
+	def addChannel(self, channel):
+		"""Starts tracking a channel we've joined."""
+		channel_key = self.key(channel)
+
+		if not channel_key in self.channels:
+			self.channels[channel_key] = set()
+		self.names[channel_key] = channel
+
+	def removeChannel(self, channel):
+		"""Stops tracking a channel we've left."""
+		channel_key = self.key(channel)
+		nicks = self.channels.pop(channel_key, None)
+
+		if nicks is None:
+			return
+
+		for nick_key in nicks:
+			self.leave(nick_key, channel_key)
+
+		self.pending.pop(channel_key, None)
+		del self.names[channel_key]
+
+	def hasChannel(self, channel):
+		"""Returns true if we're in a channel."""
+		return self.key(channel) in self.channels
+
+	def channelNames(self):
+		"""Returns the display names of our channels."""
+		return [self.names[channel_key] for channel_key in self.channels]
+
+	# ------ Other people.
+
+	def join(self, nick, channel):
+		"""Adds a nick to a channel."""
+		channel_key = self.key(channel)
+		members = self.channels.get(channel_key)
+
+		if members is None:
+			return
+
+		nick_key = self.key(nick)
+		members.add(nick_key)
+
+		if nick_key in self.nicks:
+			self.nicks[nick_key].add(channel_key)
+		else:
+			self.nicks[nick_key] = set([channel_key])
+		self.names[nick_key] = nick
+
+	def part(self, nick, channel):
+		"""Removes a nick from a channel."""
+		channel_key = self.key(channel)
+		members = self.channels.get(channel_key)
+
+		if members is None:
+			return
+
+		nick_key = self.key(nick)
+		if nick_key in members:
+			members.discard(nick_key)
+			self.leave(nick_key, channel_key)
+
+	def quit(self, nick):
+		"""Removes a nick from every channel. Returns the display names of
+		the channels they were in."""
+		nick_key = self.key(nick)
+		channel_keys = self.nicks.pop(nick_key, ())
+
+		for channel_key in channel_keys:
+			self.channels[channel_key].discard(nick_key)
+
+		self.names.pop(nick_key, None)
+
+		return [self.names[channel_key] for channel_key in channel_keys]
+
+	def rename(self, nick, new_nick):
+		"""Moves a nick's memberships to a new nick."""
+		nick_key = self.key(nick)
+		new_key = self.key(new_nick)
+		channel_keys = self.nicks.pop(nick_key, None)
+
+		self.names.pop(nick_key, None)
+
+		if channel_keys is None:
+			return
+
+		for channel_key in channel_keys:
+			members = self.channels[channel_key]
+			members.discard(nick_key)
+			members.add(new_key)
+
+		self.nicks[new_key] = channel_keys
+		self.names[new_key] = new_nick
+
+	def leave(self, nick_key, channel_key):
+		"""Drops a channel from a nick's set, forgetting the nick once it
+		shares no channels with us."""
+		channel_keys = self.nicks.get(nick_key)
+
+		if channel_keys is not None:
+			channel_keys.discard(channel_key)
+
+			if not channel_keys:
+				del self.nicks[nick_key]
+				self.names.pop(nick_key, None)
+
+	# ------ NAMES bursts.
+
+	def addNames(self, channel, nicks):
+		"""Adds one 353 line's worth of nicks to the pending list."""
+		channel_key = self.key(channel)
+
+		if not channel_key in self.channels:
+			return
+
+		pending = self.pending.get(channel_key)
+		if pending is None:
+			pending = self.pending[channel_key] = {}
+
+		for nick in nicks:
+			nick = Utils.stripNickStatus(nick)
+			if nick:
+				pending[self.key(nick)] = nick
+
+	def endNames(self, channel):
+		"""Replaces a channel's members with the names collected since the
+		last 366."""
+		channel_key = self.key(channel)
+		pending = self.pending.pop(channel_key, None)
+
+		if pending is None or not channel_key in self.channels:
+			return
+
+		members = self.channels[channel_key]
+
+		# Drop anyone who isn't there any more.
+		for nick_key in members.difference(pending):
+			self.leave(nick_key, channel_key)
+
+		self.channels[channel_key] = set(pending)
+
+		for nick_key, nick in pending.iteritems():
+			if nick_key in self.nicks:
+				self.nicks[nick_key].add(channel_key)
+			else:
+				self.nicks[nick_key] = set([channel_key])
+			self.names[nick_key] = nick
+
+	# ------ Queries.
+
+	def isOn(self, nick, channel):
+		"""Returns true if a nick is in a channel."""
+		members = self.channels.get(self.key(channel))
+		return members is not None and self.key(nick) in members
+
+	def channelNicks(self, channel):
+		"""Returns the display names of everyone in a channel."""
+		members = self.channels.get(self.key(channel), ())
+		return [self.names[nick_key] for nick_key in members]
+
+	def nickChannels(self, nick):
+		"""Returns the display names of the channels a nick shares with us."""
+		channel_keys = self.nicks.get(self.key(nick), ())
+		return [self.names[channel_key] for channel_key in channel_keys]
@@ -0,0 +1,279 @@
+# Metrics.py
+# --------------------------------------------------------------------------
+
+# Counters, gauges and histograms for the framework and plugins. Metrics are
+# looked up once, by name and labels, and then updated directly, so the hot
+# path is a single attribute update.
+#
+# ------ Usage
+#	lines = Metrics.getRegistry().counter("irc_lines_total", "Lines sent.", priority="low")
+#	lines.inc()
+#
+# ------ Exposition
+#	Metrics.serve(9100) starts an HTTP server on a background thread that
+#	answers GET /metrics in the Prometheus text format. Nothing is formatted
+#	until someone asks, and timings that are only worth taking for a scraper
+#	(see Registry.timing) stay off until the server is started.
+
+import BaseHTTPServer
+import bisect
+import threading
+
+# Seconds, good for most latencies we care about.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# ------------------------------------------------------------------------------
+
+class Counter(object):
+	"""A value that only goes up."""
+	__slots__ = ("name", "labels", "value", "__lock")
+
+	type = "counter"
+
+	def __init__(self, name, labels):
+		"""Constructor."""
+		self.name = name
+		self.labels = labels
+		self.value = 0
+		self.__lock = threading.Lock()
+
+	def inc(self, amount=1):
+		"""Adds to the counter. += isn't atomic, so it takes a lock like
+		Histogram.observe() does."""
+		with self.__lock:
+			self.value += amount
+
+	def read(self):
+		"""Returns the current value."""
+		return self.value
+
+class Gauge(Counter):
+	"""A value that can go up and down."""
+	__slots__ = ("function",)
+
+	type = "gauge"
+
+	def __init__(self, name, labels):
+		"""Constructor."""
+		Counter.__init__(self, name, labels)
+		self.function = None
+
+	def read(self):
+		"""Returns the current value, from the callback if there is one."""
+		if self.function is not None:
+			return self.function()
+		return self.value
+
+	def setFunction(self, function):
+		"""Reads the gauge from function() at collection time instead, for
+		values that are cheaper to count when asked than to keep updated."""
+		self.function = function
+
+	def dec(self, amount=1):
+		"""Subtracts from the gauge."""
+		self.inc(-amount)
+
+	def set(self, value):
+		"""Sets the gauge."""
+		self.value = value
+
+class Histogram(object):
+	"""Counts observations into buckets, and keeps their sum."""
+	__slots__ = ("name", "labels", "buckets", "counts", "count", "sum", "__lock")
+
+	type = "histogram"
+
+	def __init__(self, name, labels, buckets=DEFAULT_BUCKETS):
+		"""Constructor."""
+		self.name = name
+		self.labels = labels
+		self.buckets = tuple(buckets)
+		self.counts = [0] * (len(self.buckets) + 1)
+		self.count = 0
+		self.sum = 0.0
+		self.__lock = threading.Lock()
+
+	def observe(self, value):
+		"""Records one observation."""
+		index = bisect.bisect_left(self.buckets, value)
+
+		with self.__lock:
+			self.counts[index] += 1
+			self.count += 1
+			self.sum += value
+
+	def cumulativeCounts(self):
+		"""Returns (upper_bound, count) pairs, the last bound being None
+		for +Inf."""
+		with self.__lock:
+			counts = list(self.counts)
+
+		result = []
+		total = 0
+		for i, bound in enumerate(self.buckets + (None,)):
+			total += counts[i]
+			result.append((bound, total))
+
+		return result
+
+	def percentile(self, fraction):
+		"""Returns the upper bound of the bucket holding the given fraction
+		of observations, or None if there are none."""
+		if not self.count:
+			return None
+
+		wanted = self.count * fraction
+		for bound, total in self.cumulativeCounts():
+			if total >= wanted:
+				return bound
+
+# ------------------------------------------------------------------------------
+
+class Registry(object):
+	"""Holds every metric, keyed by name and labels."""
+
+	def __init__(self):
+		"""Constructor."""
+		self.__metrics = {}
+		self.__families = {}
+		self.__lock = threading.Lock()
+
+		# Whether to take timings that cost a clock read or two per event.
+		# Turned on by serve(), since nobody sees them otherwise.
+		self.timing = False
+
+	def counter(self, name, help="", **labels):
+		"""Returns the counter for a name and labels, creating it if needed."""
+		return self.getMetric(Counter, name, help, labels)
+
+	def gauge(self, name, help="", **labels):
+		"""Returns the gauge for a name and labels, creating it if needed."""
+		return self.getMetric(Gauge, name, help, labels)
+
+	def histogram(self, name, help="", buckets=DEFAULT_BUCKETS, **labels):
+		"""Returns the histogram for a name and labels, creating it if needed."""
+		return self.getMetric(Histogram, name, help, labels, buckets)
+
+	def getMetric(self, metric_class, name, help, labels, *args):
+		"""Looks up or creates a metric."""
+		key = (name, tuple(sorted(labels.items())))
+
+		metric = self.__metrics.get(key)
+		if metric is None:
+			with self.__lock:
+				metric = self.__metrics.get(key)
+				if metric is None:
+					metric = metric_class(name, key[1], *args)
+					self.__metrics[key] = metric
+
+					if not name in self.__families:
+						self.__families[name] = (metric_class.type, help, [])
+					self.__families[name][2].append(metric)
+
+		return metric
+
+	def collect(self):
+		"""Returns a list of (name, type, help, metrics), sorted by name."""
+		with self.__lock:
+			return [(name,) + family[:2] + (list(family[2]),) for name, family in sorted(self.__families.items())]
+
+# ------------------------------------------------------------------------------
+
+def formatValue(value):
+	"""Formats a number the way Prometheus expects."""
+	if value is None:
+		return "+Inf"
+	if isinstance(value, float):
+		if value != value:
+			return "NaN"
+		if value in (float("inf"), float("-inf")):
+			return "+Inf" if value > 0 else "-Inf"
+		return repr(value)
+	return str(value)
+
+def formatLabels(labels, extra=()):
+	"""Formats label pairs as {name="value",...}, or nothing if empty."""
+	labels = tuple(labels) + tuple(extra)
+	if not labels:
+		return ""
+
+	pairs = []
+	for name, value in labels:
+		value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+		pairs.append(name + "=\"" + value + "\"")
+
+	return "{" + ",".join(pairs) + "}"
+
+def exposition(registry=None):
+	"""Returns every metric in the Prometheus text format (version 0.0.4)."""
+	if registry is None:
+		registry = getRegistry()
+
+	lines = []
+	for name, metric_type, help, metrics in registry.collect():
+		lines.append("# HELP " + name + " " + help.replace("\\", "\\\\").replace("\n", "\\n"))
+		lines.append("# TYPE " + name + " " + metric_type)
+
+		for metric in metrics:
+			if metric_type == "histogram":
+				for bound, total in metric.cumulativeCounts():
+					lines.append(name + "_bucket" + formatLabels(metric.labels, (("le", formatValue(bound)),)) + " " + str(total))
+				lines.append(name + "_sum" + formatLabels(metric.labels) + " " + formatValue(metric.sum))
+				lines.append(name + "_count" + formatLabels(metric.labels) + " " + str(metric.count))
+			else:
+				lines.append(name + formatLabels(metric.labels) + " " + formatValue(metric.read()))
+
+	return "\n".join(lines) + "\n"
+
+class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+	"""Answers GET /metrics."""
+
+	def do_GET(self):
+		"""Sends the exposition, or a 404 for any other path."""
+		if self.path.split("?", 1)[0] != "/metrics":
+			self.send_error(404)
+			return
+
+		body = exposition(self.server.registry)
+
+		self.send_response(200)
+		self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		"""Keeps scrapes out of the console."""
+		pass
+
+def serve(port, host="127.0.0.1", registry=None):
+	"""Starts serving /metrics on a daemon thread. Returns the server, call
+	shutdown() on it to stop."""
+	if registry is None:
+		registry = getRegistry()
+
+	server = BaseHTTPServer.HTTPServer((host, port), MetricsHandler)
+	server.registry = registry
+	registry.timing = True
+
+	thread = threading.Thread(target=server.serve_forever, name="DeeIRC-metrics")
+	thread.daemon = True
+	thread.start()
+
+	return server
+
+# ------------------------------------------------------------------------------
+
+# Shared registry.
+__registry_instance = None
+__registry_lock = threading.Lock()
+
+def getRegistry():
+	"""Returns the process-wide metrics registry."""
+	global __registry_instance
+
+	with __registry_lock:
+		if not __registry_instance:
+			__registry_instance = Registry()
+
+	return __registry_instance
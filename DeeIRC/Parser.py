@@ -0,0 +1,175 @@
+# Parser.py
+# --------------------------------------------------------------------------
+
+# Parses lines from the server into Message objects. Only the command is
+# picked out up front, since that's all dispatch needs for most lines. Tags,
+# the prefix and the parameters are sliced out of the original line the first
+# time they're asked for, and then kept.
+#
+# ------ Line format
+#	[@tags ][:prefix ]command[ params...][ :trailing]
+#
+# ------ Message fields
+#	line - the raw line, without CR LF.
+#	command - upper case command or numeric.
+#	tags - dictionary of IRCv3 tags, values unescaped.
+#	prefix - "nick!user@host" or a server name.
+#	nick, user, host - parts of the prefix.
+#	params - list of parameters, the trailing one included.
+
+# IRCv3 tag value escapes.
+TAG_ESCAPES = {":":";", "s":" ", "\\":"\\", "r":"\r", "n":"\n"}
+
+# ------------------------------------------------------------------------------
+
+class Message(object):
+	"""One line from the server, parsed lazily."""
+	__slots__ = ("line", "command", "__tags_end", "__prefix_start", "__prefix_end", "__params_start", "__tags", "__source", "__params")
+
+	def __init__(self, line):
+		"""Constructor. Finds where each part of the line starts and reads
+		the command."""
+		self.line = line
+		self.__tags = None
+		self.__source = None
+		self.__params = None
+
+		# Tags.
+		if line[0:1] == "@":
+			position = line.find(" ")
+			if position < 0:
+				position = len(line)
+			self.__tags_end = position
+
+			while line[position:position+1] == " ":
+				position += 1
+		else:
+			self.__tags_end = 0
+			position = 0
+
+		# Prefix.
+		if line[position:position+1] == ":":
+			end = line.find(" ", position)
+			if end < 0:
+				end = len(line)
+			self.__prefix_start = position + 1
+			self.__prefix_end = end
+
+			position = end
+			while line[position:position+1] == " ":
+				position += 1
+		else:
+			self.__prefix_start = 0
+			self.__prefix_end = 0
+
+		# Command.
+		end = line.find(" ", position)
+		if end < 0:
+			end = len(line)
+		self.command = line[position:end].upper()
+		self.__params_start = end
+
+	def __repr__(self):
+		"""Returns the raw line, for debugging."""
+		return "Message(" + repr(self.line) + ")"
+
+	# ------ Tags.
+
+	@property
+	def tags(self):
+		"""Returns a dictionary of IRCv3 message tags."""
+		if self.__tags is None:
+			tags = {}
+
+			if self.__tags_end:
+				for item in self.line[1:self.__tags_end].split(";"):
+					if item:
+						key, equals, value = item.partition("=")
+						if "\\" in value:
+							value = unescapeTag(value)
+						tags[key] = value
+
+			self.__tags = tags
+
+		return self.__tags
+
+	# ------ Prefix.
+
+	@property
+	def prefix(self):
+		"""Returns the prefix, or an empty string if there isn't one."""
+		return self.line[self.__prefix_start:self.__prefix_end]
+
+	@property
+	def nick(self):
+		"""Returns the nick (or server name) from the prefix."""
+		return self.source()[0]
+
+	@property
+	def user(self):
+		"""Returns the username from the prefix, if any."""
+		return self.source()[1]
+
+	@property
+	def host(self):
+		"""Returns the hostname from the prefix, if any."""
+		return self.source()[2]
+
+	def source(self):
+		"""Splits the prefix into (nick, user, host)."""
+		if self.__source is None:
+			prefix = self.prefix
+
+			nick, at, host = prefix.partition("@")
+			nick, bang, user = nick.partition("!")
+
+			self.__source = (nick, user, host)
+
+		return self.__source
+
+	# ------ Parameters.
+
+	@property
+	def params(self):
+		"""Returns the list of parameters."""
+		if self.__params is None:
+			# Everything after the first " :" is the trailing parameter.
+			middle, colon, trailing = self.line[self.__params_start:].partition(" :")
+
+			params = middle.split()
+			if colon:
+				params.append(trailing)
+
+			self.__params = params
+
+		return self.__params
+
+	def param(self, index, default=""):
+		"""Returns a parameter, or default if there aren't that many."""
+		params = self.params
+		if -len(params) <= index < len(params):
+			return params[index]
+		return default
+
+# ------------------------------------------------------------------------------
+
+def parse(line):
+	"""Returns a Message for a line, which should have it's CR LF removed."""
+	return Message(line)
+
+def unescapeTag(value):
+	"""Undoes IRCv3 tag value escaping."""
+	result = []
+	escaped = False
+
+	for char in value:
+		if escaped:
+			result.append(TAG_ESCAPES.get(char, char))
+			escaped = False
+		elif char == "\\":
+			escaped = True
+		else:
+			result.append(char)
+
+	# A lone trailing backslash is dropped.
+	return "".join(result)
@@ -0,0 +1,279 @@
+# Reactor.py
+# --------------------------------------------------------------------------
+
+# The reactor owns the sockets of every DeeIRC connection in the process.
+# One I/O thread waits on all of them with select(), reads whole lines,
+# answers server PINGs straight away and hands everything else over to the
+# dispatch thread. A slow event handler therefore never holds up socket reads
+# or PONG replies, and adding a network costs a socket rather than a thread.
+#
+# ------ Threads
+#	io - select() loop, socket reads/writes and timers.
+#	dispatch - runs event handlers, one item at a time, in order.
+#
+# Timers are kept in a TimerWheel, so scheduling and cancelling stay cheap
+# with tens of thousands waiting, e.g. a turn timer for every table.
+
+import Metrics
+import TimerWheel
+
+import Queue
+import errno
+import fcntl
+import os
+import select
+import threading
+import time
+import traceback
+
+# ------------------------------------------------------------------------------
+
+# Handle returned by Reactor.callLater(), can be cancelled.
+Timer = TimerWheel.Timer
+
+# ------------------------------------------------------------------------------
+
+class Reactor(object):
+	"""Multiplexes many IRC connections onto a single I/O thread."""
+
+	def __init__(self):
+		"""Constructor."""
+		self.__connections = {}
+		self.__timers = TimerWheel.TimerWheel(time.time())
+		self.__lock = threading.Lock()
+
+		Metrics.getRegistry().gauge("irc_timers_pending", "Timers waiting to fire.").setFunction(self.__timers.__len__)
+
+		# When select() will wake up anyway, so a timer due after that
+		# needn't wake it. Infinite while the timeout is being worked out,
+		# so a timer scheduled meanwhile always wakes it.
+		self.__wake_at = float("inf")
+
+		# Handlers run here, away from the I/O thread.
+		self.__dispatch_queue = Queue.Queue()
+
+		# Writing to this pipe wakes select() up early. Opened by start(),
+		# closed by the I/O thread on it's way out.
+		self.__wake_lock = threading.Lock()
+		self.__wake_read = None
+		self.__wake_write = None
+		self.openWake()
+
+		self.__io_thread = None
+		self.__dispatch_thread = None
+		self.running = False
+
+	# ------ Thread management.
+
+	def start(self):
+		"""Starts the I/O and dispatch threads if they aren't running."""
+		with self.__lock:
+			if self.running:
+				return
+
+			self.running = True
+			self.openWake()
+
+			self.__io_thread = threading.Thread(target=self.ioLoop, name="DeeIRC-io")
+			self.__dispatch_thread = threading.Thread(target=self.dispatchLoop, name="DeeIRC-dispatch")
+
+		self.__io_thread.start()
+		self.__dispatch_thread.start()
+
+	def stop(self):
+		"""Stops the reactor once queued handlers have run. The I/O thread
+		closes the wake pipe as it leaves."""
+		with self.__lock:
+			if not self.running:
+				return
+
+			self.running = False
+
+		self.__dispatch_queue.put(None)
+		self.wakeup()
+
+	def wakeup(self):
+		"""Interrupts select() so new writes and timers are noticed. Never
+		blocks: a full pipe will wake select() already, and a closed one
+		means nobody is listening."""
+		with self.__wake_lock:
+			if self.__wake_write is None:
+				return
+
+			try:
+				os.write(self.__wake_write, "x")
+			except OSError:
+				pass
+
+	# ------ Wake pipe.
+
+	def openWake(self):
+		"""Creates the wake pipe, non-blocking at both ends, unless it's
+		open already."""
+		with self.__wake_lock:
+			if self.__wake_read is not None:
+				return
+
+			self.__wake_read, self.__wake_write = os.pipe()
+
+			for fd in (self.__wake_read, self.__wake_write):
+				fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+	def drainWake(self, wake_read):
+		"""Reads everything waiting in the wake pipe."""
+		while True:
+			try:
+				if not os.read(wake_read, 4096):
+					return
+			except OSError, e:
+				if e.errno == errno.EINTR:
+					continue
+				return
+
+	def closeWake(self, wake_read):
+		"""Closes the wake pipe, if it's still the one read from."""
+		with self.__wake_lock:
+			if self.__wake_read != wake_read:
+				return
+
+			os.close(self.__wake_read)
+			os.close(self.__wake_write)
+			self.__wake_read = None
+			self.__wake_write = None
+
+	# ------ Connection management.
+
+	def register(self, connection):
+		"""Starts watching a connection. It must provide fileno(),
+		wantsWrite(), writeDelay(), handleRead() and handleWrite()."""
+		with self.__lock:
+			self.__connections[connection.fileno()] = connection
+
+		self.wakeup()
+
+	def unregister(self, connection, fileno, returning=False):
+		"""Stops watching a connection. The reactor shuts down when the last
+		one goes away, unless it's returning (reconnecting)."""
+		with self.__lock:
+			if fileno in self.__connections:
+				del self.__connections[fileno]
+
+			remaining = len(self.__connections)
+
+		if not remaining and not returning:
+			self.stop()
+
+	# ------ Scheduling.
+
+	def callLater(self, delay, function, *args):
+		"""Runs a function on the I/O thread after delay seconds. Keep these
+		short, use callLaterDispatch() for anything that might block."""
+		timer = self.__timers.schedule(time.time() + delay, function, args)
+
+		if timer.when < self.__wake_at:
+			self.wakeup()
+
+		return timer
+
+	def callLaterDispatch(self, delay, function, *args):
+		"""Runs a function on the dispatch thread after delay seconds."""
+		return self.callLater(delay, self.dispatch, function, *args)
+
+	def dispatch(self, function, *args):
+		"""Queues a function to run on the dispatch thread."""
+		self.__dispatch_queue.put((function, args))
+
+	# ------ Loops.
+
+	def ioLoop(self):
+		"""Waits for socket activity and timers. Runs in it's own thread."""
+		wake_read = self.__wake_read
+
+		try:
+			self.selectLoop(wake_read)
+		finally:
+			self.closeWake(wake_read)
+
+	def selectLoop(self, wake_read):
+		"""ioLoop()'s loop, until the reactor stops."""
+		while self.running:
+			self.__wake_at = float("inf")
+			timeout = self.runTimers()
+
+			with self.__lock:
+				connections = self.__connections.values()
+
+			# Wake up when flood control next lets a line out.
+			for connection in connections:
+				delay = connection.writeDelay()
+				if delay is not None and (timeout is None or delay < timeout):
+					timeout = delay
+
+			if timeout is None:
+				self.__wake_at = float("inf")
+			else:
+				self.__wake_at = time.time() + timeout
+
+			readers = [wake_read] + connections
+			writers = [connection for connection in connections if connection.wantsWrite()]
+
+			try:
+				readable, writable, failed = select.select(readers, writers, [], timeout)
+			except (select.error, ValueError), e:
+				# Interrupted, or a socket was closed under us. Try again.
+				if isinstance(e, select.error) and e.args[0] != errno.EINTR and e.args[0] != errno.EBADF:
+					raise
+				continue
+
+			for connection in readable:
+				if connection is wake_read:
+					self.drainWake(wake_read)
+				else:
+					self.guard(connection.handleRead)
+
+			for connection in writable:
+				self.guard(connection.handleWrite)
+
+	def dispatchLoop(self):
+		"""Runs queued handlers in order. Runs in it's own thread."""
+		while True:
+			item = self.__dispatch_queue.get()
+
+			# Sentinel from stop().
+			if item is None:
+				break
+
+			function, args = item
+			self.guard(function, *args)
+
+	def runTimers(self):
+		"""Fires due timers and returns the seconds until the next one."""
+		now = time.time()
+
+		for timer in self.__timers.advance(now):
+			if not timer.cancelled:
+				self.guard(timer.function, *timer.args)
+
+		return self.__timers.nextDelay(now)
+
+	def guard(self, function, *args):
+		"""Calls a function, printing rather than raising any exception so
+		one bad handler can't take the loop down with it."""
+		try:
+			function(*args)
+		except Exception:
+			traceback.print_exc()
+
+# ------------------------------------------------------------------------------
+
+# Shared reactor, used by every connection that doesn't bring it's own.
+__reactor_instance = None
+
+def getReactor():
+	"""Returns the process-wide reactor, creating it if needed."""
+	global __reactor_instance
+
+	if not __reactor_instance:
+		__reactor_instance = Reactor()
+
+	return __reactor_instance
@@ -0,0 +1,158 @@
+# SendQueue.py
+# --------------------------------------------------------------------------
+
+# Outbound lines wait here until the token bucket lets them through, so we
+# never send faster than the server's flood limit. Lines are sent highest
+# priority first, and in order within a priority.
+#
+# ------ Priorities
+#	PRIORITY_HIGH - protocol replies (PONG, QUIT) that must not wait.
+#	PRIORITY_NORMAL - game play: turns, hands, errors. The default.
+#	PRIORITY_LOW - bulk text: help, celebrations.
+
+import Metrics
+
+import collections
+import threading
+import time
+
+# ------- Constants ------------------------------------------------------------
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+PRIORITY_NAMES = ("high", "normal", "low")
+
+# Defaults, roughly what common ircds allow before Excess Flood.
+DEFAULT_RATE = 1.0
+DEFAULT_BURST = 5
+
+# ------------------------------------------------------------------------------
+
+class TokenBucket(object):
+	"""Allows burst lines at once, refilling at rate lines per second."""
+
+	def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST):
+		"""Constructor. A rate of None turns flood control off."""
+		self.rate = rate
+		self.burst = burst
+		self.tokens = float(burst)
+		self.stamp = time.time()
+
+	def refill(self, now):
+		"""Adds the tokens earned since the last refill."""
+		if self.rate:
+			self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+		self.stamp = now
+
+	def consume(self, now):
+		"""Takes a token if there is one. Returns true on success."""
+		if not self.rate:
+			return True
+
+		self.refill(now)
+		if self.tokens >= 1:
+			self.tokens -= 1
+			return True
+
+		return False
+
+	def delay(self, now):
+		"""Returns the seconds until a token is available."""
+		if not self.rate:
+			return 0
+
+		self.refill(now)
+		if self.tokens >= 1:
+			return 0
+
+		return (1 - self.tokens) / self.rate
+
+# ------------------------------------------------------------------------------
+
+class SendQueue(object):
+	"""Priority queue of outbound lines, paced by a token bucket."""
+
+	def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST):
+		"""Constructor."""
+		self.bucket = TokenBucket(rate, burst)
+		self.__queues = [collections.deque() for name in PRIORITY_NAMES]
+		self.__lock = threading.Lock()
+
+		# Counters, shared by every connection.
+		registry = Metrics.getRegistry()
+		self.depth = [registry.gauge("irc_send_queue_depth", "Lines waiting in the send queue.", priority=name) for name in PRIORITY_NAMES]
+		self.sent = [registry.counter("irc_send_lines_total", "Lines written to the socket.", priority=name) for name in PRIORITY_NAMES]
+		self.wait = [registry.histogram("irc_send_wait_seconds", "Time lines spent in the send queue.", priority=name) for name in PRIORITY_NAMES]
+
+	def setRate(self, rate, burst):
+		"""Changes the flood control settings."""
+		with self.__lock:
+			self.bucket = TokenBucket(rate, burst)
+
+	def put(self, line, priority=PRIORITY_NORMAL):
+		"""Queues a line."""
+		with self.__lock:
+			self.__queues[priority].append((time.time(), line))
+		self.depth[priority].inc()
+
+	def pop(self):
+		"""Returns the next line if the bucket allows it, otherwise None."""
+		now = time.time()
+
+		with self.__lock:
+			for priority, queue in enumerate(self.__queues):
+				if queue:
+					if not self.bucket.consume(now):
+						return None
+
+					queued, line = queue.popleft()
+					break
+			else:
+				return None
+
+		self.depth[priority].dec()
+		self.sent[priority].inc()
+		self.wait[priority].observe(now - queued)
+
+		return line
+
+	def clear(self):
+		"""Throws away everything waiting."""
+		with self.__lock:
+			for priority, queue in enumerate(self.__queues):
+				self.depth[priority].dec(len(queue))
+				queue.clear()
+
+	def ready(self):
+		"""Returns true if a line could be sent right now."""
+		return self.delay() == 0
+
+	def delay(self):
+		"""Returns seconds until the next line may be sent, or None if
+		nothing is waiting."""
+		with self.__lock:
+			if not len(self):
+				return None
+
+			return self.bucket.delay(time.time())
+
+	def __len__(self):
+		"""Returns the number of lines waiting."""
+		return sum([len(queue) for queue in self.__queues])
+
+	def stats(self):
+		"""Returns this queue's depth, along with the process-wide sent and
+		wait counters, per priority."""
+		stats = {}
+
+		for priority, name in enumerate(PRIORITY_NAMES):
+			stats[name] = {
+				"depth":len(self.__queues[priority]),
+				"sent":self.sent[priority].value,
+				"wait_total":self.wait[priority].sum,
+				"wait_p99":self.wait[priority].percentile(0.99),
+			}
+
+		return stats
@@ -0,0 +1,263 @@
+# TimerWheel.py
+# --------------------------------------------------------------------------
+
+# A hierarchical timing wheel, which the reactor keeps it's timers in. Time
+# is cut into ticks of TICK seconds. The first wheel has a slot for each of
+# the next SLOTS ticks, the next wheel a slot for each of the next SLOTS
+# blocks of SLOTS ticks, and so on for LEVELS wheels. A timer goes in the
+# slot for it's tick on the lowest wheel that reaches that far, and each time
+# the first wheel comes round the next slot of the wheel above is emptied
+# down into it, so a timer only moves a few times however far off it is.
+#
+# Slots are doubly linked lists, so scheduling and cancelling are both O(1)
+# and a cancelled timer is gone straight away rather than waiting to come
+# up. That matters when every table restarts a timer on every turn. Each
+# wheel keeps a bitmap of which of it's slots have timers, so advance() and
+# nextDelay() step straight over empty slots and empty rounds.
+#
+# Timers fire on the first advance() at or after their tick, never early,
+# and at most a tick late on top of however late advance() is called.
+
+import threading
+
+# ------- Constants ------------------------------------------------------------
+
+TICK = 0.01
+
+SLOT_BITS = 8
+SLOTS = 1 << SLOT_BITS
+SLOT_MASK = SLOTS - 1
+LEVELS = 4
+
+# Ticks the wheels reach, about 500 days. Timers further off wait at the
+# top and are moved again as it comes round.
+SPAN = 1 << (SLOT_BITS * LEVELS)
+
+# ------------------------------------------------------------------------------
+
+class Timer(object):
+	"""Handle returned by TimerWheel.schedule(), can be cancelled."""
+	__slots__ = ("when", "tick", "function", "args", "cancelled", "wheel", "slot", "previous", "next")
+
+	def __init__(self, when, function, args, wheel=None):
+		"""Constructor."""
+		self.when = when
+		self.tick = 0
+		self.function = function
+		self.args = args
+		self.cancelled = False
+		self.wheel = wheel
+		self.slot = None
+		self.previous = None
+		self.next = None
+
+	def cancel(self):
+		"""Stops the timer from firing."""
+		self.cancelled = True
+
+		if self.wheel is not None:
+			self.wheel.remove(self)
+
+class Slot(object):
+	"""A list of timers due in the same slot, linked through the timers."""
+	__slots__ = ("level", "index", "previous", "next")
+
+	def __init__(self, level, index):
+		"""Constructor. Empty, so linked to itself."""
+		self.level = level
+		self.index = index
+		self.previous = self
+		self.next = self
+
+# ------------------------------------------------------------------------------
+
+class TimerWheel(object):
+	"""Holds timers in a hierarchy of wheels, see the top of this file."""
+
+	def __init__(self, now, tick=TICK):
+		"""Constructor. now is the time, in seconds, the wheel starts at."""
+		self.tick = tick
+		self.__slots = [[Slot(level, index) for index in range(SLOTS)] for level in range(LEVELS)]
+		self.__lock = threading.Lock()
+
+		# The next tick to run, and how many timers are waiting.
+		self.__next_tick = int(now / tick)
+		self.__count = 0
+
+		# For each wheel, bit i set while slot i has timers.
+		self.__occupied = [0] * LEVELS
+
+	def __len__(self):
+		"""Returns how many timers are waiting."""
+		return self.__count
+
+	def schedule(self, when, function, args=()):
+		"""Runs function(*args), from advance(), once the time is when.
+		Returns the Timer."""
+		timer = Timer(when, function, args, self)
+		timer.tick = -int(-when // self.tick)
+
+		with self.__lock:
+			self.insert(timer)
+			self.__count += 1
+
+		return timer
+
+	def insert(self, timer):
+		"""Links a timer into the slot for it's tick. Call with the lock."""
+		tick = timer.tick
+		delta = tick - self.__next_tick
+
+		# Overdue go in the next slot to run, too far off wait at the top.
+		if delta < 0:
+			tick = self.__next_tick
+			delta = 0
+		elif delta >= SPAN:
+			tick = self.__next_tick + SPAN - 1
+			delta = SPAN - 1
+
+		# The lowest wheel that reaches that far.
+		level = ((delta | 1).bit_length() - 1) // SLOT_BITS
+
+		index = (tick >> (SLOT_BITS * level)) & SLOT_MASK
+		slot = self.__slots[level][index]
+
+		timer.slot = slot
+		timer.previous = slot.previous
+		timer.next = slot
+		slot.previous.next = timer
+		slot.previous = timer
+
+		self.__occupied[level] |= 1 << index
+
+	def remove(self, timer):
+		"""Unlinks a timer, if it's still waiting."""
+		with self.__lock:
+			if timer.next is None:
+				return
+
+			timer.previous.next = timer.next
+			timer.next.previous = timer.previous
+
+			slot = timer.slot
+			if slot.next is slot:
+				self.__occupied[slot.level] &= ~(1 << slot.index)
+
+			timer.slot = None
+			timer.previous = None
+			timer.next = None
+			self.__count -= 1
+
+	def advance(self, now):
+		"""Moves the wheel on to now. Returns the timers that are due, in
+		the order they're due, for the caller to run outside the lock."""
+		due = []
+		last_tick = int(now / self.tick)
+
+		with self.__lock:
+			while self.__next_tick <= last_tick:
+
+				# Nothing waiting, skip straight to now.
+				if not self.__count:
+					self.__next_tick = last_tick + 1
+					break
+
+				tick = self.__next_tick
+				index = tick & SLOT_MASK
+
+				# Round again, bring the next slots of the wheels above down.
+				if not index:
+					level = 1
+					while level < LEVELS and not self.cascade(level, (tick >> (SLOT_BITS * level)) & SLOT_MASK):
+						level += 1
+
+				# Nothing in this slot, on to the next with timers in or a
+				# cascade with any.
+				if not self.__occupied[0] >> index & 1:
+					self.__next_tick = min(self.skip(tick + 1), last_tick + 1)
+					continue
+
+				self.__next_tick = tick + 1
+				self.__occupied[0] &= ~(1 << index)
+
+				slot = self.__slots[0][index]
+				timer = slot.next
+				while timer is not slot:
+					following = timer.next
+					timer.slot = None
+					timer.previous = None
+					timer.next = None
+					due.append(timer)
+					timer = following
+
+				slot.previous = slot
+				slot.next = slot
+
+			self.__count -= len(due)
+
+		return due
+
+	def cascade(self, level, index):
+		"""Moves the timers in a slot of a higher wheel down to where they
+		belong now. Returns index, which is 0 when the wheel above is due
+		to cascade too. Call with the lock."""
+		slot = self.__slots[level][index]
+
+		timer = slot.next
+		slot.previous = slot
+		slot.next = slot
+		self.__occupied[level] &= ~(1 << index)
+
+		while timer is not slot:
+			following = timer.next
+			self.insert(timer)
+			timer = following
+
+		return index
+
+	def skip(self, tick):
+		"""Returns the first tick from tick, which hasn't run yet, where the
+		first wheel has timers or a wheel above has any to cascade, so long
+		empty stretches are crossed at once. Call with the lock."""
+		first = None
+
+		for level in range(LEVELS):
+			shift = SLOT_BITS * level
+			index = (tick >> shift) & SLOT_MASK
+
+			occupied = self.__occupied[level]
+			waiting = occupied >> index
+			if waiting:
+				found = ((tick >> shift) + (waiting & -waiting).bit_length() - 1) << shift
+				if first is None or found < first:
+					first = found
+
+			# At the start of a round the wheel above comes round too, so
+			# carry on up. Otherwise the wheels above wait for the next
+			# round, and so do the slots behind index.
+			if index:
+				tick = ((tick >> (shift + SLOT_BITS)) + 1) << (shift + SLOT_BITS)
+				if occupied & ((1 << index) - 1):
+					found = tick + (((occupied & -occupied).bit_length() - 1) << shift)
+					if first is None or found < first:
+						first = found
+
+				if first is not None and first <= tick:
+					break
+
+		if first is None:
+			return tick
+		return first
+
+	def nextDelay(self, now):
+		"""Returns the seconds until advance() should next be called, None
+		if nothing is waiting. That's the next timer on the first wheel, or
+		the next cascade with anything in it if that's empty for the rest of
+		the way round."""
+		with self.__lock:
+			if not self.__count:
+				return None
+
+			tick = self.skip(self.__next_tick)
+
+		return max(0, tick * self.tick - now)
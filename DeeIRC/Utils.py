@@ -2,6 +2,8 @@
 # Utils.py
 # --------------------------------------------------------------------------
 
+import string
+
 # Returns the underline control code.
 def underlineCode():
 	return '\x1F'
@@ -57,11 +59,24 @@ def stripCodes(message):
 
 # ------------------------------------------------------------------------------
 
-# Strips all user status symbols from a nickname
+# Strips all user status symbols from the front of a nickname
 def stripNickStatus(nick):
-	nick = nick.replace("+", "")
-	nick = nick.replace("@", "")
-	nick = nick.replace("%", "")
-	nick = nick.replace("~", "")
-	
-	return nick
\ No newline at end of file
+	return nick.lstrip("~&@%+")
+
+# Returns true if the target is a channel rather than a nickname.
+def isChannel(target):
+	return len(target) > 0 and target[0] in "#&+!"
+
+# ------------------------------------------------------------------------------
+
+# Case folding tables, named as servers advertise them in CASEMAPPING.
+# rfc1459 treats []\~ as the upper case of {}|^.
+CASEMAPPINGS = {
+	"ascii":string.maketrans(string.ascii_uppercase, string.ascii_lowercase),
+	"rfc1459":string.maketrans(string.ascii_uppercase + "[]\\~", string.ascii_lowercase + "{}|^"),
+	"strict-rfc1459":string.maketrans(string.ascii_uppercase + "[]\\", string.ascii_lowercase + "{}|"),
+}
+
+# Returns a nick or channel name folded to lower case, for comparisons.
+def lowerNick(name, casemapping="rfc1459"):
+	return name.translate(CASEMAPPINGS[casemapping])
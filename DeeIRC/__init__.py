@@ -3,5 +3,14 @@
 # --------------------------------------------------------------------------
 
 import IRC
+import Reactor
+import SendQueue
+import Metrics
+import Coalesce
+import Capture
+import Parser
+import Membership
+import EventBus
+import Executor
 import Events
 import Utils
\ No newline at end of file
@@ -3,9 +3,9 @@
 # --------------------------------------------------------------------------
 
 import DeeIRC.Events as Events
+import DeeIRC.Utils as Utils
 
 import os
-import time
 
 # Connect Event Class
 # --------------------------------------------------------------------------
@@ -19,10 +19,13 @@ class ConnectedEvent(Events.ConnectedEvent):
 		if ident_pw:
 			# Auth with nickserv on connect.
 			bot.sendRaw("PRIVMSG NickServ :identify " + ident_pw)
-			time.sleep(3)
-		
-		# Joins the configured channels on connect.
-		bot.sendJoin(bot.config["channel"])
+			
+			# Give NickServ a few seconds before joining, without holding up
+			# the dispatch thread.
+			bot.callLater(3, bot.sendJoin, bot.config["channel"])
+		else:
+			# Joins the configured channels on connect.
+			bot.sendJoin(bot.config["channel"])
 
 # Message Event Class
 # --------------------------------------------------------------------------
@@ -31,22 +34,38 @@ class MessageEvent(Events.MessageEvent):
 	
 	# When this event is fired.
 	def fire(self, bot, nick, target, message):
-	
-		# Get the command from the message.
-		trigger_end = message.find(" ")
-		
-		if not trigger_end >= 0:
-		
-			# No parameters.
-			trigger_end = len(message)
 		
-		trigger = message[0:trigger_end].lower()
+		# Look the command up. Most lines are chatter and stop here.
+		command = bot.command_index.find(message)
 		
 		# If the command exists, run the function.
-		plugin_name = bot.findPluginFromTrigger(trigger)
-		if plugin_name:
-			plugin = bot.getPlugin(plugin_name)
-			plugin.runCommand(bot, trigger, nick, target, message[trigger_end+1:])
+		if command:
+			plugin, trigger, parameters = command
+			
+			# Commands that hand straight over to an actor, e.g. a game
+			# table's, needn't wait for the executor too.
+			if plugin.isDirect(trigger):
+				plugin.runCommand(bot, trigger, nick, target, parameters)
+			
+			# Others run on the worker pool, in order per channel. Private
+			# messages are ordered per nick instead.
+			else:
+				if Utils.isChannel(target):
+					key = bot.members.key(target)
+				else:
+					key = bot.members.key(nick)
+				
+				if not bot.command_executor.submit(key, self.runCommand, bot, plugin, trigger, nick, target, parameters):
+					bot.error("Too busy, dropped command(" + plugin.name + ":" + trigger + ") for " + key + " from " + nick)
+					bot.sendNotice(nick, "Sorry, too busy to run that, try again in a moment.")
+					return
 			
 			if bot.debug:
-				bot.log("Command(" + plugin_name + ":" + trigger + "): (" + nick + ", " + target + ", " + message +")")
+				bot.log("Command(" + plugin.name + ":" + trigger + "): (" + nick + ", " + target + ", " + message +")")
+	
+	# Runs a command on a worker thread.
+	def runCommand(self, bot, plugin, trigger, nick, target, parameters):
+		
+		# Merge whatever the command announces into as few lines as we can.
+		with bot.batch():
+			plugin.runCommand(bot, trigger, nick, target, parameters)
@@ -0,0 +1,216 @@
+# AI.py
+# --------------------------------------------------------------------------
+
+# Computer players. A move is picked by determinized Monte Carlo search: for
+# each rollout the cards the AI can't see are dealt out at random (see
+# Engine.Game.determinize), each candidate move is tried in turn and the
+# game is played out to the end with a quick policy, and the candidate that
+# won most often is played.
+#
+# Searches never run on a table's actor or the reactor. They go to a pool
+# of their own, one Actor per table, so a table's searches run in order and
+# tables take turns. Each table also has a SearchBudget, so a table full of
+# AIs gets a share of a core rather than all of it, and past that plays the
+# quick policy instead of searching.
+#
+# A table can seed each search, so the same game asks the same questions of
+# the same random numbers and, given time for every rollout, gets the same
+# moves when it's replayed.
+#
+# ------ Difficulties
+#	easy - no search, a random legal card, coloured before wild.
+#	normal - up to 0.1 seconds or 300 rollouts a move.
+#	hard - up to 0.5 seconds or 3000 rollouts a move.
+
+import random
+import threading
+import time
+import DeeIRC.Actor as Actor
+import DeeIRC.Metrics as Metrics
+import Cards
+
+# ------- Constants ------------------------------------------------------------
+
+# name:(seconds, rollouts) per move.
+DIFFICULTIES = {
+	"easy":(0, 0),
+	"normal":(0.1, 300),
+	"hard":(0.5, 3000),
+}
+DEFAULT_DIFFICULTY = "normal"
+
+# Rollouts longer than this are scored as a draw.
+ROLLOUT_TURNS = 150
+
+# Threads searching for every table together.
+SEARCH_THREADS = 1
+
+# Seconds of search a table may use per second, on average, and how many it
+# can save up.
+TABLE_SHARE = 0.25
+TABLE_BURST = 1.0
+
+# ------------------------------------------------------------------------------
+
+class SearchBudget(object):
+	"""A token bucket of search seconds, filling at share per second."""
+
+	def __init__(self, share=TABLE_SHARE, burst=TABLE_BURST):
+		"""Constructor. Starts full."""
+		self.share = share
+		self.burst = burst
+		self.available = burst
+		self.updated = time.time()
+
+	def allow(self, seconds):
+		"""Returns how many of the seconds wanted can be spent now."""
+		now = time.time()
+		self.available = min(self.burst, self.available + (now - self.updated) * self.share)
+		self.updated = now
+		return max(0, min(seconds, self.available))
+
+	def charge(self, seconds):
+		"""Takes seconds spent out of the bucket."""
+		self.available -= seconds
+
+# ------------------------------------------------------------------------------
+
+def chooseColor(hand):
+	"""The colour to call for a wild, whichever the hand holds most of."""
+	counts = [hand.colorCount(color) for color in range(len(Cards.COLORS))]
+	return counts.index(max(counts))
+
+def candidateMoves(game, player_index):
+	"""Returns the (card, color) moves a player can make now, one per card
+	they could play. Wilds call the colour held most."""
+	moves = []
+	for card in Cards.maskCards(game.playable(player_index)):
+		color = None
+		if Cards.isWild(card):
+			color = chooseColor(game.hands[player_index])
+		moves.append((card, color))
+	return moves
+
+def quickMove(game, player_index, rng):
+	"""The rollout policy: a random legal coloured card, a wild only if
+	there's nothing else. Returns (card, color), or None."""
+	playable = game.playable(player_index)
+	if not playable:
+		return None
+
+	colored = playable & ~Cards.WILD_CARDS
+	card = rng.choice(Cards.maskCards(colored or playable))
+
+	color = None
+	if Cards.isWild(card):
+		color = chooseColor(game.hands[player_index])
+	return card, color
+
+def rollout(game, player_index, rng):
+	"""Plays a game out with quickMove() for everyone. Returns 1 if
+	player_index wins, 0 if someone else does, 0.5 if it runs too long."""
+	for turn in range(ROLLOUT_TURNS):
+		current = game.turn_index
+		move = quickMove(game, current, rng)
+
+		# Draw, and play it if it can be played.
+		if move is None:
+			game.draw(current)
+			move = quickMove(game, current, rng)
+
+		if move is not None:
+			game.play(current, move[0], move[1])
+			if game.hasWon(current):
+				return current == player_index and 1 or 0
+
+		game.nextTurn()
+
+	return 0.5
+
+def search(game, player_index, rng, seconds, rollouts):
+	"""Picks a move by determinized rollouts, within seconds and rollouts.
+	Returns ((card, color) or None to draw, rollouts run)."""
+	moves = candidateMoves(game, player_index)
+	if not moves:
+		return None, 0
+	if len(moves) == 1 or seconds <= 0 or rollouts <= 0:
+		return quickMove(game, player_index, rng), 0
+
+	scores = [0.0] * len(moves)
+	played = [0] * len(moves)
+	deadline = time.time() + seconds
+	run = 0
+
+	# Round robin over the moves, so each gets the same number of tries.
+	while run < rollouts and time.time() < deadline:
+		index = run % len(moves)
+		card, color = moves[index]
+
+		world = game.determinize(player_index, rng)
+		world.play(player_index, card, color)
+
+		if world.hasWon(player_index):
+			score = 1
+		else:
+			world.nextTurn()
+			score = rollout(world, player_index, rng)
+
+		scores[index] += score
+		played[index] += 1
+		run += 1
+
+	best = max(range(len(moves)), key=lambda index: scores[index] / max(played[index], 1))
+	return moves[best], run
+
+# ------------------------------------------------------------------------------
+
+class Searcher(object):
+	"""Runs one table's searches on the search pool, within it's budget."""
+
+	def __init__(self, rng, budget=None):
+		"""Constructor."""
+		self.random = rng
+		self.budget = budget or SearchBudget()
+		self.actor = Actor.Actor(getSearchPool())
+
+		registry = Metrics.getRegistry()
+		self.__rollouts = registry.counter("uno_ai_rollouts_total", "Rollouts played by computer players.")
+		self.__seconds = registry.histogram("uno_ai_search_seconds", "Time taken to pick a computer player's move.")
+
+	def request(self, game, player_index, difficulty, callback, seed=None):
+		"""Searches a copy of game for player_index's move in the
+		background, then calls callback((card, color) or None). The copy
+		shuffles with a generator of the search's own, never the table's,
+		seeded with seed if it's given."""
+		rng = self.random if seed is None else random.Random(seed)
+		self.actor.send(self.run, game.copy(rng), player_index, difficulty, callback, rng)
+
+	def run(self, game, player_index, difficulty, callback, rng):
+		"""Runs a search on the search pool."""
+		seconds, rollouts = DIFFICULTIES.get(difficulty, DIFFICULTIES[DEFAULT_DIFFICULTY])
+
+		start = time.time()
+		move, run = search(game, player_index, rng, self.budget.allow(seconds), rollouts)
+		elapsed = time.time() - start
+
+		self.budget.charge(elapsed)
+		self.__rollouts.inc(run)
+		self.__seconds.observe(elapsed)
+
+		callback(move)
+
+# ------------------------------------------------------------------------------
+
+# Shared by every table's searcher.
+__pool_instance = None
+__pool_lock = threading.Lock()
+
+def getSearchPool():
+	"""Returns the pool searches run on, creating it if needed."""
+	global __pool_instance
+
+	with __pool_lock:
+		if not __pool_instance:
+			__pool_instance = Actor.ActorPool(SEARCH_THREADS)
+
+	return __pool_instance
@@ -0,0 +1,648 @@
+# Archive.py
+# --------------------------------------------------------------------------
+
+# Every finished game, kept for good: it's seed, every move made and the
+# hands everyone was left holding. Games are dealt from their seed (see
+# Engine.GameRandom), so the seed and the moves are enough to play any of
+# them through again, see replayGame().
+#
+# The archive is a directory of columns, a file each. A fixed width column
+# holds one value per game, or per seat at a game; the variable length
+# parts, moves and hands, are byte files that a column points into. Nothing
+# is read into memory but the names; columns are memory-mapped and read a
+# value at a time, so looking up a game, or every game a nick played, reads
+# only the few pages it needs however many millions of games there are.
+#
+# Each player's seats are chained together, newest first, through the
+# seats' "previous" column, and the names' "heads" point at the newest, so
+# a nick's games are found without reading anyone else's. Nicks are looked
+# up folded with the server's casemapping, see setCasemapping(); a name is
+# stored once, the way it was first seen.
+#
+# Games are queued and a writer thread of the archive's own (see Writer.py)
+# appends them in batches. The counts in "meta" are only updated once a
+# batch has reached the disk, and anything past them is dropped when the
+# archive is opened, so a crash part way through a batch loses the batch and
+# nothing else. A batch that fails to write is cut off the columns the same
+# way, and the writer carries on with the next.
+#
+# ------ Files
+#	meta - "DEEARC01", then how much of each column is committed.
+#	games.seed, games.finished, games.channel, games.winner - per game.
+#	games.seats - per game, the first row of it's seats.
+#	games.moves - per game, where it's moves start in moves.
+#	seats.name, seats.ai, seats.played - per seat, player's name id, the AI
+#		difficulty's name id (NONE for people) and cards played.
+#	seats.game, seats.previous - per seat, the game, and the seat before
+#		it with the same name.
+#	seats.hand - per seat, where it's final hand starts in hands.
+#	moves, hands - moves as records (see MOVE_SIZES) and hands as card ids.
+#	names, names.start - nicks, channels and difficulties, each once.
+#	names.heads - the seats it covers, then per name it's newest seat and
+#		how many it has.
+#
+# ------ Usage
+#	python2 -m Plugin.Uno.Archive <directory> show|export|replay <game id>
+#	python2 -m Plugin.Uno.Archive <directory> player <nick>
+
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import DeeIRC.Metrics as Metrics
+import DeeIRC.Utils as Utils
+import Cards
+import Engine
+import Journal
+import Writer
+
+# ------- Constants ------------------------------------------------------------
+
+MAGIC = "DEEARC01"
+META = struct.Struct("<8sIIQQIQ")
+HEADS = struct.Struct("<Q")
+HEAD = struct.Struct("<II")
+
+# No seat, or a person rather than an AI.
+NONE = 0xFFFFFFFF
+
+# Moves are journal records without the channel: the kind, then a payload
+# of this many bytes. A join's player is the next seat, so it has none.
+MOVE_SIZES = {
+	Journal.JOIN:0,
+	Journal.START:0,
+	Journal.TURN:0,
+	Journal.PLAY:Journal.PLAY_FIELDS.size,
+	Journal.DRAW:Journal.PLAYER_FIELDS.size,
+	Journal.CANPASS:Journal.FLAG_FIELDS.size,
+	Journal.AUTO:Journal.PLAYER_FIELDS.size,
+}
+
+# Seconds the writer waits for more games before writing a batch.
+BATCH_INTERVAL = 0.1
+
+# ------------------------------------------------------------------------------
+
+def encodeMove(kind, payload):
+	"""Returns a journal record's kind and payload as a move."""
+	return kind + payload[:MOVE_SIZES[kind]]
+
+def decodeMoves(moves):
+	"""Yields (kind, payload) for every move in a game's moves."""
+	offset = 0
+	while offset < len(moves):
+		kind = moves[offset]
+		size = MOVE_SIZES[kind]
+		yield kind, moves[offset+1:offset+1+size]
+		offset += 1 + size
+
+# ------------------------------------------------------------------------------
+
+class Column(object):
+	"""One column file: fixed width values of a struct code, or bytes if
+	the code is None. Appends go to the file, reads to a memory map of
+	what's committed."""
+
+	def __init__(self, path, code, count):
+		"""Constructor. Drops anything past the count committed."""
+		self.code = code
+		self.width = code and struct.calcsize("<" + code) or 1
+
+		self.file = open(path, "a+b")
+		self.file.truncate(count * self.width)
+
+		# Committed, and appended since.
+		self.count = count
+		self.written = count
+
+		self.__map = None
+		self.__lock = threading.Lock()
+
+	def append(self, values):
+		"""Appends a list of values, or bytes."""
+		if self.code:
+			self.file.write(struct.pack("<%d%s" % (len(values), self.code), *values))
+		else:
+			self.file.write(values)
+		self.written += len(values)
+
+	def sync(self):
+		"""Waits for what's appended to reach the disk."""
+		self.file.flush()
+		os.fsync(self.file.fileno())
+
+	def view(self):
+		"""Returns a map of at least everything committed, mapping again if
+		the column has grown since."""
+		view = self.__map
+		size = self.count * self.width
+
+		if view is None or len(view) < size:
+			with self.__lock:
+				view = self.__map
+				if view is None or len(view) < size:
+					view = self.__map = mmap.mmap(self.file.fileno(), size, access=mmap.ACCESS_READ)
+
+		return view
+
+	def get(self, index):
+		"""Returns one committed value."""
+		return struct.unpack_from("<" + self.code, self.view(), index * self.width)[0]
+
+	def read(self, start, end):
+		"""Returns committed bytes."""
+		if start == end:
+			return ""
+		return self.view()[start:end]
+
+	def rollback(self):
+		"""Drops anything appended since the last commit, buffered or
+		not."""
+		try:
+			self.file.close()
+		except IOError:
+			pass
+
+		self.file = open(self.file.name, "a+b")
+		self.file.truncate(self.count * self.width)
+		self.written = self.count
+
+	def close(self):
+		"""Closes the file."""
+		self.__map = None
+		self.file.close()
+
+# ------------------------------------------------------------------------------
+
+class ArchivedGame(object):
+	"""One game read back from the archive."""
+
+	def __init__(self, game_id, channel, finished, seed, winner, players, moves):
+		"""Constructor. players is a list of (nick, ai, cards played, final
+		hand), ai being None for people and the hand a list of card ids."""
+		self.id = game_id
+		self.channel = channel
+		self.finished = finished
+		self.seed = seed
+		self.winner = winner
+		self.players = players
+		self.moves = moves
+
+class GameArchive(object):
+	"""Finished games, in columns on disk, see the top of this file."""
+
+	def __init__(self, path, interval=BATCH_INTERVAL, casemapping="rfc1459"):
+		"""Constructor. Opens or creates the archive directory and loads the
+		names, nothing else."""
+		self.path = path
+		self.casemapping = casemapping
+
+		if not os.path.isdir(path):
+			os.makedirs(path)
+
+		counts = (0, 0, 0, 0, 0, 0)
+		if os.path.exists(self.filePath("meta")):
+			with open(self.filePath("meta"), "rb") as meta:
+				fields = META.unpack(meta.read(META.size))
+			if fields[0] != MAGIC:
+				raise ValueError(path + " is not a game archive.")
+			counts = fields[1:]
+
+		games, seats, moves, hands, names, name_bytes = counts
+
+		self.__game_columns = dict([(name, Column(self.filePath("games." + name), code, games)) for name, code in
+			(("seed", "Q"), ("finished", "d"), ("channel", "I"), ("winner", "B"), ("seats", "I"), ("moves", "Q"))])
+		self.__seat_columns = dict([(name, Column(self.filePath("seats." + name), code, seats)) for name, code in
+			(("name", "I"), ("ai", "I"), ("played", "H"), ("game", "I"), ("previous", "I"), ("hand", "Q"))])
+		self.__moves = Column(self.filePath("moves"), None, moves)
+		self.__hands = Column(self.filePath("hands"), None, hands)
+		self.__names = Column(self.filePath("names"), None, name_bytes)
+		self.__name_starts = Column(self.filePath("names.start"), "Q", names)
+
+		self.__lock = threading.Lock()
+		self.loadNames(names, seats)
+
+		# Names whose heads failed to be written, to try again.
+		self.__stale_heads = set()
+
+		registry = Metrics.getRegistry()
+		self.__games = registry.counter("uno_archive_games_total", "Finished games written to the game archive.")
+		self.__write_seconds = registry.histogram("uno_archive_write_seconds", "Time taken to write a batch of games to the game archive.")
+
+		errors = registry.counter("uno_archive_write_errors_total", "Batches of games that failed to be written to the game archive.")
+		self.__writer = Writer.BatchWriter("Uno-archive", self.writeGames, interval, errors)
+		registry.gauge("uno_archive_pending", "Games waiting to be written to the game archive.").setFunction(self.__writer.pending)
+
+	def filePath(self, name):
+		"""Returns the path of one of the archive's files."""
+		return os.path.join(self.path, name)
+
+	def loadNames(self, names, seats):
+		"""Reads the names and their heads. Heads are written after the
+		meta, so any seats committed since they were last written are
+		chained on now."""
+		data = self.__names.read(0, self.__names.count)
+		starts = [self.__name_starts.get(index) for index in range(names)] + [len(data)]
+
+		# name_key:name_id, and name_id:name.
+		self.__name_list = [data[starts[index]:starts[index+1]] for index in range(names)]
+		self.__name_ids = self.nameIds(self.__name_list, self.casemapping)
+
+		# Seats the heads cover, then newest seat and seat count per name id.
+		self.__heads = open(self.filePath("names.heads"), "a+b")
+		self.__heads.seek(0)
+		data = self.__heads.read(HEADS.size + names * HEAD.size)
+		self.__heads.close()
+
+		covered = 0
+		if len(data) >= HEADS.size:
+			covered = HEADS.unpack_from(data)[0]
+		heads = [HEAD.unpack_from(data, HEADS.size + index * HEAD.size) for index in range(min(names, (len(data) - HEADS.size) // HEAD.size))]
+		heads += [(NONE, 0)] * (names - len(heads))
+
+		self.__last_seats = [last for last, count in heads]
+		self.__seat_counts = [count for last, count in heads]
+
+		# A name whose head is already past a seat had it's heads written.
+		names_column = self.__seat_columns["name"]
+		for seat in range(min(covered, seats), seats):
+			name_id = names_column.get(seat)
+			if self.__last_seats[name_id] == NONE or self.__last_seats[name_id] < seat:
+				self.__last_seats[name_id] = seat
+				self.__seat_counts[name_id] += 1
+
+		# Written in place from here on.
+		self.__heads = open(self.filePath("names.heads"), "r+b")
+		self.__heads.truncate(HEADS.size + names * HEAD.size)
+		self.writeHeads(range(names), seats)
+
+	def nameIds(self, names, casemapping):
+		"""Returns {name_key:name_id} for a list of names. Names that fold
+		together go to the first of them."""
+		name_ids = {}
+		for index, name in enumerate(names):
+			name_ids.setdefault(Utils.lowerNick(name, casemapping), index)
+		return name_ids
+
+	def setCasemapping(self, casemapping):
+		"""Looks nicks up folded with another casemapping, as advertised by
+		the server's 005."""
+		if not casemapping in Utils.CASEMAPPINGS:
+			return
+
+		with self.__lock:
+			if casemapping != self.casemapping:
+				self.casemapping = casemapping
+				self.__name_ids = self.nameIds(self.__name_list, casemapping)
+
+	def __len__(self):
+		"""Returns how many games are archived."""
+		return self.__game_columns["seed"].count
+
+	# ------ Recording
+
+	def recordGame(self, channel, seed, players, winner, moves):
+		"""Queues a finished game for the archive. players is a list of
+		(nick, ai or None, cards played, final hand), winner the index of
+		the player who won and moves the game's moves as bytes."""
+		self.__writer.put((channel, seed, time.time(), list(players), winner, moves))
+
+	def writeGames(self, games):
+		"""Appends games to every column, waits for them to reach the disk,
+		then commits them. Runs on the writer's thread."""
+		start = time.time()
+
+		game_columns = self.__game_columns
+		seat_columns = self.__seat_columns
+		game_id = game_columns["seed"].written
+		seat = seat_columns["name"].written
+		moves_offset = self.__moves.written
+		hands_offset = self.__hands.written
+
+		# Names are only visible to readers once committed.
+		new_names = []
+		name_ids = {}
+		last_seats = {}
+		seat_counts = {}
+		casemapping = self.casemapping
+		known_ids = self.__name_ids
+
+		def nameId(name):
+			key = Utils.lowerNick(name, casemapping)
+			name_id = known_ids.get(key, name_ids.get(key))
+			if name_id is None:
+				name_id = name_ids[key] = len(self.__name_list) + len(new_names)
+				new_names.append(name)
+			return name_id
+
+		rows = dict([(name, []) for name in game_columns.keys() + seat_columns.keys()])
+		moves = []
+		hands = []
+
+		for channel, seed, finished, players, winner, game_moves in games:
+			rows["seed"].append(seed)
+			rows["finished"].append(finished)
+			rows["channel"].append(nameId(channel))
+			rows["winner"].append(winner)
+			rows["seats"].append(seat)
+			rows["moves"].append(moves_offset)
+
+			moves.append(game_moves)
+			moves_offset += len(game_moves)
+
+			for nick, ai, played, hand in players:
+				name_id = nameId(nick)
+
+				rows["name"].append(name_id)
+				rows["ai"].append(NONE if ai is None else nameId(ai))
+				rows["played"].append(played)
+				rows["game"].append(game_id)
+				rows["hand"].append(hands_offset)
+
+				# Chained onto this name's newest seat.
+				if not name_id in last_seats:
+					last_seats[name_id] = self.__last_seats[name_id] if name_id < len(self.__last_seats) else NONE
+					seat_counts[name_id] = self.__seat_counts[name_id] if name_id < len(self.__seat_counts) else 0
+				rows["previous"].append(last_seats[name_id])
+				last_seats[name_id] = seat
+				seat_counts[name_id] += 1
+
+				hand = "".join([chr(card) for card in hand])
+				hands.append(hand)
+				hands_offset += len(hand)
+				seat += 1
+
+			game_id += 1
+
+		name_starts = []
+		name_offset = self.__names.written
+		for name in new_names:
+			name_starts.append(name_offset)
+			name_offset += len(name)
+
+		columns = game_columns.values() + seat_columns.values() + [self.__moves, self.__hands, self.__names, self.__name_starts]
+
+		try:
+			for name, column in game_columns.items() + seat_columns.items():
+				column.append(rows[name])
+			self.__moves.append("".join(moves))
+			self.__hands.append("".join(hands))
+			self.__names.append("".join(new_names))
+			self.__name_starts.append(name_starts)
+
+			for column in columns:
+				column.sync()
+
+			self.writeMeta(game_id, seat, moves_offset, hands_offset, len(self.__name_list) + len(new_names), name_offset)
+		except Exception:
+
+			# Not committed, so none of it happened.
+			for column in columns:
+				column.rollback()
+			raise
+
+		# Committed, readers can see it now.
+		with self.__lock:
+			for column in columns:
+				column.count = column.written
+			self.__last_seats.extend([NONE] * len(new_names))
+			self.__seat_counts.extend([0] * len(new_names))
+			for name_id in last_seats:
+				self.__last_seats[name_id] = last_seats[name_id]
+				self.__seat_counts[name_id] = seat_counts[name_id]
+			self.__name_list.extend(new_names)
+
+			# Folded another way while we wrote, fold them all again.
+			if casemapping != self.casemapping:
+				self.__name_ids = self.nameIds(self.__name_list, self.casemapping)
+			else:
+				self.__name_ids.update(name_ids)
+
+		# Heads can fall behind the meta, see loadNames().
+		stale = self.__stale_heads | set(last_seats.keys())
+		try:
+			self.writeHeads(sorted(stale), seat)
+		except Exception:
+			self.__stale_heads = stale
+			raise
+		self.__stale_heads = set()
+
+		self.__games.inc(len(games))
+		self.__write_seconds.observe(time.time() - start)
+
+	def writeHeads(self, name_ids, covered):
+		"""Writes some names' heads in place, then how many seats the heads
+		now cover."""
+		for name_id in name_ids:
+			self.__heads.seek(HEADS.size + name_id * HEAD.size)
+			self.__heads.write(HEAD.pack(self.__last_seats[name_id], self.__seat_counts[name_id]))
+
+		self.__heads.flush()
+		os.fsync(self.__heads.fileno())
+
+		self.__heads.seek(0)
+		self.__heads.write(HEADS.pack(covered))
+		self.__heads.flush()
+		os.fsync(self.__heads.fileno())
+
+	def writeMeta(self, games, seats, moves, hands, names, name_bytes):
+		"""Replaces the counts, committing everything up to them."""
+		with open(self.filePath("meta.tmp"), "wb") as meta:
+			meta.write(META.pack(MAGIC, games, seats, moves, hands, names, name_bytes))
+			meta.flush()
+			os.fsync(meta.fileno())
+
+		os.rename(self.filePath("meta.tmp"), self.filePath("meta"))
+
+	def flush(self):
+		"""Waits until every game recorded so far is written."""
+		self.__writer.flush()
+
+	def close(self):
+		"""Writes anything queued and closes the files."""
+		self.__writer.close()
+
+		for column in self.__game_columns.values() + self.__seat_columns.values() + [self.__moves, self.__hands, self.__names, self.__name_starts]:
+			column.close()
+		self.__heads.close()
+
+	# ------ Reading
+
+	def getGame(self, game_id):
+		"""Returns an ArchivedGame, reading only that game."""
+		games = self.__game_columns
+		seats = self.__seat_columns
+
+		# Where the committed columns end, as of one batch.
+		with self.__lock:
+			count = len(self)
+			seat_count = seats["name"].count
+			moves_count = self.__moves.count
+			hands_count = self.__hands.count
+
+		if game_id < 0 or game_id >= count:
+			raise IndexError("No game " + str(game_id) + " in the archive.")
+
+		first = games["seats"].get(game_id)
+		if game_id + 1 < count:
+			end = games["seats"].get(game_id + 1)
+			moves_end = games["moves"].get(game_id + 1)
+		else:
+			end = seat_count
+			moves_end = moves_count
+
+		players = []
+		for seat in range(first, end):
+			if seat + 1 < seat_count:
+				hand_end = seats["hand"].get(seat + 1)
+			else:
+				hand_end = hands_count
+			ai = seats["ai"].get(seat)
+			hand = [ord(card) for card in self.__hands.read(seats["hand"].get(seat), hand_end)]
+			players.append((self.getName(seats["name"].get(seat)), None if ai == NONE else self.getName(ai), seats["played"].get(seat), hand))
+
+		return ArchivedGame(game_id, self.getName(games["channel"].get(game_id)), games["finished"].get(game_id), games["seed"].get(game_id),
+			games["winner"].get(game_id), players, self.__moves.read(games["moves"].get(game_id), moves_end))
+
+	def getName(self, name_id):
+		"""Returns a nick, channel or difficulty by it's id."""
+		return self.__name_list[name_id]
+
+	def countPlayerGames(self, nick):
+		"""Returns how many archived games a nick played in."""
+		name_id = self.__name_ids.get(Utils.lowerNick(nick, self.casemapping))
+		if name_id is None:
+			return 0
+		return self.__seat_counts[name_id]
+
+	def playerGames(self, nick):
+		"""Yields the id of every archived game a nick played in, newest
+		first, reading only their seats."""
+		name_id = self.__name_ids.get(Utils.lowerNick(nick, self.casemapping))
+		if name_id is None:
+			return
+
+		seats = self.__seat_columns
+		seat = self.__last_seats[name_id]
+
+		while seat != NONE:
+			yield seats["game"].get(seat)
+			seat = seats["previous"].get(seat)
+
+# ------------------------------------------------------------------------------
+
+def replayGame(archived):
+	"""Plays an archived game through again from it's seed. Yields (kind,
+	payload, game) after each move, the game being the Engine.Game as it
+	was then."""
+	game = Engine.Game(Engine.GameRandom(archived.seed))
+
+	for kind, payload in decodeMoves(archived.moves):
+		if kind == Journal.JOIN:
+			game.addPlayer()
+
+		elif kind == Journal.START:
+			game.start()
+
+		elif kind == Journal.TURN:
+			game.nextTurn()
+
+		elif kind == Journal.PLAY:
+			player_index, card, color = Journal.PLAY_FIELDS.unpack(payload)
+			game.play(player_index, card, None if color == Cards.NO_COLOR else color)
+
+		elif kind == Journal.DRAW:
+			player_index, amount = Journal.PLAYER_FIELDS.unpack(payload)
+			game.draw(player_index, amount)
+
+		elif kind == Journal.CANPASS:
+			game.canpass = bool(Journal.FLAG_FIELDS.unpack(payload)[0])
+
+		yield kind, payload, game
+
+def exportGame(archived):
+	"""Returns an archived game as plain values, for JSON, with card and
+	move names rather than ids."""
+	nicks = [nick for nick, ai, played, hand in archived.players]
+	moves = []
+	joined = 0
+
+	for kind, payload in decodeMoves(archived.moves):
+		if kind == Journal.PLAY:
+			player_index, card, color = Journal.PLAY_FIELDS.unpack(payload)
+			move = {"move":"play", "player":nicks[player_index], "card":Cards.toString(card)}
+			if color != Cards.NO_COLOR:
+				move["color"] = Cards.COLORS[color]
+		elif kind == Journal.DRAW:
+			player_index, amount = Journal.PLAYER_FIELDS.unpack(payload)
+			move = {"move":"draw", "player":nicks[player_index], "cards":amount}
+		elif kind == Journal.CANPASS:
+			move = {"move":"canpass", "canpass":bool(Journal.FLAG_FIELDS.unpack(payload)[0])}
+		elif kind == Journal.AUTO:
+			player_index, auto = Journal.PLAYER_FIELDS.unpack(payload)
+			move = {"move":"auto", "player":nicks[player_index], "auto":bool(auto)}
+		elif kind == Journal.JOIN:
+			move = {"move":"join", "player":nicks[joined]}
+			joined += 1
+		else:
+			move = {"move":{Journal.START:"start", Journal.TURN:"turn"}[kind]}
+		moves.append(move)
+
+	return {
+		"id":archived.id,
+		"channel":archived.channel,
+		"finished":archived.finished,
+		"seed":archived.seed,
+		"winner":nicks[archived.winner],
+		"players":[{"nick":nick, "ai":ai, "played":played, "hand":[Cards.toString(card) for card in hand]} for nick, ai, played, hand in archived.players],
+		"moves":moves,
+	}
+
+# ------------------------------------------------------------------------------
+
+def main(arguments):
+	"""Looks at an archive from the command line, see the top of this file."""
+	if len(arguments) != 3 or not arguments[1] in ("show", "export", "replay", "player"):
+		print "Usage: python2 -m Plugin.Uno.Archive <directory> show|export|replay <game id>"
+		print "       python2 -m Plugin.Uno.Archive <directory> player <nick>"
+		return 1
+
+	path, action, argument = arguments
+	archive = GameArchive(path)
+
+	try:
+		if action == "player":
+			for game_id in archive.playerGames(argument):
+				archived = archive.getGame(game_id)
+				print game_id, time.strftime("%Y-%m-%d %H:%M", time.localtime(archived.finished)), archived.channel, "won by", archived.players[archived.winner][0]
+			return 0
+
+		archived = archive.getGame(int(argument))
+
+		if action == "export":
+			print json.dumps(exportGame(archived), indent=1, sort_keys=True)
+
+		elif action == "show":
+			print "Game", archived.id, "in", archived.channel, "at", time.strftime("%Y-%m-%d %H:%M", time.localtime(archived.finished)) + ", seed", archived.seed
+			for index, (nick, ai, played, hand) in enumerate(archived.players):
+				print " ", nick + (ai and " (" + ai + ")" or "") + (index == archived.winner and ", won" or "") + ",", played, "played, left with", " ".join([Cards.toString(card) for card in hand])
+
+		else:
+			for move in replayGame(archived):
+				kind, payload, game = move
+				if kind == Journal.PLAY or kind == Journal.DRAW:
+					print kind, payload.encode("hex"), "hands", [len(hand) for hand in game.hands], "top", Cards.toString(game.last_card)
+
+			# The seed and moves should leave everyone where they were.
+			final = [sorted(hand) for nick, ai, played, hand in archived.players]
+			print "replayed", final == [sorted(hand) for hand in game.hands] and "ok" or "differently"
+	finally:
+		archive.close()
+
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
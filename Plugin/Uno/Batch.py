@@ -0,0 +1,330 @@
+# Batch.py
+# --------------------------------------------------------------------------
+
+# Plays many games of Uno in lockstep with NumPy, for tuning rule variants
+# and strategies offline. The rules are those of Engine.py, but every game's
+# hands, deck pointer, top card and turn live in arrays and each step plays
+# one turn in every game that's still going.
+#
+# The tables below are built from Cards.py, but what each card does is
+# written again here in array form, so crossCheck() deals the same games
+# through Engine.py and plays them both ways to make sure the two agree.
+#
+# Needs NumPy, which the bot itself doesn't; only import this from tools and
+# benchmarks (see Benchmarks/SimBench.py).
+#
+# ------ Arrays, for G games of P players with D standard decks
+#	decks - (G, 108 * D) card ids, each game's shuffled deck, or the decks
+#		given, see engineDecks().
+#	deck_pos, deck_len - (G,) next card to draw from each deck, and where
+#		it ends, which is short of the end after recycling.
+#	piles - (G, 54) count of each card in the discard pile, under the top.
+#	hands - (G, P, 54) count of each card per player.
+#	top, color - (G,) top card, and the colour to match, ANY_COLOR after a
+#		wild dealt face up.
+#	turn, direction - (G,) player to move, and +1 or -1.
+#
+# ------ Strategies
+#	A strategy picks a card for a batch of players at once. It's called as
+#	strategy(sim, games, hands, legal), where games are the game indexes,
+#	hands (n, 54) their counts and legal (n, 54) what they could play, and
+#	returns (n,) card ids, -1 where there's nothing to play.
+
+import random
+import numpy
+
+import Cards
+import Engine
+
+# ------- Constants ------------------------------------------------------------
+
+# Colour index meaning anything can be played.
+ANY_COLOR = len(Cards.COLORS)
+
+DECK = numpy.array(Cards.standardDeck(), dtype=numpy.int8)
+
+CARD_COLORS = numpy.array(Cards.CARD_COLORS, dtype=numpy.int8)
+CARD_FACES = numpy.array(Cards.CARD_FACES, dtype=numpy.int8)
+
+# LEGAL[top, color, card], true where card can go on top in color.
+LEGAL = numpy.ones((Cards.CARD_COUNT, ANY_COLOR + 1, Cards.CARD_COUNT), dtype=bool)
+for top in range(Cards.CARD_COUNT):
+	for color in range(ANY_COLOR):
+		LEGAL[top, color] = [bool(Cards.PLAYABLE[top][color] & bit) for bit in Cards.CARD_BITS]
+
+# How many cards the next player draws, per card.
+DRAWS = numpy.zeros(Cards.CARD_COUNT, dtype=numpy.int8)
+DRAWS[CARD_FACES == Cards.FACE_DRAW_TWO] = 2
+DRAWS[Cards.WILD_DRAW_FOUR] = 4
+
+# Cards that skip the next player.
+SKIPS = (CARD_FACES == Cards.FACE_SKIP) | (DRAWS > 0)
+
+REVERSES = CARD_FACES == Cards.FACE_REVERSE
+
+# ------------------------------------------------------------------------------
+
+def firstLegal(sim, games, hands, legal):
+	"""Plays the lowest numbered card that's legal."""
+	return numpy.where(legal.any(1), legal.argmax(1), -1)
+
+def randomLegal(sim, games, hands, legal):
+	"""Plays any legal card, at random."""
+	scores = sim.random.random_sample(legal.shape) * legal
+	return numpy.where(legal.any(1), scores.argmax(1), -1)
+
+def saveWilds(sim, games, hands, legal):
+	"""Plays a coloured card if it can, keeping wilds for when it can't."""
+	scores = legal * 2 - legal * (CARD_COLORS < 0)
+	return numpy.where(legal.any(1), scores.argmax(1), -1)
+
+def mostHeldColor(hands):
+	"""The colour to call for a wild, whichever the player holds most of."""
+	colored = hands[:, :len(Cards.COLORS) * len(Cards.FACES)]
+	return colored.reshape(len(hands), len(Cards.COLORS), len(Cards.FACES)).sum(2).argmax(1)
+
+def playFirstLegal(game, max_turns):
+	"""Plays a dealt Engine.Game out the way firstLegal plays a batch: the
+	lowest legal card, the most held colour for a wild, and a drawn card
+	straight away if it can be. Returns (winner, turns), winner None if it
+	was abandoned."""
+	for turn in range(1, max_turns + 1):
+		player = game.turn_index
+		playable = game.playable(player)
+
+		if not playable:
+			game.draw(player)
+			playable = game.playable(player)
+
+		if playable:
+			card = Cards.maskCards(playable)[0]
+			hand = game.hands[player]
+			color = None
+			if Cards.isWild(card):
+				counts = [hand.colorCount(color) for color in range(len(Cards.COLORS))]
+				color = counts.index(max(counts))
+
+			game.play(player, card, color)
+			if game.hasWon(player):
+				return player, turn
+
+		game.nextTurn()
+
+	return None, max_turns
+
+# ------------------------------------------------------------------------------
+
+class BatchGame(object):
+	"""G games of P players, dealt and played in lockstep."""
+
+	def __init__(self, games, players, seed=None, hand_size=Engine.HAND_SIZE, play_drawn=True, max_turns=1000, decks=None):
+		"""Constructor. Shuffles and deals every game, or deals from the
+		decks given. With play_drawn a player who draws plays the card
+		straight away if they can, else they pass. Games still going after
+		max_turns are abandoned. Big tables get more decks, as in the
+		engine."""
+		self.games = games
+		self.players = players
+		self.play_drawn = play_drawn
+		self.max_turns = max_turns
+		self.random = numpy.random.RandomState(seed)
+
+		deck = numpy.tile(DECK, 1 + (players - 1) // Engine.PLAYERS_PER_DECK)
+		if decks is None:
+			self.decks = deck[self.random.random_sample((games, len(deck))).argsort(1)]
+		else:
+			self.decks = numpy.array(decks, dtype=numpy.int8)
+			if self.decks.shape != (games, len(deck)):
+				raise ValueError("Decks must be " + str(games) + " by " + str(len(deck)) + " cards.")
+		self.deck_pos = numpy.zeros(games, dtype=numpy.int32)
+		self.deck_len = numpy.repeat(len(deck), games).astype(numpy.int32)
+		self.piles = numpy.zeros((games, Cards.CARD_COUNT), dtype=numpy.int16)
+		self.hands = numpy.zeros((games, players, Cards.CARD_COUNT), dtype=numpy.int16)
+
+		everyone = numpy.arange(games)
+		for player in range(players):
+			self.drawCards(everyone, numpy.repeat(player, games), numpy.repeat(hand_size, games))
+
+		# One card face up.
+		self.top = self.decks[everyone, self.deck_pos].astype(numpy.int32)
+		self.deck_pos += 1
+		self.color = numpy.where(self.top >= Cards.WILD, ANY_COLOR, CARD_COLORS[self.top]).astype(numpy.int32)
+
+		self.turn = numpy.zeros(games, dtype=numpy.int32)
+		self.direction = numpy.ones(games, dtype=numpy.int32)
+		self.turns = numpy.zeros(games, dtype=numpy.int32)
+		self.winner = numpy.repeat(-1, games)
+		self.done = numpy.zeros(games, dtype=bool)
+
+	def drawCards(self, games, players, amounts):
+		"""Draws amounts[i] cards into each players[i] hand in games[i]. The
+		games must be distinct. An empty deck is refilled from the pile, and
+		draws nothing if the pile is empty too."""
+		for i in range(int(amounts.max()) if len(amounts) else 0):
+			wanted = amounts > i
+
+			empty = games[wanted & (self.deck_pos[games] >= self.deck_len[games])]
+			if len(empty):
+				self.recycle(empty)
+
+			wanted &= self.deck_pos[games] < self.deck_len[games]
+			drawing = games[wanted]
+
+			self.hands[drawing, players[wanted], self.decks[drawing, self.deck_pos[drawing]]] += 1
+			self.deck_pos[drawing] += 1
+
+	def recycle(self, games):
+		"""Shuffles each game's discard pile back in as it's deck. Only
+		long games get here, so one game at a time is fine."""
+		for game in games:
+			cards = numpy.repeat(numpy.arange(Cards.CARD_COUNT, dtype=numpy.int8), self.piles[game])
+			self.random.shuffle(cards)
+
+			self.decks[game, :len(cards)] = cards
+			self.deck_pos[game] = 0
+			self.deck_len[game] = len(cards)
+			self.piles[game] = 0
+
+	def choose(self, strategies, games, legal):
+		"""Asks each seat's strategy for a card. Returns (n,) card ids."""
+		players = self.turn[games]
+		hands = self.hands[games, players]
+		cards = numpy.repeat(-1, len(games))
+
+		for seat, strategy in enumerate(strategies):
+			mine = players == seat
+			if mine.any():
+				cards[mine] = strategy(self, games[mine], hands[mine], legal[mine])
+
+		return cards
+
+	def legal(self, games):
+		"""Returns (n, 54), what the player to move could play in games."""
+		return (self.hands[games, self.turn[games]] > 0) & LEGAL[self.top[games], self.color[games]]
+
+	def step(self, strategies):
+		"""Plays one turn in every game still going."""
+		games = numpy.flatnonzero(~self.done)
+		if not len(games):
+			return
+
+		cards = self.choose(strategies, games, self.legal(games))
+
+		# Nothing to play, draw one.
+		stuck = cards < 0
+		if stuck.any():
+			self.drawCards(games[stuck], self.turn[games[stuck]], numpy.ones(stuck.sum(), dtype=numpy.int32))
+
+			if self.play_drawn:
+				cards[stuck] = self.choose(strategies, games[stuck], self.legal(games[stuck]))
+
+		skip = numpy.zeros(len(games), dtype=numpy.int32)
+
+		played = cards >= 0
+		if played.any():
+			skip[played] = self.play(games[played], cards[played])
+
+		# On to the next player, past any skipped, unless someone won.
+		self.turns[games] += 1
+		moving = games[~self.done[games]]
+		self.turn[moving] = (self.turn[moving] + self.direction[moving] * (1 + skip[~self.done[games]])) % self.players
+
+		self.done[self.turns >= self.max_turns] = True
+
+	def play(self, games, cards):
+		"""Plays cards for the player to move in games. Returns (n,) 1 where
+		the next player is skipped."""
+		players = self.turn[games]
+		self.hands[games, players, cards] -= 1
+
+		self.piles[games, self.top[games]] += 1
+		self.top[games] = cards
+		wild = cards >= Cards.WILD
+		self.color[games] = numpy.where(wild, mostHeldColor(self.hands[games, players]) if wild.any() else 0, CARD_COLORS[cards])
+
+		self.direction[games] *= numpy.where(REVERSES[cards], -1, 1)
+
+		# The next player draws, before they're skipped.
+		drawing = DRAWS[cards] > 0
+		if drawing.any():
+			victims = (players[drawing] + self.direction[games[drawing]]) % self.players
+			self.drawCards(games[drawing], victims, DRAWS[cards[drawing]])
+
+		won = self.hands[games, players].sum(1) == 0
+		self.done[games[won]] = True
+		self.winner[games[won]] = players[won]
+
+		return SKIPS[cards].astype(numpy.int32)
+
+	def run(self, strategies):
+		"""Plays every game out, one strategy per seat. Returns self."""
+		while not self.done.all():
+			self.step(strategies)
+		return self
+
+	def results(self):
+		"""Returns {"games", "finished", "wins", "mean_turns"}, wins being
+		per seat."""
+		finished = self.winner >= 0
+		return {
+			"games":self.games,
+			"finished":int(finished.sum()),
+			"wins":numpy.bincount(self.winner[finished], minlength=self.players).tolist(),
+			"mean_turns":float(self.turns[finished].mean()) if finished.any() else None,
+		}
+
+# ------------------------------------------------------------------------------
+
+def dealEngineGames(games, players, seed=None):
+	"""Returns games Engine.Games, dealt from seeds of a generator seeded
+	with seed, and started."""
+	rng = random.Random(seed)
+	dealt = []
+
+	for i in range(games):
+		game = Engine.Game(Engine.GameRandom(rng.getrandbits(64)))
+		for player in range(players):
+			game.addPlayer()
+		game.start()
+		game.nextTurn()
+		dealt.append(game)
+
+	return dealt
+
+def engineDecks(engine_games):
+	"""Returns decks that deal a batch the way started engine games were
+	dealt: each player's hand in turn, the card turned up, then the rest of
+	the deck."""
+	decks = []
+	for game in engine_games:
+		deck = []
+		for hand in game.hands:
+			deck.extend(hand)
+		deck.append(game.last_card)
+		deck.extend(game.deck)
+		decks.append(deck)
+	return decks
+
+def crossCheck(games, players, seed=None, max_turns=1000):
+	"""Plays the same seeded deals through Engine.py and a batch, both
+	with firstLegal. Returns (compared, mismatches), mismatches being the
+	game indexes whose winner or turns differ. Games where the engine
+	recycled the discard pile aren't compared, as the two shuffle it
+	differently."""
+	engine_games = dealEngineGames(games, players, seed)
+	batch = BatchGame(games, players, seed, max_turns=max_turns, decks=engineDecks(engine_games)).run([firstLegal] * players)
+
+	compared = 0
+	mismatches = []
+	for index, game in enumerate(engine_games):
+		shuffles = game.random.shuffles
+		winner, turns = playFirstLegal(game, max_turns)
+
+		if game.random.shuffles != shuffles:
+			continue
+
+		compared += 1
+		if (-1 if winner is None else winner) != batch.winner[index] or turns != batch.turns[index]:
+			mismatches.append(index)
+
+	return compared, mismatches
@@ -0,0 +1,187 @@
+# Cards.py
+# --------------------------------------------------------------------------
+
+# Card encoding for the Uno engine. Each of the 54 distinct card faces is a
+# small int, and hands are count vectors indexed by card, so checking,
+# adding and removing a card are all O(1). Names like "r5" are only used at
+# the IRC boundary, through fromString() and toString().
+#
+# ------ Card ids
+#	0-51 - coloured cards, color * 13 + face.
+#		colors - r, g, b, y.
+#		faces - 0-9, s (skip), r (reverse), d2 (draw two).
+#	52 - w, wild.
+#	53 - wd4, wild draw four.
+
+import array
+
+# ------- Constants ------------------------------------------------------------
+
+COLORS = ("r", "g", "b", "y")
+FACES = ("0", "1", "2", "3", "4", "5", "6", "7", "8", "9", "s", "r", "d2")
+
+FACE_SKIP = FACES.index("s")
+FACE_REVERSE = FACES.index("r")
+FACE_DRAW_TWO = FACES.index("d2")
+
+WILD = 52
+WILD_DRAW_FOUR = 53
+CARD_COUNT = 54
+
+# Wilds have no colour of their own.
+NO_COLOR = -1
+
+# Lookup tables, indexed by card id.
+CARD_NAMES = tuple([color + face for color in COLORS for face in FACES] + ["w", "wd4"])
+CARD_COLORS = tuple([color for color in range(len(COLORS)) for face in FACES] + [NO_COLOR, NO_COLOR])
+CARD_FACES = tuple([face for color in COLORS for face in range(len(FACES))] + [len(FACES), len(FACES) + 1])
+
+# One bit per card id, and masks of the cards sharing a colour or face.
+CARD_BITS = tuple([1 << card for card in range(CARD_COUNT)])
+ALL_CARDS = (1 << CARD_COUNT) - 1
+WILD_CARDS = CARD_BITS[WILD] | CARD_BITS[WILD_DRAW_FOUR]
+COLOR_MASKS = tuple([sum([CARD_BITS[card] for card in range(CARD_COUNT) if CARD_COLORS[card] == color]) for color in range(len(COLORS))])
+FACE_MASKS = tuple([sum([CARD_BITS[card] for card in range(CARD_COUNT) if CARD_FACES[card] == face]) for face in range(len(FACES) + 2)])
+
+# The cards that can go on a top card in a colour, PLAYABLE[top][color]. The
+# colour is the top card's own, or the one chosen for a wild.
+PLAYABLE = tuple([tuple([COLOR_MASKS[color] | FACE_MASKS[CARD_FACES[top]] | WILD_CARDS for color in range(len(COLORS))]) for top in range(CARD_COUNT)])
+
+CARD_IDS = dict([(name, card) for card, name in enumerate(CARD_NAMES)])
+COLOR_IDS = dict([(name, color) for color, name in enumerate(COLORS)])
+
+# ------------------------------------------------------------------------------
+
+def fromString(name):
+	"""Returns the id for a card name like "r5", or None."""
+	return CARD_IDS.get(name)
+
+def toString(card):
+	"""Returns the name of a card id."""
+	return CARD_NAMES[card]
+
+def colorFromString(name):
+	"""Returns the colour index for "r", "g", "b" or "y", or None."""
+	return COLOR_IDS.get(name)
+
+def isWild(card):
+	"""Returns true for w and wd4."""
+	return card >= WILD
+
+def playableMask(top, color):
+	"""Returns the mask of cards that can go on top in color. A color of
+	None, i.e. a wild dealt face up, takes anything."""
+	if color is None:
+		return ALL_CARDS
+	return PLAYABLE[top][color]
+
+def maskCards(mask):
+	"""Returns the card ids set in a mask, in order."""
+	return [card for card in range(CARD_COUNT) if mask & CARD_BITS[card]]
+
+def standardDeck():
+	"""Returns the 108 cards of one Uno deck, unshuffled. Per colour, one 0,
+	two each of 1-9, skip, reverse and draw two; then four w and four wd4."""
+	deck = []
+
+	for color in range(len(COLORS)):
+		base = color * len(FACES)
+		deck.append(base)
+
+		for face in range(1, len(FACES)):
+			deck.extend([base + face] * 2)
+
+	deck.extend([WILD] * 4)
+	deck.extend([WILD_DRAW_FOUR] * 4)
+
+	return deck
+
+# ------------------------------------------------------------------------------
+
+class Hand(object):
+	"""A player's cards, as a count per card id. Anything derived from the
+	cards, like the rendered hand, can be kept in cache until they change.
+	mask has the bit of every card held at least once."""
+	__slots__ = ("counts", "size", "mask", "cache")
+
+	def __init__(self, cards=()):
+		"""Constructor."""
+		self.counts = array.array("B", [0] * CARD_COUNT)
+		self.size = 0
+		self.mask = 0
+		self.cache = None
+		self.extend(cards)
+
+	def __len__(self):
+		"""Returns the number of cards held."""
+		return self.size
+
+	def __iter__(self):
+		"""Yields every card held, in id order, repeats included."""
+		counts = self.counts
+		for card in range(CARD_COUNT):
+			for i in range(counts[card]):
+				yield card
+
+	def __contains__(self, card):
+		"""Returns true if at least one of a card is held."""
+		return self.counts[card] > 0
+
+	def count(self, card):
+		"""Returns how many of a card are held."""
+		return self.counts[card]
+
+	def add(self, card, amount=1):
+		"""Adds copies of a card."""
+		self.counts[card] += amount
+		self.size += amount
+		self.mask |= CARD_BITS[card]
+		self.cache = None
+
+	def extend(self, cards):
+		"""Adds each card from a sequence."""
+		for card in cards:
+			self.add(card)
+
+	def remove(self, card):
+		"""Removes one copy of a card. Returns false if it wasn't held."""
+		if not self.counts[card]:
+			return False
+
+		self.counts[card] -= 1
+		self.size -= 1
+		if not self.counts[card]:
+			self.mask &= ~CARD_BITS[card]
+		self.cache = None
+		return True
+
+	def playable(self, top, color):
+		"""Returns the mask of cards held that can go on top in color."""
+		return self.mask & playableMask(top, color)
+
+	def copy(self):
+		"""Returns a new hand with the same cards."""
+		hand = Hand()
+		hand.counts = array.array("B", self.counts)
+		hand.size = self.size
+		hand.mask = self.mask
+		return hand
+
+	def getCounts(self):
+		"""Returns the counts as bytes, for snapshots. See fromCounts()."""
+		return self.counts.tostring()
+
+	def colorCount(self, color):
+		"""Returns how many cards of a colour are held."""
+		base = color * len(FACES)
+		return sum(self.counts[base:base + len(FACES)])
+
+def fromCounts(data):
+	"""Returns a hand from Hand.getCounts()'s bytes."""
+	hand = Hand()
+	hand.counts = array.array("B", data)
+	hand.size = sum(hand.counts)
+	for card in range(CARD_COUNT):
+		if hand.counts[card]:
+			hand.mask |= CARD_BITS[card]
+	return hand
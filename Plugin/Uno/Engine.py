@@ -0,0 +1,277 @@
+# Engine.py
+# --------------------------------------------------------------------------
+
+# The rules of Uno with no IRC in them: the deck, dealing, turn order and
+# what reverse, skip, draw two and wild draw four do. A Game only keeps
+# state and answers questions; Table.py turns commands into calls here and
+# the results into messages, and Batch.py plays the same rules over many
+# games at once for simulations.
+#
+# Players are numbered in the order they joined, and their hands are
+# Cards.Hand objects.
+#
+# The deck is a deque, so drawing is O(1) however big it is. When it runs
+# out the discard pile, bar the top card, is shuffled back in. Another 108
+# cards are shuffled in for every PLAYERS_PER_DECK players, so big tables
+# never run short.
+#
+# Tables shuffle with a GameRandom, so everything a game deals comes from
+# it's seed and the game can be dealt again from the seed alone.
+
+import array
+import collections
+import random
+import Cards
+
+# ------- Constants ------------------------------------------------------------
+
+HAND_SIZE = 7
+
+# Players one standard deck is enough for.
+PLAYERS_PER_DECK = 10
+
+# Why a card can't be played, from checkPlay().
+ERROR_NOT_HELD = 1
+ERROR_NOT_PLAYABLE = 2
+ERROR_NO_COLOR = 3
+
+# ------------------------------------------------------------------------------
+
+class GameRandom(object):
+	"""Shuffles for one game. Each shuffle comes from the game's seed and
+	how many shuffles came before it, so it's state is just those two."""
+
+	def __init__(self, seed, shuffles=0):
+		"""Constructor."""
+		self.seed = seed
+		self.shuffles = shuffles
+
+	def shuffle(self, cards):
+		"""Shuffles cards in place."""
+		random.Random((self.seed << 16) + self.shuffles).shuffle(cards)
+		self.shuffles += 1
+
+# ------------------------------------------------------------------------------
+
+class Game(object):
+	"""One game of Uno. Shuffles with the random.Random, or GameRandom,
+	it's given."""
+
+	def __init__(self, rng):
+		"""Constructor. Shuffles a new deck, players join with addPlayer()."""
+		self.random = rng
+		deck = Cards.standardDeck()
+		self.random.shuffle(deck)
+		self.deck = collections.deque(deck)
+		self.decks = 1
+		self.pile = []
+		self.hands = []
+
+		self.turn_index = None
+		self.reverse = False
+		self.last_card = None
+
+		# None while anything can be played, i.e. a wild was dealt face up.
+		self.top_color = None
+
+		# Set once the current player has drawn.
+		self.canpass = False
+
+	def addPlayer(self):
+		"""Deals a new player in. Returns their index."""
+		if len(self.hands) >= self.decks * PLAYERS_PER_DECK:
+			self.addDeck()
+
+		self.hands.append(Cards.Hand())
+		self.draw(len(self.hands) - 1, HAND_SIZE)
+		return len(self.hands) - 1
+
+	def addDeck(self):
+		"""Shuffles another standard deck into the deck."""
+		deck = list(self.deck) + Cards.standardDeck()
+		self.random.shuffle(deck)
+		self.deck = collections.deque(deck)
+		self.decks += 1
+
+	def start(self):
+		"""Turns the first card face up. Call nextTurn() for the first turn."""
+		self.pile.append(self.deck.popleft())
+		self.last_card = self.pile[0]
+
+		# A wild face up lets the first player play anything.
+		self.top_color = None
+		if not Cards.isWild(self.last_card):
+			self.top_color = Cards.CARD_COLORS[self.last_card]
+
+	def copy(self, rng=None):
+		"""Returns an independent copy of the game, e.g. to try moves on."""
+		game = Game.__new__(Game)
+		game.random = rng or self.random
+		game.deck = collections.deque(self.deck)
+		game.decks = self.decks
+		game.pile = list(self.pile)
+		game.hands = [hand.copy() for hand in self.hands]
+		game.turn_index = self.turn_index
+		game.reverse = self.reverse
+		game.last_card = self.last_card
+		game.top_color = self.top_color
+		game.canpass = self.canpass
+		return game
+
+	def getState(self):
+		"""Returns the game as plain values, for snapshots, cards as bytes.
+		See fromState()."""
+		return (array.array("B", self.deck).tostring(), self.decks, array.array("B", self.pile).tostring(),
+			[hand.getCounts() for hand in self.hands], self.turn_index, self.reverse, self.last_card, self.top_color, self.canpass)
+
+	def determinize(self, player_index, rng):
+		"""Returns a copy of the game as one player might imagine it: their
+		own hand as it is, and everyone else's cards and the deck dealt at
+		random from the cards they can't see, in the same numbers."""
+		game = self.copy(rng)
+
+		unseen = list(game.deck)
+		for index, hand in enumerate(game.hands):
+			if index != player_index:
+				unseen.extend(hand)
+		rng.shuffle(unseen)
+
+		for index, hand in enumerate(game.hands):
+			if index != player_index:
+				game.hands[index] = Cards.Hand(unseen[:len(hand)])
+				del unseen[:len(hand)]
+		game.deck = collections.deque(unseen)
+
+		return game
+
+	# ------ Turns
+
+	def getNextPlayerIndex(self, turns=1):
+		"""Returns the index of the player after the current one."""
+		for i in range(turns+1):
+
+			# Are we running in reverse?
+			if not self.reverse:
+				next_index = self.turn_index + i
+			else:
+				next_index = self.turn_index - i
+
+			# Wrap around back to the next player.
+			if next_index >= len(self.hands):
+				next_index = 0
+			if next_index < 0:
+				next_index = len(self.hands) - 1
+
+		return next_index
+
+	def nextTurn(self):
+		"""Moves the turn on to the next player, the first if none yet."""
+		if self.turn_index == None:
+			self.turn_index = 0
+		else:
+			self.turn_index = self.getNextPlayerIndex()
+
+		self.canpass = False
+
+	def skipTurn(self):
+		"""Skips the next player."""
+		self.turn_index = self.getNextPlayerIndex()
+
+	# ------ Cards
+
+	def draw(self, player_index, amount=1):
+		"""Draws cards into a player's hand. Returns how many were drawn,
+		fewer only if every card is already in someone's hand."""
+		hand = self.hands[player_index]
+
+		for i in range(amount):
+			if not self.deck:
+				self.recycle()
+				if not self.deck:
+					return i
+			hand.add(self.deck.popleft())
+
+		return amount
+
+	def canDraw(self):
+		"""Returns true if there's a card to draw, recycled or not."""
+		return len(self.deck) > 0 or len(self.pile) > 1
+
+	def recycle(self):
+		"""Shuffles the discard pile, all but the top card, into the deck."""
+		cards = self.pile[:-1]
+		del self.pile[:-1]
+		self.random.shuffle(cards)
+		self.deck.extend(cards)
+
+	def playable(self, player_index):
+		"""Returns the mask of a player's cards that can be played."""
+		return self.hands[player_index].playable(self.last_card, self.top_color)
+
+	def isPlayable(self, card):
+		"""Returns true if a card can go on the top card."""
+		return bool(Cards.CARD_BITS[card] & Cards.playableMask(self.last_card, self.top_color))
+
+	def checkPlay(self, player_index, card, color=None):
+		"""Returns why a player can't play a card, or None if they can."""
+		if Cards.isWild(card):
+			if not card in self.hands[player_index]:
+				return ERROR_NOT_HELD
+			if color is None:
+				return ERROR_NO_COLOR
+			return None
+
+		if not self.isPlayable(card):
+			return ERROR_NOT_PLAYABLE
+		if not card in self.hands[player_index]:
+			return ERROR_NOT_HELD
+		return None
+
+	def play(self, player_index, card, color=None):
+		"""Plays a card that checkPlay() allowed. Wilds take the colour
+		chosen. Returns the index of the player skipped by a skip, draw two
+		or wild draw four, who has drawn already, or None. The turn stays
+		with the player who played, call nextTurn() to move on."""
+		victim = None
+		face = Cards.CARD_FACES[card]
+
+		if face == Cards.FACE_REVERSE:
+			self.reverse = not self.reverse
+
+		elif face == Cards.FACE_SKIP:
+			victim = self.getNextPlayerIndex()
+			self.skipTurn()
+
+		elif face == Cards.FACE_DRAW_TWO or card == Cards.WILD_DRAW_FOUR:
+			victim = self.getNextPlayerIndex()
+			self.draw(victim, card == Cards.WILD_DRAW_FOUR and 4 or 2)
+			self.skipTurn()
+
+		# Onto the pile.
+		self.hands[player_index].remove(card)
+		self.pile.append(card)
+
+		self.last_card = card
+		if Cards.isWild(card):
+			self.top_color = color
+		else:
+			self.top_color = Cards.CARD_COLORS[card]
+
+		return victim
+
+	def hasWon(self, player_index):
+		"""Returns true once a player has no cards left."""
+		return len(self.hands[player_index]) == 0
+
+# ------------------------------------------------------------------------------
+
+def fromState(rng, state):
+	"""Returns a game from Game.getState()'s values, shuffling with rng."""
+	game = Game.__new__(Game)
+	game.random = rng
+
+	deck, game.decks, pile, hands, game.turn_index, game.reverse, game.last_card, game.top_color, game.canpass = state
+	game.deck = collections.deque(array.array("B", deck))
+	game.pile = array.array("B", pile).tolist()
+	game.hands = [Cards.fromCounts(counts) for counts in hands]
+	return game
@@ -0,0 +1,286 @@
+# Journal.py
+# --------------------------------------------------------------------------
+
+# An append-only journal of every change to every table, so games survive
+# the process dying. Tables call record() as they change, which only adds
+# the record to a buffer; a thread of the journal's own writes the buffer
+# out and fsyncs it every GROUP_INTERVAL, so one fsync covers every record
+# in that window and nothing on the game path waits on the disk.
+#
+# Every game shuffles from a seed of it's own (see Engine.GameRandom), which
+# is journaled when the game opens, so replaying deals the same cards in the
+# same places.
+#
+# Every SNAPSHOT_RECORDS records the journal is compacted: each table writes
+# a snapshot of itself to a new file, on it's own actor so it's consistent
+# with it's records, and later records follow it there. Once every table has
+# moved, the new file replaces the old. Replaying reads the old file and
+# then the new one, so a crash part way through loses nothing.
+#
+# ------ File format
+#	"DEEJRN01" magic, then records, each:
+#		kind - 1 byte, see below.
+#		channel length - uint8, length - uint32.
+#		channel, then that many bytes of payload.
+#
+# ------ Records
+#	G - game opened, the owner's nick, then "\0" and uint64 seed.
+#	J - player joined, nick, then "\0" and the difficulty for an AI.
+#	S - dealt, the first card turned up.
+#	T - next turn.
+#	P - card played, uint8 player, uint8 card, int8 colour (-1 for none).
+#	D - cards drawn, uint8 player, uint8 amount.
+#	C - may pass, uint8 0 or 1.
+#	A - auto, uint8 player, uint8 0 or 1.
+#	Z - game over.
+#	F - snapshot, the whole table, marshalled.
+
+import marshal
+import os
+import struct
+import threading
+import time
+import DeeIRC.Metrics as Metrics
+
+# ------- Constants ------------------------------------------------------------
+
+MAGIC = "DEEJRN01"
+RECORD = struct.Struct("<cBI")
+
+GAME = "G"
+JOIN = "J"
+START = "S"
+TURN = "T"
+PLAY = "P"
+DRAW = "D"
+CANPASS = "C"
+AUTO = "A"
+RESET = "Z"
+SNAPSHOT = "F"
+
+SEED_FIELDS = struct.Struct("<Q")
+PLAY_FIELDS = struct.Struct("<BBb")
+PLAYER_FIELDS = struct.Struct("<BB")
+FLAG_FIELDS = struct.Struct("<B")
+
+# Seconds between group commits.
+GROUP_INTERVAL = 0.01
+
+# Records between compactions.
+SNAPSHOT_RECORDS = 50000
+
+# ------------------------------------------------------------------------------
+
+def encode(channel, kind, payload=""):
+	"""Returns one record as bytes."""
+	return RECORD.pack(kind, len(channel), len(payload)) + channel + payload
+
+# ------------------------------------------------------------------------------
+
+class Journal(object):
+	"""Appends records to a journal file, committing them in groups."""
+
+	def __init__(self, path, interval=GROUP_INTERVAL, snapshot_records=SNAPSHOT_RECORDS):
+		"""Constructor. Appends to the file, creating it if needed."""
+		self.path = path
+		self.interval = interval
+		self.snapshot_records = snapshot_records
+
+		# Called with no arguments when it's time to compact, it should
+		# call beginCompaction() and have every table snapshot().
+		self.compactor = None
+
+		self.__lock = threading.Lock()
+		self.__commit_lock = threading.Lock()
+		self.__buffer = []
+		self.__records = 0
+
+		self.__file = open(path, "ab")
+		with open(path, "rb") as journal:
+			magic = journal.read(len(MAGIC))
+
+		# New, or made and cut off before the magic reached the disk.
+		if len(magic) < len(MAGIC) and MAGIC.startswith(magic):
+			self.__file.truncate(0)
+			self.__file.write(MAGIC)
+
+		# Records can't be added to anything else.
+		elif magic != MAGIC:
+			self.__file.close()
+			raise ValueError(path + " is not a game journal.")
+
+		# While compacting, the new file, it's buffer and the channels that
+		# haven't moved to it yet.
+		self.__next_file = None
+		self.__next_buffer = []
+		self.__unmoved = None
+
+		registry = Metrics.getRegistry()
+		self.__recorded = registry.counter("uno_journal_records_total", "Records written to the game journal.")
+		self.__commit_seconds = registry.histogram("uno_journal_commit_seconds", "Time taken to write and fsync a group of journal records.")
+		self.__compactions = registry.counter("uno_journal_compactions_total", "Times the game journal was compacted.")
+
+		self.__running = True
+		self.__thread = threading.Thread(target=self.commitLoop, name="Uno-journal")
+		self.__thread.daemon = True
+		self.__thread.start()
+
+	def record(self, channel, kind, payload=""):
+		"""Queues a record for the next commit."""
+		data = encode(channel, kind, payload)
+
+		with self.__lock:
+			if self.__unmoved is not None and not channel in self.__unmoved:
+				self.__next_buffer.append(data)
+			else:
+				self.__buffer.append(data)
+			self.__records += 1
+
+	# ------ Compaction
+
+	def beginCompaction(self, channels):
+		"""Starts a new file. Every channel given must snapshot() into it."""
+		with self.__commit_lock:
+			with self.__lock:
+				if self.__unmoved is not None:
+					return
+
+				self.__next_file = open(self.path + ".new", "wb")
+				self.__next_file.write(MAGIC)
+				self.__next_buffer = []
+				self.__unmoved = set(channels)
+				self.__records = 0
+
+	def snapshot(self, channel, payload):
+		"""Writes a table's snapshot to the new file, None for a table with
+		no game, and moves the table's later records there too."""
+		with self.__lock:
+			if self.__unmoved is None:
+				return
+
+			if payload is not None:
+				self.__next_buffer.append(encode(channel, SNAPSHOT, payload))
+			self.__unmoved.discard(channel)
+
+	def compacting(self):
+		"""Returns true while a compaction is under way."""
+		return self.__unmoved is not None
+
+	# ------ Commits
+
+	def commitLoop(self):
+		"""Commits every interval. Runs in it's own thread."""
+		while self.__running:
+			time.sleep(self.interval)
+			self.commit()
+
+			if self.__records >= self.snapshot_records and self.__unmoved is None and self.compactor:
+				self.compactor()
+
+	def commit(self):
+		"""Writes and fsyncs everything recorded so far."""
+		with self.__commit_lock:
+			with self.__lock:
+				buffer, self.__buffer = self.__buffer, []
+				next_buffer, self.__next_buffer = self.__next_buffer, []
+				finished = self.__unmoved is not None and not self.__unmoved
+				count = len(buffer) + len(next_buffer)
+
+			if not count and not finished:
+				return
+
+			start = time.time()
+
+			# Old file first, everything in it comes before the new one.
+			if buffer:
+				self.writeFile(self.__file, buffer)
+			if next_buffer:
+				self.writeFile(self.__next_file, next_buffer)
+
+			# Every table has moved, the new file takes over.
+			if finished:
+				self.writeFile(self.__next_file, [])
+				os.rename(self.path + ".new", self.path)
+				self.__file.close()
+
+				# Anything recorded since goes in the next commit, to the same file.
+				with self.__lock:
+					self.__file = self.__next_file
+					self.__buffer = self.__next_buffer + self.__buffer
+					self.__next_file = None
+					self.__next_buffer = []
+					self.__unmoved = None
+
+				self.__compactions.inc()
+
+			self.__recorded.inc(count)
+			self.__commit_seconds.observe(time.time() - start)
+
+	def writeFile(self, journal_file, buffer):
+		"""Writes records to a file and waits for them to reach the disk."""
+		journal_file.write("".join(buffer))
+		journal_file.flush()
+		os.fsync(journal_file.fileno())
+
+	def close(self):
+		"""Commits anything left and closes the file."""
+		self.__running = False
+		self.__thread.join()
+		self.commit()
+		self.__file.close()
+
+# ------------------------------------------------------------------------------
+
+def readJournal(path):
+	"""Yields (channel, kind, payload) for every whole record in a journal
+	file. A record cut short by a crash ends it."""
+	with open(path, "rb") as journal:
+		magic = journal.read(len(MAGIC))
+
+		# Made, but the magic hadn't reached the disk before a crash.
+		if len(magic) < len(MAGIC) and MAGIC.startswith(magic):
+			return
+
+		if magic != MAGIC:
+			raise ValueError(path + " is not a game journal.")
+
+		while True:
+			header = journal.read(RECORD.size)
+			if len(header) < RECORD.size:
+				return
+
+			kind, channel_length, length = RECORD.unpack(header)
+			data = journal.read(channel_length + length)
+			if len(data) < channel_length + length:
+				return
+
+			yield data[:channel_length], kind, data[channel_length:]
+
+def readJournals(path):
+	"""Yields every record to replay: the journal, then a compaction that
+	hadn't finished, if there is one."""
+	for name in (path, path + ".new"):
+		if os.path.exists(name):
+			for record in readJournal(name):
+				yield record
+
+def rewrite(path, snapshots):
+	"""Replaces a journal with just snapshots, a list of (channel, payload),
+	and removes any unfinished compaction."""
+	with open(path + ".tmp", "wb") as journal:
+		journal.write(MAGIC + "".join([encode(channel, SNAPSHOT, payload) for channel, payload in snapshots]))
+		journal.flush()
+		os.fsync(journal.fileno())
+
+	os.rename(path + ".tmp", path)
+
+	if os.path.exists(path + ".new"):
+		os.remove(path + ".new")
+
+def encodeSnapshot(value):
+	"""Returns a snapshot, any marshallable value, as bytes."""
+	return marshal.dumps(value)
+
+def decodeSnapshot(data):
+	"""Returns a snapshot's value."""
+	return marshal.loads(data)
@@ -0,0 +1,290 @@
+# Stats.py
+# --------------------------------------------------------------------------
+
+# Player statistics, kept in SQLite. Every player's totals are also held in
+# memory, loaded when the store opens, so "stats" and "leaders" never touch
+# the database and recordGame() only updates the totals and queues the game.
+# A writer thread of the store's own (see Writer.py) writes what's queued in
+# batches, one transaction each, so a finished game never waits on the disk.
+# A batch that fails to write is logged and dropped, but the totals it
+# carried are written with the next.
+#
+# Players are indexed by their wins too, so "leaders" only looks at the top
+# few rather than sorting everyone.
+#
+# Nicks are keyed folded with the server's casemapping, see setCasemapping().
+# Totals kept under another casemapping are re-keyed when they're loaded,
+# those of nicks that now fold together being added up.
+#
+# The database runs in WAL mode, so it can be read, e.g. with the sqlite3
+# shell, while the bot writes to it.
+#
+# ------ Tables
+#	players - one row per nick: games finished, games won, cards played.
+#	games - one row per finished game: channel, time, winner, players.
+#	game_players - one row per player per game, indexed by nick.
+
+import heapq
+import sqlite3
+import threading
+import time
+import DeeIRC.Metrics as Metrics
+import DeeIRC.Utils as Utils
+import Writer
+
+# ------- Constants ------------------------------------------------------------
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS players (
+	nick_key TEXT PRIMARY KEY,
+	nick TEXT NOT NULL,
+	games INTEGER NOT NULL,
+	wins INTEGER NOT NULL,
+	cards INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS players_wins ON players (wins DESC, games);
+
+CREATE TABLE IF NOT EXISTS games (
+	id INTEGER PRIMARY KEY,
+	channel TEXT NOT NULL,
+	finished REAL NOT NULL,
+	winner TEXT NOT NULL,
+	players INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS game_players (
+	game_id INTEGER NOT NULL REFERENCES games (id),
+	nick_key TEXT NOT NULL,
+	cards INTEGER NOT NULL,
+	won INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS game_players_nick ON game_players (nick_key, game_id);
+"""
+
+# Seconds the writer waits for more games before writing a batch.
+BATCH_INTERVAL = 0.05
+
+# Players "leaders" lists.
+LEADERS = 5
+
+# Fields of a player's totals.
+NICK = 0
+GAMES = 1
+WINS = 2
+CARDS = 3
+
+# ------------------------------------------------------------------------------
+
+class StatsStore(object):
+	"""Player totals in memory, written behind to SQLite."""
+
+	def __init__(self, path=":memory:", interval=BATCH_INTERVAL, casemapping="rfc1459"):
+		"""Constructor. Opens or creates the database and loads every
+		player's totals."""
+		self.casemapping = casemapping
+
+		# One connection, used here and then only by the writer.
+		self.__connection = sqlite3.connect(path, check_same_thread=False)
+		self.__connection.text_factory = str
+		self.__connection.execute("PRAGMA journal_mode=WAL")
+		self.__connection.execute("PRAGMA synchronous=NORMAL")
+		self.__connection.executescript(SCHEMA)
+
+		# nick_key:[nick, games, wins, cards], and wins:set([nick_key]).
+		self.__players = dict([(row[0], list(row[1:])) for row in self.__connection.execute("SELECT nick_key, nick, games, wins, cards FROM players")])
+
+		self.__lock = threading.Lock()
+		self.__leaders = None
+
+		# Nick keys whose totals changed since the last write, and old
+		# keys to replace with new ones.
+		self.__dirty = set()
+		self.__renamed = {}
+
+		self.rekey()
+
+		# Written now, before anyone can look for them under the old keys.
+		if self.__renamed:
+			self.writeBatch([], [(key,) + tuple(self.__players[key]) for key in self.__dirty], self.__renamed, self.casemapping)
+			self.__dirty = set()
+			self.__renamed = {}
+
+		registry = Metrics.getRegistry()
+		self.__games = registry.counter("uno_stats_games_total", "Finished games recorded in the statistics.")
+		self.__write_seconds = registry.histogram("uno_stats_write_seconds", "Time taken to write a batch of games to the statistics database.")
+		self.__batch_games = registry.histogram("uno_stats_batch_games", "Games written per statistics batch.", buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
+
+		errors = registry.counter("uno_stats_write_errors_total", "Batches of games that failed to be written to the statistics database.")
+		self.__writer = Writer.BatchWriter("Uno-stats", self.writeGames, interval, errors)
+		registry.gauge("uno_stats_pending", "Games waiting to be written to the statistics database.").setFunction(self.__writer.pending)
+
+	def recordGame(self, channel, winner, players):
+		"""Counts a finished game, players being (nick, cards played) pairs.
+		The totals change now, the database soon after."""
+		with self.__lock:
+			winner_key = Utils.lowerNick(winner, self.casemapping)
+
+			for nick, cards in players:
+				key = Utils.lowerNick(nick, self.casemapping)
+				totals = self.__players.get(key)
+				if totals is None:
+					totals = self.__players[key] = [nick, 0, 0, 0]
+					self.__by_wins.setdefault(0, set()).add(key)
+
+				totals[NICK] = nick
+				totals[GAMES] += 1
+				totals[CARDS] += cards
+				if key == winner_key:
+					self.__by_wins[totals[WINS]].discard(key)
+					totals[WINS] += 1
+					self.__by_wins.setdefault(totals[WINS], set()).add(key)
+					self.__most_wins = max(self.__most_wins, totals[WINS])
+
+				self.__dirty.add(key)
+
+			self.__leaders = None
+
+		self.__writer.put((channel, time.time(), winner, list(players)))
+		self.__games.inc()
+
+	def getPlayer(self, nick):
+		"""Returns a player's (nick, games, wins, cards), or None."""
+		totals = self.__players.get(Utils.lowerNick(nick, self.casemapping))
+		if totals is None:
+			return None
+		return tuple(totals)
+
+	def getLeaders(self):
+		"""Returns the LEADERS players with most wins, fewest games first on a
+		tie, as (nick, games, wins, cards)."""
+		leaders = self.__leaders
+
+		if leaders is None:
+			with self.__lock:
+				leaders = []
+				games = lambda key: self.__players[key][GAMES]
+
+				# Down from the most wins, until there's enough.
+				wins = self.__most_wins
+				while wins > 0 and len(leaders) < LEADERS:
+					keys = self.__by_wins.get(wins)
+					if keys:
+						leaders.extend(heapq.nsmallest(LEADERS - len(leaders), keys, key=games))
+					wins -= 1
+
+				leaders = self.__leaders = [tuple(self.__players[key]) for key in leaders]
+
+		return leaders
+
+	# ------ Casemapping
+
+	def setCasemapping(self, casemapping):
+		"""Keys nicks folded with another casemapping, as advertised by the
+		server's 005. The database follows with the next batch."""
+		if not casemapping in Utils.CASEMAPPINGS:
+			return
+
+		with self.__lock:
+			if casemapping == self.casemapping:
+				return
+			self.casemapping = casemapping
+
+		self.rekey()
+
+		# Woken with nothing to record, so the new keys are written soon.
+		self.__writer.put(None)
+
+	def rekey(self):
+		"""Moves every player's totals under their nick folded with our
+		casemapping, adding up nicks that now fold together, and rebuilds
+		the wins index."""
+		with self.__lock:
+			players = {}
+
+			for key, totals in self.__players.items():
+				new_key = Utils.lowerNick(totals[NICK], self.casemapping)
+
+				merged = players.get(new_key)
+				if merged is None:
+					players[new_key] = list(totals)
+				else:
+					merged[GAMES] += totals[GAMES]
+					merged[WINS] += totals[WINS]
+					merged[CARDS] += totals[CARDS]
+
+				if new_key != key:
+					self.__dirty.discard(key)
+					self.__dirty.add(new_key)
+
+					# Anything already renamed to this key goes on to the new one.
+					for old_key, renamed_key in self.__renamed.items():
+						if renamed_key == key:
+							self.__renamed[old_key] = new_key
+					self.__renamed[key] = new_key
+
+			self.__players = players
+			self.__by_wins = {}
+			for key, totals in players.items():
+				self.__by_wins.setdefault(totals[WINS], set()).add(key)
+			self.__most_wins = max([0] + self.__by_wins.keys())
+			self.__leaders = None
+
+	# ------ Writing
+
+	def writeGames(self, games):
+		"""Writes games, and the totals of everyone in them, in one
+		transaction. Runs on the writer's thread."""
+		start = time.time()
+
+		# A wake up from setCasemapping() isn't a game.
+		games = [game for game in games if game is not None]
+
+		with self.__lock:
+			dirty, self.__dirty = self.__dirty, set()
+			renamed, self.__renamed = self.__renamed, {}
+			players = [(key,) + tuple(self.__players[key]) for key in dirty if key in self.__players]
+			casemapping = self.casemapping
+
+		try:
+			self.writeBatch(games, players, renamed, casemapping)
+		except Exception:
+
+			# Those totals are still to be written.
+			with self.__lock:
+				self.__dirty.update(dirty)
+				for old_key, new_key in renamed.items():
+					self.__renamed.setdefault(old_key, new_key)
+			raise
+
+		self.__write_seconds.observe(time.time() - start)
+		self.__batch_games.observe(len(games))
+
+	def writeBatch(self, games, players, renamed={}, casemapping="rfc1459"):
+		"""Writes games, re-keyed nicks, {old_key:new_key}, and player
+		totals in one transaction."""
+		with self.__connection:
+			for old_key, new_key in renamed.items():
+				self.__connection.execute("DELETE FROM players WHERE nick_key = ?", (old_key,))
+				self.__connection.execute("UPDATE game_players SET nick_key = ? WHERE nick_key = ?", (new_key, old_key))
+
+			for channel, finished, winner, game_players in games:
+				cursor = self.__connection.execute("INSERT INTO games (channel, finished, winner, players) VALUES (?, ?, ?, ?)", (channel, finished, winner, len(game_players)))
+				game_id = cursor.lastrowid
+
+				winner_key = Utils.lowerNick(winner, casemapping)
+				rows = []
+				for nick, cards in game_players:
+					key = Utils.lowerNick(nick, casemapping)
+					rows.append((game_id, key, cards, key == winner_key))
+				self.__connection.executemany("INSERT INTO game_players (game_id, nick_key, cards, won) VALUES (?, ?, ?, ?)", rows)
+
+			self.__connection.executemany("INSERT OR REPLACE INTO players (nick_key, nick, games, wins, cards) VALUES (?, ?, ?, ?, ?)", players)
+
+	def flush(self):
+		"""Waits until every game recorded so far is written."""
+		self.__writer.flush()
+
+	def close(self):
+		"""Writes anything queued and closes the database."""
+		self.__writer.close()
+		self.__connection.close()
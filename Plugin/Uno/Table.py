@@ -0,0 +1,1233 @@
+# Table.py
+# --------------------------------------------------------------------------
+
+# One Uno game, bound to a single channel. Each table is an actor, so all of
+# it's commands run one at a time in order while other tables carry on in
+# parallel. Nothing here is shared between tables.
+#
+# The rules themselves are in Engine.py, the table runs the lobby and turns
+# commands into engine calls and the results into messages.
+
+# Player Array:
+# 
+# UnoTable.players = [
+#	[player_index]:{
+#			"nick":[player_nick],
+#			"hand":[player_hand],
+#			"auto":[draw_and_pass_for_them],
+#			"ai":[difficulty, None for people],
+#			"played":[cards_played_this_game]
+#		}
+# ]
+#
+#
+# Player indexes are the same as in the engine, and "hand" is the engine's
+# hand. Cards are small ints and hands are count vectors, see Cards.py. Card
+# names only appear when a player types one or when we render one.
+#
+# With a journal every change to the game is recorded as it's made, see
+# Journal.py, and replayRecord() puts a table back from those records.
+# Finished games are counted in the players' statistics, see Stats.py, and
+# kept whole in the game archive, see Archive.py.
+#
+# Tables keep timers on the bot's reactor, see startTimer(): a player who
+# takes too long has their turn drawn and passed for them, a lobby left open
+# is dealt or stopped, and a table nobody has used in a while stops it's game
+# and asks the plugin to drop it. Timers land in the mailbox like commands,
+# so they need no locking either.
+
+import random
+import threading
+import time
+import zlib
+import DeeIRC.Actor as Actor
+import DeeIRC.Metrics as Metrics
+import DeeIRC.SendQueue as SendQueue
+import DeeIRC.Utils as Utils
+import AI
+import Archive
+import Cards
+import Engine
+import Journal
+
+# ------- Constants ------------------------------------------------------------
+
+UNO_STATE_STOPPED = 0
+UNO_STATE_STARTING = 1
+UNO_STATE_STARTED = 2
+
+# Computer players are called this and a number. A "." can't be in a real
+# nick, so nobody can play for them.
+AI_NICK = "AI."
+
+# Seconds a player has for their turn, a lobby stays open and a table can
+# go unused before it's dropped.
+TURN_TIMEOUT = 90
+LOBBY_TIMEOUT = 300
+IDLE_TIMEOUT = 1800
+
+# Colour codes per card colour.
+CARD_COLOR_CODES = {
+	Cards.COLORS.index("r"):{"fg":0, "bg":4},
+	Cards.COLORS.index("g"):{"fg":0, "bg":3},
+	Cards.COLORS.index("b"):{"fg":0, "bg":12},
+	Cards.COLORS.index("y"):{"fg":1, "bg":8},
+	Cards.NO_COLOR:{"fg":0, "bg":1}
+}
+
+def renderCard(name, color):
+	"""Returns a card name in it's colours."""
+	return Utils.colorCode(**CARD_COLOR_CODES[color]) + name + Utils.normalCode()
+
+# Every card face rendered once, indexed by card id. HAND_STRINGS has the
+# space that follows each card in a hand.
+CARD_STRINGS = tuple([renderCard(Cards.CARD_NAMES[card], Cards.CARD_COLORS[card]) for card in range(Cards.CARD_COUNT)])
+HAND_STRINGS = tuple([card_string + " " for card_string in CARD_STRINGS])
+
+# The colour chosen for a wild, shown as just the letter.
+TOP_COLOR_STRINGS = tuple([renderCard(Cards.COLORS[color], color) for color in range(len(Cards.COLORS))])
+
+# ------------------------------------------------------------------------------
+
+
+class UnoTable(Actor.Actor):
+	
+	# Constructor. Sets default states for the channel's game. idle is
+	# called with the table once it's gone unused for IDLE_TIMEOUT.
+	def __init__(self, channel, seed=None, journal=None, stats=None, idle=None, archive=None):
+		super(UnoTable, self).__init__()
+		
+		# The channel this table belongs to.
+		self.channel = channel
+		
+		# Each table picks it's games' seeds with it's own generator, so a
+		# seeded replay deals the same cards however the channels interleave.
+		self.random = random.Random(seed)
+		self.game_seed = None
+		
+		# Set default states.
+		self.state = UNO_STATE_STOPPED
+		self.game = None
+		self.players = None
+		self.gameowner = None
+		
+		# Picks moves for computer players, created when the first joins.
+		self.searcher = None
+		
+		# Moves on every turn, so a computer player's late move is ignored.
+		self.turn_serial = 0
+		
+		# Held while the bot is disconnected.
+		self.paused = False
+		
+		# Where changes are recorded, if anywhere.
+		self.journal = journal
+		
+		# Where finished games are counted, if anywhere.
+		self.stats = stats
+		
+		# Where finished games are kept, if anywhere, and the moves of the
+		# current game for it.
+		self.archive = archive
+		self.moves = None
+		
+		# Running timers, name:(serial, handle). "game" is the lobby or the
+		# current turn, "idle" is checked against when a person last used us.
+		self.timers = {}
+		self.timer_serial = 0
+		self.last_active = time.time()
+		self.idle = idle
+		
+		# Once closed, nothing more can be sent to us.
+		self.closed = False
+		self.close_lock = threading.Lock()
+		
+# ----------------------------------------------------------------------------------
+# ------- Command Handlers ---------------------------------------------------------
+# ----------------------------------------------------------------------------------
+	
+	# runCommand() - Runs a command handler from the mailbox.
+		# - Notes that a person, not a computer player, used the table.
+		# - Announcements made by the command are merged per target.
+	
+	def runCommand(self, bot, command_name, nick, target, message):
+		registry = Metrics.getRegistry()
+		
+		if not nick.startswith(AI_NICK):
+			self.keepAlive(bot)
+		
+		with bot.batch():
+			
+			# Only timed while metrics are being served.
+			if registry.timing:
+				start = time.time()
+				getattr(self, command_name)(bot, nick, target, message)
+				registry.histogram("uno_command_seconds", "Time taken by a table to run a game command.", command=command_name).observe(time.time() - start)
+			else:
+				getattr(self, command_name)(bot, nick, target, message)
+	
+	# commandUno() - Begins a new game of Uno.
+		# - Checks is game is running.
+		# - Creates a new game, with a shuffled deck.
+		# - Sets up the channel target.
+		# - Sets current state to UNO_STATE_STARTING
+		# - Announces game started.
+		# - Set the current user to the game owner.
+		# - Add the current player to the game.
+	
+	def commandUno(self, bot, nick, target, message):
+		
+		# Confirm no game in progress.
+		if self.state == UNO_STATE_STOPPED:
+			
+			# Start Uno by initalizing the deck and pile, from a seed of the
+			# game's own.
+			self.game_seed = self.random.getrandbits(64)
+			self.game = Engine.Game(Engine.GameRandom(self.game_seed))
+			if self.archive is not None:
+				self.moves = []
+			
+			# Setup the table for starting.
+			self.state = UNO_STATE_STARTING
+			
+			# Print some messages.
+			bot.sendMessage(target, nick + " has started a game of Uno. Players can now \"join\".")
+			bot.sendNotice(nick, "You need to use \"deal\" when you are ready to start your game.")
+			
+			# Set the game's owner.
+			self.gameowner = nick
+			self.record(Journal.GAME, nick + "\0" + Journal.SEED_FIELDS.pack(self.game_seed))
+			
+			# Setup the players.
+			self.players = []
+			self.addPlayer(bot, nick)
+			
+			# Give HOP to owner
+			self.givePlayerHop(bot, nick)
+			
+			# Deal or give up if they never do.
+			self.startTimer(bot, "game", LOBBY_TIMEOUT, self.lobbyTimeout)
+			
+		# Already a game in progress.
+		elif self.state == UNO_STATE_STARTING or self.state == UNO_STATE_STARTED:
+			if not self.isPlayerInGame(nick):
+				self.commandJoin(bot, nick, target, message)
+			else:
+				bot.sendNotice(nick, "You are already in the current game.")
+	
+	# commandJoin() - Allows player to join the current game.
+		# - Checks game is in progress.
+		# - Checks the player is not in the game.
+		# - Adds the player to the game.
+	
+	def commandJoin(self, bot, nick, target, message):
+		
+		# Check there is a game in progress.
+		if self.state == UNO_STATE_STARTING or self.state == UNO_STATE_STARTED:
+		
+			# Confirm they are not in the game.
+			if not self.isPlayerInGame(nick):
+				
+				# Add then to the game.
+				self.addPlayer(bot, nick)
+				
+				# Give voice to players
+				self.givePlayerVoice(bot, nick)
+				
+			else:
+				bot.sendNotice(nick, "You are already in the game.")
+		else:
+			bot.sendNotice(nick, "There is no current game, you can create one using \"uno\".")
+	
+	# commandAi() - Adds a computer player to the lobby.
+		# - Checks the game is in lobby state.
+		# - Checks this is the owner or an admin.
+		# - Checks the difficulty.
+		# - Adds the computer player to the game.
+	
+	def commandAi(self, bot, nick, target, message):
+		
+		# Computer players join before the deal.
+		if self.state == UNO_STATE_STARTING:
+			
+			# Check this is the owner or is an admin.
+			if self.gameowner == nick or bot.isAdmin(nick):
+				
+				difficulty = message.strip().lower() or AI.DEFAULT_DIFFICULTY
+				
+				if difficulty in AI.DIFFICULTIES:
+					
+					# The first free name.
+					number = 1
+					while self.isPlayerInGame(AI_NICK + str(number)):
+						number += 1
+					
+					self.addPlayer(bot, AI_NICK + str(number), difficulty)
+					
+				else:
+					bot.sendNotice(nick, "The difficulty can be " + ", ".join(sorted(AI.DIFFICULTIES)) + ".")
+			else:
+				bot.sendNotice(nick, "You need to be the owner of the game to add computer players.")
+		else:
+			bot.sendNotice(nick, "Computer players can only join before the game is dealt.")
+	
+	# commandDeal() - Starts the game by dealing cards.
+		# - Checks game is in lobby state.
+		# - Deals cards to the players.
+	
+	def commandDeal(self, bot, nick, target, message):
+		
+		# Check this is the owner or is an admin.
+		if self.gameowner == nick or bot.isAdmin(nick):
+			
+			# Check if game in lobby
+			if self.state == UNO_STATE_STARTING:
+				
+				# Deal the cards.
+				self.unoStartGame(bot)
+				
+			# In progress or not started.
+			elif self.state == UNO_STATE_STOPPED or self.state == UNO_STATE_STARTED:
+				
+				# Cant deal now.
+				bot.sendNotice(nick, "You can't do that now.")
+			
+		else:
+			bot.sendNotice(nick, "You need to be the owner of the game to start it.")
+	
+	
+	# commandPlay() - Allows a player to play a card.
+		# - Confirm a game is in progress.
+		# - Confirm the player specified a card.
+		# - Check if it is their turn.
+		# - Check if they played a wild card, and confirm they have it.
+		# - Check if they played a normal card, and confirm they have it.
+		# - Remove the card from their hand, and add it to the pile.
+		# - Update the top card reference.
+		# - Set their turn to played.
+		# - Announce what card was played.
+		# - Check for winning player.
+		# - Announce amount of cards remaining.
+		# - Continue to next players turn.
+	
+	def commandPlay(self, bot, nick, target, message):
+		
+		# Confirm game is in progress.
+		if self.state == UNO_STATE_STARTED:
+			
+			# Confirm a card is played.
+			if message:
+				
+				# make it lower case.
+				message = message.lower()
+				
+				# strip whitespace
+				message = message.strip()
+				
+				# Get the current player
+				player_index = self.game.turn_index
+				player = self.players[player_index]
+				
+				# Make sure that it's the players turn.
+				if player["nick"] == nick:
+						
+						turn_played = False
+						
+						# Card names only exist out here, past this it's ids.
+						words = message.split()
+						card = Cards.fromString(words[0])
+						color = None
+						if len(words) > 1:
+							color = Cards.colorFromString(words[1][0:1])
+						
+						# Not a card we know.
+						if card is None:
+							if len(words[0]) < 2:
+								bot.sendNotice(nick, "Please specify a proper colour.")
+							else:
+								bot.sendNotice(nick, "You don't have that card!")
+						
+						else:
+							error = self.game.checkPlay(player_index, card, color)
+							
+							if error == Engine.ERROR_NOT_HELD:
+								bot.sendNotice(nick, "You don't have that card!")
+							
+							elif error == Engine.ERROR_NO_COLOR:
+								bot.sendNotice(nick, "Please specify a colour.")
+							
+							elif error == Engine.ERROR_NOT_PLAYABLE:
+								bot.sendNotice(nick, "You can't play that card!")
+							
+							else:
+								
+								# Play it, the engine handles what the card does.
+								victim = self.game.play(player_index, card, color)
+								self.record(Journal.PLAY, Journal.PLAY_FIELDS.pack(player_index, card, Cards.NO_COLOR if color is None else color))
+								player["played"] += 1
+								
+								# Wild draw 4
+								if card == Cards.WILD_DRAW_FOUR:
+									
+									# Print a message and send the player their hand.
+									bot.sendMessage(target, self.players[victim]["nick"] + " draws four cards.")
+									self.sendPlayerHand(bot, victim)
+									
+									bot.sendMessage(target, "Top card is now: " + self.topString())
+								
+								# wild normal
+								elif card == Cards.WILD:
+									bot.sendNotice(nick, "Top card is now: " + self.topString())
+								
+								# Draw Two Card
+								elif Cards.CARD_FACES[card] == Cards.FACE_DRAW_TWO:
+									
+									# Print a message and send the player their hand.
+									bot.sendMessage(target, self.players[victim]["nick"] + " draws two cards.")
+									self.sendPlayerHand(bot, victim)
+								
+								# Skip Card
+								elif Cards.CARD_FACES[card] == Cards.FACE_SKIP:
+									bot.sendMessage(target, self.players[victim]["nick"] + " skips their turn.")
+								
+								# Yep.
+								turn_played = True
+						
+						# Send a message to the channel and send the player's hand.
+						if turn_played:
+							
+							# Card played.
+							bot.sendMessage(target, player["nick"] + " played " + self.topString()+".")
+							
+							# A player just won!
+							if self.game.hasWon(player_index):
+								
+								# Print out messages to the channel. The celebration can
+								# wait behind other tables' turns.
+								bot.sendMessage(self.channel, nick + " has won the game!")
+								bot.sendMessage(self.channel, "\o/ " + nick + "\o/ ", SendQueue.PRIORITY_LOW)
+								bot.sendMessage(self.channel, "/o/ " + nick + "/o/ ", SendQueue.PRIORITY_LOW)
+								bot.sendMessage(self.channel, "\o\ " + nick + "\o\ ", SendQueue.PRIORITY_LOW)
+								bot.sendMessage(self.channel, "/o/ " + nick + "/o/ ", SendQueue.PRIORITY_LOW)
+								bot.sendMessage(self.channel, "\o\ " + nick + "\o\ ", SendQueue.PRIORITY_LOW)
+								
+								# Count it for everyone who played, and keep it.
+								self.recordStats(nick)
+								self.archiveGame(player_index)
+								
+								# Reset the uno game.
+								self.resetUno(bot)
+								
+							else:
+								
+								# Cards remaining!
+								bot.sendMessage(target, nick + " now has "+str(len(player["hand"]))+" cards left.")
+								
+								# Send players hand.
+								self.sendPlayerHand(bot, player_index)
+								
+								# Run the next turn.
+								self.doTurn(bot)
+				else:
+					bot.sendNotice(nick, "It's not your turn!")
+			else:
+				bot.sendNotice(nick, "Please choose a card to play.")
+		else:
+			bot.sendNotice(nick, "There is no game in progress.")
+	
+	# commandDraw() - Allows a player to draw a card.
+		# - Confirm a game is in progress.
+		# - Check the user has not already drawn a card.
+		# - Make sure it's this players turn.
+		# - Add card to players hand.
+		# - Announce they drew a card.
+		# - Send their hand.
+		# - Allow them to pass.
+	
+	def commandDraw(self, bot, nick, target, message):
+		
+		# Make sure game in progress.
+		if self.state == UNO_STATE_STARTED:
+			
+			# Get the current player and card.
+			player = self.players[self.game.turn_index]
+			player_index = self.game.turn_index
+			
+			# Check if drawn card.
+			if self.game.canpass == False:
+				
+				# Make sure it's the player using the command.
+				if player["nick"] == nick:
+					
+					# Nothing left to draw, so they may pass instead.
+					if not self.game.canDraw():
+						self.setCanPass(True)
+						bot.sendNotice(nick, "There are no cards left to draw, you must either play or \"pass\".")
+						return
+					
+					# Move the cards from the deck to the player's hand.
+					self.game.draw(player_index, 1)
+					self.record(Journal.DRAW, Journal.PLAYER_FIELDS.pack(player_index, 1))
+					
+					# Send a message to the channel and send the player's hand.
+					bot.sendMessage(target, player["nick"] + " drew a card. They now have "+str(len(player["hand"]))+" cards.")
+					
+					# Send players hand.
+					self.sendPlayerHand(bot, player_index)
+					
+					# They can now pass.
+					self.setCanPass(True)
+					
+					# Nothing to play, pass for them if they asked us to.
+					if player["auto"] and not self.playableCards(player_index):
+						self.commandPass(bot, nick, self.channel, "")
+			
+			else:
+				bot.sendNotice(nick, "You cannot draw another card, you must either play or \"pass\".")
+		else:
+			bot.sendNotice(nick, "There is no game in progress.")
+	
+	# commandPass() - Allows a player to pass their turn.
+		# - Confirm a game is in progress.
+		# - Checks they are allowed to pass.
+		# - Checks it is their turn.
+		# - Announce they passed.
+		# - Continue to the next player.
+	
+	def commandPass(self, bot, nick, target, message):
+		
+		# Check for game in progress.
+		if self.state == UNO_STATE_STARTED:
+			
+			# Check if drawn card.
+			if self.game.canpass == True:
+				
+				# Get the current player and card.
+				player = self.players[self.game.turn_index]
+				player_index = self.game.turn_index
+				
+				# Make sure it's the player using the command.
+				if player["nick"] == nick:
+					
+					# Pass turn.
+					bot.sendMessage(self.channel, nick + " passed their turn.")
+					
+					# Can no longer pass.
+					self.setCanPass(False)
+					
+					# Next turn.
+					self.doTurn(bot)
+					
+			else:
+				bot.sendNotice(nick, "You need to \"draw\" a card first.")
+		else:
+			bot.sendNotice(nick, "There is no game in progress.")
+	
+	# commandStop() - Allows the games owner to stop the game.
+		# - Confirm a game is in progress.
+		# - Confirm they are the owner.
+		# - Reset the game.
+		# - Announce game ended.
+	
+	def commandStop(self, bot, nick, target, message):
+		
+		# Game in progress
+		if self.state == UNO_STATE_STARTED or self.state == UNO_STATE_STARTING:
+			
+			# Check this is the owner or is an admin.
+			if self.gameowner == nick or bot.isAdmin(nick):
+				
+				# Reset Game
+				self.resetUno(bot)
+					
+				# Print a message.
+				bot.sendMessage(target, nick + " stopped the current game.")
+				
+			else:
+				bot.sendNotice(nick, "You need to be the owner of the game to stop it.")
+				
+		# No game in progress
+		elif self.state == UNO_STATE_STOPPED:
+			bot.sendNotice(nick, "There is no current game.")
+	
+	# commandCards() - Message a user their cards.
+		# - Confirm a game is in progress.
+		# - Confirm the player is in the current game.
+		# - Get the players index.
+		# - Message them their cards.
+	
+	def commandCards(self, bot, nick, target, message):
+		
+		# Make sure we are in game
+		if self.state == UNO_STATE_STARTED:
+			
+			# Make sure they are in the game.
+			if self.isPlayerInGame(nick):
+				
+				# Get their index
+				player_index = self.getIndexForNick(nick)
+				
+				# Send hand
+				self.sendPlayerHand(bot, player_index)
+				
+			else:
+				bot.sendNotice(nick, "You are not in this game.")
+		else:
+			bot.sendNotice(nick, "There is no current game.")
+	
+	# commandTop() - Announce the top card.
+		# - Confirm a game is in progress.
+		# - Announce the top card.
+	
+	def commandTop(self, bot, nick, target, message):
+		
+		# Check if we're in a game
+		if self.state == UNO_STATE_STARTED:
+			
+			# Send top card
+			bot.sendMessage(target, "Top card: " + self.topString())
+	
+	# commandTurn() - Announce who's turn it is.
+		# - Confirm a game is in progress.
+		# - Announce the current turn.
+	
+	def commandTurn(self, bot, nick, target, message):
+		
+		# Check if we're in a game
+		if self.state == UNO_STATE_STARTED:
+			
+			player = self.players[self.game.turn_index]
+			
+			# Send top card
+			bot.sendMessage(target, "It's currently " + player["nick"] + "'s turn!")
+		
+		else:
+			bot.sendNotice(nick, "No game in progress.")
+	
+	# commandHint() - Tell a player which of their cards they can play.
+		# - Confirm a game is in progress.
+		# - Confirm the player is in the current game.
+		# - Send them the playable cards, or what to do instead.
+	
+	def commandHint(self, bot, nick, target, message):
+		
+		# Make sure we are in game
+		if self.state == UNO_STATE_STARTED:
+			
+			# Make sure they are in the game.
+			if self.isPlayerInGame(nick):
+				
+				playable = self.playableCards(self.getIndexForNick(nick))
+				
+				if playable:
+					bot.sendNotice(nick, "You can play: " + "".join([HAND_STRINGS[card] for card in Cards.maskCards(playable)]))
+				elif self.game.canpass and self.players[self.game.turn_index]["nick"] == nick:
+					bot.sendNotice(nick, "You have nothing to play, you can \"pass\".")
+				else:
+					bot.sendNotice(nick, "You have nothing to play, you need to \"draw\" a card.")
+				
+			else:
+				bot.sendNotice(nick, "You are not in this game.")
+		else:
+			bot.sendNotice(nick, "There is no current game.")
+	
+	# commandAuto() - Toggle drawing and passing for a player who can't play.
+		# - Confirm there is a game.
+		# - Confirm the player is in the current game.
+		# - Flip their setting.
+		# - If it's their turn, act on it now.
+	
+	def commandAuto(self, bot, nick, target, message):
+		
+		# Lobby or in game
+		if self.state == UNO_STATE_STARTED or self.state == UNO_STATE_STARTING:
+			
+			# Make sure they are in the game.
+			if self.isPlayerInGame(nick):
+				
+				player_index = self.getIndexForNick(nick)
+				player = self.players[player_index]
+				player["auto"] = not player["auto"]
+				self.record(Journal.AUTO, Journal.PLAYER_FIELDS.pack(player_index, player["auto"]))
+				
+				if player["auto"]:
+					bot.sendNotice(nick, "You will draw and pass automatically when you have nothing to play.")
+					
+					# Their turn and stuck, deal with it now.
+					if self.state == UNO_STATE_STARTED and player_index == self.game.turn_index:
+						if self.game.canpass:
+							if not self.playableCards(player_index):
+								self.commandPass(bot, nick, self.channel, "")
+						elif self.autoDrawPass(bot, player_index):
+							self.doTurn(bot)
+						elif self.game.canpass:
+							self.sendPlayerHand(bot, player_index)
+				else:
+					bot.sendNotice(nick, "You will draw and pass yourself.")
+				
+			else:
+				bot.sendNotice(nick, "You are not in this game.")
+		else:
+			bot.sendNotice(nick, "There is no current game.")
+		
+	
+	
+# ----------------------------------------------------------------------------------
+# ------- Uno Functions ------------------------------------------------------------
+# ----------------------------------------------------------------------------------
+	
+	# unoStartGame() - Start the game.
+	def unoStartGame(self, bot):
+		
+		# Confirm we are in lobby mode.
+		if self.state == UNO_STATE_STARTING:
+			
+			# Check we have enough players.
+			if len(self.players) >= 2:
+			
+				# Set the game to started.
+				self.state = UNO_STATE_STARTED
+				
+				# Set the channel moderated
+				bot.sendRaw("MODE " + self.channel + " +m")
+				
+				# Send the hand to each player, except the first?
+				for i in range(1, len(self.players)):
+					self.sendPlayerHand(bot, i)
+				
+				# Get one card face up.
+				self.game.start()
+				self.record(Journal.START)
+				
+				# Send a message
+				bot.sendMessage(self.channel, "Game Started, Top Card is " + self.cardString(self.game.last_card))
+				
+				# Start the turns.
+				self.doTurn(bot)
+			else:
+				# Not enough players.
+				bot.sendMessage(self.channel, "Not enough players! Please wait for more to join, or add a computer player with \"ai\".")
+	
+	# doTurn() - Initiates the current player's turn.
+	def doTurn(self, bot):
+		
+		self.nextTurn()
+		
+		# Players with auto on are passed over while they can't play, at
+		# most once round the table.
+		for i in range(len(self.players)):
+			if not self.autoDrawPass(bot, self.game.turn_index):
+				break
+			self.nextTurn()
+		
+		# Get the current player's info.
+		player = self.players[self.game.turn_index]
+		nick = player["nick"]
+		
+		# Send them their hand.
+		self.sendPlayerHand(bot, self.game.turn_index)
+		
+		# Print out messages to the channel.
+		bot.sendMessage(self.channel, nick + "'s turn!")
+		
+		# Let a computer player think.
+		self.turn_serial += 1
+		self.requestAiMove(bot)
+		
+		# They don't get all day.
+		self.startTimer(bot, "game", TURN_TIMEOUT, self.turnTimeout)
+	
+	# requestAiMove() - Starts a computer player's search, if it's their turn.
+	def requestAiMove(self, bot):
+		
+		player_index = self.game.turn_index
+		difficulty = self.players[player_index]["ai"]
+		
+		if not difficulty or self.paused:
+			return
+		
+		if self.searcher is None:
+			self.searcher = AI.Searcher(random.Random())
+		
+		# The answer comes back to our own mailbox.
+		serial = self.turn_serial
+		self.searcher.request(self.game, player_index, difficulty, lambda move: self.send(self.playAiMove, bot, serial, move), self.aiSeed())
+	
+	# aiSeed() - Returns the seed for a computer player's search: the game's
+	# seed and where the game stands. A recovered or replayed game stands in
+	# the same places, so it's searches draw the same numbers.
+	def aiSeed(self):
+		state = Journal.encodeSnapshot(self.game.getState())
+		return (self.game_seed << 32) | (zlib.crc32(state) & 0xFFFFFFFF)
+	
+	# playAiMove() - Makes a computer player's move through the same commands people use.
+	def playAiMove(self, bot, serial, move):
+		
+		# The game moved on without us.
+		if serial != self.turn_serial or self.state != UNO_STATE_STARTED or self.paused:
+			return
+		
+		nick = self.players[self.game.turn_index]["nick"]
+		
+		if move is not None:
+			card, color = move
+			
+			text = Cards.toString(card)
+			if color is not None:
+				text = text + " " + Cards.COLORS[color]
+			
+			self.runCommand(bot, "commandPlay", nick, self.channel, text)
+		
+		elif not self.game.canpass:
+			self.runCommand(bot, "commandDraw", nick, self.channel, "")
+			
+			# Think again with the new card.
+			self.turn_serial += 1
+			self.requestAiMove(bot)
+		
+		else:
+			self.runCommand(bot, "commandPass", nick, self.channel, "")
+	
+	# autoDrawPass() - Draws for a player with auto on who can't play, and
+	# passes for them if the card drawn can't be played either. Returns True
+	# if their turn was passed.
+	def autoDrawPass(self, bot, player_index):
+		player = self.players[player_index]
+		
+		# They have something, or are playing by hand.
+		if not player["auto"] or self.playableCards(player_index):
+			return False
+		
+		# Draw them a card, unless there's none left.
+		if not self.game.canDraw():
+			return False
+		self.game.draw(player_index, 1)
+		self.record(Journal.DRAW, Journal.PLAYER_FIELDS.pack(player_index, 1))
+		
+		bot.sendMessage(self.channel, player["nick"] + " drew a card. They now have "+str(len(player["hand"]))+" cards.")
+		
+		# Their turn after all.
+		if self.playableCards(player_index):
+			self.setCanPass(True)
+			return False
+		
+		bot.sendMessage(self.channel, player["nick"] + " passed their turn.")
+		return True
+	
+	# resetUno() - Resets the game variables.
+	def resetUno(self, bot):
+		
+		# Set the channel moderated
+		bot.sendRaw("MODE " + self.channel + " -m")
+	
+		self.takePlayerHop(bot, self.gameowner)
+		
+		if self.players:
+			for player in self.players:
+				if(player is not self.gameowner) and not player["ai"]:
+					self.takePlayerVoice(bot, player["nick"])
+		
+		self.record(Journal.RESET)
+		self.clearGame()
+	
+	# clearGame() - Forgets the game, with nothing sent.
+	def clearGame(self):
+		self.state = UNO_STATE_STOPPED
+		self.game = None
+		self.game_seed = None
+		self.moves = None
+		self.players = None
+		self.paused = False
+		self.stopTimer("game")
+	
+	# pause() - Holds the game while the bot is disconnected.
+	def pause(self):
+		
+		# Only games in progress need holding, and their clocks stopped.
+		if self.state != UNO_STATE_STOPPED:
+			self.paused = True
+			
+			for name in self.timers.keys():
+				self.stopTimer(name)
+	
+	# resume() - Picks a held game back up once we're back in the channel.
+	def resume(self, bot):
+		
+		if self.paused:
+			self.paused = False
+			
+			with bot.batch():
+				
+				# Let everyone know where we were.
+				if self.state == UNO_STATE_STARTED:
+					player = self.players[self.game.turn_index]
+					
+					bot.sendMessage(self.channel, "Sorry about that, the game continues! Top card is " + self.topString() + ".")
+					bot.sendMessage(self.channel, "It's " + player["nick"] + "'s turn!")
+					self.sendPlayerHand(bot, self.game.turn_index)
+					self.requestAiMove(bot)
+					self.startTimer(bot, "game", TURN_TIMEOUT, self.turnTimeout)
+					
+				elif self.state == UNO_STATE_STARTING:
+					bot.sendMessage(self.channel, "Sorry about that, players can still \"join\" the game.")
+					self.startTimer(bot, "game", LOBBY_TIMEOUT, self.lobbyTimeout)
+			
+			# Give everyone time to come back before we count as idle.
+			self.keepAlive(bot)
+		
+		
+# ----------------------------------------------------------------------------------
+# ------- Timer Functions ----------------------------------------------------------
+# ----------------------------------------------------------------------------------
+	
+	# startTimer() - Calls handler(bot) from the mailbox after delay seconds,
+	# replacing any timer of the same name.
+	def startTimer(self, bot, name, delay, handler):
+		self.stopTimer(name)
+		
+		self.timer_serial += 1
+		handle = bot.callLater(delay, self.send, self.runTimer, bot, name, self.timer_serial, handler)
+		self.timers[name] = (self.timer_serial, handle)
+	
+	# stopTimer() - Cancels a timer, if it's running.
+	def stopTimer(self, name):
+		timer = self.timers.pop(name, None)
+		
+		if timer is not None:
+			timer[1].cancel()
+	
+	# runTimer() - Runs a timer's handler from the mailbox. One stopped or
+	# replaced after it fired, but before it got here, is ignored.
+	def runTimer(self, bot, name, serial, handler):
+		
+		timer = self.timers.get(name)
+		if timer is None or timer[0] != serial:
+			return
+		del self.timers[name]
+		
+		# Nothing counts down while we're held, resume() starts again.
+		if self.paused:
+			return
+		
+		Metrics.getRegistry().counter("uno_timeouts_total", "Turns, lobbies and tables that timed out.", timer=name).inc()
+		
+		with bot.batch():
+			handler(bot)
+	
+	# keepAlive() - Notes that a person used the table, and starts watching
+	# for it going unused.
+	def keepAlive(self, bot):
+		self.last_active = time.time()
+		
+		# Checked when it fires rather than restarted every command.
+		if not "idle" in self.timers:
+			self.startTimer(bot, "idle", IDLE_TIMEOUT, self.idleTimeout)
+	
+	# turnTimeout() - Draws and passes for a player who took too long.
+	def turnTimeout(self, bot):
+		
+		if self.state != UNO_STATE_STARTED:
+			return
+		
+		player_index = self.game.turn_index
+		player = self.players[player_index]
+		
+		bot.sendMessage(self.channel, player["nick"] + " took too long.")
+		
+		# They owe the card they would have drawn.
+		if not self.game.canpass and self.game.canDraw():
+			self.game.draw(player_index, 1)
+			self.record(Journal.DRAW, Journal.PLAYER_FIELDS.pack(player_index, 1))
+			bot.sendMessage(self.channel, player["nick"] + " drew a card. They now have "+str(len(player["hand"]))+" cards.")
+		
+		bot.sendMessage(self.channel, player["nick"] + " passed their turn.")
+		
+		if self.game.canpass:
+			self.setCanPass(False)
+		
+		self.doTurn(bot)
+	
+	# lobbyTimeout() - Deals a lobby left open too long, or stops it if
+	# nobody joined.
+	def lobbyTimeout(self, bot):
+		
+		if self.state != UNO_STATE_STARTING:
+			return
+		
+		if len(self.players) >= 2:
+			bot.sendMessage(self.channel, "Time's up, dealing the cards!")
+			self.unoStartGame(bot)
+		else:
+			owner = self.gameowner
+			self.resetUno(bot)
+			bot.sendMessage(self.channel, "Nobody joined " + owner + "'s game, so it's been stopped.")
+	
+	# idleTimeout() - Stops the game at a table nobody has used in a while,
+	# then asks to be dropped.
+	def idleTimeout(self, bot):
+		
+		# Used since we started counting, count the rest.
+		remaining = self.last_active + IDLE_TIMEOUT - time.time()
+		if remaining > 0:
+			self.startTimer(bot, "idle", remaining, self.idleTimeout)
+			return
+		
+		if self.state != UNO_STATE_STOPPED:
+			self.resetUno(bot)
+			bot.sendMessage(self.channel, "Nobody has played for a while, so the game has been stopped.")
+		
+		if self.idle is not None:
+			self.idle(self)
+	
+	# send() - Queues a call to run on this table. Returns False, and drops
+	# the call, once the table is closed.
+	def send(self, function, *args):
+		with self.close_lock:
+			if self.closed:
+				return False
+			
+			super(UnoTable, self).send(function, *args)
+			return True
+	
+	# close() - Closes the table, if nothing is waiting in the mailbox and
+	# there's no game. Returns True if it closed.
+	def close(self):
+		with self.close_lock:
+			if self.pending() or self.state != UNO_STATE_STOPPED:
+				return False
+			
+			self.closed = True
+		
+		for name in self.timers.keys():
+			self.stopTimer(name)
+		
+		return True
+	
+# ----------------------------------------------------------------------------------
+# ------- Tool Functions -----------------------------------------------------------
+# ----------------------------------------------------------------------------------
+	
+	# playableCards() - Returns the mask of cards in a player's hand that can be played.
+	def playableCards(self, player_index):
+		return self.game.playable(player_index)
+	
+	# nextTurn() - Moves the game on to the next player.
+	def nextTurn(self):
+		self.game.nextTurn()
+		self.record(Journal.TURN)
+	
+	# setCanPass() - Sets whether the current player may pass.
+	def setCanPass(self, canpass):
+		self.game.canpass = canpass
+		self.record(Journal.CANPASS, Journal.FLAG_FIELDS.pack(canpass))
+	
+# ----------------------------------------------------------------------------------
+# ------- Player Functions ---------------------------------------------------------
+# ----------------------------------------------------------------------------------
+	
+	# addPlayer() - Adds a player to the current game, a computer player if
+	# given a difficulty.
+	def addPlayer(self, bot, nick, ai=None):
+		
+		# Check they are not already in the game.
+		if not self.isPlayerInGame(nick):
+			
+			# Deal them in, and append them onto the players array.
+			player_index = self.game.addPlayer()
+			self.players.append({"nick":nick, "hand":self.game.hands[player_index], "auto":False, "ai":ai, "played":0})
+			self.record(Journal.JOIN, nick + (ai and "\0" + ai or ""))
+			
+			# If they are not the initiator.
+			if self.gameowner is not nick:
+				
+				# Announce their join.
+				bot.sendMessage(self.channel, nick + " has joined the game!")
+	
+	# sendPlayerHand() - Sends a notice to a player with their current hand.
+	def sendPlayerHand(self, bot, player_index):
+		
+		# Computer players can see their cards already.
+		if self.players[player_index]["ai"]:
+			return
+		
+		# Get their nick and hand.
+		nick = self.players[player_index]["nick"]
+		hand = self.players[player_index]["hand"]
+		
+		# Colourize their cards, once per change to the hand.
+		if hand.cache is None:
+			hand.cache = self.deckString(hand)
+		hand_string = hand.cache
+		
+		# Send the hand.
+		bot.sendNotice(nick, "Hand: " + hand_string)
+	
+	# recordStats() - Counts a finished game in the statistics. Computer
+	# players aren't counted, only the people they played.
+	def recordStats(self, winner):
+		if self.stats is not None:
+			self.stats.recordGame(self.channel, winner, [(player["nick"], player["played"]) for player in self.players if not player["ai"]])
+	
+	# archiveGame() - Keeps a finished game in the archive: it's seed, moves
+	# and everyone's hands.
+	def archiveGame(self, winner_index):
+		if self.moves is not None:
+			players = [(player["nick"], player["ai"], player["played"], list(player["hand"])) for player in self.players]
+			self.archive.recordGame(self.channel, self.game_seed, players, winner_index, "".join(self.moves))
+	
+	# getIndexForNick() - Returns the index of the specified nick.
+	def getIndexForNick(self, nick):
+		
+		# Loop players, till we find the right nick.
+		for index, player in enumerate(self.players):
+			
+			# If this is the right nick, return the index.
+			if player["nick"] == nick:
+				return index
+	
+	# isPlayerInGame() - Returns True if player is in game.
+	def isPlayerInGame(self, nick):
+		
+		# Loop the players.
+		for player in self.players:
+			if player["nick"] == nick:
+				return True
+		
+		# Defualt return false.
+		return False
+	
+	# givePlayerVoice() - Gives the player Voice (For players)
+	def givePlayerVoice(self, bot, nick):
+		bot.sendAddMode(self.channel, nick, "v")
+		
+	# givePlayerHop() - Give a player hop (party owner)
+	def givePlayerHop(self, bot, nick):
+		bot.sendAddMode(self.channel, nick, "h")
+		
+	# takePlayerVoice() - Takes the player Voice (For players)
+	def takePlayerVoice(self, bot, nick):
+		bot.sendRemMode(self.channel, nick, "v")
+		
+	# takePlayerHop() - Take a player hop (party owner)
+	def takePlayerHop(self, bot, nick):
+		bot.sendRemMode(self.channel, nick, "h")
+		
+	
+# ----------------------------------------------------------------------------------
+# ------- Deck Functions -----------------------------------------------------------
+# ----------------------------------------------------------------------------------
+	
+	# deckString() - Returns a string with all of the cards in the deck, colored.
+	def deckString(self, deck):
+		
+		# Hands are counts, so each card is rendered once however many are held.
+		if isinstance(deck, Cards.Hand):
+			counts = deck.counts
+			return "".join([HAND_STRINGS[card] * counts[card] for card in range(Cards.CARD_COUNT) if counts[card]])
+		
+		return "".join([HAND_STRINGS[card] for card in deck])
+	
+# ----------------------------------------------------------------------------------
+# ------- Card Functions -----------------------------------------------------------
+# ----------------------------------------------------------------------------------
+	
+	# cardString() - Returns the card name including colours.
+	def cardString(self, card):
+		return CARD_STRINGS[card]
+	
+	# topString() - Returns the top card including colours. A played wild
+	# shows as the colour that was chosen.
+	def topString(self):
+		if Cards.isWild(self.game.last_card) and self.game.top_color is not None:
+			return TOP_COLOR_STRINGS[self.game.top_color]
+		
+		return CARD_STRINGS[self.game.last_card]
+	
+# ----------------------------------------------------------------------------------
+# ------- Journal Functions --------------------------------------------------------
+# ----------------------------------------------------------------------------------
+	
+	# record() - Records a change to the game, if we have a journal, and
+	# the moves for the archive.
+	def record(self, kind, payload=""):
+		self.recordMove(kind, payload)
+		
+		if self.journal is not None:
+			self.journal.record(self.channel, kind, payload)
+	
+	# recordMove() - Keeps a change that's a move, if we're keeping them.
+	def recordMove(self, kind, payload):
+		if self.moves is not None and kind in Archive.MOVE_SIZES:
+			self.moves.append(Archive.encodeMove(kind, payload))
+	
+	# encodeSnapshot() - Returns the whole table as a snapshot, None if there's no game.
+	def encodeSnapshot(self):
+		if self.state == UNO_STATE_STOPPED:
+			return None
+		
+		players = [(player["nick"], player["ai"] or "", player["auto"], player["played"]) for player in self.players]
+		moves = "".join(self.moves) if self.moves is not None else None
+		return Journal.encodeSnapshot((self.state, self.gameowner, players, self.game.getState(), self.game_seed, self.game.random.shuffles, moves))
+	
+	# snapshotJournal() - Writes our snapshot to the journal being compacted.
+	# Runs from the mailbox, so it's in order with our records.
+	def snapshotJournal(self):
+		self.journal.snapshot(self.channel, self.encodeSnapshot())
+	
+	# replayRecord() - Applies one journal record, rebuilding the game with
+	# nothing sent. Call startJournal() once every record is in.
+	def replayRecord(self, kind, payload):
+		
+		if kind == Journal.GAME:
+			self.gameowner, separator, seed = payload.partition("\0")
+			self.game_seed = Journal.SEED_FIELDS.unpack(seed)[0]
+			self.game = Engine.Game(Engine.GameRandom(self.game_seed))
+			if self.archive is not None:
+				self.moves = []
+			self.state = UNO_STATE_STARTING
+			self.players = []
+		
+		elif kind == Journal.JOIN:
+			nick, separator, ai = payload.partition("\0")
+			player_index = self.game.addPlayer()
+			self.players.append({"nick":nick, "hand":self.game.hands[player_index], "auto":False, "ai":ai or None, "played":0})
+		
+		elif kind == Journal.START:
+			self.game.start()
+			self.state = UNO_STATE_STARTED
+		
+		elif kind == Journal.TURN:
+			self.game.nextTurn()
+		
+		elif kind == Journal.PLAY:
+			player_index, card, color = Journal.PLAY_FIELDS.unpack(payload)
+			self.game.play(player_index, card, None if color == Cards.NO_COLOR else color)
+			self.players[player_index]["played"] += 1
+		
+		elif kind == Journal.DRAW:
+			player_index, amount = Journal.PLAYER_FIELDS.unpack(payload)
+			self.game.draw(player_index, amount)
+		
+		elif kind == Journal.CANPASS:
+			self.game.canpass = bool(Journal.FLAG_FIELDS.unpack(payload)[0])
+		
+		elif kind == Journal.AUTO:
+			player_index, auto = Journal.PLAYER_FIELDS.unpack(payload)
+			self.players[player_index]["auto"] = bool(auto)
+		
+		elif kind == Journal.RESET:
+			self.clearGame()
+		
+		elif kind == Journal.SNAPSHOT:
+			self.state, self.gameowner, players, game_state, self.game_seed, shuffles, moves = Journal.decodeSnapshot(payload)
+			self.game = Engine.fromState(Engine.GameRandom(self.game_seed, shuffles), game_state)
+			self.players = [{"nick":nick, "hand":self.game.hands[player_index], "auto":auto, "ai":ai or None, "played":played} for player_index, (nick, ai, auto, played) in enumerate(players)]
+			self.moves = [moves] if moves is not None and self.archive is not None else None
+		
+		self.recordMove(kind, payload)
+	
+	# startJournal() - Starts recording to the journal. A recovered game is
+	# held until we're back in the channel, see resume().
+	def startJournal(self, journal):
+		self.journal = journal
+		self.pause()
@@ -0,0 +1,106 @@
+# Writer.py
+# --------------------------------------------------------------------------
+
+# The write-behind loop the statistics and the game archive both use. Each
+# store has a BatchWriter, and so a thread, of it's own: items are queued
+# from any thread and the writer's thread hands them to it's store in
+# batches, waiting a moment after the first so a busy spell costs one write
+# rather than one each.
+#
+# A batch that fails to write is logged, counted and dropped, and the writer
+# carries on; flush() always returns once everything queued before it has
+# been tried. Stores that need to undo a half written batch do so before
+# raising.
+
+import Queue
+import threading
+import time
+import traceback
+
+# ------- Constants ------------------------------------------------------------
+
+# What's queued, besides items.
+FLUSH = 0
+STOP = 1
+
+# ------------------------------------------------------------------------------
+
+class BatchWriter(object):
+	"""Calls write(items) from a thread of it's own with batches of what
+	put() queued."""
+
+	def __init__(self, name, write, interval, errors):
+		"""Constructor. Starts the thread. errors is a Metrics counter of
+		batches that failed."""
+		self.write = write
+		self.interval = interval
+		self.errors = errors
+
+		self.__queue = Queue.Queue()
+
+		self.__thread = threading.Thread(target=self.writeLoop, name=name)
+		self.__thread.daemon = True
+		self.__thread.start()
+
+	def put(self, item):
+		"""Queues an item for the next batch."""
+		self.__queue.put((None, item))
+
+	def pending(self):
+		"""Returns roughly how many items are waiting, for a gauge."""
+		return self.__queue.qsize()
+
+	def writeLoop(self):
+		"""Writes queued items in batches. Runs in it's own thread."""
+		while True:
+			entry = self.__queue.get()
+
+			# Let a batch build up behind the first item.
+			if self.interval:
+				time.sleep(self.interval)
+
+			items = []
+			waiting = []
+			stopping = False
+
+			while entry is not None:
+				kind, value = entry
+				if kind is None:
+					items.append(value)
+				elif kind == FLUSH:
+					waiting.append(value)
+				else:
+					stopping = True
+
+				try:
+					entry = self.__queue.get_nowait()
+				except Queue.Empty:
+					entry = None
+
+			# A failed write mustn't stop the writer, or leave flush()
+			# waiting.
+			if items:
+				try:
+					self.write(items)
+				except Exception:
+					traceback.print_exc()
+					self.errors.inc()
+
+			# Everything flush() was waiting for has been tried.
+			for event in waiting:
+				event.set()
+
+			if stopping:
+				return
+
+	def flush(self):
+		"""Waits until every item queued so far has been written, or has
+		failed to be."""
+		event = threading.Event()
+		self.__queue.put((FLUSH, event))
+		event.wait()
+
+	def close(self):
+		"""Writes anything queued and stops the thread."""
+		self.__queue.put((STOP, None))
+		self.__thread.join()
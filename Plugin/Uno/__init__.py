@@ -1,36 +1,48 @@
-
 # _init_.py
 # --------------------------------------------------------------------------
 
-# Player Array:
-# 
-# UnoPlugin.players = [
-#	[player_index]:{
-#			"nick":[player_nick],
-#			"hand":[player_hand]
-#		}
-# ]
-
-# Cards are divided up as follows in a new deck:
-# 19 Blue Cards (1 x b0, 2 x b1-b9)
-# 19 Green Cards (1 x g0, 2 x g1-g9)
-# 19 Red Cards (1 x r0, 2 x r1-r9)
-# 19 Yellow Cards (1 x y0, 2 x y1-y9)
-# 8 Draw Two cards (2 in each colour)
-# 8 Reverse Cards (2 in each colour)
-# 8 Skip Cards (2 in each colour)
-# 4 Wild Cards
-# 4 Wild Draw 4 cards
+# Table Dictionary:
+#
+# UnoPlugin.tables = {
+#	"[channel_key]":[UnoTable]
+# }
+#
+# Each channel gets it's own table, see Table.py. Game commands are looked up
+# by channel and forwarded to that table's mailbox. A table nobody has used
+# in a while closes and is dropped, and made again if the channel comes back.
+#
+# With the "journal" config set, every table's changes are journaled to that
+# file (see Journal.py) and on load the tables are rebuilt from it, so games
+# carry on after a crash or restart.
+#
+# Finished games are counted in the players' statistics, see Stats.py, kept
+# in the SQLite database set by the "stats" config, or in memory if unset.
+# With the "archive" config set they're also kept whole, seed, moves and
+# hands, in the game archive in that directory, see Archive.py.
 
+import itertools
 import random
+import threading
+import time
 import Plugin
+import DeeIRC.Events as Events
+import DeeIRC.Metrics as Metrics
+import DeeIRC.SendQueue as SendQueue
 import DeeIRC.Utils as Utils
 
+import Archive
+import Journal
+import Stats
+
+from Table import UnoTable, UNO_STATE_STOPPED, UNO_STATE_STARTING, UNO_STATE_STARTED
+
 # ------- Constants ------------------------------------------------------------
 
-UNO_STATE_STOPPED = 0
-UNO_STATE_STARTING = 1
-UNO_STATE_STARTED = 2
+# Games "games" lists.
+RECENT_GAMES = 5
+
+# Commands waiting on one table before more are turned away.
+TABLE_QUEUE = 32
 
 # ------------------------------------------------------------------------------
 
@@ -41,37 +53,51 @@ class UnoPlugin(Plugin.Plugin):
 	def load(self, bot):
 		
 		# Uno turns bot on.
-		self.addCommand("uno", self.commandUno)
+		self.addCommand("uno", self.tableCommand("commandUno"), direct=True)
 		
 		# Join allows players to join the current game.
-		self.addCommand("join", self.commandJoin)
+		self.addCommand("join", self.tableCommand("commandJoin"), direct=True)
 		
 		# Stop the current game.
-		self.addCommand("stop", self.commandStop)
+		self.addCommand("stop", self.tableCommand("commandStop"), direct=True)
+		
+		# Add a computer player.
+		self.addCommand("ai", self.tableCommand("commandAi"), direct=True)
 		
 		# Deal initiates the current game.
-		self.addCommand("deal", self.commandDeal)
+		self.addCommand("deal", self.tableCommand("commandDeal"), direct=True)
 		
 		# Play sets cards into play.
-		self.addCommand("play", self.commandPlay)
-		self.addCommand("p", self.commandPlay)
+		self.addCommand("play", self.tableCommand("commandPlay"), direct=True)
+		self.addCommand("p", self.tableCommand("commandPlay"), direct=True)
 		
 		# Draw card draws a card to the players deck.
-		self.addCommand("draw", self.commandDraw)
-		self.addCommand("d", self.commandDraw)
+		self.addCommand("draw", self.tableCommand("commandDraw"), direct=True)
+		self.addCommand("d", self.tableCommand("commandDraw"), direct=True)
 		
 		# Pass turn.
-		self.addCommand("pass", self.commandPass)
+		self.addCommand("pass", self.tableCommand("commandPass"), direct=True)
 		
 		# Show hand to player.
-		self.addCommand("cards", self.commandCards)
-		self.addCommand("hand", self.commandCards)
+		self.addCommand("cards", self.tableCommand("commandCards"), direct=True)
+		self.addCommand("hand", self.tableCommand("commandCards"), direct=True)
 		
 		# Display top card.
-		self.addCommand("top", self.commandTop)
+		self.addCommand("top", self.tableCommand("commandTop"), direct=True)
 		
 		# Display current turn
-		self.addCommand("turn", self.commandTurn)
+		self.addCommand("turn", self.tableCommand("commandTurn"), direct=True)
+		
+		# Show which cards can be played.
+		self.addCommand("hint", self.tableCommand("commandHint"), direct=True)
+		
+		# Toggle drawing and passing automatically.
+		self.addCommand("auto", self.tableCommand("commandAuto"), direct=True)
+		
+		# Player statistics.
+		self.addCommand("stats", self.commandStats)
+		self.addCommand("leaders", self.commandLeaders)
+		self.addCommand("games", self.commandGames)
 		
 		# Admin Commands
 		self.addCommand("admin", self.commandAdmin)
@@ -80,500 +106,311 @@ class UnoPlugin(Plugin.Plugin):
 		self.addCommand("help", self.commandHelp)
 		self.addCommand("commands", self.commandHelp)
 		
-		# Set default states.
-		self.state = UNO_STATE_STOPPED
-		self.deck = None
-		self.pile = None
-		self.channel = None
-		self.players = None
-		self.turn_index = None
-		self.reverse = False
-		self.last_card = False
-		self.gameowner = None
-		self.canpass = False
+		# One table per channel, created when first used. Table seeds come
+		# from the global generator, which a capture seeds.
+		self.tables = {}
+		self.seed = random.getrandbits(64)
+		self.tables_lock = threading.Lock()
+		
+		# Channels and nicks are keyed the way the server folds them, which
+		# it may only tell us once we're connected. Stand-in bots have no
+		# membership, so fold the rfc1459 way.
+		self.members = getattr(bot, "members", None)
+		self.casemapping = self.members.casemapping if self.members is not None else "rfc1459"
+		
+		# Counted when scraped, rather than kept up to date by every table.
+		registry = Metrics.getRegistry()
+		registry.gauge("uno_tables_active", "Tables with a lobby open or a game running.").setFunction(self.countActiveTables)
+		registry.gauge("uno_players_active", "Players at tables with a lobby open or a game running.").setFunction(self.countActivePlayers)
+		
+		# Hold games over a lost connection.
+		self.events = {
+			"disconnected":UnoDisconnectedEvent(),
+			"self_join":UnoSelfJoinEvent(),
+		}
+		for event_type, event in self.events.items():
+			bot.addEvent(event_type, event)
 		
-# ----------------------------------------------------------------------------------
-# ------- Command Handlers ---------------------------------------------------------
-# ----------------------------------------------------------------------------------
-	
-	# commandUno() - Begins a new game of Uno.
-		# - Checks is game is running.
-		# - Creates a new deck, shuffles it.
-		# - Creates a new pile.
-		# - Sets up the channel target.
-		# - Sets current state to UNO_STATE_STARTING
-		# - Announces game started.
-		# - Set the current user to the game owner.
-		# - Add the current player to the game.
-	
-	def commandUno(self, bot, nick, target, message):
+		# Totals for every player are loaded now, so stats are answered from memory.
+		self.stats = Stats.StatsStore(bot.config.get("stats") or ":memory:", casemapping=self.casemapping)
 		
-		# Confirm no game in progress.
-		if self.state == UNO_STATE_STOPPED:
-			
-			# Start Uno by initalizing the deck and pile.
-			self.deck = self.createDeck()
-			self.shuffleDeck(self.deck)
-			self.pile = []
-			
-			# Setup the plugin for starting.
-			self.channel = target
-			self.state = UNO_STATE_STARTING
-			
-			# Print some messages.
-			bot.sendMessage(target, nick + " has started a game of Uno. Players can now \"join\".")
-			bot.sendNotice(nick, "You need to use \"deal\" when you are ready to start your game.")
-			
-			# Set the game's owner.
-			self.gameowner = nick
-			
-			# Setup the players.
-			self.players = []
-			self.addPlayer(bot, nick)
-			
-			# Give HOP to owner
-			self.givePlayerHop(bot, nick)
+		# Only the names are loaded, games are read from disk when asked for.
+		self.archive = None
+		if bot.config.get("archive"):
+			self.archive = Archive.GameArchive(bot.config.get("archive"), casemapping=self.casemapping)
+		
+		# Put back the games we had, then journal from here on.
+		self.journal = None
+		journal_path = bot.config.get("journal")
+		
+		if journal_path:
+			self.recoverTables(bot, journal_path)
 			
-		# Already a game in progress.
-		elif self.state == UNO_STATE_STARTING or self.state == UNO_STATE_STARTED:
-			if not self.isPlayerInGame(nick):
-				self.commandJoin(bot, nick, target, message)
-			else:
-				bot.sendNotice(nick, "You are already in the current game.")
+			self.journal = Journal.Journal(journal_path)
+			self.journal.compactor = self.compactJournal
+			for table in self.tables.values():
+				table.startJournal(self.journal)
 	
-	# commandJoin() - Allows player to join the current game.
-		# - Checks game is in progress.
-		# - Checks the player is not in the game.
-		# - Adds the player to the game.
-	
-	def commandJoin(self, bot, nick, target, message):
+	# Onunload Cleanup.
+	def unload(self, bot):
 		
-		# Check there is a game in progress.
-		if self.state == UNO_STATE_STARTING or self.state == UNO_STATE_STARTED:
+		for event_type, event in self.events.items():
+			bot.removeEvent(event_type, event)
 		
-			# Confirm they are not in the game.
-			if not self.isPlayerInGame(nick):
-				
-				# Add then to the game.
-				self.addPlayer(bot, nick)
-				
-				# Give voice to players
-				self.givePlayerVoice(bot, nick)
-				
-			else:
-				bot.sendNotice(nick, "You are already in the game.")
-		else:
-			bot.sendNotice(nick, "There is no current game, you can create one using \"uno\".")
-	
-	# commandDeal() - Starts the game by dealing cards.
-		# - Checks game is in lobby state.
-		# - Deals cards to the players.
-	
-	def commandDeal(self, bot, nick, target, message):
+		if self.journal:
+			self.journal.close()
 		
-		# Check this is the owner or is an admin.
-		if self.gameowner == nick or bot.isAdmin(nick):
-			
-			# Check if game in lobby
-			if self.state == UNO_STATE_STARTING:
-				
-				# Deal the cards.
-				self.unoStartGame(bot)
-				
-			# In progress or not started.
-			elif self.state == UNO_STATE_STOPPED or self.state == UNO_STATE_STARTED:
-				
-				# Cant deal now.
-				bot.sendNotice(nick, "You can't do that now.")
-			
-		else:
-			bot.sendNotice(nick, "You need to be the owner of the game to start it.")
-	
-	
-	# commandPlay() - Allows a player to play a card.
-		# - Confirm a game is in progress.
-		# - Confirm the player specified a card.
-		# - Check if it is their turn.
-		# - Check if they played a wild card, and confirm they have it.
-		# - Check if they played a normal card, and confirm they have it.
-		# - Remove the card from their hand, and add it to the pile.
-		# - Update the top card reference.
-		# - Set their turn to played.
-		# - Announce what card was played.
-		# - Check for winning player.
-		# - Announce amount of cards remaining.
-		# - Continue to next players turn.
-	
-	def commandPlay(self, bot, nick, target, message):
+		self.stats.close()
 		
-		# Confirm game is in progress.
-		if self.state == UNO_STATE_STARTED:
-			
-			# Confirm a card is played.
-			if message:
-				
-				# make it lower case.
-				message = message.lower()
-				
-				# strip whitespace
-				message = message.strip()
-				
-				# Get the current player
-				player_index = self.turn_index
-				player = self.players[player_index]
-				
-				# Make sure that it's the players turn.
-				if player["nick"] == nick:
-						
-						turn_played = False
-						
-						# if the first letter is w
-						if message[0] == "w":
-							
-							# Wild draw 4 and confirm they have it
-							if message[1:3] == "d4" and "wd4" in player["hand"]:
-								
-								color = message[4:5]
-								
-								if self.isValidColor(color):
-									
-									# Remove the card from the player.
-									self.removeCardFromHand(player_index, "wd4")
-									
-									# Draw four. Get the next player.
-									next_player_index = self.getNextPlayerIndex()
-									next_player = self.players[next_player_index]
-									
-									# Place 4 cards in next players hand
-									self.drawCards(next_player_index, 4)
-									
-									# Print a message and send the player their hand.
-									bot.sendMessage(target, next_player["nick"] + " draws four cards.")
-									self.sendPlayerHand(bot, next_player_index)
-									
-									# Top of pile.
-									self.last_card = color
-									bot.sendMessage(target, "Top card is now: " + self.cardString(self.last_card))
-									
-									# Skip next players turn.
-									self.skipTurn()
-										
-									# mark that we played a turn.
-									turn_played = True
-									
-								else:
-									bot.sendNotice(nick, "Please specify a colour.")
-								
-							# wild normal
-							elif "w" in player["hand"]:
-								
-								color = message[2:3]
-								
-								# Check for valid color
-								if self.isValidColor(color):
-									
-									# Remove the card from the the palyer
-									self.removeCardFromHand(player_index, "w")
-									
-									# Top of pile.
-									self.last_card = color
-									bot.sendNotice(nick, "Top card is now: " + self.cardString(self.last_card))
-									
-									# We did indeed play a turn.
-									turn_played = True
-								else:
-									bot.sendNotice(nick, "Please specify a colour.")
-							else:
-								bot.sendNotice(nick, "You don't have that card!")
-						
-						elif len(message) >= 2:
-							if message[0] == self.last_card[0] or message[1] == self.last_card[1] or self.last_card == "w" or self.last_card == "wd4":
-								
-								# Make sure the player actually has that card.
-								if message in player["hand"]:
-									
-									# Reverse Card
-									if message[1] == "r":
-										
-										# Reverse play
-										self.reverse = not self.reverse
-										
-									# Skip Card
-									elif message[1] == "s":
-									
-										# Skip. Get the next player.
-										next_player = self.players[self.getNextPlayerIndex()]
-										
-										# Print out a message.
-										bot.sendMessage(target, next_player["nick"] + " skips their turn.")	
-											
-										# Skip their turn.
-										self.skipTurn()
-										
-									# Draw Two Card
-									elif message[1:3] == "d2":
-										
-										# Draw two.	Get the next player.
-										next_player_index = self.getNextPlayerIndex()
-										next_player = self.players[next_player_index]
-										
-										# Move the cards from the deck to the player's hands.
-										self.drawCards(next_player_index, 2)
-										
-										# Print a message and send the player their hand.
-										bot.sendMessage(target, next_player["nick"] + " draws two cards.")
-										self.sendPlayerHand(bot, next_player_index)
-											
-										# Skip the turn.
-										self.skipTurn()
-										
-									# Remove the card from the player's hand.
-									self.removeCardFromHand(player_index, message)
-									
-									# Set top card
-									self.last_card = message
-									
-									# Yep.
-									turn_played = True
-								else:
-									bot.sendNotice(nick, "You don't have that card!")
-							else:
-								bot.sendNotice(nick, "You can't play that card!")
-						
-						else:
-								bot.sendNotice(nick, "Please specify a proper colour.")
-						
-						# Send a message to the channel and send the player's hand.
-						if turn_played:
-							
-							# Card played.
-							bot.sendMessage(target, player["nick"] + " played " + self.cardString(self.last_card)+".")
-							
-							# A player just won!
-							if len(player["hand"]) == 0:
-								
-								# Print out messages to the channel.
-								bot.sendMessage(self.channel, nick + " has won the game!")
-								bot.sendMessage(self.channel, "\o/ " + nick + "\o/ ")
-								bot.sendMessage(self.channel, "/o/ " + nick + "/o/ ")
-								bot.sendMessage(self.channel, "\o\ " + nick + "\o\ ")
-								bot.sendMessage(self.channel, "/o/ " + nick + "/o/ ")
-								bot.sendMessage(self.channel, "\o\ " + nick + "\o\ ")
-								
-								# Reset the uno game.
-								self.resetUno(bot)
-								
-							else:
-								
-								# Cards remaining!
-								bot.sendMessage(target, nick + " now has "+str(len(player["hand"]))+" cards left.")
-								
-								# Send players hand.
-								self.sendPlayerHand(bot, player_index)
-								
-								# Run the next turn.
-								self.doTurn(bot)
-				else:
-					bot.sendNotice(nick, "It's not your turn!")
-			else:
-				bot.sendNotice(nick, "Please choose a card to play.")
-		else:
-			bot.sendNotice(nick, "There is no game in progress.")
+		if self.archive:
+			self.archive.close()
 	
-	# commandDraw() - Allows a player to draw a card.
-		# - Confirm a game is in progress.
-		# - Check the user has not already drawn a card.
-		# - Make sure it's this players turn.
-		# - Add card to players hand.
-		# - Announce they drew a card.
-		# - Send their hand.
-		# - Allow them to pass.
+# ----------------------------------------------------------------------------------
+# ------- Table Manager ------------------------------------------------------------
+# ----------------------------------------------------------------------------------
 	
-	def commandDraw(self, bot, nick, target, message):
+	# tableCommand() - Returns a command handler that forwards to the
+	# channel's table. It runs on the dispatch thread, so it only queues.
+	def tableCommand(self, command_name):
 		
-		# Make sure game in progress.
-		if self.state == UNO_STATE_STARTED:
+		def command(bot, nick, target, message):
 			
-			# Get the current player and card.
-			player = self.players[self.turn_index]
-			player_index = self.turn_index
+			# Games only happen in channels.
+			if not Utils.isChannel(target):
+				bot.sendNotice(nick, "Use that command in a game channel.")
+				return
 			
-			# Check if drawn card.
-			if self.canpass == False:
-				
-				# Make sure it's the player using the command.
-				if player["nick"] == nick:
-					
-					# Move the cards from the deck to the player's hand.
-					self.moveCards(self.deck, player["hand"], 1)
-					
-					# Send a message to the channel and send the player's hand.
-					bot.sendMessage(target, player["nick"] + " drew a card. They now have "+str(len(player["hand"]))+" cards.")
-					
-					# Send players hand.
-					self.sendPlayerHand(bot, player_index)
-					
-					# They can now pass.
-					self.canpass = True
+			table = self.getTable(target)
 			
-			else:
-				bot.sendNotice(nick, "You cannot draw another card, you must either play or \"pass\".")
-		else:
-			bot.sendNotice(nick, "There is no game in progress.")
-	
-	# commandPass() - Allows a player to pass their turn.
-		# - Confirm a game is in progress.
-		# - Checks they are allowed to pass.
-		# - Checks it is their turn.
-		# - Announce they passed.
-		# - Continue to the next player.
-	
-	def commandPass(self, bot, nick, target, message):
-		
-		# Check for game in progress.
-		if self.state == UNO_STATE_STARTED:
+			# A flood in one channel mustn't pile up without end.
+			if table.pending() >= TABLE_QUEUE:
+				bot.error("Too busy, dropped command(" + command_name + ") for " + target + " from " + nick)
+				bot.sendNotice(nick, "Sorry, the table is too busy to take that, try again in a moment.")
+				return
 			
-			# Check if drawn card.
-			if self.canpass == True:
-				
-				# Get the current player and card.
-				player = self.players[self.turn_index]
-				player_index = self.turn_index
-				
-				# Make sure it's the player using the command.
-				if player["nick"] == nick:
-					
-					# Pass turn.
-					bot.sendMessage(self.channel, nick + " passed their turn.")
-					
-					# Can no longer pass.
-					self.canpass = False
-					
-					# Next turn.
-					self.doTurn(bot)
-					
-			else:
-				bot.sendNotice(nick, "You need to \"draw\" a card first.")
-		else:
-			bot.sendNotice(nick, "There is no game in progress.")
+			# Queue the command on the channel's table. One that closed as
+			# we got it is gone, so the next getTable() makes a new one.
+			while not table.send(table.runCommand, bot, command_name, nick, target, message):
+				table = self.getTable(target)
+		
+		return command
 	
-	# commandStop() - Allows the games owner to stop the game.
-		# - Confirm a game is in progress.
-		# - Confirm they are the owner.
-		# - Reset the game.
-		# - Announce game ended.
+	# foldName() - Returns a channel or nick folded with the server's
+	# casemapping, catching up with it first, see checkCasemapping().
+	def foldName(self, name):
+		self.checkCasemapping()
+		return Utils.lowerNick(name, self.casemapping)
 	
-	def commandStop(self, bot, nick, target, message):
+	# checkCasemapping() - Re-keys the tables, statistics and archive if the
+	# server's casemapping has changed since we last looked.
+	def checkCasemapping(self):
+		if self.members is None or self.members.casemapping == self.casemapping:
+			return
 		
-		# Game in progress
-		if self.state == UNO_STATE_STARTED or self.state == UNO_STATE_STARTING:
+		with self.tables_lock:
+			casemapping = self.members.casemapping
+			if casemapping == self.casemapping:
+				return
 			
-			# Check this is the owner or is an admin.
-			if self.gameowner == nick or bot.isAdmin(nick):
-				
-				# Reset Game
-				self.resetUno(bot)
-					
-				# Print a message.
-				bot.sendMessage(target, nick + " stopped the current game.")
-				
-			else:
-				bot.sendNotice(nick, "You need to be the owner of the game to stop it.")
-				
-		# No game in progress
-		elif self.state == UNO_STATE_STOPPED:
-			bot.sendNotice(nick, "There is no current game.")
+			self.tables = dict([(Utils.lowerNick(table.channel, casemapping), table) for table in self.tables.values()])
+			self.stats.setCasemapping(casemapping)
+			if self.archive:
+				self.archive.setCasemapping(casemapping)
+			self.casemapping = casemapping
 	
-	# commandCards() - Message a user their cards.
-		# - Confirm a game is in progress.
-		# - Confirm the player is in the current game.
-		# - Get the players index.
-		# - Message them their cards.
-	
-	def commandCards(self, bot, nick, target, message):
+	# getTable() - Returns the table for a channel, creating it if needed.
+	def getTable(self, channel):
+		key = self.foldName(channel)
 		
-		# Make sure we are in game
-		if self.state == UNO_STATE_STARTED:
-			
-			# Make sure they are in the game.
-			if self.isPlayerInGame(nick):
-				
-				# Get their index
-				player_index = self.getIndexForNick(nick)
-				
-				# Send hand
-				self.sendPlayerHand(bot, player_index)
+		# Fast path, no lock needed to read.
+		table = self.tables.get(key)
+		
+		if table is None:
+			with self.tables_lock:
 				
-			else:
-				bot.sendNotice(nick, "You are not in this game.")
-		else:
-			bot.sendNotice(nick, "There is no current game.")
+				# Check again, another thread may have beaten us to it.
+				table = self.tables.get(key)
+				if table is None:
+					table = UnoTable(channel, str(self.seed) + key, self.journal, self.stats, self.closeTable, self.archive)
+					self.tables[key] = table
+		
+		return table
+	
+	# closeTable() - Drops a table that's gone unused, unless something was
+	# sent to it meanwhile. Called from the table's mailbox.
+	def closeTable(self, table):
+		key = self.foldName(table.channel)
+		
+		with self.tables_lock:
+			if self.tables.get(key) is table and table.close():
+				del self.tables[key]
+	
+	# recoverTables() - Rebuilds every table from the journal, then rewrites
+	# it as just their snapshots so the next start is as quick.
+	def recoverTables(self, bot, journal_path):
+		start = time.time()
+		records = 0
+		
+		for channel, kind, payload in Journal.readJournals(journal_path):
+			self.getTable(channel).replayRecord(kind, payload)
+			records += 1
+		
+		snapshots = [(table.channel, table.encodeSnapshot()) for table in self.tables.values()]
+		snapshots = [(channel, snapshot) for channel, snapshot in snapshots if snapshot is not None]
+		Journal.rewrite(journal_path, snapshots)
+		
+		# Tables whose games had finished needn't be kept.
+		for key, table in self.tables.items():
+			if table.state == UNO_STATE_STOPPED:
+				del self.tables[key]
+		
+		bot.log("Recovered " + str(len(snapshots)) + " games from " + str(records) + " journal records in " + str(int((time.time() - start) * 1000)) + "ms.")
+	
+	# compactJournal() - Has every table snapshot itself into a new journal.
+	# Called from the journal's thread.
+	def compactJournal(self):
+		
+		# Tables made after this start in the new journal.
+		with self.tables_lock:
+			tables = list(self.tables.values())
+			self.journal.beginCompaction([table.channel for table in tables])
+		
+		# A table that closed meanwhile has no game to move.
+		for table in tables:
+			if not table.send(table.snapshotJournal):
+				self.journal.snapshot(table.channel, None)
+	
+	# countActiveTables() - Number of tables that aren't stopped.
+	def countActiveTables(self):
+		return len([table for table in self.tables.values() if table.state != UNO_STATE_STOPPED])
+	
+	# countActivePlayers() - Number of players at tables that aren't stopped.
+	def countActivePlayers(self):
+		return sum([len(table.players or ()) for table in self.tables.values() if table.state != UNO_STATE_STOPPED])
 	
-	# commandTop() - Announce the top card.
-		# - Confirm a game is in progress.
-		# - Announce the top card.
+# ----------------------------------------------------------------------------------
+# ------- Command Handlers ---------------------------------------------------------
+# ----------------------------------------------------------------------------------
+	
+	# commandHelp() - Send player help message.
+		# - Message the player the help messages.
 	
-	def commandTop(self, bot, nick, target, message):
+	def commandHelp(self, bot, nick, target, message):
+		bot.sendMessage(target, "PMing help message to " + nick)
+		bot.sendNotice(nick, "UnoBot v0.3 Alpha", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "uno", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "- Creates a new game lobby if none already exist.", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "join", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "- Join the current game lobby.", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "ai [easy|normal|hard]", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "- Adds a computer player to the game lobby, the game's owner can use this.", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "deal", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "- Once enough players have joined, this starts the game.", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "play <card> [color]", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "- Play a card, color is optional for wild cards, and should be only a single letter.", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "draw / d", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "- If you cannot play a card, you can use this command to draw a card.", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "pass", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "- Once you have drawn a card, you may pass your turn.", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "hand", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "- Shows your current hand.", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "top", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "- Display the top card of the pile.", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "hint", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "- Shows which of your cards you can play.", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "auto", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "- Turns drawing and passing for you on or off, for when you have nothing to play.", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "stats [nick]", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "- Shows a player's games, wins and cards played, yours if no nick is given.", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "leaders", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "- Shows the players with the most wins.", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "games [nick]", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "- Shows a player's last few games from the archive, yours if no nick is given.", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "", SendQueue.PRIORITY_LOW)
+		bot.sendNotice(nick, "-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-", SendQueue.PRIORITY_LOW)
+	
+	# commandStats() - Show a player's statistics.
+		# - Look up the nick given, or the player asking.
+		# - Reply in the channel, or by notice if asked privately.
+	
+	def commandStats(self, bot, nick, target, message):
+		
+		who = message.strip() or nick
+		self.checkCasemapping()
+		totals = self.stats.getPlayer(who)
+		
+		if totals is None:
+			reply = who + " hasn't finished a game yet."
+		else:
+			who, games, wins, cards = totals
+			reply = who + " has won " + str(wins) + " of " + str(games) + " games (" + str(wins * 100 // games) + "%) and played " + str(cards) + " cards."
 		
-		# Check if we're in a game
-		if self.state == UNO_STATE_STARTED:
-			
-			# Send top card
-			bot.sendMessage(target, "Top card: " + self.cardString(self.last_card))
+		self.sendReply(bot, nick, target, reply)
 	
-	# commandTurn() - Announce who's turn it is.
-		# - Confirm a game is in progress.
-		# - Announce the current turn.
+	# commandLeaders() - Show the players with the most wins.
+		# - Reply in the channel, or by notice if asked privately.
 	
-	def commandTurn(self, bot, nick, target, message):
+	def commandLeaders(self, bot, nick, target, message):
 		
-		# Check if we're in a game
-		if self.state == UNO_STATE_STARTED:
-			
-			player = self.players[self.turn_index]
-			
-			# Send top card
-			bot.sendMessage(target, "It's currently " + player["nick"] + "'s turn!")
+		self.checkCasemapping()
+		leaders = self.stats.getLeaders()
 		
+		if leaders:
+			places = [str(place + 1) + ". " + who + " (" + str(wins) + ")" for place, (who, games, wins, cards) in enumerate(leaders)]
+			reply = "Most wins: " + ", ".join(places)
 		else:
-			bot.sendNotice(nick, "No game in progress.")
+			reply = "Nobody has won a game yet."
 		
+		self.sendReply(bot, nick, target, reply)
 	
+	# commandGames() - Show a player's last few archived games.
+		# - Look up the nick given, or the player asking.
+		# - Only their own games are read from the archive.
+		# - Reply in the channel, or by notice if asked privately.
 	
-	# commandHelp() - Send player help message.
-		# - Message the player the help messages.
+	def commandGames(self, bot, nick, target, message):
+		
+		who = message.strip() or nick
+		
+		if self.archive is None:
+			reply = "Games aren't being archived."
+		else:
+			who_key = self.foldName(who)
+			games = []
+			for game_id in itertools.islice(self.archive.playerGames(who), RECENT_GAMES):
+				archived = self.archive.getGame(game_id)
+				winner = archived.players[archived.winner][0]
+				games.append("#" + str(game_id) + " " + time.strftime("%Y-%m-%d", time.localtime(archived.finished)) + " " + (self.foldName(winner) == who_key and "won" or "lost to " + winner))
+			
+			if games:
+				reply = who + " has played " + str(self.archive.countPlayerGames(who)) + " archived games, lately: " + ", ".join(games)
+			else:
+				reply = who + " has no archived games."
+		
+		self.sendReply(bot, nick, target, reply)
 	
-	def commandHelp(self, bot, nick, target, message):
-		bot.sendMessage(target, "PMing help message to " + nick)
-		bot.sendNotice(nick, "UnoBot v0.3 Alpha")
-		bot.sendNotice(nick, "")
-		bot.sendNotice(nick, "-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-")
-		bot.sendNotice(nick, "")
-		bot.sendNotice(nick, "uno")
-		bot.sendNotice(nick, "- Creates a new game lobby if none already exist.")
-		bot.sendNotice(nick, "")
-		bot.sendNotice(nick, "join")
-		bot.sendNotice(nick, "- Join the current game lobby.")
-		bot.sendNotice(nick, "")
-		bot.sendNotice(nick, "deal")
-		bot.sendNotice(nick, "- Once enough players have joined, this starts the game.")
-		bot.sendNotice(nick, "")
-		bot.sendNotice(nick, "play <card> [color]")
-		bot.sendNotice(nick, "- Play a card, color is optional for wild cards, and should be only a single letter.")
-		bot.sendNotice(nick, "")
-		bot.sendNotice(nick, "draw / d")
-		bot.sendNotice(nick, "- If you cannot play a card, you can use this command to draw a card.")
-		bot.sendNotice(nick, "")
-		bot.sendNotice(nick, "pass")
-		bot.sendNotice(nick, "- Once you have drawn a card, you may pass your turn.")
-		bot.sendNotice(nick, "")
-		bot.sendNotice(nick, "hand")
-		bot.sendNotice(nick, "- Shows your current hand.")
-		bot.sendNotice(nick, "")
-		bot.sendNotice(nick, "top")
-		bot.sendNotice(nick, "- Display the top card of the pile.")
-		bot.sendNotice(nick, "")
-		bot.sendNotice(nick, "-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-*-")
+	# sendReply() - Replies in a channel, or to the player if it was a private message.
+	def sendReply(self, bot, nick, target, message):
+		if Utils.isChannel(target):
+			bot.sendMessage(target, message)
+		else:
+			bot.sendNotice(nick, message)
 	
 	# commandAdmin() - Admin Commands.
 	
@@ -585,331 +422,45 @@ class UnoPlugin(Plugin.Plugin):
 			# Confirm admin.
 			if bot.isAdmin(nick):
 					
-					# if the first letter is w
+					# Shut the bot down. Quitting closes the last connection,
+					# which stops the reactor.
 					if message == "die":
-						exit()
+						bot.disconnect()
+					
+					# Round trip to the server, from our own PINGs.
+					elif message == "lag":
+						lag = bot.getLag()
+						
+						if lag is None:
+							bot.sendNotice(nick, "Lag hasn't been measured yet.")
+						else:
+							bot.sendNotice(nick, "Lag: " + str(int(lag * 1000)) + "ms.")
 						
 			else:
 				bot.sendNotice(nick, "You are NOT a bot admin.")
 		else:
 			bot.sendNotice(nick, "Invalid Command.")
-	
-	
-# ----------------------------------------------------------------------------------
-# ------- Uno Functions ------------------------------------------------------------
-# ----------------------------------------------------------------------------------
-	
-	# unoStartGame() - Start the game.
-	def unoStartGame(self, bot):
-		
-		# Confirm we are in lobby mode.
-		if self.state == UNO_STATE_STARTING:
-			
-			# Check we have enough players.
-			if len(self.players) >= 2:
-			
-				# Set the game to started.
-				self.state = UNO_STATE_STARTED
-				
-				# Set the channel moderated
-				bot.sendRaw("MODE " + self.channel + " +m")
-				
-				# Send the hand to each player, except the first?
-				for i in range(1, len(self.players)):
-					self.sendPlayerHand(bot, i)
-				
-				# Get one card face up.
-				self.moveCards(self.deck, self.pile, 1)
-				self.last_card = self.pile[0]
-				
-				# Send a message
-				bot.sendMessage(self.channel, "Game Started, Top Card is " + self.cardString(self.last_card))
-				
-				# Start the turns.
-				self.doTurn(bot)
-			else:
-				# Not enough players.
-				bot.sendMessage(self.channel, "Not enough players! Please wait for more to join.")
-	
-	# skipTurn() - Skips the next turn.
-	def skipTurn(self):
-		
-		# Advances the turn index.
-		self.turn_index = self.getNextPlayerIndex()
-	
-	# doTurn() - Initiates the current player's turn.
-	def doTurn(self, bot):
-		
-		# Set the turn to the first player the turn index isn't set.
-		if self.turn_index == None:
-			
-			# Reset turn index.
-			self.turn_index = 0
-		
-		# Move on to the next player.
-		else:
-			self.turn_index = self.getNextPlayerIndex()
-		
-		# Get the current player's info.
-		player = self.players[self.turn_index]
-		nick = player["nick"]
-		hand = player["hand"]
-		
-		# Cannot pass.
-		self.canpass = False
-		
-		# Send them their hand.
-		self.sendPlayerHand(bot, self.turn_index)
-		
-		# Print out messages to the channel.
-		bot.sendMessage(self.channel, nick + "'s turn!")
-	
-	# resetUno() - Resets the game variables.
-	def resetUno(self, bot):
-		
-		# Set the channel moderated
-		bot.sendRaw("MODE " + self.channel + " -m")
-	
-		self.takePlayerHop(bot, self.gameowner)
-		
-		if self.players:
-			for player in self.players:
-				if(player is not self.gameowner):
-					self.takePlayerVoice(bot, player["nick"])
-		
-		self.state = UNO_STATE_STOPPED
-		self.deck = None
-		self.channel = None
-		self.players = None
-		self.turn_index = None
-		self.reverse = False
-		self.canpass = False
-		
-		
-# ----------------------------------------------------------------------------------
-# ------- Tool Functions -----------------------------------------------------------
-# ----------------------------------------------------------------------------------
-	
-	# isValidColor() - Check if the value is a valid card colour.
-	def isValidColor(self, value):
-		
-		# Define colours.
-		colors = ["r", "g", "b", "y"]
-		
-		# Check if the collor is in the array.
-		if value is not None and len(value) > 0 and value in colors:
-			return True
-		
-		# Default return false.
-		return False
-	
-# ----------------------------------------------------------------------------------
-# ------- Player Functions ---------------------------------------------------------
-# ----------------------------------------------------------------------------------
-	
-	# addPlayer() - Adds a player to the current game.
-	def addPlayer(self, bot, nick):
-		
-		# Check they are not already in the game.
-		if not self.isPlayerInGame(nick):
-			
-			# Append them onto the players array, no hand.
-			self.players.append({"nick":nick, "hand":[]})
-			
-			# Move cards into their hand.
-			self.moveCards(self.deck, self.players[len(self.players)-1]["hand"])
-			
-			# If they are not the initiator.
-			if self.gameowner is not nick:
-				
-				# Announce their join.
-				bot.sendMessage(self.channel, nick + " has joined the game!")
-	
-	# sendPlayerHand() - Sends a notice to a player with their current hand.
-	def sendPlayerHand(self, bot, player_index):
-		
-		# Get their nick and hand.
-		nick = self.players[player_index]["nick"]
-		hand = self.players[player_index]["hand"]
-		
-		# Colourize their cards.
-		hand_string = self.deckString(hand)
-		
-		# Send the hand.
-		bot.sendNotice(nick, "Hand: " + hand_string)
-	
-	# getNextPlayerIndex() - Returns the index of the next player.
-	def getNextPlayerIndex(self, turns=1):
-		
-		# Loops for science!
-		for i in range(turns+1):
-			
-			# Are we running in reverse?
-			if not self.reverse:
-				next_index = self.turn_index + i
-			else:
-				next_index = self.turn_index - i
-				
-			# Wrap around back to the next player.
-			if next_index >= len(self.players):
-				next_index = 0
-			if next_index < 0:
-				next_index = len(self.players) - 1
-		
-		# Return the player index for the next player.
-		return next_index
-	
-	# getIndexForNick() - Returns the index of the specified nick.
-	def getIndexForNick(self, nick):
-		
-		# Loop players, till we find the right nick.
-		for index, player in enumerate(self.players):
-			
-			# If this is the right nick, return the index.
-			if player["nick"] == nick:
-				return index
-	
-	# isPlayerInGame() - Returns True if player is in game.
-	def isPlayerInGame(self, nick):
-		
-		# Loop the players.
-		for player in self.players:
-			if player["nick"] == nick:
-				return True
-		
-		# Defualt return false.
-		return False
-	
-	# givePlayerVoice() - Gives the player Voice (For players)
-	def givePlayerVoice(self, bot, nick):
-		bot.sendAddMode(self.channel, nick, "v")
-		
-	# givePlayerHop() - Give a player hop (party owner)
-	def givePlayerHop(self, bot, nick):
-		bot.sendAddMode(self.channel, nick, "h")
-		
-	# takePlayerVoice() - Takes the player Voice (For players)
-	def takePlayerVoice(self, bot, nick):
-		bot.sendRemMode(self.channel, nick, "v")
-		
-	# takePlayerHop() - Take a player hop (party owner)
-	def takePlayerHop(self, bot, nick):
-		bot.sendRemMode(self.channel, nick, "h")
-		
-	
-# ----------------------------------------------------------------------------------
-# ------- Deck Functions -----------------------------------------------------------
-# ----------------------------------------------------------------------------------
-	
-	# createDeck() - Generate a Uno deck.
-	def createDeck(self):
-		
-		# Define colours.
-		colors = ["r", "g", "b", "y"]
-		
-		# Start with an empty deck.
-		deck = []
-		
-		# Loop for each color.
-		for i in range(4):
-			
-			# Add one of each c0 to the deck.
-			deck.append(colors[i] + "0")
-			
-			# Loop nine times for each number c1-c9
-			for j in range(9):
-				
-				# Loop twice for two of each.
-				for k in range(2):
-					deck.append(colors[i] + str(j+1))
-			
-			# Two of each of these cards.
-			for j in range(2):
-				deck.append(colors[i] + "d2")
-				deck.append(colors[i] + "s")
-				deck.append(colors[i] + "r")
-		
-		# Four of each of these.
-		for i in range(4):
-			deck.append("w")
-			deck.append("wd4")
-		
-		# Return the final deck.
-		return deck
-	
-	# shuffleDeck() - Shuffles the specified Uno deck.
-	def shuffleDeck(self, deck):
-		random.shuffle(deck)
-	
-	# moveCards() - Moves cards from decks.
-	def moveCards(self, deck_from, deck_to, amount=7):
-		
-		# Copy cards to second deck.
-		deck_to.extend(deck_from[0:amount])
-		
-		# Remove from original deck.
-		del deck_from[0:amount]
-	
-	# deckString() - Returns a string with all of the cards in the deck, colored.
-	def deckString(self, deck):
-		
-		# Blank return string.
-		deck_string = ""
-		
-		# For each card in the array.
-		for i in range(len(deck)):
-			
-			# Colourize each card and append to string.
-			deck_string = deck_string + self.cardString(deck[i]) + " "
-		
-		# Return the final deck string.
-		return deck_string
-	
+
 # ----------------------------------------------------------------------------------
-# ------- Card Functions -----------------------------------------------------------
+# ------- Events -------------------------------------------------------------------
 # ----------------------------------------------------------------------------------
+
+# UnoDisconnectedEvent - Pauses every game while the bot reconnects.
+class UnoDisconnectedEvent(Events.DisconnectedEvent):
 	
-	# cardColorCode() - Returns the appropriate colour code for a card.
-	def cardColorCode(self, card):
-		
-		# Define card colours.
-		colors = {
-			"r":{"fg":0, "bg":4}, 
-			"g":{"fg":0, "bg":3},
-			"b":{"fg":0, "bg":12}, 
-			"y":{"fg":1, "bg":8},
-			"w":{"fg":0, "bg":1}
-		}
-		
-		if len(card) == 2:
-			if card[0] == "w":
-				color = colors[card[1]]
-			else:
-				color = colors[card[0]]
-		else:
-			color = colors[card[0]]
-			
-		# Return colourized string.
-		return Utils.colorCode(**color)
-	
-	# cardString() - Returns the card name including colours.
-	def cardString(self, card):
-		return self.cardColorCode(card) + card + Utils.normalCode()
-	
-	# drawCards() - Draw the specified amount of cards into a players hand.
-	def drawCards(self, player_index, amount=1):
-		
-		# Move the specified amount of cards from the desk to the players hand.
-		self.moveCards(self.deck, self.players[player_index]["hand"], amount)
+	def fire(self, bot):
+		for table in getPluginInstance().tables.values():
+			table.send(table.pause)
+
+# UnoSelfJoinEvent - Resumes a channel's game once the bot is back in it.
+class UnoSelfJoinEvent(Events.SelfJoinEvent):
 	
-	# removeCardFromHand() - Removes a card from a players hand and puts it in the pile.
-	def removeCardFromHand(self, player_index, card):
-		
-		# Remove the card from their hand.
-		self.players[player_index]["hand"].remove(card)
+	def fire(self, bot, channel):
+		plugin = getPluginInstance()
+		table = plugin.tables.get(plugin.foldName(channel))
 		
-		# Append it onto the pile.
-		self.pile.append(card)
+		if table:
+			table.send(table.resume, bot)
 	
 # ----------------------------------------------------------------------------------
 # ------- Plugin loader ------------------------------------------------------------
@@ -2,6 +2,10 @@
 # _init_.py
 # --------------------------------------------------------------------------
 
+import DeeIRC.Metrics as Metrics
+
+import time
+
 # Plugin Base Class
 # --------------------------------------------------------------------------
 
@@ -14,6 +18,26 @@ class Plugin(object):
 		
 		# No commands defined.
 		self.commands = {}
+		
+		# Triggers that only hand the command to an actor of the plugin's
+		# own, so they're run straight from the dispatch thread.
+		self.direct_commands = set()
+		
+		# Per trigger latency histograms, made when first needed.
+		self.timings = {}
+		
+		# The bot's shared index, set by attachIndex() when loaded.
+		self.index = None
+		self.name = None
+	
+	# Called by the bot before load(), so commands go into the shared index.
+	def attachIndex(self, index, name):
+		self.index = index
+		self.name = name
+		
+		# Index anything added before we were attached.
+		for trigger in self.commands:
+			index.add(trigger, self)
 	
 	# Called when the plugin is loaded. Use this to add commands.
 	def load(self, bot):
@@ -30,7 +54,25 @@ class Plugin(object):
 		
 		# If triggered, run the function.
 		if trigger in self.commands:
-			self.commands[trigger](bot, nick, target, message)
+			registry = Metrics.getRegistry()
+			
+			# Only timed while metrics are being served.
+			if registry.timing:
+				start = time.time()
+				self.commands[trigger](bot, nick, target, message)
+				
+				timing = self.timings.get(trigger)
+				if timing is None:
+					timing = self.timings[trigger] = registry.histogram("plugin_command_seconds", "Time taken to run a command.", plugin=str(self.name), trigger=trigger)
+				timing.observe(time.time() - start)
+			else:
+				self.commands[trigger](bot, nick, target, message)
+	
+	# Returns true if a trigger's command is quick enough to run straight
+	# from the dispatch thread, see addCommand().
+	def isDirect(self, trigger):
+		
+		return trigger in self.direct_commands
 	
 	# Returns true if a trigger exists in this plugin.
 	def hasCommand(self, trigger):
@@ -43,16 +85,125 @@ class Plugin(object):
 	
 	# --------------------------------------------------------------------------
 	
-	# Adds a command to the command dictionary so it can be triggered.
-	def addCommand(self, trigger, function):
+	# Adds a command to the command dictionary so it can be triggered. A
+	# direct command must only queue the work somewhere of it's own, e.g. an
+	# actor, and is run without going through the command executor.
+	def addCommand(self, trigger, function, direct=False):
 		
 		# If it does not already exist, add it to the dictionary.
 		if not trigger in self.commands:
 			self.commands[trigger] = function
+			
+			if direct:
+				self.direct_commands.add(trigger)
+			
+			if self.index:
+				self.index.add(trigger, self)
 	
 	# Removed a command from the command dictionary.
 	def removeCommand(self, trigger):
 		
 		# If the trigger exists, have ti removed from the dictionary.
 		if trigger in self.commands:
-			del self.commands[trigger]
\ No newline at end of file
+			del self.commands[trigger]
+			self.direct_commands.discard(trigger)
+			
+			if self.index:
+				self.index.remove(trigger, self)
+
+# Command Index Class
+# --------------------------------------------------------------------------
+
+# One dictionary of every trigger from every loaded plugin, so a line from a
+# channel is matched with a single lookup. Lines that can't be commands are
+# turned away before any string is copied or lower cased: wrong prefix,
+# first letter no trigger starts with, or first word longer than any trigger.
+
+class CommandIndex(object):
+	
+	# Constructor. Commands must start with prefix, if it's set.
+	def __init__(self, prefix=""):
+		
+		self.prefix = prefix
+		
+		# Lower case trigger -> plugin instance.
+		self.triggers = {}
+		
+		# For the fast reject.
+		self.first_chars = frozenset()
+		self.longest = 0
+	
+	# --------------------------------------------------------------------------
+	
+	# Adds a trigger. If two plugins want the same one, the first keeps it.
+	def add(self, trigger, plugin):
+		
+		trigger = trigger.lower()
+		if not trigger in self.triggers:
+			self.triggers[trigger] = plugin
+			self.rebuild()
+	
+	# Removes a trigger, if the plugin owns it.
+	def remove(self, trigger, plugin):
+		
+		trigger = trigger.lower()
+		if self.triggers.get(trigger) is plugin:
+			del self.triggers[trigger]
+			self.rebuild()
+	
+	# Removes every trigger a plugin owns.
+	def removePlugin(self, plugin):
+		
+		for trigger in [trigger for trigger, owner in self.triggers.items() if owner is plugin]:
+			del self.triggers[trigger]
+		
+		self.rebuild()
+	
+	# Rebuilds the fast reject tables.
+	def rebuild(self):
+		
+		first_chars = set()
+		for trigger in self.triggers:
+			first_chars.add(trigger[0])
+			first_chars.add(trigger[0].upper())
+		
+		self.first_chars = frozenset(first_chars)
+		self.longest = max([len(trigger) for trigger in self.triggers] or [0])
+	
+	# --------------------------------------------------------------------------
+	
+	# Returns the plugin for a trigger, or None.
+	def get(self, trigger):
+		
+		return self.triggers.get(trigger.lower())
+	
+	# Matches a line against the index. Returns (plugin, trigger, parameters)
+	# or None if the line isn't a command.
+	def find(self, message):
+		
+		# Strip the prefix.
+		start = len(self.prefix)
+		if start and not message.startswith(self.prefix):
+			return None
+		
+		# Does any trigger start like this?
+		if not message[start:start+1] in self.first_chars:
+			return None
+		
+		# Find the end of the first word, giving up early if it's too long.
+		trigger_end = message.find(" ", start, start + self.longest + 1)
+		
+		if trigger_end < 0:
+			
+			# No parameters.
+			if len(message) - start > self.longest:
+				return None
+			trigger_end = len(message)
+		
+		trigger = message[start:trigger_end].lower()
+		plugin = self.triggers.get(trigger)
+		
+		if plugin is None:
+			return None
+		
+		return plugin, trigger, message[trigger_end+1:]
\ No newline at end of file
@@ -0,0 +1,288 @@
+# TestArchive.py
+# --------------------------------------------------------------------------
+
+# Tests for Plugin/Uno/Archive.py: games read back and replayed as they
+# were played, a batch that fails to write leaving no trace, and a batch
+# cut off by a crash dropped when the archive is opened again.
+
+import os
+import random
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import DeeIRC.Metrics as Metrics
+import Plugin.Uno.Archive as Archive
+import Plugin.Uno.Cards as Cards
+import Plugin.Uno.Engine as Engine
+import Plugin.Uno.Journal as Journal
+
+# ------------------------------------------------------------------------------
+
+def playGame(rng, channel, nicks, seed):
+	"""Plays a game through the engine the way a table does, keeping it's
+	moves. Returns it as writeGames() takes it."""
+	game = Engine.Game(Engine.GameRandom(seed))
+	moves = []
+	played = [0] * len(nicks)
+
+	for nick in nicks:
+		game.addPlayer()
+		moves.append(Archive.encodeMove(Journal.JOIN, ""))
+	game.start()
+	moves.append(Archive.encodeMove(Journal.START, ""))
+
+	winner = None
+	while winner is None:
+		game.nextTurn()
+		moves.append(Archive.encodeMove(Journal.TURN, ""))
+		player = game.turn_index
+
+		playable = Cards.maskCards(game.playable(player))
+		if not playable:
+			drawn = game.draw(player)
+			moves.append(Archive.encodeMove(Journal.DRAW, Journal.PLAYER_FIELDS.pack(player, drawn)))
+			moves.append(Archive.encodeMove(Journal.CANPASS, Journal.FLAG_FIELDS.pack(1)))
+			playable = Cards.maskCards(game.playable(player))
+
+		if playable:
+			card = rng.choice(playable)
+			color = Cards.isWild(card) and rng.randrange(4) or None
+			game.play(player, card, color)
+			moves.append(Archive.encodeMove(Journal.PLAY, Journal.PLAY_FIELDS.pack(player, card, Cards.NO_COLOR if color is None else color)))
+			played[player] += 1
+
+			if game.hasWon(player):
+				winner = player
+
+	players = [(nick, None, played[index], list(game.hands[index])) for index, nick in enumerate(nicks)]
+	return channel, seed, time.time(), players, winner, "".join(moves)
+
+# ------------------------------------------------------------------------------
+
+class ArchiveTest(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp(prefix="unobot-test-")
+		self.path = os.path.join(self.directory, "archive")
+		self.rng = random.Random(1)
+		self.archives = []
+
+	def tearDown(self):
+		for archive in self.archives:
+			archive.close()
+		shutil.rmtree(self.directory)
+
+	def open(self):
+		archive = Archive.GameArchive(self.path, interval=0)
+		self.archives.append(archive)
+		return archive
+
+	def close(self, archive):
+		self.archives.remove(archive)
+		archive.close()
+
+	def games(self, count, nicks=("alice", "Bob", "carol", "dave")):
+		"""Returns count games of two to four players."""
+		games = []
+		for i in range(count):
+			players = self.rng.sample(nicks, self.rng.randrange(2, len(nicks) + 1))
+			games.append(playGame(self.rng, "#uno" + str(i % 3), players, self.rng.getrandbits(64)))
+		return games
+
+	def checkGames(self, archive, games, first=0):
+		"""Checks games were archived as given, from game id first, and
+		that each replays to the hands it finished with."""
+		for index, (channel, seed, finished, players, winner, moves) in enumerate(games):
+			archived = archive.getGame(first + index)
+
+			self.assertEqual(archived.id, first + index)
+			self.assertEqual(archived.channel, channel)
+			self.assertEqual(archived.seed, seed)
+			self.assertEqual(archived.finished, finished)
+			self.assertEqual(archived.winner, winner)
+			self.assertEqual(archived.players, [(nick, ai, played, sorted(hand)) for nick, ai, played, hand in players])
+			self.assertEqual(archived.moves, moves)
+
+			for kind, payload, game in Archive.replayGame(archived):
+				pass
+			self.assertEqual([sorted(hand) for hand in game.hands], [sorted(hand) for nick, ai, played, hand in players])
+			self.assertTrue(game.hasWon(winner))
+
+	def playerGames(self, games, nick, first=0):
+		"""Returns the ids of the games a nick played in, newest first."""
+		ids = [first + index for index, game in enumerate(games) if nick.lower() in [player[0].lower() for player in game[3]]]
+		return ids[::-1]
+
+	# ------ Reading back
+
+	def testRoundTrip(self):
+		archive = self.open()
+		games = self.games(30)
+		for game in games:
+			archive.recordGame(game[0], game[1], game[3], game[4], game[5])
+		archive.flush()
+
+		self.assertEqual(len(archive), 30)
+
+		# recordGame() stamps the time itself.
+		games = [(channel, seed, archive.getGame(index).finished, players, winner, moves) for index, (channel, seed, finished, players, winner, moves) in enumerate(games)]
+		self.checkGames(archive, games)
+
+		self.close(archive)
+		archive = self.open()
+		self.assertEqual(len(archive), 30)
+		self.checkGames(archive, games)
+
+		for nick in ("alice", "bob", "carol", "dave"):
+			self.assertEqual(list(archive.playerGames(nick)), self.playerGames(games, nick))
+			self.assertEqual(archive.countPlayerGames(nick.upper()), len(self.playerGames(games, nick)))
+		self.assertEqual(list(archive.playerGames("nobody")), [])
+
+	def testExport(self):
+		archive = self.open()
+		games = self.games(1)
+		archive.writeGames(games)
+
+		exported = Archive.exportGame(archive.getGame(0))
+		self.assertEqual(exported["winner"], games[0][3][games[0][4]][0])
+		self.assertEqual([move["move"] for move in exported["moves"][:len(games[0][3]) + 1]], ["join"] * len(games[0][3]) + ["start"])
+
+	def testMissingGame(self):
+		archive = self.open()
+		archive.writeGames(self.games(2))
+		self.assertRaises(IndexError, archive.getGame, 2)
+		self.assertRaises(IndexError, archive.getGame, -1)
+
+	def testForeignMeta(self):
+		os.makedirs(self.path)
+		with open(os.path.join(self.path, "meta"), "wb") as meta:
+			meta.write(Archive.META.pack("NOTANARC", 0, 0, 0, 0, 0, 0))
+		self.assertRaises(ValueError, Archive.GameArchive, self.path)
+
+	def testCasemapping(self):
+		archive = self.open()
+		games = [playGame(self.rng, "#uno", ["Nick[a]", "other"], 1)]
+		archive.writeGames(games)
+
+		self.assertEqual(list(archive.playerGames("nick{A}")), [0])
+		archive.setCasemapping("ascii")
+		self.assertEqual(list(archive.playerGames("nick{A}")), [])
+		self.assertEqual(list(archive.playerGames("NICK[A]")), [0])
+
+	# ------ Failed and cut off batches
+
+	def testFailedBatch(self):
+		archive = self.open()
+		before = self.games(5)
+		archive.writeGames(before)
+
+		# cards played is a uint16, so this fails part way through the
+		# columns.
+		channel, seed, finished, players, winner, moves = self.games(1, ("alice", "erin"))[0]
+		players = [(nick, ai, 70000, hand) for nick, ai, played, hand in players]
+		failed = self.games(3, ("alice", "erin")) + [(channel, seed, finished, players, winner, moves)]
+		self.assertRaises(struct.error, archive.writeGames, failed)
+
+		# None of it happened.
+		self.assertEqual(len(archive), 5)
+		self.assertEqual(list(archive.playerGames("erin")), [])
+		self.assertEqual(archive.countPlayerGames("erin"), 0)
+		self.assertEqual(list(archive.playerGames("alice")), self.playerGames(before, "alice"))
+		self.checkGames(archive, before)
+
+		# And the next batch carries on where the last good one stopped.
+		after = self.games(5, ("alice", "erin", "frank"))
+		archive.writeGames(after)
+		self.assertEqual(len(archive), 10)
+		self.checkGames(archive, before + after)
+		self.assertEqual(list(archive.playerGames("erin")), self.playerGames(after, "erin", 5))
+		self.assertEqual(list(archive.playerGames("alice")), self.playerGames(before + after, "alice"))
+
+		self.close(archive)
+		archive = self.open()
+		self.checkGames(archive, before + after)
+		self.assertEqual(list(archive.playerGames("erin")), self.playerGames(after, "erin", 5))
+		self.assertEqual(list(archive.playerGames("alice")), self.playerGames(before + after, "alice"))
+
+	def testFailedCommit(self):
+		archive = self.open()
+		before = self.games(5)
+		archive.writeGames(before)
+
+		# Every column written and synced, but the meta never replaced.
+		def writeMeta(*counts):
+			raise IOError("disk full")
+		archive.writeMeta = writeMeta
+		self.assertRaises(IOError, archive.writeGames, self.games(3, ("erin", "frank")))
+		del archive.writeMeta
+
+		self.assertEqual(len(archive), 5)
+		self.assertEqual(list(archive.playerGames("erin")), [])
+		self.assertEqual(os.path.getsize(archive.filePath("games.seed")), 5 * 8)
+
+		after = self.games(2, ("erin", "carol"))
+		archive.writeGames(after)
+		self.checkGames(archive, before + after)
+		self.assertEqual(list(archive.playerGames("erin")), self.playerGames(after, "erin", 5))
+
+		self.close(archive)
+		archive = self.open()
+		self.checkGames(archive, before + after)
+		self.assertEqual(list(archive.playerGames("carol")), self.playerGames(before + after, "carol"))
+
+	def testFailedWriterCarriesOn(self):
+		archive = self.open()
+		errors = Metrics.getRegistry().counter("uno_archive_write_errors_total")
+		failures = errors.read()
+
+		# The writer counts the failure, logs it and keeps going.
+		stderr, sys.stderr = sys.stderr, open(os.devnull, "w")
+		try:
+			archive.recordGame("#uno", 1, [("alice", None, 70000, []), ("bob", None, 0, [])], 0, "")
+			archive.flush()
+		finally:
+			sys.stderr.close()
+			sys.stderr = stderr
+
+		self.assertEqual(errors.read(), failures + 1)
+		self.assertEqual(len(archive), 0)
+
+		games = self.games(2)
+		for game in games:
+			archive.recordGame(game[0], game[1], game[3], game[4], game[5])
+		archive.flush()
+		self.assertEqual(len(archive), 2)
+		self.assertEqual(list(archive.playerGames("bob")), self.playerGames(games, "bob"))
+
+	def testCutOff(self):
+		archive = self.open()
+		games = self.games(5)
+		archive.writeGames(games)
+		self.close(archive)
+
+		# A crash mid batch leaves columns longer than the meta says.
+		for name in os.listdir(self.path):
+			if name != "meta":
+				with open(os.path.join(self.path, name), "ab") as column:
+					column.write("\xff" * 37)
+
+		archive = self.open()
+		self.assertEqual(len(archive), 5)
+		self.checkGames(archive, games)
+		self.assertEqual(os.path.getsize(archive.filePath("games.seed")), 5 * 8)
+
+		after = self.games(3)
+		archive.writeGames(after)
+		self.checkGames(archive, games + after)
+
+		for nick in ("alice", "bob", "carol", "dave"):
+			self.assertEqual(list(archive.playerGames(nick)), self.playerGames(games + after, nick))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,89 @@
+# TestCommandIndex.py
+# --------------------------------------------------------------------------
+
+# Tests for Plugin.CommandIndex: what it matches, and what it turns away
+# before looking anything up.
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import Plugin
+
+# ------------------------------------------------------------------------------
+
+class CommandIndexTest(unittest.TestCase):
+
+	def setUp(self):
+		self.uno = Plugin.Plugin()
+		self.other = Plugin.Plugin()
+
+		self.index = Plugin.CommandIndex()
+		self.uno.attachIndex(self.index, "uno")
+		self.other.attachIndex(self.index, "other")
+
+		self.uno.addCommand("play", None)
+		self.uno.addCommand("uno", None)
+		self.other.addCommand("help", None)
+
+	def testMatches(self):
+		self.assertEqual(self.index.find("play r5"), (self.uno, "play", "r5"))
+		self.assertEqual(self.index.find("uno"), (self.uno, "uno", ""))
+		self.assertEqual(self.index.find("help me now"), (self.other, "help", "me now"))
+
+	def testCase(self):
+		self.assertEqual(self.index.find("PLAY r5"), (self.uno, "play", "r5"))
+		self.assertEqual(self.index.find("Uno"), (self.uno, "uno", ""))
+		self.assertTrue(self.index.get("HELP") is self.other)
+
+	def testRejects(self):
+		for line in ("", " play", "pla", "player r5", "plays", "xyz", "unoo", "hello", "q", "play" + "y" * 100):
+			self.assertEqual(self.index.find(line), None, line)
+
+	def testFirstChars(self):
+		self.assertEqual(self.index.first_chars, frozenset("pPuUhH"))
+		self.assertEqual(self.index.longest, 4)
+
+	def testFirstKeeps(self):
+		self.other.addCommand("play", None)
+		self.assertTrue(self.index.get("play") is self.uno)
+
+		# Only the owner can take it away.
+		self.index.remove("play", self.other)
+		self.assertTrue(self.index.get("play") is self.uno)
+
+	def testRemove(self):
+		self.uno.removeCommand("play")
+		self.assertEqual(self.index.find("play r5"), None)
+		self.assertEqual(self.index.first_chars, frozenset("uUhH"))
+
+		self.index.removePlugin(self.uno)
+		self.assertEqual(self.index.find("uno"), None)
+		self.assertEqual(self.index.first_chars, frozenset("hH"))
+		self.assertEqual(self.index.find("help"), (self.other, "help", ""))
+
+		self.index.removePlugin(self.other)
+		self.assertEqual(self.index.longest, 0)
+		self.assertEqual(self.index.find("help"), None)
+
+	def testPrefix(self):
+		index = Plugin.CommandIndex("!")
+		index.add("play", self.uno)
+
+		self.assertEqual(index.find("!play r5"), (self.uno, "play", "r5"))
+		self.assertEqual(index.find("!Play"), (self.uno, "play", ""))
+		for line in ("play r5", "!", "! play", "?play", "!!play", "!plays"):
+			self.assertEqual(index.find(line), None, line)
+
+	def testDirect(self):
+		self.uno.addCommand("draw", None, direct=True)
+		self.assertTrue(self.uno.isDirect("draw"))
+		self.assertFalse(self.uno.isDirect("play"))
+
+		self.uno.removeCommand("draw")
+		self.assertFalse(self.uno.isDirect("draw"))
+
+if __name__ == "__main__":
+	unittest.main()
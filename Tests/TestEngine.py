@@ -0,0 +1,322 @@
+# TestEngine.py
+# --------------------------------------------------------------------------
+
+# Tests for Plugin/Uno/Engine.py: what each card does, drawing through a
+# recycled pile, extra decks for big tables and dealing again from a seed.
+# Batch.py is checked against it too, where NumPy is installed.
+
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import Plugin.Uno.Cards as Cards
+import Plugin.Uno.Engine as Engine
+
+try:
+	import Plugin.Uno.Batch as Batch
+except ImportError:
+	Batch = None
+
+# ------------------------------------------------------------------------------
+
+def card(name):
+	return Cards.fromString(name)
+
+def allCards(game):
+	"""Returns every card in the game, wherever it is, sorted."""
+	cards = list(game.deck) + list(game.pile)
+	for hand in game.hands:
+		cards.extend(hand)
+	return sorted(cards)
+
+def newGame(players, seed=1):
+	game = Engine.Game(Engine.GameRandom(seed))
+	for i in range(players):
+		game.addPlayer()
+	game.start()
+	game.nextTurn()
+	return game
+
+def playRandomly(game, rng, turns):
+	"""Plays turns of legal moves, drawing when there's nothing to play.
+	Returns the winner, or None."""
+	for i in range(turns):
+		player = game.turn_index
+		playable = Cards.maskCards(game.playable(player))
+
+		if not playable:
+			game.draw(player)
+			playable = Cards.maskCards(game.playable(player))
+
+		if playable:
+			played = rng.choice(playable)
+			game.play(player, played, Cards.isWild(played) and rng.randrange(4) or None)
+			if game.hasWon(player):
+				return player
+
+		game.nextTurn()
+
+# ------------------------------------------------------------------------------
+
+class RulesTest(unittest.TestCase):
+
+	def setUp(self):
+		self.game = newGame(4)
+		self.game.last_card = card("r5")
+		self.game.top_color = Cards.COLOR_IDS["r"]
+		for hand in self.game.hands:
+			hand.extend([card("rs"), card("rr"), card("rd2"), card("w"), card("wd4")])
+
+	def testDeal(self):
+		game = newGame(4)
+		self.assertEqual([len(hand) for hand in game.hands], [Engine.HAND_SIZE] * 4)
+		self.assertEqual(len(game.pile), 1)
+		self.assertEqual(len(game.deck), 108 - 4 * Engine.HAND_SIZE - 1)
+		self.assertEqual(allCards(game), sorted(Cards.standardDeck()))
+		self.assertEqual(game.turn_index, 0)
+
+	def testCheckPlay(self):
+		game = self.game
+		self.assertEqual(game.checkPlay(0, card("g7")), Engine.ERROR_NOT_PLAYABLE)
+		self.assertEqual(game.checkPlay(0, card("w")), Engine.ERROR_NO_COLOR)
+		self.assertEqual(game.checkPlay(0, card("w"), 2), None)
+		self.assertEqual(game.checkPlay(0, card("rs")), None)
+
+		game.hands[1] = Cards.Hand()
+		self.assertEqual(game.checkPlay(1, card("rs")), Engine.ERROR_NOT_HELD)
+		self.assertEqual(game.checkPlay(1, card("wd4"), 0), Engine.ERROR_NOT_HELD)
+
+	def testSameFace(self):
+		self.assertTrue(self.game.isPlayable(card("g5")))
+		self.assertTrue(self.game.isPlayable(card("r9")))
+		self.assertFalse(self.game.isPlayable(card("g6")))
+
+	def testReverse(self):
+		game = self.game
+		self.assertEqual(game.play(0, card("rr")), None)
+		game.nextTurn()
+		self.assertEqual(game.turn_index, 3)
+		game.nextTurn()
+		self.assertEqual(game.turn_index, 2)
+
+	def testSkip(self):
+		game = self.game
+		self.assertEqual(game.play(0, card("rs")), 1)
+		game.nextTurn()
+		self.assertEqual(game.turn_index, 2)
+
+	def testDrawTwo(self):
+		game = self.game
+		before = len(game.hands[1])
+		self.assertEqual(game.play(0, card("rd2")), 1)
+		self.assertEqual(len(game.hands[1]), before + 2)
+		game.nextTurn()
+		self.assertEqual(game.turn_index, 2)
+
+	def testWildDrawFour(self):
+		game = self.game
+		before = len(game.hands[1])
+		self.assertEqual(game.play(0, card("wd4"), Cards.COLOR_IDS["b"]), 1)
+		self.assertEqual(len(game.hands[1]), before + 4)
+		self.assertEqual(game.top_color, Cards.COLOR_IDS["b"])
+		self.assertTrue(game.isPlayable(card("b1")))
+		self.assertFalse(game.isPlayable(card("r1")))
+
+	def testReverseThenSkip(self):
+		game = self.game
+		game.play(0, card("rr"))
+		self.assertEqual(game.play(0, card("rs")), 3)
+		game.nextTurn()
+		self.assertEqual(game.turn_index, 2)
+
+	def testTwoPlayers(self):
+		game = newGame(2)
+		game.last_card = card("r5")
+		game.top_color = Cards.COLOR_IDS["r"]
+		game.hands[0].extend([card("rs"), card("rr")])
+
+		game.play(0, card("rs"))
+		game.nextTurn()
+		self.assertEqual(game.turn_index, 0)
+
+		game.play(0, card("rr"))
+		game.nextTurn()
+		self.assertEqual(game.turn_index, 1)
+
+	def testWildDealt(self):
+		game = newGame(2)
+		game.last_card = card("w")
+		game.top_color = None
+		for name in ("r1", "g2", "b3", "y4", "ys"):
+			self.assertTrue(game.isPlayable(card(name)))
+
+	def testWin(self):
+		game = self.game
+		game.hands[0] = Cards.Hand([card("r1")])
+		self.assertFalse(game.hasWon(0))
+		game.play(0, card("r1"))
+		self.assertTrue(game.hasWon(0))
+
+# ------------------------------------------------------------------------------
+
+class DrawTest(unittest.TestCase):
+
+	def testRecycle(self):
+		game = newGame(3)
+		game.pile.extend(game.deck)
+		game.deck.clear()
+		top = game.pile[-1]
+		under = game.pile[:-1]
+		held = list(game.hands[0])
+		shuffles = game.random.shuffles
+
+		self.assertTrue(game.canDraw())
+		self.assertEqual(game.draw(0, 3), 3)
+
+		# Everything but the top card went back in, shuffled.
+		self.assertEqual(game.pile, [top])
+		self.assertEqual(game.random.shuffles, shuffles + 1)
+		self.assertEqual(sorted(list(game.deck) + list(game.hands[0])), sorted(under + held))
+		self.assertEqual(allCards(game), sorted(Cards.standardDeck()))
+
+	def testRecycleMidDraw(self):
+		game = newGame(2)
+		game.pile.extend(list(game.deck)[2:])
+		remaining = list(game.deck)[:2]
+		game.deck.clear()
+		game.deck.extend(remaining)
+
+		held = len(game.hands[1])
+		self.assertEqual(game.draw(1, 4), 4)
+		self.assertEqual(len(game.hands[1]), held + 4)
+		self.assertEqual(len(game.pile), 1)
+		self.assertEqual(allCards(game), sorted(Cards.standardDeck()))
+
+	def testNothingToDraw(self):
+		game = newGame(2)
+		game.hands[0].extend(game.deck)
+		game.deck.clear()
+
+		self.assertFalse(game.canDraw())
+		self.assertEqual(game.draw(1, 2), 0)
+
+		# One card on the pile to spare, so one drawn.
+		spare = iter(game.hands[0]).next()
+		game.hands[0].remove(spare)
+		game.pile.insert(0, spare)
+		self.assertTrue(game.canDraw())
+		self.assertEqual(game.draw(1, 2), 1)
+		self.assertFalse(game.canDraw())
+		self.assertEqual(allCards(game), sorted(Cards.standardDeck()))
+
+	def testDrawFourShort(self):
+		game = newGame(2)
+		deck = list(game.deck)
+		deck.remove(card("wd4"))
+		deck.remove(card("r1"))
+		game.hands[0].add(card("wd4"))
+		game.hands[1].extend(deck)
+		game.deck.clear()
+		game.pile.append(card("r1"))
+		game.last_card = card("r1")
+		game.top_color = Cards.COLOR_IDS["r"]
+
+		before = len(game.hands[1])
+		self.assertEqual(game.play(0, card("wd4"), 0), 1)
+
+		# Only the one card under the top was there to draw.
+		self.assertEqual(len(game.hands[1]), before + 1)
+		self.assertEqual(allCards(game), sorted(Cards.standardDeck()))
+
+	def testCardsKept(self):
+		rng = random.Random(5)
+		for players in (2, 5, 10):
+			for seed in range(10):
+				game = newGame(players, seed)
+				playRandomly(game, rng, 500)
+				self.assertEqual(allCards(game), sorted(Cards.standardDeck()), (players, seed))
+
+# ------------------------------------------------------------------------------
+
+class DecksTest(unittest.TestCase):
+
+	def testDecksAdded(self):
+		for players, decks in ((1, 1), (10, 1), (11, 2), (20, 2), (21, 3), (35, 4)):
+			game = newGame(players)
+			self.assertEqual(game.decks, decks, players)
+			self.assertEqual(allCards(game), sorted(Cards.standardDeck() * decks), players)
+			self.assertEqual([len(hand) for hand in game.hands], [Engine.HAND_SIZE] * players)
+
+	def testBigTablePlays(self):
+		rng = random.Random(7)
+		game = newGame(25, 3)
+		playRandomly(game, rng, 3000)
+		self.assertEqual(allCards(game), sorted(Cards.standardDeck() * 3))
+
+	def testJoinAfterStart(self):
+		game = newGame(10)
+		game.addPlayer()
+		self.assertEqual(game.decks, 2)
+		self.assertEqual(len(game.hands[10]), Engine.HAND_SIZE)
+		self.assertEqual(allCards(game), sorted(Cards.standardDeck() * 2))
+
+# ------------------------------------------------------------------------------
+
+class SeedTest(unittest.TestCase):
+
+	def testSameSeed(self):
+		first = newGame(6, 42)
+		second = newGame(6, 42)
+		self.assertEqual(first.getState(), second.getState())
+		self.assertNotEqual(first.getState(), newGame(6, 43).getState())
+
+	def testSameGame(self):
+		first = newGame(4, 9)
+		second = newGame(4, 9)
+		playRandomly(first, random.Random(1), 400)
+		playRandomly(second, random.Random(1), 400)
+		self.assertEqual(first.getState(), second.getState())
+		self.assertEqual(first.random.shuffles, second.random.shuffles)
+
+	def testFromState(self):
+		game = newGame(4, 11)
+		playRandomly(game, random.Random(2), 50)
+
+		copy = Engine.fromState(Engine.GameRandom(game.random.seed, game.random.shuffles), game.getState())
+		self.assertEqual(copy.getState(), game.getState())
+
+		# And carries on the same, recycling included.
+		playRandomly(game, random.Random(3), 400)
+		playRandomly(copy, random.Random(3), 400)
+		self.assertEqual(copy.getState(), game.getState())
+
+	def testCopy(self):
+		game = newGame(3, 4)
+		copy = game.copy()
+		playRandomly(copy, random.Random(4), 20)
+		self.assertEqual(game.getState(), newGame(3, 4).getState())
+
+	def testDeterminize(self):
+		game = newGame(4, 8)
+		guess = game.determinize(1, random.Random(1))
+		self.assertEqual(list(guess.hands[1]), list(game.hands[1]))
+		self.assertEqual([len(hand) for hand in guess.hands], [len(hand) for hand in game.hands])
+		self.assertEqual(len(guess.deck), len(game.deck))
+		self.assertEqual(allCards(guess), allCards(game))
+
+# ------------------------------------------------------------------------------
+
+@unittest.skipIf(Batch is None, "needs NumPy")
+class BatchTest(unittest.TestCase):
+
+	def testCrossCheck(self):
+		for players in (2, 4, 11):
+			compared, mismatches = Batch.crossCheck(40, players, 1)
+			self.assertTrue(compared > 0, players)
+			self.assertEqual(mismatches, [], players)
+
+if __name__ == "__main__":
+	unittest.main()
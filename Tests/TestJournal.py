@@ -0,0 +1,401 @@
+# TestJournal.py
+# --------------------------------------------------------------------------
+
+# Tests for Plugin/Uno/Journal.py: records read back as written, foreign
+# files turned away, compaction, and tables rebuilt from the journal after
+# the bot dies, part way through a compaction or not.
+
+import contextlib
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import DeeIRC.TimerWheel as TimerWheel
+import Plugin.Uno as Uno
+import Plugin.Uno.Cards as Cards
+import Plugin.Uno.Journal as Journal
+import Plugin.Uno.Table as Table
+
+# ------------------------------------------------------------------------------
+
+class StandInBot(object):
+	"""Just enough of DeeBot for the Uno plugin. Timers never fire."""
+
+	def __init__(self, config):
+		self.config = config
+
+	def sendMessage(self, target, message, priority=None):
+		pass
+
+	def sendNotice(self, target, message, priority=None):
+		pass
+
+	def sendRaw(self, line, priority=None):
+		pass
+
+	def sendAddMode(self, *args):
+		pass
+
+	def sendRemMode(self, *args):
+		pass
+
+	def isAdmin(self, nick):
+		return False
+
+	def callLater(self, delay, function, *args):
+		return TimerWheel.Timer(0, function, args)
+
+	def addEvent(self, event_type, event):
+		pass
+
+	def removeEvent(self, event_type, event):
+		pass
+
+	def log(self, message):
+		pass
+
+	def error(self, message):
+		pass
+
+	@contextlib.contextmanager
+	def batch(self):
+		yield
+
+def playTurns(bot, table, rng, turns):
+	"""Plays a table's game for a number of turns, or until it's over."""
+	for i in range(turns):
+		if table.state != Table.UNO_STATE_STARTED:
+			return
+
+		nick = table.players[table.game.turn_index]["nick"]
+		playable = Cards.maskCards(table.playableCards(table.game.turn_index))
+
+		if playable:
+			card = rng.choice(playable)
+			table.runCommand(bot, "commandPlay", nick, table.channel, Cards.toString(card) + (Cards.isWild(card) and " g" or ""))
+		elif table.game.canpass:
+			table.runCommand(bot, "commandPass", nick, table.channel, "")
+		else:
+			table.runCommand(bot, "commandDraw", nick, table.channel, "")
+
+def snapshots(plugin):
+	"""Returns {channel:snapshot} for every table with a game, decoded, as
+	marshal writes interned strings differently."""
+	tables = [(table.channel, table.encodeSnapshot()) for table in plugin.tables.values()]
+	return dict([(channel, Journal.decodeSnapshot(snapshot)) for channel, snapshot in tables if snapshot is not None])
+
+# ------------------------------------------------------------------------------
+
+class JournalFileTest(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp(prefix="unobot-test-")
+		self.path = os.path.join(self.directory, "journal")
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def records(self):
+		return [
+			("#uno", Journal.GAME, "owner\0" + Journal.SEED_FIELDS.pack(2 ** 64 - 1)),
+			("#uno", Journal.JOIN, "owner\0"),
+			("#other", Journal.GAME, "someone\0" + Journal.SEED_FIELDS.pack(5)),
+			("#uno", Journal.JOIN, "UnoBot\0hard"),
+			("#uno", Journal.START),
+			("#uno", Journal.TURN),
+			("#uno", Journal.PLAY, Journal.PLAY_FIELDS.pack(0, Cards.WILD, 2)),
+			("#uno", Journal.DRAW, Journal.PLAYER_FIELDS.pack(1, 4)),
+			("#uno", Journal.CANPASS, Journal.FLAG_FIELDS.pack(1)),
+			("#uno", Journal.AUTO, Journal.PLAYER_FIELDS.pack(1, 0)),
+			("#other", Journal.RESET),
+			("#" + "x" * 254, Journal.SNAPSHOT, "\0" * 70000),
+		]
+
+	def expected(self, records):
+		return [(record + ("",))[:3] for record in records]
+
+	def testRoundTrip(self):
+		journal = Journal.Journal(self.path, interval=0.01)
+		for record in self.records():
+			journal.record(*record)
+		journal.close()
+
+		self.assertEqual(list(Journal.readJournal(self.path)), self.expected(self.records()))
+
+		# Appends to what's there.
+		journal = Journal.Journal(self.path, interval=0.01)
+		journal.record("#uno", Journal.TURN)
+		journal.close()
+		self.assertEqual(list(Journal.readJournal(self.path)), self.expected(self.records()) + [("#uno", Journal.TURN, "")])
+
+	def testGroupCommit(self):
+		journal = Journal.Journal(self.path, interval=0.001)
+		for record in self.records():
+			journal.record(*record)
+
+		# Committed by the journal's thread, without closing.
+		for i in range(1000):
+			if len(list(Journal.readJournal(self.path))) == len(self.records()):
+				break
+			time.sleep(0.001)
+		self.assertEqual(list(Journal.readJournal(self.path)), self.expected(self.records()))
+		journal.close()
+
+	def testCutShort(self):
+		journal = Journal.Journal(self.path, interval=0.01)
+		for record in self.records():
+			journal.record(*record)
+		journal.close()
+
+		# A crash mid write leaves part of the last record.
+		size = os.path.getsize(self.path)
+		for cut in (1, Journal.RECORD.size + 3, 70000):
+			with open(self.path, "r+b") as journal_file:
+				journal_file.truncate(size - cut)
+			self.assertEqual(list(Journal.readJournal(self.path)), self.expected(self.records()[:-1]))
+
+	def testMagicCutShort(self):
+		for data in ("", Journal.MAGIC[:3]):
+			with open(self.path, "wb") as journal_file:
+				journal_file.write(data)
+			self.assertEqual(list(Journal.readJournal(self.path)), [])
+
+			journal = Journal.Journal(self.path)
+			journal.record("#uno", Journal.TURN)
+			journal.close()
+			self.assertEqual(list(Journal.readJournal(self.path)), [("#uno", Journal.TURN, "")])
+
+	def testForeignFile(self):
+		with open(self.path, "wb") as journal_file:
+			journal_file.write("DEEJRN00" + Journal.encode("#uno", Journal.TURN))
+
+		self.assertRaises(ValueError, Journal.Journal, self.path)
+		self.assertRaises(ValueError, list, Journal.readJournal(self.path))
+		self.assertEqual(os.path.getsize(self.path), len(Journal.MAGIC) + Journal.RECORD.size + 4)
+
+	def testCompaction(self):
+		journal = Journal.Journal(self.path, interval=0.01)
+		journal.record("#a", Journal.TURN)
+		journal.record("#b", Journal.TURN)
+		journal.record("#c", Journal.TURN)
+		journal.commit()
+
+		journal.beginCompaction(["#a", "#b", "#c"])
+		self.assertTrue(journal.compacting())
+
+		# Once moved, a channel's records follow it's snapshot.
+		journal.snapshot("#a", "a-snapshot")
+		journal.snapshot("#c", None)
+		journal.record("#a", Journal.DRAW, "1")
+		journal.record("#b", Journal.DRAW, "2")
+		journal.record("#new", Journal.DRAW, "3")
+		journal.commit()
+
+		# Crashing now replays both files, old then new.
+		self.assertTrue(os.path.exists(self.path + ".new"))
+		self.assertEqual(list(Journal.readJournals(self.path)), [
+			("#a", Journal.TURN, ""), ("#b", Journal.TURN, ""), ("#c", Journal.TURN, ""), ("#b", Journal.DRAW, "2"),
+			("#a", Journal.SNAPSHOT, "a-snapshot"), ("#a", Journal.DRAW, "1"), ("#new", Journal.DRAW, "3"),
+		])
+
+		journal.snapshot("#b", "b-snapshot")
+		journal.record("#b", Journal.DRAW, "4")
+		journal.commit()
+
+		self.assertFalse(journal.compacting())
+		self.assertFalse(os.path.exists(self.path + ".new"))
+
+		compacted = [
+			("#a", Journal.SNAPSHOT, "a-snapshot"), ("#a", Journal.DRAW, "1"), ("#new", Journal.DRAW, "3"),
+			("#b", Journal.SNAPSHOT, "b-snapshot"), ("#b", Journal.DRAW, "4"),
+		]
+		self.assertEqual(list(Journal.readJournals(self.path)), compacted)
+
+		# And the compacted file is the journal from here on.
+		journal.record("#a", Journal.RESET)
+		journal.close()
+		self.assertEqual(list(Journal.readJournal(self.path)), compacted + [("#a", Journal.RESET, "")])
+
+	def testCompactor(self):
+		compactions = []
+		journal = Journal.Journal(self.path, interval=0.001, snapshot_records=5)
+		journal.compactor = lambda: compactions.append(journal.beginCompaction(["#a"]))
+
+		# Called from the journal's thread once enough are committed.
+		for i in range(5):
+			journal.record("#a", Journal.TURN)
+		for i in range(1000):
+			if compactions:
+				break
+			time.sleep(0.001)
+
+		self.assertEqual(len(compactions), 1)
+		self.assertTrue(journal.compacting())
+
+		journal.snapshot("#a", "snapshot")
+		journal.close()
+		self.assertEqual(list(Journal.readJournal(self.path)), [("#a", Journal.SNAPSHOT, "snapshot")])
+
+	def testRewrite(self):
+		journal = Journal.Journal(self.path, interval=0.01)
+		journal.record("#a", Journal.TURN)
+		journal.close()
+		with open(self.path + ".new", "wb") as journal_file:
+			journal_file.write(Journal.MAGIC)
+
+		Journal.rewrite(self.path, [("#a", "one"), ("#b", "two")])
+		self.assertEqual(list(Journal.readJournals(self.path)), [("#a", Journal.SNAPSHOT, "one"), ("#b", Journal.SNAPSHOT, "two")])
+		self.assertFalse(os.path.exists(self.path + ".new"))
+
+# ------------------------------------------------------------------------------
+
+class RecoveryTest(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp(prefix="unobot-test-")
+		self.path = os.path.join(self.directory, "journal")
+		self.plugins = []
+
+	def tearDown(self):
+		for plugin, bot in self.plugins:
+			plugin.unload(bot)
+		shutil.rmtree(self.directory)
+
+	def load(self, path):
+		bot = StandInBot({"journal":path})
+		plugin = Uno.UnoPlugin()
+		plugin.load(bot)
+		self.plugins.append((plugin, bot))
+		return plugin, bot
+
+	def unload(self, plugin):
+		for index, (loaded, bot) in enumerate(self.plugins):
+			if loaded is plugin:
+				plugin.unload(bot)
+				del self.plugins[index]
+				return
+
+	def crash(self, plugin, name):
+		"""Copies a plugin's journal as it is on disk now, as though the
+		process had died. Returns the copy's path."""
+		plugin.journal.commit()
+
+		path = os.path.join(self.directory, name)
+		for suffix in ("", ".new"):
+			if os.path.exists(self.path + suffix):
+				shutil.copy(self.path + suffix, path + suffix)
+		return path
+
+	def playGames(self, plugin, bot, rng, channels):
+		"""Opens a game in each channel, in every state a table can be in,
+		and plays some of each."""
+		for index, channel in enumerate(channels):
+			table = plugin.getTable(channel)
+			owner = "owner" + str(index)
+
+			table.runCommand(bot, "commandUno", owner, channel, "")
+			table.runCommand(bot, "commandJoin", "Player", channel, "")
+			for extra in range(index % 4):
+				table.runCommand(bot, "commandJoin", "extra" + str(extra), channel, "")
+			if index % 3 == 1:
+				table.runCommand(bot, "commandAuto", "Player", channel, "")
+
+			# Left in the lobby.
+			if index % 5 == 4:
+				continue
+
+			table.runCommand(bot, "commandDeal", owner, channel, "")
+			playTurns(bot, table, rng, rng.randrange(60))
+
+	def testRestart(self):
+		plugin, bot = self.load(self.path)
+		self.playGames(plugin, bot, random.Random(1), ["#uno" + str(i) for i in range(20)])
+		before = snapshots(plugin)
+		self.assertTrue(len(before) > 10)
+
+		crashed = self.crash(plugin, "crashed")
+		self.unload(plugin)
+
+		# Closed cleanly.
+		recovered, bot = self.load(self.path)
+		self.assertEqual(snapshots(recovered), before)
+		for table in recovered.tables.values():
+			self.assertTrue(table.paused)
+
+		# Died without closing.
+		recovered, bot = self.load(crashed)
+		self.assertEqual(snapshots(recovered), before)
+
+	def testCarriesOn(self):
+		plugin, bot = self.load(self.path)
+		self.playGames(plugin, bot, random.Random(2), ["#a", "#b", "#c"])
+		crashed = self.crash(plugin, "crashed")
+
+		recovered, recovered_bot = self.load(crashed)
+		for table in recovered.tables.values():
+			table.resume(recovered_bot)
+
+		# The same moves lead to the same games, recycling and all.
+		for channel in ("#a", "#b", "#c"):
+			playTurns(bot, plugin.getTable(channel), random.Random(3), 500)
+			playTurns(recovered_bot, recovered.getTable(channel), random.Random(3), 500)
+		self.assertEqual(snapshots(recovered), snapshots(plugin))
+
+	def testCrashMidCompaction(self):
+		plugin, bot = self.load(self.path)
+		rng = random.Random(4)
+		channels = ["#uno" + str(i) for i in range(10)]
+		self.playGames(plugin, bot, rng, channels)
+
+		tables = [plugin.getTable(channel) for channel in channels]
+		plugin.journal.beginCompaction([table.channel for table in tables])
+
+		# Half moved, and games played on both sides.
+		for table in tables[:5]:
+			table.snapshotJournal()
+		for table in tables:
+			playTurns(bot, table, rng, 20)
+
+		crashed = self.crash(plugin, "crashed")
+		self.assertTrue(os.path.exists(crashed + ".new"))
+		before = snapshots(plugin)
+
+		recovered, recovered_bot = self.load(crashed)
+		self.assertEqual(snapshots(recovered), before)
+		self.assertFalse(os.path.exists(crashed + ".new"))
+
+		# Finished, the compacted journal alone has everything.
+		for table in tables[5:]:
+			table.snapshotJournal()
+		for table in tables:
+			playTurns(bot, table, rng, 20)
+		plugin.journal.commit()
+		self.assertFalse(plugin.journal.compacting())
+
+		before = snapshots(plugin)
+		compacted = self.crash(plugin, "compacted")
+		self.assertFalse(os.path.exists(compacted + ".new"))
+
+		recovered, recovered_bot = self.load(compacted)
+		self.assertEqual(snapshots(recovered), before)
+
+	def testFinishedGamesDropped(self):
+		plugin, bot = self.load(self.path)
+		table = plugin.getTable("#uno")
+		table.runCommand(bot, "commandUno", "owner", "#uno", "")
+		table.runCommand(bot, "commandJoin", "Player", "#uno", "")
+		table.runCommand(bot, "commandDeal", "owner", "#uno", "")
+		playTurns(bot, table, random.Random(5), 5000)
+		self.assertEqual(table.state, Table.UNO_STATE_STOPPED)
+
+		recovered, recovered_bot = self.load(self.crash(plugin, "crashed"))
+		self.assertEqual(recovered.tables, {})
+
+if __name__ == "__main__":
+	unittest.main()
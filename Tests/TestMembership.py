@@ -0,0 +1,165 @@
+# TestMembership.py
+# --------------------------------------------------------------------------
+
+# Tests for DeeIRC/Membership.py: NAMES bursts swapped in on 366, and joins,
+# parts and renames under each casemapping a server can advertise.
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import DeeIRC.Membership as Membership
+import DeeIRC.Utils as Utils
+
+# ------------------------------------------------------------------------------
+
+class NamesTest(unittest.TestCase):
+
+	def setUp(self):
+		self.members = Membership.Membership()
+		self.members.addChannel("#Uno")
+		self.members.addChannel("#other")
+
+		for nick in ("alice", "bob", "carol"):
+			self.members.join(nick, "#uno")
+		self.members.join("bob", "#other")
+
+	def testSwap(self):
+		self.members.addNames("#uno", ["@alice", "+dave"])
+
+		# Nothing changes until the 366.
+		self.assertEqual(sorted(self.members.channelNicks("#uno")), ["alice", "bob", "carol"])
+		self.assertFalse(self.members.isOn("dave", "#uno"))
+
+		self.members.addNames("#UNO", ["erin", ""])
+		self.members.endNames("#uno")
+
+		self.assertEqual(sorted(self.members.channelNicks("#uno")), ["alice", "dave", "erin"])
+		self.assertTrue(self.members.isOn("Dave", "#uno"))
+		self.assertFalse(self.members.isOn("carol", "#uno"))
+
+		# Gone from here, still somewhere else.
+		self.assertEqual(self.members.nickChannels("bob"), ["#other"])
+		self.assertEqual(self.members.nickChannels("carol"), [])
+		self.assertFalse(self.members.key("carol") in self.members.nicks)
+		self.assertEqual(self.members.nickChannels("dave"), ["#Uno"])
+
+	def testStatusPrefixes(self):
+		self.members.addNames("#uno", ["~owner", "&admin", "@op", "%half", "+voice", "@+both"])
+		self.members.endNames("#uno")
+		self.assertEqual(sorted(self.members.channelNicks("#uno")), ["admin", "both", "half", "op", "owner", "voice"])
+
+	def testBurstsAreSeparate(self):
+		self.members.addNames("#uno", ["alice"])
+		self.members.addNames("#other", ["zed"])
+		self.members.endNames("#other")
+
+		self.assertEqual(self.members.channelNicks("#other"), ["zed"])
+		self.assertEqual(sorted(self.members.channelNicks("#uno")), ["alice", "bob", "carol"])
+
+		self.members.endNames("#uno")
+		self.assertEqual(self.members.channelNicks("#uno"), ["alice"])
+		self.assertEqual(self.members.nickChannels("bob"), [])
+
+	def testUnknownChannel(self):
+		self.members.addNames("#nowhere", ["alice"])
+		self.members.endNames("#nowhere")
+		self.assertFalse(self.members.hasChannel("#nowhere"))
+		self.assertEqual(self.members.nickChannels("alice"), ["#Uno"])
+
+	def testEndWithoutNames(self):
+		self.members.endNames("#uno")
+		self.assertEqual(sorted(self.members.channelNicks("#uno")), ["alice", "bob", "carol"])
+
+	def testLeaveDuringBurst(self):
+		self.members.addNames("#uno", ["alice"])
+		self.members.removeChannel("#uno")
+		self.members.endNames("#uno")
+
+		self.assertFalse(self.members.hasChannel("#uno"))
+		self.assertEqual(self.members.nickChannels("alice"), [])
+		self.assertEqual(self.members.nickChannels("bob"), ["#other"])
+
+# ------------------------------------------------------------------------------
+
+class CasemappingTest(unittest.TestCase):
+
+	def make(self, casemapping):
+		members = Membership.Membership(casemapping)
+		members.addChannel("#Uno[1]")
+		members.join("Nick[a]", "#uno[1]")
+		members.join("other", "#UNO[1]")
+		return members
+
+	def testFolding(self):
+		self.assertEqual(Utils.lowerNick("ABC[]\\~", "ascii"), "abc[]\\~")
+		self.assertEqual(Utils.lowerNick("ABC[]\\~", "rfc1459"), "abc{}|^")
+		self.assertEqual(Utils.lowerNick("ABC[]\\~", "strict-rfc1459"), "abc{}|~")
+
+	def testEveryMapping(self):
+		for casemapping in Utils.CASEMAPPINGS:
+			members = self.make(casemapping)
+
+			self.assertTrue(members.isOn("NICK[A]", "#uno[1]"), casemapping)
+			self.assertEqual(sorted(members.channelNicks("#UNO[1]")), ["Nick[a]", "other"])
+
+			# Case only, keeps the memberships and takes the new display name.
+			members.rename("nick[A]", "NICK[A]")
+			self.assertEqual(sorted(members.channelNicks("#uno[1]")), ["NICK[A]", "other"], casemapping)
+
+			members.rename("Nick[a]", "new")
+			self.assertTrue(members.isOn("NEW", "#uno[1]"))
+			self.assertFalse(members.isOn("Nick[a]", "#uno[1]"))
+			self.assertEqual(members.nickChannels("new"), ["#Uno[1]"])
+			self.assertEqual(members.nickChannels("Nick[a]"), [])
+
+			members.part("NEW", "#Uno[1]")
+			self.assertEqual(members.channelNicks("#uno[1]"), ["other"])
+			self.assertFalse(members.key("new") in members.nicks)
+
+	def testRenameBrackets(self):
+		for casemapping, same in (("ascii", False), ("rfc1459", True), ("strict-rfc1459", True)):
+			members = self.make(casemapping)
+			members.rename("Nick{a}", "renamed")
+			self.assertEqual(members.isOn("renamed", "#uno[1]"), same, casemapping)
+			self.assertEqual(members.isOn("Nick[a]", "#uno[1]"), not same, casemapping)
+
+	def testRenameTilde(self):
+		for casemapping, same in (("ascii", False), ("rfc1459", True), ("strict-rfc1459", False)):
+			members = Membership.Membership(casemapping)
+			members.addChannel("#uno")
+			members.join("a~", "#uno")
+			members.rename("A^", "b")
+			self.assertEqual(members.isOn("b", "#uno"), same, casemapping)
+
+	def testChannelsFold(self):
+		for casemapping, same in (("ascii", False), ("rfc1459", True), ("strict-rfc1459", True)):
+			members = self.make(casemapping)
+			self.assertEqual(members.hasChannel("#uno{1}"), same, casemapping)
+
+	def testSwitch(self):
+		members = self.make("ascii")
+		members.addChannel("#{x}")
+		members.join("Nick[a]", "#{x}")
+
+		members.setCasemapping("rfc1459")
+		self.assertEqual(members.casemapping, "rfc1459")
+		self.assertTrue(members.isOn("nick{A}", "#uno{1}"))
+		self.assertEqual(sorted(members.nickChannels("NICK{A}")), ["#Uno[1]", "#{x}"])
+		self.assertTrue(members.key("nick[a]") is members.key("NICK{A}"))
+
+		# Back again, and names that don't fold the new way come apart.
+		members.setCasemapping("ascii")
+		self.assertFalse(members.hasChannel("#uno{1}"))
+		self.assertTrue(members.hasChannel("#uno[1]"))
+
+	def testUnknownMapping(self):
+		members = self.make("rfc1459")
+		members.setCasemapping("unheard-of")
+		self.assertEqual(members.casemapping, "rfc1459")
+		self.assertTrue(members.isOn("nick{a}", "#uno[1]"))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,110 @@
+# TestParser.py
+# --------------------------------------------------------------------------
+
+# Tests for DeeIRC/Parser.py, and for how DeeIRC/IRC.py answers PINGs with
+# the token the server sent, colons and all.
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import DeeIRC.IRC as IRC
+import DeeIRC.Parser as Parser
+
+# ------------------------------------------------------------------------------
+
+class ParseTest(unittest.TestCase):
+
+	def testCommandOnly(self):
+		message = Parser.parse("quit")
+		self.assertEqual(message.command, "QUIT")
+		self.assertEqual(message.prefix, "")
+		self.assertEqual(message.params, [])
+		self.assertEqual(message.tags, {})
+
+	def testPrefix(self):
+		message = Parser.parse(":Nick!user@host.example PRIVMSG #uno :play r5")
+		self.assertEqual(message.prefix, "Nick!user@host.example")
+		self.assertEqual((message.nick, message.user, message.host), ("Nick", "user", "host.example"))
+		self.assertEqual(message.params, ["#uno", "play r5"])
+
+	def testServerPrefix(self):
+		message = Parser.parse(":irc.example.net 001 UnoBot :Welcome")
+		self.assertEqual((message.nick, message.user, message.host), ("irc.example.net", "", ""))
+		self.assertEqual(message.command, "001")
+
+	def testTrailing(self):
+		message = Parser.parse(":n!u@h PRIVMSG #uno :a :b  c ")
+		self.assertEqual(message.params, ["#uno", "a :b  c "])
+
+	def testEmptyTrailing(self):
+		self.assertEqual(Parser.parse("PRIVMSG #uno :").params, ["#uno", ""])
+
+	def testMiddleColons(self):
+		message = Parser.parse(":n!u@h MODE #uno +k pass:word")
+		self.assertEqual(message.params, ["#uno", "+k", "pass:word"])
+
+	def testExtraSpaces(self):
+		message = Parser.parse(":n!u@h  PRIVMSG   #uno   :hi")
+		self.assertEqual(message.command, "PRIVMSG")
+		self.assertEqual(message.params, ["#uno", "hi"])
+
+	def testParam(self):
+		message = Parser.parse("353 UnoBot = #uno :a b")
+		self.assertEqual(message.param(2), "#uno")
+		self.assertEqual(message.param(-1), "a b")
+		self.assertEqual(message.param(4), "")
+		self.assertEqual(message.param(-5, "none"), "none")
+
+	def testTags(self):
+		message = Parser.parse("@time=2020-01-01T00:00:00.000Z;account=nick;+draft/x;msgid= :n!u@h PRIVMSG #uno :hi")
+		self.assertEqual(message.tags, {"time":"2020-01-01T00:00:00.000Z", "account":"nick", "+draft/x":"", "msgid":""})
+		self.assertEqual(message.command, "PRIVMSG")
+		self.assertEqual(message.nick, "n")
+		self.assertEqual(message.params, ["#uno", "hi"])
+
+	def testTagEscapes(self):
+		message = Parser.parse("@a=one\\stwo\\:three\\\\;b=x\\ry\\nz;c=\\q;d=end\\ PING :x")
+		self.assertEqual(message.tags, {"a":"one two;three\\", "b":"x\ry\nz", "c":"q", "d":"end"})
+
+	def testTagsWithoutPrefix(self):
+		message = Parser.parse("@id=1 PING :token")
+		self.assertEqual(message.tags, {"id":"1"})
+		self.assertEqual(message.prefix, "")
+		self.assertEqual(message.params, ["token"])
+
+	def testPingTokens(self):
+		self.assertEqual(Parser.parse("PING :irc.example.net:6667").params, ["irc.example.net:6667"])
+		self.assertEqual(Parser.parse("PING irc.example.net:6667").params, ["irc.example.net:6667"])
+		self.assertEqual(Parser.parse("PING ::leading").params, [":leading"])
+		self.assertEqual(Parser.parse("PING :a:b c:d").params, ["a:b c:d"])
+
+# ------------------------------------------------------------------------------
+
+class PongTest(unittest.TestCase):
+
+	def setUp(self):
+		self.irc = IRC.DeeIRC()
+
+	def sent(self):
+		"""Returns every line queued for the server."""
+		lines = []
+		line = self.irc.send_queue.pop()
+		while line is not None:
+			lines.append(line)
+			line = self.irc.send_queue.pop()
+		return lines
+
+	def testReaderAnswers(self):
+		self.irc.receiveLine("PING :irc.example.net:6667")
+		self.irc.receiveLine("PING irc.example.net:6667")
+		self.assertEqual(self.sent(), ["PONG :irc.example.net:6667\r\n", "PONG irc.example.net:6667\r\n"])
+
+	def testTaggedPing(self):
+		self.irc.handleLine("@time=2020-01-01T00:00:00.000Z PING :a:b c")
+		self.assertEqual(self.sent(), ["PONG :a:b c\r\n"])
+
+if __name__ == "__main__":
+	unittest.main()
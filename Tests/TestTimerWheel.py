@@ -0,0 +1,135 @@
+# TestTimerWheel.py
+# --------------------------------------------------------------------------
+
+# Tests for DeeIRC/TimerWheel.py, run side by side with a heap: every timer
+# must fire on the first advance() at or after it's tick, never before, in
+# tick order, and cancelled ones never.
+
+import heapq
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import DeeIRC.TimerWheel as TimerWheel
+
+# ------------------------------------------------------------------------------
+
+class HeapTimers(object):
+	"""What the wheel should do, the slow way."""
+
+	def __init__(self, tick):
+		self.tick = tick
+		self.heap = []
+		self.cancelled = set()
+
+	def schedule(self, tick, name):
+		heapq.heappush(self.heap, (tick, name))
+
+	def cancel(self, name):
+		self.cancelled.add(name)
+
+	def advance(self, now):
+		last_tick = int(now / self.tick)
+		due = []
+		while self.heap and self.heap[0][0] <= last_tick:
+			tick, name = heapq.heappop(self.heap)
+			if not name in self.cancelled:
+				due.append((tick, name))
+		return due
+
+	def __len__(self):
+		return len([name for due_tick, name in self.heap if not name in self.cancelled])
+
+class TimerWheelTest(unittest.TestCase):
+
+	def compare(self, seed, tick, delays, steps, rounds=2000):
+		"""Schedules, cancels and advances both at random, and checks they
+		agree after every advance."""
+		rng = random.Random(seed)
+		now = rng.uniform(0, 1e6) * tick
+		wheel = TimerWheel.TimerWheel(now, tick)
+		heap = HeapTimers(tick)
+
+		timers = {}
+		names = 0
+
+		for i in xrange(rounds):
+			for j in xrange(rng.randrange(4)):
+				when = now + rng.choice(delays) * rng.random() * tick
+				timer = wheel.schedule(when, None, (names,))
+				self.assertEqual(timer.tick, -int(-when // tick))
+				heap.schedule(timer.tick, names)
+				timers[names] = timer
+				names += 1
+
+			if timers and rng.random() < 0.3:
+				name = rng.choice(timers.keys())
+				timers.pop(name).cancel()
+				heap.cancel(name)
+
+			now += rng.choice(steps) * rng.random() * tick
+
+			due = wheel.advance(now)
+			expected = heap.advance(now)
+
+			self.assertEqual(sorted([(timer.tick, timer.args[0]) for timer in due]), sorted(expected))
+			self.assertEqual([timer.tick for timer in due], sorted([timer.tick for timer in due]))
+			for timer in due:
+				self.assertTrue(timer.when <= now + 1e-9)
+				timers.pop(timer.args[0])
+
+			self.assertEqual(len(wheel), len(heap))
+
+			# nextDelay() never sleeps past the next timer.
+			delay = wheel.nextDelay(now)
+			if heap.heap and len(heap):
+				first = min([due_tick for due_tick, name in heap.heap if not name in heap.cancelled])
+				self.assertTrue(delay is not None)
+				self.assertTrue(now + delay <= first * tick + 1e-9)
+			else:
+				self.assertEqual(delay, None)
+
+	def testNear(self):
+		self.compare(1, 1.0, (1, 10, 300), (1, 5, 50))
+
+	def testEveryLevel(self):
+		self.compare(2, 1.0, (1, 300, 70000, 20000000, 5000000000), (1, 300, 70000, 20000000))
+
+	def testBigJumps(self):
+		self.compare(3, 1.0, (10, 1000, 100000), (0, 10000000, 5000000000))
+
+	def testDefaultTick(self):
+		self.compare(4, TimerWheel.TICK, (1, 100, 30000), (0, 1, 10, 300))
+
+	def testOverdue(self):
+		wheel = TimerWheel.TimerWheel(100.0, 1.0)
+		timer = wheel.schedule(50.0, None)
+		self.assertEqual(wheel.nextDelay(100.0), 0)
+		self.assertEqual(wheel.advance(100.0), [timer])
+		self.assertEqual(len(wheel), 0)
+
+	def testNeverEarly(self):
+		wheel = TimerWheel.TimerWheel(0.0, 1.0)
+		timer = wheel.schedule(10.5, None)
+		self.assertEqual(wheel.advance(10.9), [])
+		self.assertEqual(wheel.advance(11.0), [timer])
+
+	def testCancelTwice(self):
+		wheel = TimerWheel.TimerWheel(0.0, 1.0)
+		first = wheel.schedule(5.0, None)
+		second = wheel.schedule(5.0, None)
+		first.cancel()
+		first.cancel()
+		self.assertEqual(len(wheel), 1)
+		self.assertEqual(wheel.advance(5.0), [second])
+
+		# Cancelling once it's fired does nothing.
+		second.cancel()
+		self.assertEqual(len(wheel), 0)
+		self.assertEqual(wheel.nextDelay(5.0), None)
+
+if __name__ == "__main__":
+	unittest.main()